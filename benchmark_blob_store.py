@@ -0,0 +1,80 @@
+"""
+Raportti: vaiheen 1 tiedostoviittausten (blob_store.py) vaikutus tulosten kokoon ja käsittelyaikaan.
+
+  - ennen: {{FILE: ...}} korvataan koko tiedoston JSON-escapeeratulla tekstillä (lineaarinen
+    nimihaku per placeholder), ja sama teksti on context.results-, orchestrator.results- ja
+    dataset-kopioissa
+  - nyt: {{FILE: ...}} korvataan viittauksella {{BLOB: tiiviste}} (nimihaku sanakirjasta), ja teksti
+    liitetään vasta kehotteeseen tai vientiin
+
+Tiedostoina --files kappaletta --file-kb kokoisia tekstejä; vaiheen 1 vastaus viittaa niihin kaikkiin.
+Aika on --repeat toiston keskiarvo.
+
+Käyttö: python benchmark_blob_store.py [--files 3] [--file-kb 300] [--repeat 20]
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+
+from context import AssessmentContext
+from orchestrator import Orchestrator
+
+
+def _inline(text, context):
+    """Aiempi toteutus: placeholder -> tiedoston teksti JSON-escapeerattuna."""
+    def replace_match(match):
+        filename = match.group(1).strip()
+        for fname, content in context.files:
+            if fname == filename or fname.endswith(filename) or filename in fname:
+                return json.dumps(content)[1:-1]
+        return f"[TIEDOSTOA {filename} EI LÖYTYNYT]"
+    return re.sub(r'\{\{FILE:\s*(.*?)\}\}', replace_match, text)
+
+
+def _timed(fn, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return result, (time.perf_counter() - started) * 1000 / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=3)
+    parser.add_argument("--file-kb", type=int, default=300)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    context = AssessmentContext("Säännöt", {f"VAIHE {i}": f"Ohje {i}" for i in range(1, 10)}, token_limit=None)
+    for n in range(args.files):
+        context.add_file(f"Tiedosto{n}.pdf", (f"Opiskelijan teksti {n}: \"lainaus\" jatkuu. " * 8000)[:args.file_kb * 1000])
+    response = json.dumps({"data": {f"tiedosto_{n}": f"{{{{FILE: Tiedosto{n}.pdf}}}}" for n in range(args.files)}})
+    orchestrator = Orchestrator(None, None)
+
+    inlined, inline_ms = _timed(lambda: _inline(response, context), args.repeat)
+    referenced, reference_ms = _timed(lambda: orchestrator._inject_file_content(response, context), args.repeat)
+    _, expand_ms = _timed(lambda: context.expand_result(referenced), args.repeat)
+
+    def prompt_ms(result):
+        context.add_result("VAIHE 1", result)
+        context._compiled_prompts.clear()
+        return _timed(lambda: (context._compiled_prompts.clear(), context.build_prompt("VAIHE 5")), args.repeat)[1]
+
+    before_prompt_ms, after_prompt_ms = prompt_ms(inlined), prompt_ms(referenced)
+
+    print(f"--- Vaiheen 1 tulos: {args.files} tiedostoa x {args.file_kb} kt ---")
+    print(f"{'':<28} {'ennen':>12} {'nyt':>12}")
+    print(f"{'tuloksen koko (merkkiä)':<28} {len(inlined):12,} {len(referenced):12,}")
+    print(f"{'tulokset muistissa (2 kopiota)':<28} {2 * len(inlined):12,} {2 * len(referenced):12,}")
+    print(f"{'placeholderien korvaus ms':<28} {inline_ms:12.3f} {reference_ms:12.3f}")
+    print(f"{'vaiheen 5 kehote ms':<28} {before_prompt_ms:12.3f} {after_prompt_ms:12.3f}")
+    print(f"Vienti (expand_result) {expand_ms:.3f} ms, tiedostovarasto {context.blobs.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Mikrobenchmark: Gemini-kutsun asiakaspuolen ylimäärä ennen ja jälkeen mallikahvojen uudelleenkäytön.
+
+Verkkokutsu korvataan asiakasoliolla, joka palauttaa tyhjän vastauksen, jolloin mitataan kaikki
+muu: kahvan luonti, pyynnön rakentaminen (response_schema -> proto) ja vastauksen kääriminen.
+  - ennen: genai.GenerativeModel + GenerationConfig luodaan jokaisella yrityksellä
+  - jälkeen: GeminiBackend.model_handle palauttaa valmiin kahvan (malli, asetukset)
+  - Streamlit-uudelleenajo: GeminiBackend (genai.configure) luodaan joka kerta vs. kerran
+
+Käyttö: python benchmark_client_reuse.py [--calls 2000] [--transport grpc|rest]
+"""
+import argparse
+import os
+import sys
+import time
+from unittest.mock import patch
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+
+import google.generativeai as genai
+from google.generativeai import client as genai_client
+from google.generativeai import protos
+
+from config import PHASES
+from llm_backends import GeminiBackend
+from schema_converter import to_response_schema
+
+
+class _OfflineClient:
+    """Korvaa GenerativeServiceClientin: ei verkkoa, tyhjä vastaus."""
+
+    def generate_content(self, request, **kwargs):
+        return protos.GenerateContentResponse()
+
+
+def _params_per_phase():
+    """Vaiheiden generointiasetukset sellaisina kuin LLMService ne lähettää (response_schema mukana)."""
+    params = []
+    for phase in PHASES:
+        if "schema" in phase:
+            params.append({
+                "max_output_tokens": 8192,
+                "response_mime_type": "application/json",
+                # Sama olio joka kutsulla, kuten Orchestratorin cached_response_schema
+                "response_schema": to_response_schema(phase["schema"])
+            })
+    return params
+
+
+def _per_call_us(fn, calls):
+    started = time.perf_counter()
+    for i in range(calls):
+        fn(i)
+    return (time.perf_counter() - started) / calls * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument("--transport", choices=["grpc", "rest"], default="grpc")
+    args = parser.parse_args()
+
+    model_name = "gemini-2.5-flash"
+    phase_params = _params_per_phase()
+
+    with patch.object(genai_client, "get_default_generative_client", return_value=_OfflineClient()):
+        backend = GeminiBackend(api_key="benchmark", transport=args.transport)
+
+        def before(i):
+            params = phase_params[i % len(phase_params)]
+            genai.GenerativeModel(model_name).generate_content(
+                "kehote", generation_config=genai.types.GenerationConfig(**params),
+                request_options={"timeout": 300})
+
+        def after(i):
+            backend.generate(model_name, "kehote", phase_params[i % len(phase_params)])
+
+        def rerun_before(i):
+            GeminiBackend(api_key="benchmark", transport=args.transport)
+
+        def rerun_after(i):
+            backend
+
+        rerun_calls = max(1, args.calls // 10)
+        results = [
+            ("Kutsu, uusi kahva joka kerta", _per_call_us(before, args.calls)),
+            ("Kutsu, uudelleenkäytetty kahva", _per_call_us(after, args.calls)),
+            ("Uudelleenajo, configure joka kerta", _per_call_us(rerun_before, rerun_calls)),
+            ("Uudelleenajo, välimuistissa (st.cache_resource)", _per_call_us(rerun_after, rerun_calls)),
+        ]
+
+    print(f"--- Asiakaspuolen ylimäärä ({args.transport}, {args.calls} kutsua, {len(phase_params)} vaiheskeemaa) ---")
+    for label, us in results:
+        print(f"{label:<50} {us:10.1f} µs/kutsu")
+    print(f"Kutsun nopeutus: {results[0][1] / max(results[1][1], 1e-9):.1f}x")
+
+
+if __name__ == "__main__":
+    main()
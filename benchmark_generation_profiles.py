@@ -0,0 +1,137 @@
+"""
+Benchmark: vaihekohtaiset generointiprofiilit (config.PHASES["generation"]) vs. kiinteä 8192 tokenin raja.
+
+Ajetaan LLMServicen läpi SimulatorBackendillä jokaiselle --models-mallille (oletuksena ensisijainen
+malli ja fallback-ketjun gemini-2.0-flash):
+  - vastauksina dataset/-kansion tallennetut vaihevastaukset (mallin tuottamassa muodossa),
+  - ajattelevilla malleilla (config.THINKING_MODELS) ajattelutokenit lognormaalijakaumasta
+    (--thinking-median); muilla malleilla ajattelua ei ole,
+  - ajattelubudjetti rajaa ajattelua vain, jos asennettu SDK välittää sen (GEMINI_SUPPORTS_THINKING;
+    google-generativeai 0.8.x ei välitä, jolloin ajattelu kuluttaa kattoa rajatta),
+  - ajattelu- ja vastaustokenit lasketaan samaan max_output_tokens-rajaan (katkaisu = finish_reason 2),
+  - kesto = kiinteä viive per pyyntö (myös jatkopyynnöt) + tuotetut tokenit / --tokens-per-second.
+
+Kesto lasketaan telemetriasta (tokenit, jatkopyynnöt), joten tulos on deterministinen siemenellä.
+
+Käyttö: python benchmark_generation_profiles.py [--models gemini-2.5-flash,gemini-2.0-flash] [--runs 20]
+        [--thinking-median 6000] [--tokens-per-second 150]
+"""
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import random
+import sys
+from unittest.mock import patch
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+
+import llm_service as llm_module
+from config import PHASES, THINKING_MODELS
+from generation_profiles import DEFAULT_PROFILE, generation_profile, _model_output
+from llm_backends import GEMINI_SUPPORTS_THINKING, SimulatorBackend
+from llm_service import LLMService
+from telemetry import telemetry_scope
+
+
+class _InstalledSdkSimulator(SimulatorBackend):
+    """
+    Simulaattori, joka ohittaa ajattelubudjetin kuten asennettu SDK (ks. GEMINI_SUPPORTS_THINKING) ja
+    ajattelee vain ajattelevilla malleilla (myös fallback-ketjun malleille vaihdettaessa).
+    """
+
+    supports_thinking_budget = GEMINI_SUPPORTS_THINKING
+
+    def generate(self, model_name, prompt, generation_params, timeout=300, stream=False):
+        if not GEMINI_SUPPORTS_THINKING and generation_params:
+            generation_params = {k: v for k, v in generation_params.items() if k != "thinking_budget"}
+        thinking = self.thinking_tokens
+        if model_name not in THINKING_MODELS:
+            self.thinking_tokens = 0
+        try:
+            return super().generate(model_name, prompt, generation_params, timeout, stream)
+        finally:
+            self.thinking_tokens = thinking
+
+
+def _recorded_responses(dataset_dir):
+    """Viimeisin skeeman mukainen tallennettu vastaus vaiheittain (ks. generation_profiles)."""
+    responses = {}
+    for phase in PHASES:
+        if "schema" not in phase:
+            continue
+        for path in sorted(glob.glob(os.path.join(dataset_dir, f"*_{phase['id']}.json"))):
+            with open(path, "r", encoding="utf-8") as f:
+                record = json.load(f)
+            if all(key in record for key in phase["schema"]["properties"]):
+                record.pop("metadata", None)
+                responses[phase["phase_key"]] = json.dumps(_model_output(record, phase["schema"]),
+                                                           ensure_ascii=False)
+    return responses
+
+
+def _run(phase, profile, responses, model, args):
+    """Ajaa vaiheen args.runs kertaa annetulla profiililla. Palauttaa (keskikesto s, katkaisut, jatkot)."""
+    backend = _InstalledSdkSimulator(time_scale=0, latency_fn=lambda model, prompt: 0.0, responses=responses)
+    service = LLMService(backend=backend, repair_model=None, single_flight=None)
+    rng = random.Random(args.seed)
+
+    def validate(data):
+        return isinstance(data, dict)
+    validate.generation_profile = profile
+
+    seconds = []
+    for run in range(args.runs):
+        backend.thinking_tokens = int(rng.lognormvariate(0.0, 0.5) * args.thinking_median)
+        # Uudelleenyritysten odotukset ohitetaan (yritykset lasketaan kestoon --request-latency-arvolla)
+        with telemetry_scope(phase_id=phase["id"]), patch.object(llm_module.time, "sleep"), \
+                contextlib.redirect_stdout(io.StringIO()):
+            service.generate_response(f"--- SUORITA {phase['phase_key']} --- ajo {run}", model, validate)
+        record = service.telemetry.records(phase_id=phase["id"])[-1]
+        requests = record["attempts"] + record["continuations"]
+        seconds.append(requests * args.request_latency + record["output_tokens"] / args.tokens_per_second)
+    continuations = service.telemetry.summary()[phase["id"]]["continuations"]
+    return sum(seconds) / len(seconds), backend.stats()["truncated"], continuations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--models", default="gemini-2.5-flash,gemini-2.0-flash")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--dataset", default="dataset")
+    parser.add_argument("--thinking-median", type=int, default=6000, help="Ajattelutokenien mediaani ilman budjettia")
+    parser.add_argument("--tokens-per-second", type=float, default=150.0)
+    parser.add_argument("--request-latency", type=float, default=1.5, help="Kiinteä viive per pyyntö (s)")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    responses = _recorded_responses(args.dataset)
+    for model in args.models.split(","):
+        _report(model.strip(), responses, args)
+
+
+def _report(model, responses, args):
+    thinking = f"ajattelu mediaani {args.thinking_median} tokenia" if model in THINKING_MODELS else "ei ajattelua"
+    budget = "välitetään" if GEMINI_SUPPORTS_THINKING else "ei välitetä (SDK)"
+    print(f"--- Generointiprofiilit vs. kiinteä raja ({model}, {args.runs} ajoa/vaihe, {thinking}, "
+          f"ajattelubudjetti {budget}, {args.tokens_per_second:.0f} tokenia/s) ---")
+    print(f"{'vaihe':<8} {'profiili':<24} {'kiinteä s':>10} {'profiili s':>11} {'säästö':>8} "
+          f"{'katkaisut':>12} {'jatkot':>10}")
+    total_before = total_after = 0.0
+    for phase in PHASES:
+        if phase["phase_key"] not in responses:
+            continue
+        profile = generation_profile(phase)
+        before, truncated_before, continued_before = _run(phase, dict(DEFAULT_PROFILE), responses, model, args)
+        after, truncated_after, continued_after = _run(phase, profile, responses, model, args)
+        total_before += before
+        total_after += after
+        label = f"{profile['max_output_tokens']}+{profile['thinking_budget']} t={profile['temperature']}"
+        print(f"{phase['id']:<8} {label:<24} {before:10.1f} {after:11.1f} {1 - after / before:8.0%} "
+              f"{truncated_before:>5} -> {truncated_after:<4} {continued_before:>3} -> {continued_after:<3}")
+    print(f"{'yhteensä':<8} {'':<24} {total_before:10.1f} {total_after:11.1f} {1 - total_after / total_before:8.0%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Raportti: kehotteen historiaosion koko vaiheittain ennen ja jälkeen kenttäprojektion.
+
+  - ennen: riippuvuusvaiheiden tulokset kokonaisina, sisennettyinä (json.dumps(indent=2)) kuten
+    Orchestrator ne tallentaa (vaiheen 1 tuloksessa tiedostojen sisältö mukana)
+  - jälkeen: vain config.HISTORY_PROJECTIONS-säännön kentät tiiviinä JSONina
+
+Tulokset luetaan dataset/-kansion viimeisimmästä ajosta (vaiheet 1-8 skeeman mukaisina).
+Tokenit arvioidaan TokenEstimatorilla (~4 merkkiä / token, ks. token_budget.py).
+
+Käyttö: python benchmark_history_projection.py [--dataset dataset]
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+
+from config import PHASES
+from context import AssessmentContext
+
+
+def _latest_results(dataset_dir):
+    """Viimeisin skeeman mukainen tulos vaiheittain: {phase_key: tallennettu JSON-teksti}."""
+    results = {}
+    for phase in PHASES:
+        if "schema" not in phase:
+            continue
+        for path in sorted(glob.glob(os.path.join(dataset_dir, f"*_{phase['id']}.json"))):
+            with open(path, "r", encoding="utf-8") as f:
+                content = f.read()
+            record = json.loads(content)
+            if all(key in record for key in phase["schema"]["properties"]):
+                results[phase["phase_key"]] = content
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dataset", default="dataset")
+    args = parser.parse_args()
+
+    context = AssessmentContext("", {}, token_limit=None)
+    for phase_key, content in _latest_results(args.dataset).items():
+        context.add_result(phase_key, content)
+
+    print(f"--- Historian koko vaiheittain ({args.dataset}, tulokset: {', '.join(sorted(context.results))}) ---")
+    print(f"{'vaihe':<8} {'ennen tokenia':>14} {'jälkeen tokenia':>16} {'säästö':>8}")
+    total_before = total_after = 0
+    for phase in PHASES:
+        if "schema" not in phase or phase["phase_key"] == "VAIHE 1":
+            continue
+        budget = context.prompt_budget(phase["phase_key"])
+        before, after = budget["history_unprojected"], budget["sections"]["history"]
+        total_before += before
+        total_after += after
+        print(f"{phase['phase_key']:<8} {before:14,} {after:16,} {1 - after / max(before, 1):8.0%}")
+    print(f"{'yhteensä':<8} {total_before:14,} {total_after:16,} {1 - total_after / max(total_before, 1):8.0%}")
+
+
+if __name__ == "__main__":
+    main()
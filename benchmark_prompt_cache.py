@@ -0,0 +1,87 @@
+"""
+Raportti: kehotteen alkuosan välimuistin vaikutus yhden arvioinnin kehotetokeneihin ja hintaan.
+
+  - ilman: oletusasettelu (säännöt, vaiheohje, tiedostot, historia), koko kehote joka kutsulla
+  - välimuistilla: vakioasettelu (AssessmentContext.cache_layout) ja PromptCache; säännöt ja
+    vaiheiden 4-7 yhteinen historia luetaan välimuistikahvasta
+
+Ajo tehdään simulaattorilla (ei verkkoa): kehotteet prompts/-kansiosta, tiedostoina --file-kb
+kokoiset tekstit. Tokenit ja hinta luetaan telemetriasta (usage_metadata, config.MODEL_PRICING).
+Välimuistin tallennusmaksua (tokenit x tunnit) ei lasketa mukaan.
+
+Käyttö: python benchmark_prompt_cache.py [--prompts prompts] [--file-kb 40] [--model gemini-2.5-flash]
+"""
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+from unittest.mock import patch
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+
+import llm_service as llm_module
+from context import AssessmentContext
+from data_handler import DataHandler
+from llm_backends import SimulatorBackend
+from llm_service import LLMService
+from orchestrator import Orchestrator
+from prompt_cache import PromptCache
+from prompt_splitter import PromptSplitter
+from run_store import RunStore
+
+
+def _run(args, common_rules, prompt_phases, cached):
+    """Yksi arviointi simulaattorilla. Palauttaa (telemetrian kooste vaiheittain, PromptCache tai None)."""
+    simulator = SimulatorBackend(time_scale=0, seed=1)
+    prompt_cache = PromptCache(simulator) if cached else None
+    service = LLMService(backend=simulator, prompt_cache=prompt_cache)
+    run_dir = tempfile.mkdtemp()
+    try:
+        orchestrator = Orchestrator(service, DataHandler(), run_store=RunStore(run_dir))
+        context = AssessmentContext(common_rules, prompt_phases, cache_layout=cached)
+        for name in ("Keskusteluhistoria.pdf", "Lopputuote.pdf", "Reflektiodokumentti.pdf"):
+            context.add_file(name, ("Opiskelijan teksti jatkuu. " * 4000)[:args.file_kb * 1000])
+        with patch.object(llm_module.time, "sleep"), contextlib.redirect_stdout(io.StringIO()):
+            orchestrator.run_pipeline(context, args.model)
+    finally:
+        shutil.rmtree(run_dir, True)
+    return service.telemetry.summary(), prompt_cache
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--prompts", default="prompts")
+    parser.add_argument("--file-kb", type=int, default=40)
+    parser.add_argument("--model", default="gemini-2.5-flash")
+    args = parser.parse_args()
+
+    splitter = PromptSplitter()
+    if not splitter.load_from_disk(args.prompts):
+        raise SystemExit(f"Kehotteita ei löytynyt kansiosta {args.prompts}")
+    modules = splitter.get_prompt_modules()
+    common_rules = modules.get("COMMON_RULES", "")
+    prompt_phases = {k: v for k, v in modules.items() if k.startswith("VAIHE")}
+
+    plain, _ = _run(args, common_rules, prompt_phases, cached=False)
+    cached, prompt_cache = _run(args, common_rules, prompt_phases, cached=True)
+
+    print(f"--- Kehotetokenit vaiheittain ({args.model}, säännöt {len(common_rules):,} merkkiä, "
+          f"tiedostot 3 x {args.file_kb} kt) ---")
+    print(f"{'vaihe':<9} {'kehote':>9} {'välimuistista':>14} {'osuus':>7} {'hinta ennen $':>14} {'hinta nyt $':>12}")
+    for phase_id in sorted(cached):
+        before, after = plain.get(phase_id, {}), cached[phase_id]
+        print(f"{phase_id:<9} {after['prompt_tokens']:9,} {after['cached_tokens']:14,} "
+              f"{after['cached_tokens'] / max(after['prompt_tokens'], 1):7.0%} "
+              f"{before.get('cost_usd', 0):14.5f} {after['cost_usd']:12.5f}")
+    total_before = sum(s["cost_usd"] for s in plain.values())
+    total_after = sum(s["cost_usd"] for s in cached.values())
+    print(f"{'yhteensä':<9} {sum(s['prompt_tokens'] for s in cached.values()):9,} "
+          f"{sum(s['cached_tokens'] for s in cached.values()):14,} {'':>7} {total_before:14.5f} {total_after:12.5f}")
+    print(f"Välimuistikahvat: {prompt_cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
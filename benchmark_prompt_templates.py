@@ -0,0 +1,104 @@
+"""
+Mikrobenchmark: AssessmentContext.build_prompt ennen ja jälkeen esikäännettyjen kehotepohjien.
+
+  - ennen: kehote rakennetaan joka kutsulla +=-ketjuna (säännöt, vaiheohje, tiedostot, historia)
+  - jälkeen (kylmä): PromptTemplate (säännöt + vaiheohje valmiina), loppuosa yhdellä join-kutsulla
+  - jälkeen (muistettu): sama (vaihe, syöteversio) toiseen kertaan, kuten app.py:n debug-näkymä
+    ja run_phase peräkkäin
+
+Aika mitataan perf_counterilla ja muistinvaraukset tracemallocilla (kutsun aikainen huippu).
+Syötteet: ~33 kt säännöt, kolme tiedostoa ja vaiheiden 1-7 tulokset (--file-kb, --result-kb).
+
+Käyttö: python benchmark_prompt_templates.py [--calls 200] [--file-kb 150] [--result-kb 20]
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+
+from context import AssessmentContext
+
+
+def legacy_build_prompt(context, phase_key):
+    """build_prompt sellaisena kuin se oli ennen kehotepohjia (+=-ketju joka kutsulla)."""
+    prompt = context.common_rules
+    if phase_key and phase_key in context.prompt_modules:
+        prompt += f"\\n\\n--- {phase_key} ---\\n{context.prompt_modules[phase_key]}"
+    files_text = ""
+    if phase_key in ["VAIHE 1", "MOODI_A"]:
+        for filename, content in context.files:
+            files_text += f"\\n--- TIEDOSTO: {filename} ---\\n{content}\\n"
+    prompt += f"\\n\\n{files_text}"
+    history = ""
+    if context.results:
+        history += "\\n\\n--- AIEMMAT TULOKSET ---\\n"
+        for dep in context.PHASE_DEPENDENCIES.get(phase_key, []):
+            content = context.results.get(dep)
+            if content:
+                history += f"\\n=== TULOS: {dep} ===\\n{content}\\n"
+    prompt += history
+    prompt += f"\\n\\n--- SUORITA {phase_key} ---"
+    if phase_key == "VAIHE 1":
+        prompt += "\\n\\nOPTIMOINTI-OHJE: ÄLÄ kopioi tiedostojen sisältöä 'data'-kenttiin, jos ne ovat pitkiä. Sen sijaan palauta tiedostonimi muodossa '{{FILE: tiedostonimi}}'. Esimerkiksi: \"keskusteluhistoria\": \"{{FILE: Keskusteluhistoria.pdf}}\". Järjestelmä hakee sisällön automaattisesti."
+    return prompt
+
+
+def _make_context(args):
+    rules = ("Yleinen sääntö: arvioi perustellusti ja viittaa lähteisiin. " * 600)[:33000]
+    context = AssessmentContext(rules, {f"VAIHE {i}": f"Vaiheen {i} ohje. " * 200 for i in range(1, 10)},
+                                token_limit=None)
+    for name in ("Keskusteluhistoria.pdf", "Lopputuote.pdf", "Reflektiodokumentti.pdf"):
+        context.add_file(name, ("Opiskelijan teksti jatkuu. " * 8000)[:args.file_kb * 1000])
+    for i in range(1, 8):
+        context.add_result(f"VAIHE {i}", ('{"kentta": "arvo", "perustelu": "..."}, ' * 1000)[:args.result_kb * 1000])
+    return context
+
+
+def _measure(fn, calls):
+    """(µs/kutsu, tracemallocin huippu kt/kutsu)."""
+    started = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    elapsed = (time.perf_counter() - started) / calls * 1e6
+    tracemalloc.start()
+    for _ in range(min(calls, 20)):
+        tracemalloc.reset_peak()
+        fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--file-kb", type=int, default=150)
+    parser.add_argument("--result-kb", type=int, default=20)
+    args = parser.parse_args()
+
+    context = _make_context(args)
+    phase_keys = ["VAIHE 1", "VAIHE 4", "VAIHE 8"]
+    for phase_key in phase_keys:
+        assert legacy_build_prompt(context, phase_key) == context.build_prompt(phase_key)
+
+    print(f"--- build_prompt ({args.calls} kutsua, tiedostot 3 x {args.file_kb} kt, tulokset 7 x {args.result_kb} kt) ---")
+    print(f"{'vaihe':<8} {'kehote kt':>10} {'ennen µs':>10} {'kylmä µs':>10} {'muistettu µs':>13} "
+          f"{'ennen kt':>10} {'kylmä kt':>10} {'muistettu kt':>13}")
+    for phase_key in phase_keys:
+        def cold():
+            context._compiled_prompts.clear()  # Uusi syöteversio joka kutsulla
+            context.build_prompt(phase_key)
+
+        size = len(context.build_prompt(phase_key)) / 1000
+        before_us, before_kb = _measure(lambda: legacy_build_prompt(context, phase_key), args.calls)
+        cold_us, cold_kb = _measure(cold, args.calls)
+        warm_us, warm_kb = _measure(lambda: context.build_prompt(phase_key), args.calls)
+        print(f"{phase_key:<8} {size:10.0f} {before_us:10.1f} {cold_us:10.1f} {warm_us:13.1f} "
+              f"{before_kb:10.0f} {cold_kb:10.0f} {warm_kb:13.1f}")
+
+
+if __name__ == "__main__":
+    main()
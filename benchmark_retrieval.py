@@ -0,0 +1,96 @@
+"""
+Raportti: hakuindeksin (retrieval.py) vaikutus hakuvaiheiden (config.RETRIEVAL_PHASES) kehotteisiin.
+
+  - ilman hakua: vaiheen 1 tuloksessa koko keskusteluhistoria
+  - haulla: keskusteluhistorian tilalla vaiheen 2 väitteisiin osuvat segmentit (top-k per väite)
+
+Tiedostot ja tulokset luetaan dataset/-kansion viimeisimmästä ajosta (tiedostojen teksti vaiheen 1
+data-kentistä). --repeat monistaa keskusteluhistorian pitkän keskustelun simuloimiseksi.
+Lisäksi mitataan indeksin rakennusaika ja osumatarkkuus: niistä vaiheen 2 konteksti-segmenteistä,
+jotka on lainattu keskusteluhistoriasta, kuinka moni löytyy haetuista segmenteistä. Lainaus katsotaan
+löydetyksi segmentistä, jossa on vähintään 60 % sen hakutermeistä (lainaukset ovat usein mukailtuja).
+
+Käyttö: python benchmark_retrieval.py [--dataset dataset] [--repeat 1] [--top-k 3]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+
+import context as context_module
+from benchmark_history_projection import _latest_results
+from context import AssessmentContext
+from retrieval import RetrievalIndex, hypothesis_queries, retrieve_evidence, terms
+from spans import SpanMap
+
+FILES = {"keskusteluhistoria": "Keskusteluhistoria.pdf", "lopputuote": "Lopputuote.pdf",
+         "reflektiodokumentti": "Reflektiodokumentti.pdf"}
+
+
+def _make_context(results, repeat):
+    context = AssessmentContext("", {}, token_limit=None)
+    data = json.loads(results["VAIHE 1"])["data"]
+    data["keskusteluhistoria"] = "\n".join([data["keskusteluhistoria"]] * repeat)
+    for field, filename in FILES.items():
+        context.add_file(filename, data[field])
+    for phase_key, content in results.items():
+        context.add_result(phase_key, content)
+    context.add_result("VAIHE 1", json.dumps(dict(json.loads(results["VAIHE 1"]), data=data), indent=2,
+                                             ensure_ascii=False))
+    return context
+
+
+def _history_tokens(context, phase_key):
+    context._compiled_prompts.clear()
+    return context.prompt_budget(phase_key)["sections"]["history"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dataset", default="dataset")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--top-k", type=int, default=3)
+    args = parser.parse_args()
+
+    context = _make_context(_latest_results(args.dataset), args.repeat)
+    chat = context.get_file_content("Keskusteluhistoria")
+
+    started = time.perf_counter()
+    index = RetrievalIndex(context.files)
+    build_ms = (time.perf_counter() - started) * 1000
+    queries = hypothesis_queries(context.results["VAIHE 2"])
+    started = time.perf_counter()
+    evidence = json.loads(retrieve_evidence(index, queries, SpanMap(context.files), k=args.top_k,
+                                            files=["Keskusteluhistoria"]))
+    query_ms = (time.perf_counter() - started) * 1000
+
+    quotes = [set(terms(e.get("konteksti_segmentti", "")))
+              for e in json.loads(context.results["VAIHE 2"]).get("rag_todisteet", [])]
+    def matches(quote, texts):
+        return any(len(quote & set(terms(text))) >= 0.6 * len(quote) for text in texts)
+    chat_segments = [s["text"] for s in index.segments if s["file"] == FILES["keskusteluhistoria"]]
+    quotes = [q for q in quotes if q and matches(q, chat_segments)]
+    found = sum(1 for q in quotes if matches(q, evidence["otteet"]))
+
+    print(f"--- Hakuindeksi: keskusteluhistoria {len(chat):,} merkkiä, {len(index.segments)} segmenttiä, "
+          f"{len(index.vocabulary):,} termiä ---")
+    print(f"Rakennus {build_ms:.1f} ms, {len(queries)} väitteen haku {query_ms:.1f} ms, "
+          f"{len(evidence['otteet'])} otetta kehotteeseen")
+    print(f"Keskusteluhistoriasta lainatuista konteksti-segmenteistä löytyi haetuista {found}/{len(quotes)}")
+
+    print(f"{'vaihe':<8} {'ilman hakua':>12} {'haulla':>10} {'säästö':>8}")
+    for phase_key in context_module.RETRIEVAL_PHASES:
+        with_retrieval = _history_tokens(context, phase_key)
+        phases, context_module.RETRIEVAL_PHASES = context_module.RETRIEVAL_PHASES, []
+        try:
+            without = _history_tokens(context, phase_key)
+        finally:
+            context_module.RETRIEVAL_PHASES = phases
+        print(f"{phase_key:<8} {without:12,} {with_retrieval:10,} {1 - with_retrieval / max(without, 1):8.0%}")
+
+
+if __name__ == "__main__":
+    main()
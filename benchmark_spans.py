@@ -0,0 +1,100 @@
+"""
+Raportti: lähdeviittausprotokollan (spans.py) vaikutus vaiheiden 2, 3 ja 7 vastaustokeneihin.
+
+  - lainaamalla: malli kopioi lähdetekstin kenttiin (konteksti_segmentti, data, backing, vaite)
+  - viittaamalla: malli kirjoittaa kentän tilalle {{SPAN: K12}} tai {{SPAN: K12-K13}}
+
+Tulokset ja tiedostot luetaan dataset/-kansion viimeisimmästä ajosta (tiedostojen teksti vaiheen 1
+data-kentistä). Lainaus katsotaan lähteestä otetuksi, jos yksi segmentti tai kaksi peräkkäistä
+segmenttiä sisältää vähintään 60 % sen hakutermeistä (lainaukset ovat usein mukailtuja); muut kentät
+jäävät ennalleen. Vastaustokenit arvioidaan TokenEstimatorilla (~4 merkkiä / token). Lisäksi mitataan
+viittausten korvaamisen (SpanMap.resolve) kesto.
+
+Käyttö: python benchmark_spans.py [--dataset dataset] [--span-chars 300]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+
+from benchmark_history_projection import _latest_results
+from retrieval import terms
+from spans import SpanMap
+from token_budget import TokenEstimator
+
+FILES = {"keskusteluhistoria": "Keskusteluhistoria.pdf", "lopputuote": "Lopputuote.pdf",
+         "reflektiodokumentti": "Reflektiodokumentti.pdf"}
+QUOTE_FIELDS = {"VAIHE 2": ("rag_todisteet", ["konteksti_segmentti"]),
+                "VAIHE 3": ("toulmin_analyysi", ["data", "backing"]),
+                "VAIHE 7": ("faktantarkistus_rfi", ["vaite"])}
+
+
+def _reference(spans, quote):
+    """Lainausta vastaava viittaus ("{{SPAN: K3}}" tai "{{SPAN: K3-K4}}") tai None."""
+    quote_terms = set(terms(quote))
+    if not quote_terms:
+        return None
+    span_terms = {span_id: set(terms(spans.quote(span_id))) for span_id in spans.spans}
+    best, best_overlap = None, 0
+    for ids in spans.by_file.values():
+        for i, (span_id, _, _) in enumerate(ids):
+            candidates = [[span_id]] + ([[span_id, ids[i + 1][0]]] if i + 1 < len(ids) else [])
+            for candidate in candidates:
+                overlap = len(quote_terms & set().union(*(span_terms[c] for c in candidate)))
+                if overlap > best_overlap or (overlap == best_overlap and best and len(candidate) < len(best)):
+                    best, best_overlap = candidate, overlap
+    if best is None or best_overlap < 0.6 * len(quote_terms):
+        return None
+    return "{{SPAN: " + "-".join(dict.fromkeys([best[0], best[-1]])) + "}}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dataset", default="dataset")
+    parser.add_argument("--span-chars", type=int, default=300)
+    args = parser.parse_args()
+
+    results = _latest_results(args.dataset)
+    data = json.loads(results["VAIHE 1"])["data"]
+    spans = SpanMap([(filename, data[field]) for field, filename in FILES.items()], span_chars=args.span_chars)
+    estimator = TokenEstimator()
+
+    print(f"--- Lähdesegmentit: {len(spans.spans)} kpl ({args.span_chars} merkkiä), "
+          f"tiedostot {sum(len(t) for t in spans.texts.values()):,} merkkiä ---")
+    print(f"{'vaihe':<8} {'lainauksia':>10} {'lähteestä':>10} {'vastaus':>9} {'viittaamalla':>13} {'säästö':>8}")
+    total_before = total_after = 0
+    references = []
+    for phase_key, (list_field, fields) in QUOTE_FIELDS.items():
+        if phase_key not in results:
+            continue
+        result = json.loads(results[phase_key])
+        before = estimator.estimate(json.dumps(result, ensure_ascii=False))
+        quotes = matched = 0
+        for item in result.get(list_field) or []:
+            for field in fields:
+                if not isinstance(item.get(field), str):
+                    continue
+                quotes += 1
+                reference = _reference(spans, item[field])
+                if reference:
+                    matched += 1
+                    item[field] = reference
+                    references.append(reference)
+        after = estimator.estimate(json.dumps(result, ensure_ascii=False))
+        total_before, total_after = total_before + before, total_after + after
+        print(f"{phase_key:<8} {quotes:10} {matched:10} {before:9,} {after:13,} {1 - after / max(before, 1):8.0%}")
+    print(f"{'yhteensä':<8} {'':>10} {'':>10} {total_before:9,} {total_after:13,} "
+          f"{1 - total_after / max(total_before, 1):8.0%}")
+
+    text = json.dumps({"viittaukset": references * 10}, ensure_ascii=False)
+    started = time.perf_counter()
+    _, report = spans.resolve(text)
+    print(f"Korvaus: {report['resolved']} viittausta {(time.perf_counter() - started) * 1000:.2f} ms, "
+          f"tuntemattomia {len(report['unknown'])}")
+
+
+if __name__ == "__main__":
+    main()
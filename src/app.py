@@ -2,18 +2,51 @@ import streamlit as st
 import json
 import os
 from llm_service import LLMService
+from llm_cache import LLMCache
+from single_flight import SingleFlight
+from rate_limiter import RateLimiter
+from config import RATE_LIMITS, RATE_LIMIT_STATE_FILE, LLM_BACKEND, AUTO_MODEL, DEFAULT_MODEL, PROMPT_CACHE_ENABLED
+from llm_backends import create_backend
+from prompt_cache import PromptCache
 from data_handler import DataHandler, TextUpload
 from orchestrator import Orchestrator
 from context import AssessmentContext
 from prompt_splitter import PromptSplitter
+from token_budget import TokenEstimator
 
 # Sivun asetukset
 st.set_page_config(page_title="Holistinen Mestaruus 3.0", layout="wide")
 st.title("🤖 Holistinen Mestaruus 3.0")
 
 # --- ALUSTUS (Service Layer & Data Layer) ---
+@st.cache_resource
+def get_llm_service(backend_name):
+    """
+    Yksi LLMService per prosessi: Streamlit ajaa skriptin uudelleen jokaisella vuorovaikutuksella,
+    mutta palvelu (genai.configure, yhteys, mallikahvat, välimuisti, nopeusrajoitin ja katkaisijat)
+    luodaan vain kerran. Poikkeuksia ei tallenneta, joten puuttuva API-avain yritetään uudelleen.
+    """
+    cache = LLMCache()
+    backend = create_backend(backend_name)
+    return LLMService(
+        cache=cache,
+        rate_limiter=RateLimiter(RATE_LIMITS, state_file=RATE_LIMIT_STATE_FILE),
+        backend=backend,
+        # Lukkotiedostot välimuistikansiossa: myös toinen Streamlit-prosessi tai eräajo odottaa samaa pyyntöä
+        single_flight=SingleFlight(lock_dir=os.path.join(cache.cache_dir, "locks")),
+        # Sääntöjen ja yhteisen historian välimuistikahvat jaetaan kaikkien arviointien kesken
+        prompt_cache=PromptCache(backend) if PROMPT_CACHE_ENABLED else None
+    )
+
+@st.cache_resource
+def get_token_estimator():
+    """Yksi token-arvio per prosessi: kalibroidaan kerran count_tokens-rajapinnalla (ks. token_budget.py)."""
+    return TokenEstimator()
+
+token_estimator = get_token_estimator()
+
 try:
-    llm_service = LLMService()
+    llm_service = get_llm_service(LLM_BACKEND)
     data_handler = DataHandler()
     orchestrator = Orchestrator(llm_service, data_handler)
     api_key_configured = True
@@ -60,17 +93,13 @@ with st.sidebar:
                     os.environ["GOOGLE_SEARCH_CX"] = new_cx
                     st.rerun()
             
-    # Mallin valinta
-    available_models = llm_service.get_available_models()
+    # Mallin valinta ("auto" = reititin valitsee vaihekohtaisesti nopeimman luotettavan mallin)
+    available_models = [AUTO_MODEL] + llm_service.get_available_models()
+    model_labels = {AUTO_MODEL: "Automaattinen (reititin)"}
     default_index = 0
-    if "gemini-2.5-flash" in available_models:
-        default_index = available_models.index("gemini-2.5-flash")
-    elif "gemini-1.5-flash-latest" in available_models:
-        default_index = available_models.index("gemini-1.5-flash-latest")
-    elif "gemini-1.5-flash" in available_models:
-        default_index = available_models.index("gemini-1.5-flash")
-        
-    model_selection = st.selectbox("Valitse Päämalli (Analyysi & Synteesi)", available_models, index=default_index)
+
+    model_selection = st.selectbox("Valitse Päämalli (Analyysi & Synteesi)", available_models, index=default_index,
+                                   format_func=lambda m: model_labels.get(m, m))
     
     # Kriitikkoryhmän malli (Phases 4-7)
     st.caption("Kriitikkoryhmän malli (Vaiheet 4-7)")
@@ -78,9 +107,48 @@ with st.sidebar:
         "Valitse Kriitikkomalli", 
         available_models, 
         index=default_index,
+        format_func=lambda m: model_labels.get(m, m),
         help="Voit valita eri mallin kriitikkoryhmälle (Red Teaming) parantaaksesi luotettavuutta."
     )
+
+    # Rinnakkaisuus (riippuvuusgraafi: Vaiheet 4-7 voidaan ajaa samanaikaisesti)
+    max_parallel_phases = st.number_input(
+        "Rinnakkaiset vaiheet (max)",
+        min_value=1,
+        max_value=8,
+        value=4,
+        help="Kuinka monta toisistaan riippumatonta vaihetta (esim. kriitikkovaiheet 4-7) ajetaan samanaikaisesti."
+    )
     
+    # LLM-välimuisti: identtiset kehotteet palautetaan levyltä ilman uutta API-kutsua.
+    # Asetukset välitetään ajolle (run_pipeline/run_mode), koska llm_service on kaikkien istuntojen yhteinen.
+    bypass_cache, stream_responses = None, None
+    if api_key_configured:
+        bypass_cache = st.checkbox(
+            "Ohita LLM-välimuisti",
+            value=False,
+            help="Pakottaa uudet LLM-kutsut, vaikka identtinen kehote löytyisi välimuistista (.llm_cache/)."
+        )
+        stream_responses = st.checkbox(
+            "Striimaa vastaukset",
+            value=True,
+            help="Näyttää vaiheen osittaisen tuloksen generoinnin aikana ja keskeyttää virheellisen vastauksen heti."
+        )
+        with st.expander("LLM-välimuistin tilastot"):
+            st.json(llm_service.cache.stats())
+        with st.expander("Samanaikaiset identtiset pyynnöt (single-flight)"):
+            st.json(llm_service.single_flight.stats())
+        with st.expander("Mallien reititys (viive, onnistumis- ja 429-aste)"):
+            st.json({"hedge": llm_service.hedge_stats, "reititin": llm_service.router.snapshot()})
+        with st.expander("Nopeusrajoitin (RPM/TPM)"):
+            st.json(llm_service.rate_limiter.stats())
+        with st.expander("Mallien katkaisijat (circuit breaker)"):
+            breaker_state = llm_service.circuit_breaker.snapshot()
+            if breaker_state:
+                st.json(breaker_state)
+            else:
+                st.caption("Kaikki mallit käytössä.")
+
     # Tutkimusdatan keräys (Luku 6.2)
     st.caption("Tutkimusagenda (Luku 6)")
     collect_dataset = st.checkbox(
@@ -197,6 +265,32 @@ if common_rules and prompt_phases:
         total_phase_chars = sum(len(v) for v in prompt_phases.values())
         st.write(f"Vaihe-ohjeet yhteensä: {total_phase_chars:,} merkkiä (~{total_phase_chars//4:,} tokenia)")
 
+        # Vaihekohtainen token-budjetti osioittain (ennakkotarkistus ennen ajoa, ks. AssessmentContext.build_prompt)
+        budget_context = st.session_state.get("assessment_context")
+        if budget_context:
+            st.write(f"Token-budjetti vaiheittain (raja {budget_context.token_limit:,} tokenia, "
+                     f"{budget_context.estimator.chars_per_token:.2f} merkkiä/token"
+                     f"{', kalibroitu' if budget_context.estimator.calibrated else ''}):")
+            budget_rows = []
+            for phase_key in sorted(prompt_phases):
+                budget = budget_context.prompt_budget(phase_key)
+                sections = budget["sections"]
+                budget_rows.append({
+                    "Vaihe": phase_key,
+                    "Säännöt": sections["rules"],
+                    "Vaiheohje": sections["phase_module"],
+                    "Tiedostot": sections["files"],
+                    "Historia": sections["history"],
+                    "Historia ennen projektiota": budget.get("history_unprojected", sections["history"]),
+                    "Yhteensä": budget["total"],
+                    "Välimuistista": budget.get("cacheable", 0),
+                    "Karsinta": ", ".join(f"{t['policy']} (-{t['saved_tokens']:,})" for t in budget["trimmed"]),
+                    "Yli rajan": "⚠️" if budget["over_limit"] else ""
+                })
+            st.dataframe(budget_rows, hide_index=True)
+        else:
+            st.caption("Token-budjetti vaiheittain näytetään, kun konteksti on alustettu.")
+
 # --- ORKESTROINTI ---
 tab1, tab2 = st.tabs(["Orkestrointi (9 Vaihetta)", "Yksittäiset Agentit"])
 
@@ -220,9 +314,11 @@ with tab1:
         st.session_state.mode_c_results = None
     if "pdf_path" not in st.session_state:
         st.session_state.pdf_path = None
+    if "run_id" not in st.session_state:
+        st.session_state.run_id = None
 
     if st.button("Alusta / Nollaa Konteksti", type="secondary"):
-        st.session_state.assessment_context = AssessmentContext(common_rules, prompt_phases)
+        st.session_state.assessment_context = AssessmentContext(common_rules, prompt_phases, estimator=token_estimator)
         # Lisää tiedostot
         # Lisää tiedostot
         if historia_file:
@@ -236,9 +332,35 @@ with tab1:
         if reflektio_file:
             content = data_handler.read_file_content(reflektio_file)
             st.session_state.assessment_context.add_file("Reflektiodokumentti.pdf", content)
+
+        # Token-arvio kalibroidaan kerran rajapinnan count_tokens-laskennalla (säännöt + tiedostot näytteenä)
+        if api_key_configured and not token_estimator.calibrated:
+            token_estimator.calibrate(
+                lambda text: llm_service.backend.count_tokens(DEFAULT_MODEL, text),
+                [common_rules] + [content for _, content in st.session_state.assessment_context.files]
+            )
+
+        # Uusi ajotunnus: valmiit vaiheet tallennetaan checkpointeiksi (runs/<run_id>/)
+        st.session_state.run_id = orchestrator.run_store.new_run_id()
             
         st.success("Konteksti alustettu! Tiedostot ladattu muistiin.")
 
+    # Keskeytyneen ajon jatkaminen (checkpointit levyltä)
+    saved_runs = orchestrator.run_store.list_runs()
+    if saved_runs:
+        with st.expander("♻️ Jatka keskeytynyttä ajoa"):
+            resume_run_id = st.selectbox("Tallennettu ajo", saved_runs)
+            if st.button("Lataa ajo", disabled=not (common_rules and prompt_phases)):
+                restored_context = AssessmentContext(common_rules, prompt_phases, estimator=token_estimator)
+                restored = orchestrator.restore_run(resume_run_id, restored_context)
+                st.session_state.assessment_context = restored_context
+                st.session_state.run_id = resume_run_id
+                st.success(f"Ajo {resume_run_id} ladattu. Valmiit vaiheet: {', '.join(restored) or 'ei yhtään'}. "
+                           "Seuraava ajo jatkaa ensimmäisestä puuttuvasta vaiheesta.")
+
+    if st.session_state.run_id:
+        st.caption(f"Ajotunnus: {st.session_state.run_id}")
+
     context = st.session_state.assessment_context
     
     if execution_mode == "Koko Prosessi (Vaiheet 1-9)":
@@ -253,35 +375,65 @@ with tab1:
                 st.write(f"Yleiset säännöt: {len(common_rules)} merkkiä")
                 st.write(list(prompt_phases.keys()))
 
+            # Vaiheet ajetaan riippuvuusgraafin mukaan: kriitikkovaiheet 4-7 rinnakkain.
+            # Streamlit-päivitykset tehdään pääsäikeessä on_phase_complete-callbackissa.
+            phase_names = {step["id"]: step["name"] for step in phases}
             for step in phases:
-                step_id = step["id"]
+                results_placeholders[step["id"]].info(f"⏳ Odottaa: {step['name']}")
+
+            def show_phase_result(step_id, result_text):
+                # Tallenna tulos sessioon
+                st.session_state.full_process_results[step_id] = result_text
+                step = next(p for p in phases if p["id"] == step_id)
+
                 with results_placeholders[step_id].container():
-                    with st.spinner(f"Suoritetaan {step['name']}..."):
-                        
-                        # Debug: Näytä kehote ennen lähetystä (paitsi Vaihe 9, joka on Python-koodia)
-                        if step_id != "phase_9":
-                            phase_key = step.get("phase_key")
-                            debug_prompt = context.build_prompt(phase_key)
-                            with st.expander(f"🔍 Debug: Kehote ({step['name']})"):
-                                st.text(debug_prompt)
-                            
-                        # Valitse malli vaiheen mukaan
-                        current_model = model_selection
-                        if step_id in ["phase_4", "phase_5", "phase_6", "phase_7"]:
-                            current_model = critic_model_selection
-                            
-                        result_text = orchestrator.run_phase(
-                            step_id, 
-                            context, 
-                            current_model,
-                            save_dataset=collect_dataset
-                        )
-                        
-                        # Tallenna tulos sessioon
-                        st.session_state.full_process_results[step_id] = result_text
-                        
-                        with st.expander(f"✅ {step['name']} (Valmis)"):
-                            st.markdown(result_text)
+                    # Debug: Näytä vaiheen kehote (paitsi Vaihe 9, joka on Python-koodia)
+                    if step_id != "phase_9":
+                        debug_prompt = context.build_prompt(step.get("phase_key"))
+                        with st.expander(f"🔍 Debug: Kehote ({step['name']})"):
+                            st.text(debug_prompt)
+
+                    with st.expander(f"✅ {step['name']} (Valmis)"):
+                        st.markdown(context.expand_result(result_text))
+
+            def show_phase_progress(step_id, partial):
+                # Striimattu osittainen tulos (päivitetään kunnes vaihe valmistuu)
+                with results_placeholders[step_id].container():
+                    st.info(f"✍️ Generoidaan: {phase_names.get(step_id, step_id)}")
+                    st.json(partial, expanded=False)
+
+            with st.spinner("Suoritetaan vaiheita (kriitikkovaiheet 4-7 rinnakkain)..."):
+                pipeline_results = orchestrator.run_pipeline(
+                    context,
+                    model_selection,
+                    critic_model_name=critic_model_selection,
+                    save_dataset=collect_dataset,
+                    max_workers=max_parallel_phases,
+                    on_phase_complete=show_phase_result,
+                    run_id=st.session_state.run_id,
+                    on_phase_progress=show_phase_progress,
+                    cache_bypass=bypass_cache,
+                    streaming=stream_responses
+                )
+
+            if "STOPPED_EARLY" in pipeline_results:
+                st.error(pipeline_results["STOPPED_EARLY"])
+
+            with st.expander("⏱️ Ajoajat (kriittinen polku)"):
+                summary = orchestrator.last_run_summary
+                st.write(f"Kokonaisaika: {summary.get('wall_time', 0)} s "
+                         f"(sekventiaalisesti {summary.get('sequential_time', 0)} s)")
+                st.write("Kriittinen polku: " + " → ".join(
+                    phase_names.get(pid, pid) for pid in summary.get("critical_path", [])))
+                st.json(orchestrator.phase_timings)
+
+            with st.expander("💰 LLM-telemetria (tokenit, yritykset, hinta)"):
+                telemetry_summary = orchestrator.get_telemetry()
+                st.write(f"Kutsut: {telemetry_summary.get('calls', 0)}, "
+                         f"tokenit: {telemetry_summary.get('prompt_tokens', 0)} + {telemetry_summary.get('output_tokens', 0)} "
+                         f"(välimuistista {telemetry_summary.get('cached_tokens', 0)}), "
+                         f"arvioitu hinta: {telemetry_summary.get('cost_usd', 0)} USD")
+                st.json(telemetry_summary.get("phases", {}), expanded=False)
             
             # PDF-lataus (Koko Prosessi)
             if "phase_9" in orchestrator.results:
@@ -326,11 +478,11 @@ with tab1:
         st.subheader("Moodi A: Alustus (Vaiheet 1-3)")
         if st.button("Suorita Moodi A", type="primary", disabled=not context):
             with st.spinner("Suoritetaan Moodi A..."):
-                results = orchestrator.run_mode("MOODI_A", context, model_selection, save_dataset=collect_dataset)
+                results = orchestrator.run_mode("MOODI_A", context, model_selection, save_dataset=collect_dataset, run_id=st.session_state.run_id, cache_bypass=bypass_cache, streaming=stream_responses)
                 for pid, res in results.items():
                     st.markdown(f"**{pid}**: Valmis")
                     with st.expander(f"Tulos: {pid}"):
-                        st.markdown(res)
+                        st.markdown(context.expand_result(res))
             st.success("Moodi A valmis!")
 
         st.markdown("---")
@@ -339,13 +491,13 @@ with tab1:
         st.subheader("Moodi B: Auditointi (Vaiheet 4-7)")
         if st.button("Suorita Moodi B", type="primary", disabled=not context):
              with st.spinner("Suoritetaan Moodi B..."):
-                results = orchestrator.run_mode("MOODI_B", context, model_selection, critic_model_name=critic_model_selection, save_dataset=collect_dataset)
+                results = orchestrator.run_mode("MOODI_B", context, model_selection, critic_model_name=critic_model_selection, save_dataset=collect_dataset, run_id=st.session_state.run_id, cache_bypass=bypass_cache, streaming=stream_responses)
                 st.session_state.mode_b_results = results
                 
                 for pid, res in results.items():
                     st.markdown(f"**{pid}**: Valmis")
                     with st.expander(f"Tulos: {pid}"):
-                        st.markdown(res)
+                        st.markdown(context.expand_result(res))
              st.success("Moodi B valmis!")
 
         st.markdown("---")
@@ -354,13 +506,13 @@ with tab1:
         st.subheader("Moodi C: Synteesi (Vaiheet 8-9)")
         if st.button("Suorita Moodi C", type="primary", disabled=not context):
              with st.spinner("Suoritetaan Moodi C..."):
-                results = orchestrator.run_mode("MOODI_C", context, model_selection, save_dataset=collect_dataset)
+                results = orchestrator.run_mode("MOODI_C", context, model_selection, save_dataset=collect_dataset, run_id=st.session_state.run_id, cache_bypass=bypass_cache, streaming=stream_responses)
                 st.session_state.mode_c_results = results
                 
                 for pid, res in results.items():
                     st.markdown(f"**{pid}**: Valmis")
                     with st.expander(f"Tulos: {pid}"):
-                        st.markdown(res)
+                        st.markdown(context.expand_result(res))
                         
                 # PDF-lataus
                 if "phase_9" in results:
@@ -0,0 +1,426 @@
+"""
+Eräajo: arvioi kokonaisen kurssin palautukset ilman käyttöliittymää.
+
+Syöte on joko hakemisto (yksi alikansio per opiskelija) tai manifesti (JSON/CSV),
+jossa jokaiselle opiskelijalle on annettu Keskusteluhistoria, Lopputuote ja
+Reflektiodokumentti. Jokaiselle opiskelijalle rakennetaan oma AssessmentContext
+ja Orchestrator, ja tulokset kirjoitetaan tuloskansioon opiskelijakohtaisesti.
+
+Käyttö:
+    python src/batch_runner.py palautukset/ --output tulokset/ --workers 4 \\
+        --model-concurrency gemini-2.5-flash=6
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from context import AssessmentContext
+from data_handler import DataHandler
+from orchestrator import Orchestrator
+from prompt_splitter import PromptSplitter
+from run_store import RunStore
+from telemetry import Telemetry
+
+# Tiedostorooli -> tiedostonimi kontekstissa (sama kuin app.py:ssä)
+FILE_ROLES = {
+    "keskusteluhistoria": "Keskusteluhistoria.pdf",
+    "lopputuote": "Lopputuote.pdf",
+    "reflektiodokumentti": "Reflektiodokumentti.pdf",
+}
+
+# Hakemistomoodissa tiedosto tunnistetaan nimen alun perusteella
+ROLE_PREFIXES = {
+    "keskusteluhistoria": ("keskusteluhistoria", "keskustelu", "historia"),
+    "lopputuote": ("lopputuote", "tuote"),
+    "reflektiodokumentti": ("reflektiodokumentti", "reflektio"),
+}
+
+SUPPORTED_EXTENSIONS = (".pdf", ".txt", ".docx", ".md")
+
+
+class ModelConcurrencyLimiter:
+    """
+    Kääre LLM-palvelulle: rajoittaa samanaikaisten kutsujen määrää mallikohtaisesti.
+    Kaikki eräajon opiskelijat jakavat saman rajoittimen.
+
+    LLMService-palvelulle rajoitin asennetaan palvelun concurrency_limiter-koukuksi, jolloin raja
+    koskee todellista kutsuttua mallia ("auto", fallback, hedge, korjausmalli) eikä pyydettyä nimeä.
+    Muut palvelut (esim. testien mockit) rajoitetaan pyydetyn mallin mukaan.
+    """
+
+    def __init__(self, llm_service, limits=None, default_limit=4):
+        self.llm_service = llm_service
+        self.limits = dict(limits or {})
+        self.default_limit = default_limit
+        self._semaphores = {}
+        self._async_semaphores = {}
+        self._lock = threading.Lock()
+        self._in_service = getattr(llm_service, "concurrency_limiter", False) is None
+        if self._in_service:
+            llm_service.concurrency_limiter = self
+
+    def slot(self, model_name):
+        """Mallin semafori (with-lohko); LLMService kutsuu tätä ennen jokaista API-kutsua."""
+        with self._lock:
+            if model_name not in self._semaphores:
+                limit = self.limits.get(model_name, self.default_limit)
+                self._semaphores[model_name] = threading.BoundedSemaphore(max(1, int(limit)))
+            return self._semaphores[model_name]
+
+    def aslot(self, model_name):
+        """Asynkroninen versio slot-metodista (async with -lohko)."""
+        with self._lock:
+            if model_name not in self._async_semaphores:
+                limit = self.limits.get(model_name, self.default_limit)
+                self._async_semaphores[model_name] = asyncio.Semaphore(max(1, int(limit)))
+            return self._async_semaphores[model_name]
+
+    def generate_response(self, prompt, model_name="gemini-2.5-flash", validation_fn=None, **kwargs):
+        if self._in_service:
+            return self.llm_service.generate_response(prompt, model_name, validation_fn=validation_fn, **kwargs)
+        with self.slot(model_name):
+            return self.llm_service.generate_response(prompt, model_name, validation_fn=validation_fn, **kwargs)
+
+    async def agenerate_response(self, prompt, model_name="gemini-2.5-flash", validation_fn=None, **kwargs):
+        if self._in_service:
+            return await self.llm_service.agenerate_response(prompt, model_name, validation_fn=validation_fn, **kwargs)
+        async with self.aslot(model_name):
+            return await self.llm_service.agenerate_response(prompt, model_name, validation_fn=validation_fn, **kwargs)
+
+    def __getattr__(self, name):
+        # Muut metodit (esim. get_available_models) suoraan alla olevalle palvelulle
+        return getattr(self.llm_service, name)
+
+
+def discover_submissions(source):
+    """
+    Palauttaa listan palautuksista: [{"id": ..., "files": {rooli: polku}}].
+    source voi olla hakemisto tai manifesti (.json / .csv).
+    """
+    if os.path.isdir(source):
+        return _discover_from_directory(source)
+    if source.lower().endswith(".json"):
+        return _load_json_manifest(source)
+    if source.lower().endswith(".csv"):
+        return _load_csv_manifest(source)
+    raise ValueError(f"Tuntematon syöte: {source} (odotettiin hakemistoa, .json- tai .csv-manifestia)")
+
+
+def _discover_from_directory(root):
+    submissions = []
+    for student_id in sorted(os.listdir(root)):
+        student_dir = os.path.join(root, student_id)
+        if not os.path.isdir(student_dir):
+            continue
+
+        files = {}
+        for fname in sorted(os.listdir(student_dir)):
+            if not fname.lower().endswith(SUPPORTED_EXTENSIONS):
+                continue
+            lower = fname.lower()
+            for role, prefixes in ROLE_PREFIXES.items():
+                if role not in files and lower.startswith(prefixes):
+                    files[role] = os.path.join(student_dir, fname)
+                    break
+
+        if files:
+            submissions.append({"id": student_id, "files": files})
+    return submissions
+
+
+def _resolve_entry(entry, base_dir, index):
+    student_id = _safe_student_id(entry.get("id") or entry.get("opiskelija") or f"opiskelija_{index + 1}")
+    files = {}
+    for role in FILE_ROLES:
+        path = entry.get(role)
+        if path:
+            files[role] = path if os.path.isabs(path) else os.path.join(base_dir, path)
+    return {"id": student_id, "files": files}
+
+
+def _safe_student_id(student_id):
+    # Tunnus on tuloskansion ja checkpointin nimi: estetään polkujen karkaaminen (kuten RunStore.run_dir)
+    safe_id = os.path.basename(str(student_id).strip())
+    if not safe_id or safe_id in (".", ".."):
+        raise ValueError(f"Virheellinen opiskelijatunnus manifestissa: {student_id!r}")
+    return safe_id
+
+
+def _load_json_manifest(path):
+    with open(path, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+    base_dir = os.path.dirname(os.path.abspath(path))
+    return [_resolve_entry(e, base_dir, i) for i, e in enumerate(entries)]
+
+
+def _load_csv_manifest(path):
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        entries = list(csv.DictReader(f))
+    base_dir = os.path.dirname(os.path.abspath(path))
+    return [_resolve_entry(e, base_dir, i) for i, e in enumerate(entries)]
+
+
+class BatchRunner:
+    """
+    Ajaa arvioinnin usealle opiskelijalle rinnakkain.
+    Yhden opiskelijan virhe kirjataan, mutta se ei pysäytä eräajoa.
+    """
+
+    def __init__(self, llm_service, common_rules, prompt_phases, output_dir,
+                 model_name="gemini-2.5-flash", critic_model_name=None,
+                 workers=4, phase_workers=4, save_pdf=False, resume=True):
+        self.llm_service = llm_service
+        self.data_handler = DataHandler()
+        self.common_rules = common_rules
+        self.prompt_phases = prompt_phases
+        self.output_dir = output_dir
+        self.model_name = model_name
+        self.critic_model_name = critic_model_name
+        self.workers = max(1, int(workers))
+        self.phase_workers = max(1, int(phase_workers))
+        self.save_pdf = save_pdf
+        # Checkpointit opiskelijakohtaisesti: uudelleenajo jatkaa puuttuvista vaiheista
+        self.resume = resume
+        self.run_store = RunStore(os.path.join(output_dir, "runs"))
+
+    def build_context(self, submission):
+        """Rakentaa AssessmentContextin yhden opiskelijan tiedostoista."""
+        context = AssessmentContext(self.common_rules, self.prompt_phases)
+        for role, context_name in FILE_ROLES.items():
+            path = submission["files"].get(role)
+            if path:
+                context.add_file(context_name, self.data_handler.read_file_path(path))
+        return context
+
+    def assess(self, submission):
+        """Arvioi yhden palautuksen ja kirjoittaa tulokset. Palauttaa tilarivin."""
+        student_id = submission["id"]
+        started = time.perf_counter()
+        status = {"id": student_id, "status": "failed", "duration": 0.0, "error": None}
+
+        try:
+            missing = [role for role in FILE_ROLES if role not in submission["files"]]
+            if missing:
+                print(f"--- ERÄAJO: {student_id}: puuttuvat tiedostot {missing} ---")
+
+            context = self.build_context(submission)
+            orchestrator = Orchestrator(self.llm_service, self.data_handler,
+                                        max_workers=self.phase_workers, run_store=self.run_store)
+            results = orchestrator.run_pipeline(
+                context,
+                self.model_name,
+                critic_model_name=self.critic_model_name,
+                run_id=student_id if self.resume else None
+            )
+
+            self._write_results(student_id, results, orchestrator, context)
+            telemetry = orchestrator.get_telemetry()
+            status["cost_usd"] = telemetry.get("cost_usd", 0.0)
+            status["tokens"] = telemetry.get("prompt_tokens", 0) + telemetry.get("output_tokens", 0)
+
+            report = results.get("phase_9", "")
+            if "STOPPED_EARLY" in results:
+                status["status"] = "stopped"
+                status["error"] = results["STOPPED_EARLY"]
+            elif report and not report.startswith("VIRHE"):
+                status["status"] = "ok"
+            else:
+                status["error"] = report or "Raporttia (Vaihe 9) ei syntynyt."
+        except Exception as e:
+            status["error"] = str(e)
+            print(f"--- ERÄAJO: {student_id} epäonnistui: {e} ---")
+            traceback.print_exc()
+
+        status["duration"] = round(time.perf_counter() - started, 2)
+        return status
+
+    def _write_results(self, student_id, results, orchestrator, context):
+        student_dir = os.path.join(self.output_dir, student_id)
+        os.makedirs(student_dir, exist_ok=True)
+
+        for phase_id, result in results.items():
+            if phase_id == "phase_9":
+                filename = "raportti.md"
+            elif phase_id.startswith("phase_"):
+                filename = f"{phase_id}.json"
+            else:
+                continue
+            with open(os.path.join(student_dir, filename), "w", encoding="utf-8") as f:
+                # Tiedostoviittaukset ({{BLOB: ...}}) korvataan sisällöllä vasta viennissä
+                f.write(context.expand_result(result) if isinstance(result, str)
+                        else json.dumps(result, ensure_ascii=False))
+
+        with open(os.path.join(student_dir, "ajoajat.json"), "w", encoding="utf-8") as f:
+            json.dump({"phases": orchestrator.phase_timings, "summary": orchestrator.last_run_summary,
+                       "telemetry": orchestrator.get_telemetry()},
+                      f, indent=2, ensure_ascii=False)
+
+        if self.save_pdf and "phase_9" in results:
+            orchestrator.report_generator.save_as_pdf(results["phase_9"], os.path.join(student_dir, "raportti.pdf"))
+
+    def run(self, submissions):
+        """
+        Ajaa kaikki palautukset. Palauttaa yhteenvedon, jossa on läpäisykyky
+        (arviointia tunnissa) ja opiskelijakohtaiset tilat.
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        started = time.perf_counter()
+        statuses = []
+
+        print(f"--- ERÄAJO: {len(submissions)} palautusta, {self.workers} rinnakkain ---")
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="student") as pool:
+            futures = {pool.submit(self.assess, s): s["id"] for s in submissions}
+            for future in as_completed(futures):
+                status = future.result()
+                statuses.append(status)
+                print(f"--- ERÄAJO: {status['id']} -> {status['status']} ({status['duration']} s) "
+                      f"[{len(statuses)}/{len(submissions)}] ---")
+
+        elapsed = time.perf_counter() - started
+        completed = sum(1 for s in statuses if s["status"] == "ok")
+        summary = {
+            "total": len(submissions),
+            "completed": completed,
+            "stopped": sum(1 for s in statuses if s["status"] == "stopped"),
+            "failed": sum(1 for s in statuses if s["status"] == "failed"),
+            "elapsed_seconds": round(elapsed, 2),
+            "assessments_per_hour": round(completed / elapsed * 3600, 2) if elapsed > 0 else 0.0,
+            "cost_usd": round(sum(s.get("cost_usd", 0.0) for s in statuses), 6),
+            "students": sorted(statuses, key=lambda s: s["id"]),
+        }
+
+        with open(os.path.join(self.output_dir, "yhteenveto.json"), "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2, ensure_ascii=False)
+
+        # Kutsukohtainen telemetria (yksi LLM-kutsu per rivi) jälkianalyysia varten
+        telemetry = getattr(self.llm_service, "telemetry", None)
+        if isinstance(telemetry, Telemetry):
+            telemetry.export_jsonl(os.path.join(self.output_dir, "telemetry.jsonl"))
+
+        print(f"--- ERÄAJO VALMIS: {completed}/{len(submissions)} onnistui, "
+              f"{summary['assessments_per_hour']} arviointia/tunti ---")
+        return summary
+
+
+def _parse_model_limits(values):
+    limits = {}
+    for value in values or []:
+        model, _, limit = value.partition("=")
+        if not limit:
+            raise argparse.ArgumentTypeError(f"Virheellinen --model-concurrency: {value} (odotettiin malli=N)")
+        limits[model.strip()] = int(limit)
+    return limits
+
+
+def _parse_hedge_policy(phases, percentile):
+    """--hedge phase_4 --hedge phase_5 -> {"phase_4": {"percentile": 90}, ...}; None = config.HEDGE_POLICY."""
+    if not phases:
+        return None
+    return {phase: {"percentile": percentile} for phase in phases}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Holistinen Mestaruus 3.0 - eräarviointi")
+    parser.add_argument("source", help="Palautushakemisto tai manifesti (.json/.csv)")
+    parser.add_argument("--output", default="batch_output", help="Tuloskansio")
+    parser.add_argument("--prompts", default="prompts", help="Kehotekansio (Yleiset_säännöt.txt, VAIHE_N.txt)")
+    parser.add_argument("--model", default="auto",
+                        help="Päämalli; \"auto\" = reititin valitsee vaihekohtaisesti (config.FALLBACK_MODELS)")
+    parser.add_argument("--critic-model", default=None, help="Kriitikkoryhmän malli (Vaiheet 4-7)")
+    parser.add_argument("--workers", type=int, default=4, help="Rinnakkain arvioitavat opiskelijat")
+    parser.add_argument("--phase-workers", type=int, default=4, help="Rinnakkaiset vaiheet opiskelijaa kohden")
+    parser.add_argument("--model-concurrency", action="append", metavar="MALLI=N",
+                        help="Mallikohtainen samanaikaisten kutsujen raja (voi toistaa)")
+    parser.add_argument("--default-concurrency", type=int, default=4,
+                        help="Samanaikaisten kutsujen raja malleille, joita ei ole erikseen määritelty")
+    parser.add_argument("--pdf", action="store_true", help="Tallenna raportti myös PDF-muodossa")
+    parser.add_argument("--cache-dir", default=None, help="LLM-välimuistin kansio (oletus .llm_cache/)")
+    parser.add_argument("--no-cache", action="store_true", help="Älä käytä LLM-välimuistia")
+    parser.add_argument("--rate-limit-file", default=None,
+                        help="Jaettu RPM/TPM-tilatiedosto (oletus config.RATE_LIMIT_STATE_FILE)")
+    parser.add_argument("--no-rate-limit", action="store_true", help="Älä käytä ennakoivaa nopeusrajoitusta")
+    parser.add_argument("--no-resume", action="store_true",
+                        help="Älä jatka aiempia checkpointeja (<output>/runs/<opiskelija>)")
+    parser.add_argument("--hedge", action="append", metavar="VAIHE",
+                        help="Hedged-pyynnöt vaiheelle (esim. phase_4), voi toistaa; oletus config.HEDGE_POLICY")
+    parser.add_argument("--hedge-percentile", type=float, default=90,
+                        help="Päämallin kestojakauman persentiili, jonka jälkeen varamallille lähtee rinnakkainen pyyntö")
+    parser.add_argument("--backend", choices=["gemini", "openai", "simulator"], default=None,
+                        help="LLM-taustapalvelu (oletus config.LLM_BACKEND)")
+    parser.add_argument("--transport", choices=["grpc", "rest"], default=None,
+                        help="Gemini-rajapinnan siirtokerros (oletus config.GEMINI_TRANSPORT)")
+    parser.add_argument("--base-url", default=None, help="OpenAI-yhteensopivan palvelimen osoite (--backend openai)")
+    parser.add_argument("--sim-latency", type=float, default=1.0, help="Simulaattorin viiveen mediaani (s)")
+    parser.add_argument("--sim-429-rate", type=float, default=0.0, help="Simulaattorin 429-virheiden osuus")
+    parser.add_argument("--sim-truncation-rate", type=float, default=0.0,
+                        help="Simulaattorin katkaistujen vastausten osuus (finish_reason 2)")
+    parser.add_argument("--sim-time-scale", type=float, default=1.0, help="Simulaattorin viiveiden kerroin")
+    args = parser.parse_args(argv)
+
+    splitter = PromptSplitter()
+    if not splitter.load_from_disk(args.prompts):
+        parser.error(f"Kehotteita ei löytynyt kansiosta {args.prompts}")
+    prompt_modules = splitter.get_prompt_modules()
+    common_rules = prompt_modules.get("COMMON_RULES", "")
+    prompt_phases = {k: v for k, v in prompt_modules.items() if k.startswith("VAIHE")}
+
+    from llm_service import LLMService
+    from llm_cache import LLMCache
+    from single_flight import SingleFlight
+    from rate_limiter import RateLimiter
+    from config import RATE_LIMITS, RATE_LIMIT_STATE_FILE, LLM_BACKEND, PROMPT_CACHE_ENABLED
+    from llm_backends import create_backend
+    from prompt_cache import PromptCache
+
+    backend_name = args.backend or LLM_BACKEND
+    backend_options = {}
+    if backend_name == "gemini" and args.transport:
+        backend_options["transport"] = args.transport
+    elif backend_name == "openai" and args.base_url:
+        backend_options["base_url"] = args.base_url
+    elif backend_name == "simulator":
+        backend_options = {
+            "latency_median": args.sim_latency,
+            "rate_limit_rate": args.sim_429_rate,
+            "truncation_rate": args.sim_truncation_rate,
+            "time_scale": args.sim_time_scale
+        }
+    backend = create_backend(backend_name, **backend_options)
+
+    rate_limiter = None
+    if not args.no_rate_limit:
+        rate_limiter = RateLimiter(RATE_LIMITS, state_file=args.rate_limit_file or RATE_LIMIT_STATE_FILE)
+    cache = None if args.no_cache else LLMCache(args.cache_dir)
+    # Prosessien välinen yhdistäminen vaatii jaetun välimuistin (tulos välittyy sen kautta)
+    single_flight = SingleFlight(lock_dir=os.path.join(cache.cache_dir, "locks") if cache else None)
+    llm_service = ModelConcurrencyLimiter(
+        LLMService(cache=cache, rate_limiter=rate_limiter, backend=backend, single_flight=single_flight,
+                   hedge_policy=_parse_hedge_policy(args.hedge, args.hedge_percentile),
+                   # Sääntöjen välimuistikahva jaetaan kaikkien palautusten kesken (ks. prompt_cache.py)
+                   prompt_cache=PromptCache(backend) if PROMPT_CACHE_ENABLED else None),
+        limits=_parse_model_limits(args.model_concurrency),
+        default_limit=args.default_concurrency
+    )
+
+    runner = BatchRunner(
+        llm_service, common_rules, prompt_phases, args.output,
+        model_name=args.model,
+        critic_model_name=args.critic_model,
+        workers=args.workers,
+        phase_workers=args.phase_workers,
+        save_pdf=args.pdf,
+        resume=not args.no_resume
+    )
+    summary = runner.run(discover_submissions(args.source))
+    return 0 if summary["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,102 @@
+import hashlib
+import json
+import re
+import threading
+
+_REFERENCE = re.compile(r"\{\{BLOB:\s*([0-9a-f]{64})\s*\}\}")
+
+
+class BlobStore:
+    """
+    Sisältöosoitteinen tiedostovarasto yhdelle arvioinnille.
+
+    Jokainen sisältö tallennetaan kerran SHA-256-tiivisteen mukaan, ja tulokset viittaavat siihen
+    kevyellä viittauksella {{BLOB: tiiviste}} (ks. Orchestrator._inject_file_content). Viittaukset
+    korvataan sisällöllä vasta, kun tulos näytetään, viedään tai liitetään kehotteeseen (expand).
+    Tiedostonimen haku on sanakirjahaku; osittainen nimi etsitään kuten ennen (loppu tai osa nimeä).
+    """
+
+    def __init__(self):
+        self._blobs = {} # tiiviste -> sisältö
+        self._names = {} # tiedostonimi -> tiiviste
+        self._escaped_lengths = {} # tiiviste -> JSON-escapeeratun sisällön pituus (expanded_length)
+        self._lock = threading.Lock()
+
+    def put(self, filename, content):
+        """Tallentaa tiedoston sisällön ja palauttaa sen tiivisteen."""
+        digest = hashlib.sha256(content.encode("utf-8")).hexdigest()
+        with self._lock:
+            self._blobs.setdefault(digest, content)
+            self._names[filename] = digest
+        return digest
+
+    def get(self, digest):
+        return self._blobs.get(digest)
+
+    def find(self, filename):
+        """Tiedoston tiiviste nimen perusteella (tarkka nimi, nimen loppu tai osa nimeä), tai None."""
+        digest = self._names.get(filename)
+        if digest is not None:
+            return digest
+        for name, digest in list(self._names.items()):
+            if name.endswith(filename) or filename in name:
+                return digest
+        return None
+
+    def reference(self, filename):
+        """Viittaus {{BLOB: tiiviste}} tiedostoon, tai None jos tiedostoa ei ole."""
+        digest = self.find(filename)
+        return None if digest is None else "{{BLOB: " + digest + "}}"
+
+    def expand(self, text):
+        """
+        Korvaa viittaukset sisällöllä JSON-escapeerattuna (viittaus on JSON-merkkijonon sisällä).
+        Teksti ilman viittauksia palautetaan samana oliona. Tuntematon viittaus korvataan virhemerkinnällä.
+        """
+        if not text or "{{BLOB:" not in text:
+            return text
+
+        def replace(match):
+            content = self._blobs.get(match.group(1))
+            if content is None:
+                return f"[TIEDOSTOA {match.group(1)[:12]} EI LÖYTYNYT]"
+            return json.dumps(content, ensure_ascii=False)[1:-1]
+
+        return _REFERENCE.sub(replace, text)
+
+    def expanded_length(self, text):
+        """expand(text)-tuloksen pituus ilman, että sisältöä kopioidaan (esim. token-budjetti)."""
+        if not text or "{{BLOB:" not in text:
+            return len(text) if text else 0
+        length = len(text)
+        for match in _REFERENCE.finditer(text):
+            length += self._escaped_length(match.group(1)) - len(match.group(0))
+        return length
+
+    def retain(self, digests):
+        """Poistaa sisällöt, joita ei ole annetuissa tiivisteissä (esim. sanitoinnin korvaamat raakatiedostot)."""
+        keep = set(digests)
+        with self._lock:
+            self._blobs = {d: content for d, content in self._blobs.items() if d in keep}
+            self._names = {name: d for name, d in self._names.items() if d in keep}
+            self._escaped_lengths = {d: n for d, n in self._escaped_lengths.items() if d in keep}
+
+    def stats(self):
+        return {"blobs": len(self._blobs), "chars": sum(map(len, self._blobs.values()))}
+
+    def _escaped_length(self, digest):
+        length = self._escaped_lengths.get(digest)
+        if length is None:
+            content = self._blobs.get(digest)
+            if content is None:
+                return len(f"[TIEDOSTOA {digest[:12]} EI LÖYTYNYT]")
+            length = len(json.dumps(content, ensure_ascii=False)) - 2
+            self._escaped_lengths[digest] = length
+        return length
+
+
+def blob_references(text):
+    """Tekstin viittaamat tiivisteet."""
+    if not text or "{{BLOB:" not in text:
+        return set()
+    return set(_REFERENCE.findall(text))
@@ -0,0 +1,128 @@
+import re
+import threading
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def parse_retry_after(error):
+    """
+    Poimii Retry-After-vihjeen (sekunteina) Gemini-virheilmoituksesta, esim.
+    "Please retry in 23.5s" tai "retry_delay { seconds: 23 }". Palauttaa None jos vihjettä ei ole.
+    """
+    text = str(error)
+    match = re.search(r"retry in ([\d.]+)\s*s", text, re.IGNORECASE)
+    if not match:
+        match = re.search(r"retry_delay\s*\{\s*seconds:\s*(\d+)", text)
+    if not match:
+        match = re.search(r"Retry-After:?\s*([\d.]+)", text, re.IGNORECASE)
+    try:
+        return float(match.group(1)) if match else None
+    except ValueError:
+        return None
+
+
+class CircuitBreaker:
+    """
+    Mallikohtainen katkaisija (closed / open / half_open), joka korvaa pysyvän estolistan.
+
+    - closed: malli on käytössä.
+    - open: mallin kiintiö on täynnä; kutsut ohjataan varamalliin cooldownin ajan.
+    - half_open: cooldown on kulunut; yksi koekutsu (probe) päästetään läpi. Onnistuminen
+      palauttaa mallin käyttöön, uusi 429 avaa katkaisijan kaksinkertaisella cooldownilla.
+    """
+
+    def __init__(self, failure_threshold=1, cooldown=60.0, max_cooldown=3600.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._lock = threading.Lock()
+        self._models = {}
+
+    def _entry(self, model_name):
+        return self._models.setdefault(model_name, {
+            "state": CLOSED,
+            "failures": 0,
+            "opened_at": None,
+            "cooldown": self.cooldown,
+            "probe_in_flight": False,
+            "trips": 0
+        })
+
+    def allow(self, model_name):
+        """Saako mallia kutsua nyt? Siirtää open -> half_open kun cooldown on kulunut."""
+        with self._lock:
+            entry = self._entry(model_name)
+            if entry["state"] == CLOSED:
+                return True
+
+            if entry["state"] == OPEN:
+                if time.time() - entry["opened_at"] < entry["cooldown"]:
+                    return False
+                entry["state"] = HALF_OPEN
+                entry["probe_in_flight"] = False
+                print(f"--- CIRCUIT BREAKER: {model_name} HALF-OPEN (koekutsu) ---")
+
+            # HALF_OPEN: vain yksi koekutsu kerrallaan
+            if entry["probe_in_flight"]:
+                return False
+            entry["probe_in_flight"] = True
+            return True
+
+    def is_probing(self, model_name):
+        with self._lock:
+            return self._entry(model_name)["state"] == HALF_OPEN
+
+    def record_success(self, model_name):
+        """Malli vastasi (ei kiintiövirhettä) -> closed."""
+        with self._lock:
+            entry = self._entry(model_name)
+            if entry["state"] != CLOSED:
+                print(f"--- CIRCUIT BREAKER: {model_name} CLOSED (malli palautettu käyttöön) ---")
+            entry.update(state=CLOSED, failures=0, opened_at=None, cooldown=self.cooldown, probe_in_flight=False)
+
+    def record_failure(self, model_name, retry_after=None):
+        """
+        Kiintiövirhe (429). Avaa katkaisijan kun raja täyttyy tai koekutsu epäonnistuu.
+        retry_after (s) asettaa cooldownin API:n vihjeen mukaan.
+        """
+        with self._lock:
+            entry = self._entry(model_name)
+            entry["failures"] += 1
+
+            if entry["state"] == HALF_OPEN:
+                cooldown = min(entry["cooldown"] * 2, self.max_cooldown)
+            elif entry["failures"] >= self.failure_threshold:
+                cooldown = self.cooldown
+            else:
+                return
+
+            if retry_after:
+                cooldown = min(max(float(retry_after), 1.0), self.max_cooldown)
+
+            entry.update(state=OPEN, opened_at=time.time(), cooldown=cooldown, probe_in_flight=False)
+            entry["trips"] += 1
+            print(f"--- CIRCUIT BREAKER: {model_name} OPEN ({cooldown:.0f} s) ---")
+
+    def open_models(self):
+        """Mallit, joita ei tällä hetkellä kutsuta (open tai koekutsu käynnissä)."""
+        with self._lock:
+            return {m for m, e in self._models.items() if e["state"] != CLOSED}
+
+    def snapshot(self):
+        """Katkaisijoiden tila monitorointia varten."""
+        now = time.time()
+        with self._lock:
+            return {
+                model: {
+                    "state": e["state"],
+                    "failures": e["failures"],
+                    "trips": e["trips"],
+                    "cooldown": e["cooldown"],
+                    "retry_in": round(max(0.0, e["opened_at"] + e["cooldown"] - now), 1)
+                    if e["state"] == OPEN else 0.0
+                }
+                for model, e in self._models.items()
+            }
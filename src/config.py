@@ -3,7 +3,147 @@ import os
 # Mallien konfiguraatio
 # Mallien konfiguraatio
 DEFAULT_MODEL = "gemini-2.5-flash"
-FALLBACK_MODELS = ["gemini-1.5-flash", "gemini-1.5-pro", "gemini-2.5-flash"]
+# Sallitut mallit: reititin (ks. model_router.py) valitsee vaiheen mallin ja järjestää fallback-ketjun
+# näistä. Järjestys on oletusprioriteetti, kunnes mallista on kertynyt tilastoja.
+FALLBACK_MODELS = ["gemini-2.5-flash", "gemini-2.0-flash", "gemini-2.5-flash-lite"]
+# Mallivalinta "auto": reititin valitsee vaihekohtaisesti parhaan sallitun mallin
+AUTO_MODEL = "auto"
+# Kriitikkoryhmän vaiheet, joille voidaan valita oma malli (Red Teaming)
+CRITIC_PHASES = ["phase_4", "phase_5", "phase_6", "phase_7"]
+# Reitittimen liukuva ikkuna (kutsua per vaihe ja malli), havaintoraja ja heikon mallin raja
+ROUTER_WINDOW = 50
+ROUTER_MIN_SAMPLES = 5
+ROUTER_MIN_SUCCESS_RATE = 0.5
+
+# MAX_TOKENS-katkaisu: vastausta jatketaan katkaisukohdasta enintään näin monella jatkopyynnöllä
+# ennen kuin koko kehote yritetään uudelleen (0 = ei jatkopyyntöjä)
+MAX_CONTINUATIONS = 3
+
+# Hedged-pyynnöt (vaihekohtainen opt-in): jos malli ei ole vastannut vaiheen havaitun kestojakauman
+# persentiilin kuluessa, sama pyyntö lähetetään rinnakkain fallback-ketjun seuraavalle mallille ja
+# ensimmäinen validi vastaus voittaa. Ennen min_samples havaintoa viiveenä on default_delay (s).
+# Esim. {"phase_4": {"percentile": 90, "min_samples": 5, "default_delay": 60, "min_delay": 5}}
+HEDGE_POLICY = {}
+
+# LLM-taustapalvelu (ks. llm_backends.py): "gemini", "openai" (OpenAI-yhteensopiva
+# paikallinen palvelin) tai "simulator" (kuormitustestit ilman verkkoa)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")
+OPENAI_COMPAT_BASE_URL = os.getenv("OPENAI_COMPAT_BASE_URL", "http://localhost:8000/v1")
+# Gemini-rajapinnan siirtokerros: "grpc" (oletus) tai "rest" (jos gRPC on estetty verkossa)
+GEMINI_TRANSPORT = os.getenv("GEMINI_TRANSPORT", "grpc")
+
+# Mallikohtaiset kiintiöt ennakoivaa nopeusrajoitusta varten (ks. rate_limiter.py)
+# rpm = pyyntöä minuutissa, tpm = syötetokenia minuutissa. Säädä oman API-tason mukaan.
+RATE_LIMITS = {
+    "gemini-2.5-flash": {"rpm": 10, "tpm": 250000},
+    "gemini-2.0-flash": {"rpm": 15, "tpm": 1000000},
+    "gemini-2.5-flash-lite": {"rpm": 15, "tpm": 250000}
+}
+
+# Hinnat telemetrian kustannusarviota varten (USD / 1M tokenia, input = kehote, output = vastaus,
+# cached_input = välimuistista luettu kehotteen osa, ks. PROMPT_CACHE_ENABLED)
+MODEL_PRICING = {
+    "gemini-2.5-flash": {"input": 0.30, "output": 2.50, "cached_input": 0.075},
+    "gemini-2.0-flash": {"input": 0.10, "output": 0.40, "cached_input": 0.025},
+    "gemini-2.5-flash-lite": {"input": 0.10, "output": 0.40, "cached_input": 0.025}
+}
+
+# Jaettu tilatiedosto: usea prosessi (Streamlit-palvelin, eräajot) jakaa saman kiintiön
+RATE_LIMIT_STATE_FILE = os.path.join(os.getcwd(), ".llm_state", "rate_limits.json")
+
+# Natiivi rakenteinen tuloste: vaiheen skeema lähetetään Geminille response_schemana
+# (ks. schema_converter.py). Tällöin esimerkki-JSONia ei tarvitse injektoida kehotteisiin.
+USE_RESPONSE_SCHEMA = True
+INJECT_SCHEMA_EXAMPLES = not USE_RESPONSE_SCHEMA
+
+# Nopea malli, jolle lähetetään validoinnissa hylätty vastaus korjattavaksi (None = ei korjausta)
+REPAIR_MODEL = "gemini-2.5-flash-lite"
+
+# Kehotteen token-budjetti (ks. token_budget.py, AssessmentContext.build_prompt). Raja on pienin
+# TPM-kiintiö (RATE_LIMITS) vähennettynä, jotta kehote mahtuu yhteen minuuttiin; mallien
+# kontekstiikkuna (1M tokenia) on tätä suurempi.
+PROMPT_TOKEN_LIMIT = 200000
+# Karsintapolitiikat järjestyksessä, jos kehote ylittää rajan (säännöt ja vaiheohje jätetään aina ennalleen):
+#   "trim_files" = tiedostoja lyhennetään suhteessa pituuteen (alku ja loppu säilyvät),
+#   "drop_distant_history" = kaukaisimmat riippuvuusvaiheiden tulokset jätetään pois (lähin säilyy),
+#   "trim_history" = aiempia tuloksia lyhennetään suhteessa pituuteen.
+PROMPT_TRIM_POLICIES = ["trim_files", "drop_distant_history", "trim_history"]
+# Aiempien tulosten projektio kehotteen historiaan (ks. history_projection.py): mitkä riippuvuus-
+# vaiheen kentät kukin vaihe tarvitsee (pisteellä erotetut polut, taulukoiden alkiot alkioittain).
+# Tulokset lähetetään tiiviinä JSONina. Riippuvuuksista, joille ei ole sääntöä, lähetetään kaikki
+# kentät paitsi HISTORY_DROP_FIELDS (kirjanpito, jota seuraavat vaiheet eivät käytä).
+# Yleisten sääntöjen BaseJSON-pohjarakenteen ylätason kentät, jotka kehotteet käskevät lisäämään
+# jokaiseen vastaukseen (myös silloin, kun vaiheen skeema ei niitä luettele)
+BASE_JSON_KEYS = ["metadata", "metodologinen_loki", "edellisen_vaiheen_validointi", "semanttinen_tarkistussumma"]
+HISTORY_DROP_FIELDS = ["metadata", "metodologinen_loki", "semanttinen_tarkistussumma", "edellisen_vaiheen_validointi"]
+HISTORY_PROJECTIONS = {
+    "VAIHE 2": {"VAIHE 1": ["data", "security_check.riski_taso"]},
+    "VAIHE 3": {"VAIHE 1": ["data"]},
+    "VAIHE 4": {"VAIHE 1": ["data"]},
+    "VAIHE 5": {"VAIHE 1": ["data"]},
+    "VAIHE 6": {"VAIHE 1": ["data"]},
+    "VAIHE 7": {"VAIHE 1": ["data"]},
+    # Tuomari nojaa kriitikoiden (4-7) ja loogikon (3) analyyseihin: vaiheesta 1 vain lopputuote ja
+    # reflektio, vaiheesta 2 väitteet ja perustelut ilman lainattuja tekstisegmenttejä
+    "VAIHE 8": {
+        "VAIHE 1": ["data.lopputuote", "data.reflektiodokumentti", "security_check.riski_taso"],
+        "VAIHE 2": ["hypoteesit", "rag_todisteet.viittaa_hypoteesiin_id", "rag_todisteet.perusteet",
+                    "rag_todisteet.relevanssi_score"]
+    }
+}
+# Hakuindeksi (ks. retrieval.py): tiedostot jaetaan limittäisiin segmentteihin ja indeksoidaan BM25:llä.
+# RETRIEVAL_PHASES-vaiheissa pitkän lähdetiedoston koko teksti (vaiheen 1 kenttä) korvataan
+# segmenteillä, jotka osuvat parhaiten vaiheen 2 väitteisiin (RETRIEVAL_TOP_K per väite).
+# Vaiheet 5 (aikajana) ja 6 (performatiivisuus) arvioivat koko prosessia, joten ne saavat koko tekstin.
+RETRIEVAL_PHASES = ["VAIHE 3", "VAIHE 4", "VAIHE 7"]
+# Lähdetiedostot (tiedostonimen osa) -> vaiheen 1 kenttä, jossa tiedoston teksti on
+SOURCE_FIELDS = {
+    "Keskusteluhistoria": "data.keskusteluhistoria",
+    "Lopputuote": "data.lopputuote",
+    "Reflektiodokumentti": "data.reflektiodokumentti"
+}
+# Lähdetiedostot, joiden koko teksti korvataan hakutuloksilla
+RETRIEVAL_SOURCES = ["Keskusteluhistoria"]
+RETRIEVAL_TOP_K = 3
+RETRIEVAL_CHUNK_CHARS = 1200
+RETRIEVAL_OVERLAP_CHARS = 200
+# Hakutermistä käytetään näin monta alkumerkkiä (karkea taivutusmuotojen yhdistäminen)
+RETRIEVAL_STEM_CHARS = 6
+# Muistissa pidettävien indeksien määrä (avain = tiedostojen sisältötiivisteet)
+RETRIEVAL_INDEX_CACHE_SIZE = 16
+
+# Lähdeviittaukset (ks. spans.py): SPAN_PHASES-vaiheissa lähdetekstit näytetään segmenttitunnisteineen
+# ([K12] ...), ja malli viittaa lainauksiin muodossa {{SPAN: K12}} tai {{SPAN: K12-K14}} kopioimatta
+# tekstiä. Orchestrator korvaa viittaukset alkuperäisellä tekstillä ja tarkistaa tunnisteet.
+SPAN_PHASES = ["VAIHE 2", "VAIHE 3", "VAIHE 7"]
+# Segmentin koko merkkeinä (segmentit eivät limity)
+SPAN_CHARS = 300
+
+# Kehotteen alkuosan välimuisti (ks. prompt_cache.py): vakioasettelussa kehote alkaa yleisillä
+# säännöillä ja vaiheiden yhteisellä historialla, ja tämä alkuosa viedään taustapalvelun välimuistiin
+# (Gemini cached content). Kahva luodaan per sisältö (sääntöversio, arvioinnin historia), sen
+# voimassaoloa jatketaan käytettäessä ja se vanhenee PROMPT_CACHE_TTL_SECONDS sekunnissa.
+PROMPT_CACHE_ENABLED = False
+PROMPT_CACHE_TTL_SECONDS = 3600
+# Jatketaan voimassaoloa, kun kahvaa käytetään alle tämän ajan ennen vanhenemista (s)
+PROMPT_CACHE_REFRESH_MARGIN = 600
+# Rajapinnan pienin välimuistiin hyväksymä sisältö (tokenia); pienempää alkuosaa ei viedä välimuistiin
+PROMPT_CACHE_MIN_TOKENS = 4096
+# Token-arvion kalibrointinäytteen koko (merkkiä), kun rajapinnan count_tokens on käytettävissä
+TOKEN_CALIBRATION_SAMPLE_CHARS = 20000
+
+# Vaihekohtaiset generointiprofiilit (PHASES[...]["generation"], ks. generation_profiles.py):
+#   max_output_tokens = vastauksen token-katto, thinking_budget = ajattelutokenit, temperature.
+# Arvot on johdettu skeemoista ja dataset/-kansion vastauspituuksista (python src/generation_profiles.py);
+# vastauspituuksia käytetään vasta riittävästä otoksesta, ja vaiheiden 2 ja 8 katto on vähintään 8192.
+# Ajattelevilla malleilla ajattelutokenit lasketaan mukaan max_output_tokens-rajaan, joten niille
+# lähetetään katoksi vastauksen katto + ajattelubudjetti (rajattuna mallin enimmäisarvoon).
+THINKING_MODELS = ["gemini-2.5-flash", "gemini-2.5-flash-lite"]
+MODEL_MAX_OUTPUT_TOKENS = {
+    "gemini-2.5-flash": 65536,
+    "gemini-2.0-flash": 8192,
+    "gemini-2.5-flash-lite": 65536
+}
 
 # Vaiheet (Business Logic Definitions)
 PHASES = [
@@ -12,6 +152,7 @@ PHASES = [
         "name": "Vaihe 1",
         "phase_key": "VAIHE 1",
         "model": DEFAULT_MODEL,
+        "generation": {"max_output_tokens": 2048, "thinking_budget": 3072, "temperature": 0.2},
         "schema": {
             "type": "object",
             "properties": {
@@ -39,6 +180,7 @@ PHASES = [
         "name": "Vaihe 2",
         "phase_key": "VAIHE 2",
         "model": DEFAULT_MODEL,
+        "generation": {"max_output_tokens": 8192, "thinking_budget": 3072, "temperature": 0.2},
         "schema": {
             "type": "object",
             "properties": {
@@ -73,6 +215,7 @@ PHASES = [
         "name": "Vaihe 3",
         "phase_key": "VAIHE 3",
         "model": DEFAULT_MODEL,
+        "generation": {"max_output_tokens": 2048, "thinking_budget": 4096, "temperature": 0.2},
         "schema": {
             "type": "object",
             "properties": {
@@ -111,6 +254,7 @@ PHASES = [
         "name": "Vaihe 4",
         "phase_key": "VAIHE 4",
         "model": DEFAULT_MODEL,
+        "generation": {"max_output_tokens": 2048, "thinking_budget": 3072, "temperature": 0.5},
         "schema": {
             "type": "object",
             "properties": {
@@ -141,6 +285,7 @@ PHASES = [
         "name": "Vaihe 5",
         "phase_key": "VAIHE 5",
         "model": DEFAULT_MODEL,
+        "generation": {"max_output_tokens": 2048, "thinking_budget": 3072, "temperature": 0.5},
         "schema": {
             "type": "object",
             "properties": {
@@ -168,6 +313,7 @@ PHASES = [
         "name": "Vaihe 6",
         "phase_key": "VAIHE 6",
         "model": DEFAULT_MODEL,
+        "generation": {"max_output_tokens": 2048, "thinking_budget": 3072, "temperature": 0.5},
         "schema": {
             "type": "object",
             "properties": {
@@ -198,6 +344,7 @@ PHASES = [
         "name": "Vaihe 7",
         "phase_key": "VAIHE 7",
         "model": DEFAULT_MODEL,
+        "generation": {"max_output_tokens": 2048, "thinking_budget": 3072, "temperature": 0.5},
         "schema": {
             "type": "object",
             "properties": {
@@ -231,6 +378,7 @@ PHASES = [
         "name": "Vaihe 8",
         "phase_key": "VAIHE 8",
         "model": DEFAULT_MODEL,
+        "generation": {"max_output_tokens": 8192, "thinking_budget": 6144, "temperature": 0.2},
         "schema": {
             "type": "object",
             "properties": {
@@ -1,3 +1,88 @@
+import json
+import math
+
+from config import (PROMPT_TOKEN_LIMIT, PROMPT_TRIM_POLICIES, PROMPT_CACHE_ENABLED, HISTORY_PROJECTIONS,
+                    RETRIEVAL_PHASES, RETRIEVAL_SOURCES, SOURCE_FIELDS, SPAN_PHASES)
+from token_budget import TokenEstimator, new_budget, shrink_items
+from history_projection import project_history, drop_result_fields
+from retrieval import retrieval_index, hypothesis_queries, retrieve_evidence
+from spans import span_map
+from blob_store import BlobStore, blob_references
+
+
+class PromptTemplate:
+    """
+    Vaiheen esikäännetty kehotepohja: muuttumaton alkuosa (yleiset säännöt + vaiheohje) yhdistetään
+    kerran, ja muuttuva loppuosa liitetään siihen render-kutsussa yhdellä join-operaatiolla.
+    """
+
+    def __init__(self, phase_key, rules, module):
+        self.rules = rules
+        self.module = module
+        # 1. Yleiset säännöt (Nyt vain OSA 1-5, ei koko dokumentti!) ja 2. Vaihekohtaiset ohjeet
+        phase_module = f"\\n\\n--- {phase_key} ---\\n{module}" if module is not None else ""
+        self.prefix = rules + phase_module
+        self.phase_module = phase_module
+        self.rules_chars = len(rules)
+        self.module_chars = len(phase_module)
+
+        # 5. Lopetus / Tehtävänanto
+        ending = f"\\n\\n--- SUORITA {phase_key} ---"
+        
+        # HACK: Varmista että Vaihe 9 sisällyttää pisteet
+        if phase_key == "VAIHE 9":
+            ending += "\\n\\nTÄRKEÄÄ: Sinun TÄYTYY sisällyttää raporttiin VAIHEEN 8 antamat pisteet selkeänä taulukkona tai listana. Älä jätä niitä pois."
+
+        # OPTIMOINTI: Vaihe 1 (Input Sanitization) ei saa kopioida koko tekstiä, koska se ylittää token-rajat.
+        if phase_key == "VAIHE 1":
+            ending += "\\n\\nOPTIMOINTI-OHJE: ÄLÄ kopioi tiedostojen sisältöä 'data'-kenttiin, jos ne ovat pitkiä. Sen sijaan palauta tiedostonimi muodossa '{{FILE: tiedostonimi}}'. Esimerkiksi: \"keskusteluhistoria\": \"{{FILE: Keskusteluhistoria.pdf}}\". Järjestelmä hakee sisällön automaattisesti."
+
+        # OPTIMOINTI: Lainaukset lähdeteksteistä segmenttiviittauksina (ks. spans.py)
+        if phase_key in SPAN_PHASES:
+            ending += "\\n\\nLÄHDEVIITTAUS-OHJE: Lähdetekstit on jaettu segmentteihin, joiden tunniste on hakasulkeissa (esim. [K12]). ÄLÄ kopioi lainauksia lähdeteksteistä. Kirjoita lainauksen paikalle viittaus muodossa '{{SPAN: K12}}' tai peräkkäisille segmenteille '{{SPAN: K12-K14}}'. Esimerkiksi: \"konteksti_segmentti\": \"{{SPAN: K12}}\". Järjestelmä korvaa viittauksen alkuperäisellä tekstillä sanatarkasti."
+        self.ending = ending
+
+    def section_chars(self, file_parts, history_parts):
+        """Osioiden pituudet merkkeinä token-budjettia varten (ks. token_budget.new_budget)."""
+        return {
+            "rules": self.rules_chars,
+            "phase_module": self.module_chars,
+            "files": sum(map(len, file_parts)),
+            "history": sum(map(len, history_parts)),
+            "other": len(self.ending)
+        }
+
+    def render(self, file_parts, history_parts):
+        return "".join([self.prefix, *file_parts, *history_parts, self.ending])
+
+    def render_stable(self, file_parts, history_parts, shared_history):
+        """
+        Välimuistiasettelu: säännöt, historia, tiedostot, vaiheohje, lopetus. Palauttaa (kehote,
+        välimuistiin vietävän alkuosan pituus): säännöt, ja jos historia on yhteinen usealle vaiheelle
+        (esim. vaiheet 4-7), myös historia. Alkuosa on merkki merkiltä sama kaikissa näissä vaiheissa.
+        """
+        prefix_parts = [self.rules, *history_parts] if shared_history else [self.rules]
+        rest = [*file_parts, self.phase_module, self.ending]
+        if not shared_history:
+            rest = [*history_parts, *rest]
+        prefix = "".join(prefix_parts)
+        return "".join([prefix, *rest]), len(prefix)
+
+
+def _file_parts(files):
+    parts = []
+    for filename, content in files:
+        parts += ("\\n--- TIEDOSTO: ", filename, " ---\\n", content, "\\n")
+    return parts
+
+
+def _result_parts(entries):
+    parts = []
+    for key, content in entries:
+        parts += ("\\n=== TULOS: ", key, " ===\\n", content, "\\n")
+    return parts
+
+
 class AssessmentContext:
     """
     Hallinnoi arvioinnin kontekstia: tiedostoja, tuloksia ja sääntöjä.
@@ -18,15 +103,43 @@ class AssessmentContext:
         "VAIHE 9": ["VAIHE 8", "VAIHE 7", "VAIHE 6", "VAIHE 5", "VAIHE 4", "VAIHE 3", "VAIHE 2", "VAIHE 1"]
     }
 
-    def __init__(self, common_rules, prompt_modules):
+    def __init__(self, common_rules, prompt_modules, estimator=None, token_limit=PROMPT_TOKEN_LIMIT,
+                 trim_policies=None, cache_layout=PROMPT_CACHE_ENABLED):
         self.common_rules = common_rules if common_rules else ""
         self.prompt_modules = prompt_modules if prompt_modules else {}
+        self.results = {} # Dict: phase_id -> result_text ({{BLOB: ...}}-viittauksin, ks. expand_result)
+        self.blobs = BlobStore() # Tiedostojen sisällöt kerran tiivisteen mukaan
         self.files = [] # List of tuples: (filename, content)
-        self.results = {} # Dict: phase_id -> result_text
+        self.estimator = estimator or TokenEstimator() # Token-arvio (kalibroitavissa count_tokens-rajapinnalla)
+        self.token_limit = token_limit # Kehotteen enimmäiskoko tokeneina (None/0 = ei rajaa)
+        self.trim_policies = list(PROMPT_TRIM_POLICIES if trim_policies is None else trim_policies)
+        self.budgets = {} # phase_key -> viimeisimmän build_prompt-kutsun token-budjetti osioittain
+        # True = kehotteen yhteinen alkuosa ensin (ks. PromptTemplate.render_stable, prompt_cache.py)
+        self.cache_layout = cache_layout
+        self.cache_prefixes = {} # phase_key -> välimuistiin vietävän alkuosan pituus merkkeinä (cache_layout)
+        self._templates = {} # phase_key -> PromptTemplate (esikäännetty säännöt + vaiheohje)
+        self._compiled_prompts = {} # phase_key -> (syöteversio, kehote, budjetti, syötteet, alkuosan pituus)
+
+    @property
+    def files(self):
+        return self._files
+
+    @files.setter
+    def files(self, files):
+        """
+        Korvaa tiedostolistan (esim. SecurityValidator.sanitize_all, jatkettu ajo). Tiedostovarastoon
+        jäävät vain uudet sisällöt ja ne, joihin tulokset vielä viittaavat.
+        """
+        self._files = files
+        keep = {self.blobs.put(filename, content) for filename, content in files}
+        for content in self.results.values():
+            keep |= blob_references(content)
+        self.blobs.retain(keep)
 
     def add_file(self, filename, content):
         """Lisää tiedoston kontekstiin."""
-        self.files.append((filename, content))
+        self._files.append((filename, content))
+        self.blobs.put(filename, content)
 
     def get_file_content(self, filename_part):
         """Etsii tiedoston sisältöä nimen osan perusteella."""
@@ -39,6 +152,10 @@ class AssessmentContext:
         """Lisää vaiheen tuloksen kontekstiin."""
         self.results[phase_id] = content
 
+    def expand_result(self, content):
+        """Tulos näytettäväksi tai vietäväksi: tiedostoviittaukset ({{BLOB: ...}}) korvattu sisällöllä."""
+        return self.blobs.expand(content)
+
     def get_files_text(self, phase_key=None):
         """
         Palauttaa tiedostot muotoiltuna tekstinä.
@@ -51,85 +168,269 @@ class AssessmentContext:
             
         # Vain Vaihe 1 ja 2 tarvitsevat raakatiedostot
         # Myös Moodi A (joka alkaa Vaiheesta 1) tarvitsee ne
-        if phase_key in ["VAIHE 1", "MOODI_A"]:
+        if self._needs_files(phase_key):
             return self._format_all_files()
             
         return ""
 
-    def _format_all_files(self):
-        text = ""
-        for filename, content in self.files:
-            text += f"\\n--- TIEDOSTO: {filename} ---\\n{content}\\n"
-        return text
+    def _needs_files(self, phase_key):
+        # Ilman phase_keytä palautetaan kaikki (esim. debuggausta varten)
+        return phase_key is None or phase_key in ["VAIHE 1", "MOODI_A"]
+
+    def _format_all_files(self, files=None):
+        return "".join(_file_parts(self.files if files is None else files))
 
     def get_history_text(self, phase_key=None):
         """
         Palauttaa aiemmat tulokset muotoiltuna tekstinä.
-        OPTIMOINTI: Palauttaa vain relevantin historian riippuvuuksien perusteella.
+        OPTIMOINTI: Palauttaa vain relevantin historian riippuvuuksien perusteella, ja vain ne kentät,
+        joita vaihe tarvitsee (config.HISTORY_PROJECTIONS), tiiviinä JSONina.
         """
-        text = ""
+        history = project_history(phase_key, self._history_entries(phase_key))
+        return self._format_history(self._expand_entries(self._with_sources(phase_key, history)))
+
+    def _history_entries(self, phase_key=None):
+        """Vaiheen tarvitsemat aiemmat tulokset (avain, sisältö) -pareina, lähin riippuvuus ensin."""
+        entries = []
         if not self.results:
-            return text
+            return entries
 
-        text += "\\n\\n--- AIEMMAT TULOKSET ---\\n"
-        
         # Jos phase_key on annettu, suodata riippuvuuksien mukaan
         if phase_key and phase_key in self.PHASE_DEPENDENCIES:
             dependencies = self.PHASE_DEPENDENCIES[phase_key]
-            found_any = False
             for dep in dependencies:
                 # Tarkista onko riippuvuus olemassa tuloksissa
                 # Huom: Tulokset voivat olla tallennettu eri avaimilla (esim. "VAIHE 1" tai "phase_1")
                 # Yritetään löytää oikea
                 content = self.results.get(dep)
                 if content:
-                    text += f"\\n=== TULOS: {dep} ===\\n{content}\\n"
-                    found_any = True
+                    entries.append((dep, content))
             
             # Jos ei löytynyt mitään riippuvuuksia, mutta tuloksia on,
             # saatetaan olla tilanteessa jossa ajetaan Moodia (esim. Moodi B tarvitsee Moodi A:n tulokset)
-            if not found_any and phase_key.startswith("MOODI"):
+            if not entries and phase_key.startswith("MOODI"):
                 # Moodeille palautetaan kaikki aiemmat tulokset varmuuden vuoksi
-                for key, val in self.results.items():
-                    text += f"\\n=== TULOS: {key} ===\\n{val}\\n"
+                entries = list(self.results.items())
         else:
             # Jos ei phase_keytä (tai tuntematon), palauta kaikki (turvallinen oletus)
-            for key, val in self.results.items():
-                text += f"\\n=== TULOS: {key} ===\\n{val}\\n"
+            entries = list(self.results.items())
                 
-        return text
+        return entries
+
+    def _with_sources(self, phase_key, history):
+        """
+        Korvaa lähdetiedostojen koko tekstin vaiheen 1 tuloksessa:
+        - RETRIEVAL_PHASES: hakutuloksilla, eli vaiheen 2 väitteisiin parhaiten osuvilla segmenteillä
+          (ks. retrieval.py). Jos väitteitä tai osumia ei ole, käytetään seuraavaa kohtaa.
+        - SPAN_PHASES: samalla tekstillä segmenttitunnisteineen, jotta malli voi viitata
+          lainauksiin tunnisteella (ks. spans.py). Jos hakutulokset korvasivat osan lähteistä
+          (RETRIEVAL_SOURCES), loput lähteet näytetään segmenttitunnisteineen.
+        Muuten historia palautetaan ennallaan.
+        """
+        parts = list(SOURCE_FIELDS)
+        if phase_key in RETRIEVAL_PHASES:
+            entries = self._with_evidence(history)
+            if entries is not None:
+                history = entries
+                parts = [part for part in SOURCE_FIELDS if part not in RETRIEVAL_SOURCES]
+        if phase_key in SPAN_PHASES:
+            return self._with_source_spans(history, parts)
+        return history
+
+    def _source_files(self, parts):
+        """Lähdetiedostot nimen osan perusteella: {nimen osa: tiedostonimi} (kuten get_file_content)."""
+        found = {}
+        for part in parts:
+            filename = next((fname for fname, content in self.files if part.lower() in fname.lower() and content), None)
+            if filename:
+                found[part] = filename
+        return found
+
+    def _with_evidence(self, history):
+        sources = self._source_files(RETRIEVAL_SOURCES)
+        queries = hypothesis_queries(self.results.get("VAIHE 2"))
+        if not sources or not queries:
+            return None
+        evidence = retrieve_evidence(
+            retrieval_index(self.files), queries, span_map(self.files), files=list(sources),
+            description=f"Otteet tiedostoista ({', '.join(sources)}), jotka osuvat parhaiten vaiheen 2 väitteisiin; "
+                        f"koko tekstiä ei ole liitetty."
+        )
+        if evidence is None:
+            return None
+        return self._replace_sources(history, "HAKUTULOKSET", evidence, sources)
+
+    def _with_source_spans(self, history, parts):
+        sources = self._source_files(parts)
+        if not sources:
+            return history
+        spans = span_map(self.files)
+        labelled = "".join(f"\\n--- TIEDOSTO: {filename} ---\\n{spans.labelled(filename)}\\n"
+                           for filename in sources.values())
+        return self._replace_sources(history, "LÄHDESEGMENTIT", labelled, sources)
+
+    def _replace_sources(self, history, key, content, sources):
+        """Lisää (key, content) vaiheen 1 tuloksen edelle ja poistaa siitä lähteiden kentät (SOURCE_FIELDS)."""
+        fields = [SOURCE_FIELDS[part] for part in sources if part in SOURCE_FIELDS]
+        entries = []
+        for entry_key, entry_content in history:
+            if entry_key == "VAIHE 1":
+                entries.append((key, content))
+                entry_content = drop_result_fields(entry_content, fields)
+            entries.append((entry_key, entry_content))
+        if (key, content) not in entries:
+            entries.append((key, content))
+        return entries
+
+    def _expand_entries(self, entries):
+        """Historian tiedostoviittaukset sisällöksi vasta projektion ja lähdekenttien poiston jälkeen."""
+        return [(key, self.blobs.expand(content)) for key, content in entries]
+
+    def _format_history(self, entries):
+        return "".join(self._history_parts(entries))
+
+    def _history_parts(self, entries):
+        if not self.results:
+            return []
+        return ["\\n\\n--- AIEMMAT TULOKSET ---\\n"] + _result_parts(entries)
 
     def build_prompt(self, phase_key):
         """
         Rakentaa täydellisen kehotteen tietylle vaiheelle.
+
+        Muuttumaton alkuosa (säännöt + vaiheohje) on esikäännetty vaiheen PromptTemplateen ja
+        muuttuva loppuosa (tiedostot, historia) yhdistetään yhdellä join-kutsulla. Aiemmista
+        tuloksista otetaan vain vaiheen tarvitsemat kentät tiiviinä JSONina
+        (config.HISTORY_PROJECTIONS), ja hakuvaiheissa (config.RETRIEVAL_PHASES) pitkä lähdeteksti
+        korvataan väitteisiin osuvilla segmenteillä (ks. _with_sources). Valmis kehote
+        muistetaan per (vaihe, syöteversio): sama kehote (esim. debug-näkymä ja run_phase) rakennetaan
+        vain kerran, kunnes tiedostot tai riippuvuusvaiheiden tulokset muuttuvat.
+
+        Kehotteen token-budjetti osioittain (säännöt, vaiheohje, tiedostot, historia) tallennetaan
+        self.budgets[phase_key]-kenttään. Jos kehote ylittää token_limit-rajan, tiedostoja ja
+        historiaa karsitaan trim_policies-järjestyksessä ennen lähetystä.
+
+        Jos cache_layout on päällä, kehote alkaa vaiheiden yhteisellä osalla (säännöt ja yhteinen
+        historia) ja sen pituus tallennetaan self.cache_prefixes[phase_key]-kenttään (ks. prompt_cache.py).
         """
-        # 1. Yleiset säännöt (Nyt vain OSA 1-5, ei koko dokumentti!)
-        prompt = self.common_rules
+        # 3. Tiedostot (Vain jos tarpeen) ja 4. Historia (Vain relevantit)
+        files = list(self.files) if self._needs_files(phase_key) else []
+        history = self._history_entries(phase_key)
+        # Haku- ja viittausvaiheissa tiedostot vaikuttavat historiaan (hakutulokset, segmentit), vaikka
+        # niitä ei liitetä kehotteeseen
+        indexed_files = list(self.files) if phase_key in RETRIEVAL_PHASES or phase_key in SPAN_PHASES else []
+
+        version = self._input_version(files, history, indexed_files)
+        compiled = self._compiled_prompts.get(phase_key)
+        if compiled and compiled[0] == version:
+            self.budgets[phase_key] = compiled[2]
+            self.cache_prefixes[phase_key] = compiled[4]
+            return compiled[1]
 
-        # 2. Vaihekohtaiset ohjeet
-        if phase_key and phase_key in self.prompt_modules:
-            prompt += f"\\n\\n--- {phase_key} ---\\n{self.prompt_modules[phase_key]}"
+        template = self._template(phase_key)
+        unprojected_chars = sum(map(self.blobs.expanded_length, self._history_parts(history)))
+        history = self._expand_entries(self._with_sources(phase_key, project_history(phase_key, history)))
+        file_parts, history_parts = self._tail_parts(files, history)
+        budget = new_budget(self.estimator, template.section_chars(file_parts, history_parts), self.token_limit)
+        # Historian koko ennen projektiota ja tiivistystä (käyttöliittymän vertailu)
+        budget["history_unprojected"] = self.estimator.estimate_chars(unprojected_chars)
+        if budget["over_limit"]:
+            unprojected = budget["history_unprojected"]
+            file_parts, history_parts, budget = self._trim_to_budget(phase_key, template, files, history, budget)
+            budget["history_unprojected"] = unprojected
+        prefix_chars = None
+        if self.cache_layout:
+            prompt, prefix_chars = template.render_stable(file_parts, history_parts, self._shares_history(phase_key))
+            budget["cacheable"] = self.estimator.estimate_chars(prefix_chars)
         else:
-            pass
+            prompt = template.render(file_parts, history_parts)
 
-        # 3. Tiedostot (Vain jos tarpeen)
-        prompt += f"\\n\\n{self.get_files_text(phase_key)}"
+        self.budgets[phase_key] = budget
+        self.cache_prefixes[phase_key] = prefix_chars
+        # Syötteet pidetään tallessa, jotta versioavaimen olio-id:t eivät vapaudu uudelleenkäyttöön
+        self._compiled_prompts[phase_key] = (version, prompt, budget, (files, history, indexed_files), prefix_chars)
+        return prompt
 
-        # 4. Historia (Vain relevantit)
-        prompt += self.get_history_text(phase_key)
+    def prompt_budget(self, phase_key):
+        """Vaiheen token-budjetti ilman LLM-kutsua (esim. käyttöliittymän ennakkotarkistus)."""
+        self.build_prompt(phase_key)
+        return self.budgets[phase_key]
 
-        # 5. Lopetus / Tehtävänanto
-        prompt += f"\\n\\n--- SUORITA {phase_key} ---"
-        
-        # HACK: Varmista että Vaihe 9 sisällyttää pisteet
-        if phase_key == "VAIHE 9":
-            prompt += "\\n\\nTÄRKEÄÄ: Sinun TÄYTYY sisällyttää raporttiin VAIHEEN 8 antamat pisteet selkeänä taulukkona tai listana. Älä jätä niitä pois."
+    def _template(self, phase_key):
+        """Vaiheen esikäännetty kehotepohja; käännetään uudelleen vain, jos säännöt tai vaiheohje vaihtuvat."""
+        module = self.prompt_modules.get(phase_key) if phase_key else None
+        template = self._templates.get(phase_key)
+        if template is None or template.rules is not self.common_rules or template.module is not module:
+            template = PromptTemplate(phase_key, self.common_rules, module)
+            self._templates[phase_key] = template
+        return template
 
-        # OPTIMOINTI: Vaihe 1 (Input Sanitization) ei saa kopioida koko tekstiä, koska se ylittää token-rajat.
-        if phase_key == "VAIHE 1":
-            prompt += "\\n\\nOPTIMOINTI-OHJE: ÄLÄ kopioi tiedostojen sisältöä 'data'-kenttiin, jos ne ovat pitkiä. Sen sijaan palauta tiedostonimi muodossa '{{FILE: tiedostonimi}}'. Esimerkiksi: \"keskusteluhistoria\": \"{{FILE: Keskusteluhistoria.pdf}}\". Järjestelmä hakee sisällön automaattisesti."
+    def _shares_history(self, phase_key):
+        """Onko vaiheen historia (riippuvuudet ja projektio) sama kuin jollain toisella vaiheella (esim. 4-7)."""
+        def signature(key):
+            return (tuple(self.PHASE_DEPENDENCIES.get(key, ())),
+                    json.dumps(HISTORY_PROJECTIONS.get(key, {}), sort_keys=True),
+                    "haku" if key in RETRIEVAL_PHASES else "segmentit" if key in SPAN_PHASES else None)
+        if not self.PHASE_DEPENDENCIES.get(phase_key):
+            return False
+        own = signature(phase_key)
+        return any(signature(key) == own for key in self.PHASE_DEPENDENCIES if key != phase_key)
 
-        return prompt
+    def _input_version(self, files, history, indexed_files=()):
+        """
+        Syöteversio: tiedostojen ja tulosten nimet ja sisältöolioiden identiteetit sekä budjetin asetukset.
+        Merkkijonot ovat muuttumattomia, joten sama olio tarkoittaa samaa sisältöä.
+        """
+        return (
+            tuple((name, id(content)) for name, content in files),
+            tuple((key, id(content)) for key, content in history),
+            tuple((name, id(content)) for name, content in indexed_files),
+            bool(self.results),
+            self.token_limit,
+            tuple(self.trim_policies),
+            self.estimator.chars_per_token,
+            self.cache_layout
+        )
+
+    def _tail_parts(self, files, history):
+        return ["\\n\\n"] + _file_parts(files), self._history_parts(history)
+
+    def _trim_to_budget(self, phase_key, template, files, history, budget):
+        """
+        Karsii tiedostoja ja historiaa trim_policies-järjestyksessä, kunnes kehote mahtuu rajaan.
+        Säännöt ja vaiheohje säilyvät aina. Palauttaa (tiedosto-osat, historiaosat, budjetti).
+        """
+        def measure():
+            file_parts, history_parts = self._tail_parts(files, history)
+            return new_budget(self.estimator, template.section_chars(file_parts, history_parts), self.token_limit)
+
+        trimmed = []
+        for policy in self.trim_policies:
+            if not budget["over_limit"]:
+                break
+            before = budget["total"]
+            excess_chars = math.ceil((budget["total"] - self.token_limit) * self.estimator.chars_per_token)
+            if policy == "trim_files":
+                files = shrink_items(files, excess_chars)
+            elif policy == "drop_distant_history":
+                # Riippuvuudet ovat lähin ensin: pudotetaan lopusta, lähin tulos säilyy
+                while len(history) > 1 and budget["over_limit"]:
+                    history = history[:-1]
+                    budget = measure()
+            elif policy == "trim_history":
+                history = shrink_items(history, excess_chars)
+            else:
+                print(f"VAROITUS: Tuntematon karsintapolitiikka '{policy}' ohitetaan.")
+                continue
+            budget = measure()
+            if budget["total"] < before:
+                trimmed.append({"policy": policy, "saved_tokens": before - budget["total"]})
+
+        budget["trimmed"] = trimmed
+        print(f"--- TOKEN-BUDJETTI {phase_key}: {budget['total']:,}/{self.token_limit:,} tokenia, karsinta: "
+              f"{', '.join(t['policy'] for t in trimmed) or 'ei vaikutusta'} ---")
+        file_parts, history_parts = self._tail_parts(files, history)
+        return file_parts, history_parts, budget
 
     def build_combined_prompt(self, phase_keys):
         """
@@ -0,0 +1,50 @@
+import re
+
+# Jatkopyynnön merkinnät (SimulatorBackend tunnistaa ne ja palauttaa puuttuvan loppuosan)
+PARTIAL_MARKER = "--- KESKEN JÄÄNYT VASTAUS ---"
+CONTINUE_MARKER = "--- JATKA VASTAUSTA ---"
+
+# Päällekkäisyys poistetaan vain, jos toistettu jakso on vähintään näin pitkä: lyhyt yhteinen
+# pätkä (esim. '"' tai '},') on todennäköisemmin sattumaa kuin toistoa
+MIN_OVERLAP = 16
+MAX_OVERLAP = 2000
+
+_FENCE_START = re.compile(r"^\s*```(?:json)?\s*\n?")
+_FENCE_END = re.compile(r"\n?```\s*$")
+
+
+def continuation_prompt(prompt, partial_text):
+    """
+    Jatkokehote MAX_TOKENS-katkaisun jälkeen: alkuperäinen kehote, kesken jäänyt vastaus ja ohje
+    jatkaa täsmälleen katkaisukohdasta. Koska alku on sama, jatkopyyntö käyttää alkuperäisen kutsun
+    kehotevälimuistin kahvaa ja lähettää vain loppuosan (ks. LLMService._continuation_request).
+    """
+    return (
+        f"{prompt}\n\n{PARTIAL_MARKER}\n{partial_text}\n{CONTINUE_MARKER}\n"
+        "Yllä oleva JSON-vastauksesi katkesi token-rajaan. Jatka sitä täsmälleen siitä merkistä, "
+        "johon se päättyi. Älä toista aiempaa tekstiä, älä aloita uutta JSON-objektia äläkä lisää "
+        "selityksiä tai koodiaitoja. Palauta vain puuttuva loppuosa."
+    )
+
+
+def partial_from_prompt(prompt):
+    """Palauttaa (alkuperäinen kehote, kesken jäänyt vastaus) jatkokehotteesta tai None."""
+    start = prompt.rfind(f"\n\n{PARTIAL_MARKER}\n")
+    end = prompt.rfind(f"\n{CONTINUE_MARKER}\n")
+    if start == -1 or end < start:
+        return None
+    return prompt[:start], prompt[start + len(PARTIAL_MARKER) + 3:end]
+
+
+def stitch(partial_text, continuation):
+    """
+    Liittää jatko-osan kesken jääneeseen vastaukseen. Poistaa koodiaidat ja jakson, jonka malli
+    mahdollisesti toisti katkaisukohdasta.
+    """
+    continuation = _FENCE_END.sub("", _FENCE_START.sub("", continuation))
+    longest = min(len(partial_text), len(continuation), MAX_OVERLAP)
+    for size in range(longest, MIN_OVERLAP - 1, -1):
+        if partial_text.endswith(continuation[:size]):
+            continuation = continuation[size:]
+            break
+    return partial_text + continuation
@@ -1,4 +1,5 @@
 import io
+import os
 import docx
 import PyPDF2
 import re
@@ -30,6 +31,17 @@ class DataHandler:
             stringio = io.StringIO(uploaded_file.getvalue().decode("utf-8"))
             return stringio.read()
 
+    def read_file_path(self, path):
+        """Lukee levyllä olevan tiedoston sisällön tekstinä (eräajo, ks. batch_runner.py)."""
+        ext = os.path.splitext(path)[1].lower()
+        if ext == ".pdf":
+            return self._read_pdf(path)
+        elif ext == ".docx":
+            return self._read_docx(path)
+        else:
+            with open(path, "r", encoding="utf-8", errors="replace") as f:
+                return f.read()
+
     def _read_pdf(self, file_obj):
         """Lukee tekstin PDF-tiedostosta käyttäen PyPDF2."""
         try:
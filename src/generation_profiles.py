@@ -0,0 +1,164 @@
+"""
+Vaihekohtaiset generointiprofiilit: vastauksen token-katto, ajattelubudjetti ja lämpötila.
+
+Profiilit ovat config.PHASES-merkinnöissä ("generation"). Oletusarvot johdetaan
+  - vaiheen skeeman koosta (esimerkkivastauksen pituus ja kenttien määrä) ja
+  - dataset/-kansioon tallennettujen vastausten pituuksista (p95, ks. Orchestrator._save_to_dataset).
+
+Profiilit päivitetään ajamalla tämä moduuli: python src/generation_profiles.py [--dataset dataset]
+"""
+import argparse
+import glob
+import json
+import math
+import os
+import re
+
+from config import PHASES, CRITIC_PHASES
+from llm_backends import example_from_schema
+
+# Merkkiä per token (sama karkea arvio kuin LLMService._estimate_tokens)
+CHARS_PER_TOKEN = 4
+# Havaitun p95-pituuden kerroin: vastausten pituus vaihtelee opiskelijan aineiston mukaan
+OUTPUT_HEADROOM = 2.0
+# Havaintoja vähintään näin monta, ennen kuin p95:tä käytetään (muuten vain skeeman arvio)
+MIN_OBSERVATIONS = 5
+# Skeeman esimerkissä on yksi alkio per taulukko; todellisissa vastauksissa niitä on useita
+SCHEMA_FANOUT = 16
+# Token-katto ja ajattelubudjetti pyöristetään ylöspäin tämän monikertaan ja rajataan väleille
+TOKEN_STEP = 1024
+MIN_OUTPUT_TOKENS = 2048
+MAX_OUTPUT_TOKENS = 32768
+# Vaihekohtaiset alarajat: vaiheiden 2 ja 8 vastaukset voivat ylittää 8192 tokenia (ks. continuation.py),
+# joten niiden katto ei laske aiemman kiinteän rajan alle (myös ei-ajattelevilla fallback-malleilla)
+OUTPUT_TOKEN_FLOORS = {"phase_2": 8192, "phase_8": 8192}
+# Ajattelubudjetti kasvaa skeeman kenttien määrän mukaan (enemmän arvioitavaa -> enemmän päättelyä)
+THINKING_TOKENS_PER_FIELD = 256
+MIN_THINKING_BUDGET = 1024
+MAX_THINKING_BUDGET = 8192
+# Poiminta- ja synteesivaiheet matalalla lämpötilalla, kriitikot hieman korkeammalla (vaihtoehtoiset tulkinnat)
+TEMPERATURE = 0.2
+CRITIC_TEMPERATURE = 0.5
+
+# Profiili, jota käytetään, jos vaiheella ei ole skeemaa eikä profiilia (vanha kiinteä raja)
+DEFAULT_PROFILE = {"max_output_tokens": 8192, "thinking_budget": None, "temperature": None}
+
+_PLACEHOLDER = re.compile(r"^\{\{FILE:")
+
+
+def generation_profile(phase):
+    """Vaiheen profiili: config.PHASES-merkinnän "generation" tai skeemasta johdettu oletus."""
+    if phase.get("generation"):
+        return dict(DEFAULT_PROFILE, **phase["generation"])
+    if "schema" in phase:
+        return derive_profile(phase)
+    return dict(DEFAULT_PROFILE)
+
+
+def derive_profile(phase, observed_tokens=None):
+    """
+    Johdetaan profiili skeemasta ja havaituista vastauspituuksista (tokeneina).
+
+    Token-katto on suurempi arvioista (p95 * OUTPUT_HEADROOM, skeeman esimerkki * SCHEMA_FANOUT);
+    p95:tä käytetään vasta, kun havaintoja on vähintään MIN_OBSERVATIONS. Katto ei laske vaiheen
+    alarajan (OUTPUT_TOKEN_FLOORS) alle. Ajattelubudjetti johdetaan kenttien määrästä. Molemmat
+    pyöristetään TOKEN_STEP-monikertaan.
+    """
+    schema = phase["schema"]
+    schema_tokens = len(json.dumps(example_from_schema(schema), ensure_ascii=False)) / CHARS_PER_TOKEN
+    estimate = schema_tokens * SCHEMA_FANOUT
+    if observed_tokens and len(observed_tokens) >= MIN_OBSERVATIONS:
+        estimate = max(estimate, _percentile(observed_tokens, 95) * OUTPUT_HEADROOM)
+    minimum = max(MIN_OUTPUT_TOKENS, OUTPUT_TOKEN_FLOORS.get(phase["id"], 0))
+    return {
+        "max_output_tokens": _round_tokens(estimate, minimum, MAX_OUTPUT_TOKENS),
+        "thinking_budget": _round_tokens(_count_fields(schema) * THINKING_TOKENS_PER_FIELD,
+                                         MIN_THINKING_BUDGET, MAX_THINKING_BUDGET),
+        "temperature": CRITIC_TEMPERATURE if phase["id"] in CRITIC_PHASES else TEMPERATURE
+    }
+
+
+def observed_output_tokens(dataset_dir="dataset"):
+    """
+    Tallennettujen vastausten pituudet (tokeneina) vaiheittain: {phase_id: [tokenit, ...]}.
+
+    Mukaan otetaan vain tiedostot, joissa ovat kaikki vaiheen skeeman ylätason avaimet (testiajojen
+    paikkamerkkivastaukset ohitetaan). Vaiheen 1 {{FILE: ...}}-kentät korvataan paikkamerkillä,
+    koska Orchestrator liittää tiedostojen sisällön vasta mallin vastauksen jälkeen.
+    """
+    phases = {phase["id"]: phase for phase in PHASES if "schema" in phase}
+    observed = {}
+    for path in sorted(glob.glob(os.path.join(dataset_dir, "*.json"))):
+        phase_id = "_".join(os.path.basename(path)[:-len(".json")].split("_")[-2:])
+        phase = phases.get(phase_id)
+        if not phase:
+            continue
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if not isinstance(record, dict) or any(key not in record for key in phase["schema"]["properties"]):
+            continue
+        record.pop("metadata", None)  # Orchestrator lisää aikaleiman vastauksen jälkeen
+        text = json.dumps(_model_output(record, phase["schema"]), ensure_ascii=False)
+        observed.setdefault(phase_id, []).append(math.ceil(len(text) / CHARS_PER_TOKEN))
+    return observed
+
+
+def derive_profiles(dataset_dir="dataset"):
+    """Profiilit kaikille skeemallisille vaiheille: {phase_id: profiili}."""
+    observed = observed_output_tokens(dataset_dir)
+    return {
+        phase["id"]: derive_profile(phase, observed.get(phase["id"]))
+        for phase in PHASES if "schema" in phase
+    }
+
+
+# --- Sisäiset apumetodit ---
+
+def _model_output(value, schema):
+    """Palauttaa tallennetun arvon sellaisena kuin malli sen tuotti ({{FILE: ...}}-kentät takaisin)."""
+    if isinstance(value, dict) and schema.get("type") == "object":
+        properties = schema.get("properties", {})
+        return {key: _model_output(item, properties.get(key, {})) for key, item in value.items()}
+    if isinstance(value, list) and schema.get("type") == "array":
+        return [_model_output(item, schema.get("items", {})) for item in value]
+    example = schema.get("example")
+    if isinstance(example, str) and _PLACEHOLDER.match(example):
+        return example
+    return value
+
+
+def _count_fields(schema):
+    if schema.get("type") == "object":
+        return 1 + sum(_count_fields(prop) for prop in schema.get("properties", {}).values())
+    if schema.get("type") == "array":
+        return 1 + _count_fields(schema.get("items", {}))
+    return 1
+
+
+def _percentile(values, percentile):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(percentile / 100 * (len(values) - 1))))]
+
+
+def _round_tokens(value, minimum, maximum):
+    return int(min(maximum, max(minimum, math.ceil(value / TOKEN_STEP) * TOKEN_STEP)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Johtaa vaiheiden generointiprofiilit (config.PHASES)")
+    parser.add_argument("--dataset", default="dataset", help="Tallennettujen vastausten kansio")
+    args = parser.parse_args()
+
+    observed = observed_output_tokens(args.dataset)
+    for phase_id, profile in derive_profiles(args.dataset).items():
+        samples = observed.get(phase_id, [])
+        p95 = _percentile(samples, 95) if samples else "-"
+        print(f"{phase_id}: havaintoja {len(samples)}, p95 {p95} tokenia -> \"generation\": "
+              f"{json.dumps(profile)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import json
+
+from config import HISTORY_PROJECTIONS, HISTORY_DROP_FIELDS
+
+_MISSING = object()
+
+
+def project_history(phase_key, entries, projections=None):
+    """
+    Projisoi vaiheen riippuvuustulokset (avain, sisältö) -pareina: vain vaiheen tarvitsemat kentät
+    (config.HISTORY_PROJECTIONS) tiiviinä JSONina. Tuloksista, joille ei ole sääntöä, poistetaan
+    kirjanpitokentät (config.HISTORY_DROP_FIELDS).
+    """
+    rules = (HISTORY_PROJECTIONS if projections is None else projections).get(phase_key, {})
+    return [(key, project_result(content, rules.get(key))) for key, content in entries]
+
+
+def project_result(content, fields=None, drop_fields=HISTORY_DROP_FIELDS):
+    """
+    Palauttaa tuloksen valitut kentät minimoituna JSONina. fields on lista pisteellä erotettuja
+    polkuja ("data.lopputuote"); taulukoiden alkiot projisoidaan alkioittain ("hypoteesit.id").
+    fields=None = kaikki ylätason kentät paitsi drop_fields. Muu kuin JSON-sisältö palautetaan sellaisenaan.
+    """
+    try:
+        data = json.loads(content)
+    except (TypeError, ValueError):
+        return content
+    if isinstance(data, dict):
+        if fields is None:
+            data = {key: value for key, value in data.items() if key not in drop_fields}
+        else:
+            projected = {}
+            for path in fields:
+                value = _project(data, path.split("."))
+                if value is not _MISSING:
+                    projected = _merge(projected, value)
+            data = projected
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+def drop_result_fields(content, paths):
+    """Poistaa tuloksesta pisteellä erotetut polut ("data.keskusteluhistoria") ja palauttaa tiiviin JSONin."""
+    try:
+        data = json.loads(content)
+    except (TypeError, ValueError):
+        return content
+    for path in paths:
+        *parents, name = path.split(".")
+        target = data
+        for key in parents:
+            target = target.get(key) if isinstance(target, dict) else None
+        if isinstance(target, dict):
+            target.pop(name, None)
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+# --- Sisäiset apumetodit ---
+
+def _project(value, path):
+    if not path:
+        return value
+    if isinstance(value, dict):
+        if path[0] not in value:
+            return _MISSING
+        inner = _project(value[path[0]], path[1:])
+        return _MISSING if inner is _MISSING else {path[0]: inner}
+    if isinstance(value, list):
+        # Alkiot säilyvät paikoillaan, jotta saman taulukon eri polut yhdistyvät alkioittain
+        return [{} if item is _MISSING else item for item in (_project(item, path) for item in value)]
+    return _MISSING
+
+
+def _merge(target, value):
+    if isinstance(target, dict) and isinstance(value, dict):
+        merged = dict(target)
+        for key, item in value.items():
+            merged[key] = _merge(merged[key], item) if key in merged else item
+        return merged
+    if isinstance(target, list) and isinstance(value, list):
+        return [_merge(a, b) for a, b in zip(target, value)]
+    return value
@@ -0,0 +1,40 @@
+import threading
+from collections import deque
+
+
+class LatencyStats:
+    """
+    Liukuva ikkuna onnistuneiden LLM-kutsujen kestoista avaimittain (esim. (vaihe, malli)).
+    Hedged-pyynnöt (ks. LLMService) käyttävät persentiiliä rinnakkaisen pyynnön viiveenä.
+    """
+
+    def __init__(self, window=50):
+        self.window = window
+        self._samples = {}  # avain -> deque(kestot sekunteina)
+        self._lock = threading.Lock()
+
+    def record(self, key, seconds):
+        with self._lock:
+            self._samples.setdefault(key, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, key, percentile, min_samples=5):
+        """Palauttaa persentiilin (0-100) tai None, jos havaintoja on alle min_samples."""
+        with self._lock:
+            samples = sorted(self._samples.get(key, ()))
+        if not samples or len(samples) < min_samples:
+            return None
+        index = min(len(samples) - 1, int(round(percentile / 100 * (len(samples) - 1))))
+        return samples[index]
+
+    def snapshot(self):
+        """Havaintojen määrä, mediaani ja p90 avaimittain (UI / yhteenvedot)."""
+        with self._lock:
+            keys = list(self._samples)
+        return {
+            " / ".join(str(part) for part in key) if isinstance(key, tuple) else str(key): {
+                "samples": len(self._samples[key]),
+                "p50": round(self.percentile(key, 50, 1), 3),
+                "p90": round(self.percentile(key, 90, 1), 3)
+            }
+            for key in keys
+        }
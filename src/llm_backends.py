@@ -0,0 +1,537 @@
+import asyncio
+import datetime
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import google.generativeai as genai
+import requests
+from dotenv import load_dotenv
+
+from config import PHASES, OPENAI_COMPAT_BASE_URL, GEMINI_TRANSPORT
+from continuation import partial_from_prompt
+
+
+# google-generativeai 0.8.x:n GenerationConfig ei tunne ajattelubudjettia (thinking_config)
+GEMINI_SUPPORTS_THINKING = "thinking_config" in genai.protos.GenerationConfig.meta.fields
+
+
+class LLMBackend:
+    """
+    LLM-taustapalvelun rajapinta, jota LLMService käyttää.
+
+    Toteutukset palauttavat Gemini-vastauksen muotoisia olioita (text, candidates[0].finish_reason,
+    candidates[0].content.parts, usage_metadata), joten LLMService:n retry-, validointi- ja
+    striimauslogiikka toimii kaikilla taustapalveluilla sellaisenaan.
+    Striimatessa (stream=True) palautetaan iteroitava jono paloja, joilla on text-attribuutti.
+
+    Kehotteen alkuosan välimuisti (ks. prompt_cache.py): create_cache palauttaa kahvan, joka välitetään
+    generointiparametrina cached_content. Tällöin prompt on vain kehotteen loppuosa.
+    """
+
+    name = "backend"
+    # Rajaako taustapalvelu ajattelutokenit generointiparametrin thinking_budget mukaan
+    supports_thinking_budget = False
+
+    def generate(self, model_name, prompt, generation_params, timeout=300, stream=False):
+        raise NotImplementedError
+
+    async def agenerate(self, model_name, prompt, generation_params, timeout=300, stream=False):
+        """Oletus: sync-kutsu ajetaan säikeessä (striimi kerätään listaksi)."""
+        def call():
+            response = self.generate(model_name, prompt, generation_params, timeout=timeout, stream=stream)
+            return list(response) if stream else response
+        result = await asyncio.to_thread(call)
+        return _AsyncChunks(result) if stream else result
+
+    def list_models(self):
+        return []
+
+    def count_tokens(self, model_name, text):
+        """Rajapinnan token-laskenta (token-arvion kalibrointi) tai None, jos sitä ei ole."""
+        return None
+
+    def create_cache(self, model_name, prefix, ttl):
+        """Vie kehotteen alkuosan välimuistiin ttl sekunniksi ja palauttaa kahvan, tai None, jos välimuistia ei ole."""
+        return None
+
+    def refresh_cache(self, handle, ttl):
+        """Jatkaa kahvan voimassaoloa ttl sekuntia eteenpäin."""
+
+    def delete_cache(self, handle):
+        """Poistaa kahvan sisällön taustapalvelusta."""
+
+
+class BackendResponse:
+    """Gemini-vastausta vastaava kevyt vastausolio muille taustapalveluille."""
+
+    def __init__(self, text, finish_reason=1, prompt_tokens=None, output_tokens=None, cached_tokens=None):
+        self.text = text
+        self.candidates = [_Candidate(text, finish_reason)]
+        self.usage_metadata = _Usage(prompt_tokens, output_tokens, cached_tokens)
+
+
+class _Candidate:
+    def __init__(self, text, finish_reason):
+        self.finish_reason = finish_reason
+        self.content = _Content([text] if text else [])
+
+
+class _Content:
+    def __init__(self, parts):
+        self.parts = parts
+
+
+class _Usage:
+    def __init__(self, prompt_tokens, output_tokens, cached_tokens=None):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = output_tokens
+        self.cached_content_token_count = cached_tokens
+
+
+class _AsyncChunks:
+    """Tekee listasta asynkronisesti iteroitavan (async for)."""
+
+    def __init__(self, chunks):
+        self._chunks = list(chunks)
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for chunk in self._chunks:
+            yield chunk
+
+
+class GeminiBackend(LLMBackend):
+    """
+    Google Gemini (google-generativeai).
+
+    Kirjasto pitää yhden asiakkaan (gRPC-kanava tai REST-istunto) per genai.configure-kutsu, joten
+    yhteys ja sen keep-alive säilyvät kutsujen välillä, kunhan configurea ei kutsuta uudelleen.
+    Mallikahvat (GenerativeModel + GenerationConfig) luodaan kerran per (malli, asetukset) ja
+    käytetään uudelleen kaikissa vaiheissa ja yrityksissä.
+
+    transport: "grpc" (oletus, HTTP/2-kanava) tai "rest" (HTTP/1.1, keep-alive-istunto; toimii
+    välityspalvelimien läpi, joissa gRPC on estetty).
+    """
+
+    name = "gemini"
+    supports_thinking_budget = GEMINI_SUPPORTS_THINKING
+    MAX_MODEL_HANDLES = 64
+
+    def __init__(self, api_key=None, transport=GEMINI_TRANSPORT):
+        load_dotenv()
+        api_key = api_key or os.getenv("GOOGLE_API_KEY")
+        if not api_key:
+            raise ValueError("GOOGLE_API_KEY puuttuu .env-tiedostosta.")
+        if transport not in ("grpc", "rest"):
+            raise ValueError(f"Tuntematon Gemini-siirtokerros: {transport} (vaihtoehdot: grpc, rest)")
+        self.transport = transport
+        # "grpc" jätetään kirjaston valittavaksi: eksplisiittinen transport="grpc" rakentaisi myös
+        # async-asiakkaan synkronisen gRPC-kanavan päälle (generate_content_async ei toimisi).
+        # Ilman arvoa kirjasto käyttää sync-asiakkaalle grpc- ja async-asiakkaalle grpc_asyncio-kanavaa.
+        if transport == "rest":
+            genai.configure(api_key=api_key, transport=transport)
+        else:
+            genai.configure(api_key=api_key)
+        self._models = OrderedDict()
+        self._models_lock = threading.Lock()
+
+    def model_handle(self, model_name, generation_params):
+        """
+        Palauttaa välimuistista (tai luo) mallikahvan, jonka GenerationConfig on valmiiksi asetettu.
+        Kirjasto muuntaa response_schema-skeeman protoksi vain kahvaa luotaessa, ei joka kutsulla.
+        Jos parametreissa on cached_content, kahva luodaan välimuistissa olevan alkuosan päälle.
+        """
+        key = self._handle_key(model_name, generation_params)
+        with self._models_lock:
+            entry = self._models.get(key)
+            if entry is not None:
+                self._models.move_to_end(key)
+                return entry[0]
+            params = self._config_params(generation_params)
+            cached_content = params.pop("cached_content", None)
+            generation_config = genai.types.GenerationConfig(**params)
+            if cached_content is not None:
+                model = genai.GenerativeModel.from_cached_content(cached_content, generation_config=generation_config)
+            else:
+                model = genai.GenerativeModel(model_name, generation_config=generation_config)
+            # Parametrit pidetään tallessa, jotta avaimen olio-id:t eivät vapaudu uudelleenkäyttöön
+            self._models[key] = (model, generation_params)
+            if len(self._models) > self.MAX_MODEL_HANDLES:
+                self._models.popitem(last=False)
+            return model
+
+    def _config_params(self, generation_params):
+        # Ajattelubudjetti (LLMService, vaiheen generointiprofiili) välitetään thinking_configina, jos
+        # kirjastoversio tukee sitä. Muuten se jätetään pois: budjetti sisältyy silloin jo token-kattoon.
+        params = dict(generation_params)
+        thinking_budget = params.pop("thinking_budget", None)
+        if thinking_budget is not None and GEMINI_SUPPORTS_THINKING:
+            params["thinking_config"] = {"thinking_budget": thinking_budget}
+        return params
+
+    def _handle_key(self, model_name, generation_params):
+        # Skeemat ovat samoja olioita vaiheesta toiseen (schema_converter.cached_response_schema),
+        # joten dict/list-arvoille riittää identiteetti eikä koko skeemaa tarvitse sarjallistaa
+        return (model_name, tuple(sorted(
+            (name, id(value) if isinstance(value, (dict, list)) else value)
+            for name, value in generation_params.items()
+        )))
+
+    def generate(self, model_name, prompt, generation_params, timeout=300, stream=False):
+        return self.model_handle(model_name, generation_params).generate_content(
+            prompt,
+            request_options={"timeout": timeout},
+            stream=stream
+        )
+
+    async def agenerate(self, model_name, prompt, generation_params, timeout=300, stream=False):
+        return await self.model_handle(model_name, generation_params).generate_content_async(
+            prompt,
+            request_options={"timeout": timeout},
+            stream=stream
+        )
+
+    def list_models(self):
+        return [m.name.replace("models/", "") for m in genai.list_models()
+                if 'generateContent' in m.supported_generation_methods]
+
+    def count_tokens(self, model_name, text):
+        return self.model_handle(model_name, {}).count_tokens(text).total_tokens
+
+    def create_cache(self, model_name, prefix, ttl):
+        return genai.caching.CachedContent.create(model=model_name, contents=[prefix],
+                                                  ttl=datetime.timedelta(seconds=ttl))
+
+    def refresh_cache(self, handle, ttl):
+        handle.update(ttl=datetime.timedelta(seconds=ttl))
+
+    def delete_cache(self, handle):
+        handle.delete()
+
+
+class OpenAICompatibleBackend(LLMBackend):
+    """
+    OpenAI-yhteensopiva HTTP-rajapinta (esim. paikallinen vLLM-, llama.cpp- tai Ollama-palvelin).
+
+    model_map muuntaa Gemini-mallinimet palvelimen malleiksi, esim. {"gemini-2.5-flash": "qwen2.5:14b"}.
+    """
+
+    name = "openai"
+
+    def __init__(self, base_url=OPENAI_COMPAT_BASE_URL, api_key=None, model_map=None):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key or os.getenv("OPENAI_API_KEY", "")
+        self.model_map = dict(model_map or {})
+        # Pysyvä istunto: TCP/TLS-yhteydet pidetään auki (keep-alive) kutsujen välillä
+        self.session = requests.Session()
+
+    def generate(self, model_name, prompt, generation_params, timeout=300, stream=False):
+        payload = {
+            "model": self.model_map.get(model_name, model_name),
+            "messages": [{"role": "user", "content": prompt}],
+            "stream": stream
+        }
+        if generation_params.get("max_output_tokens"):
+            payload["max_tokens"] = generation_params["max_output_tokens"]
+        if generation_params.get("temperature") is not None:
+            payload["temperature"] = generation_params["temperature"]
+        if generation_params.get("response_mime_type") == "application/json":
+            payload["response_format"] = {"type": "json_object"}
+
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+
+        response = self.session.post(f"{self.base_url}/chat/completions", json=payload, headers=headers,
+                                 timeout=timeout, stream=stream)
+        if response.status_code == 429:
+            retry_after = response.headers.get("Retry-After", "")
+            raise RuntimeError(f"429 Quota exceeded ({self.base_url}). Retry-After: {retry_after}")
+        if response.status_code >= 400:
+            raise RuntimeError(f"{response.status_code} {response.text[:500]}")
+
+        if stream:
+            return self._iter_stream(response)
+
+        data = response.json()
+        choice = data["choices"][0]
+        usage = data.get("usage") or {}
+        return BackendResponse(
+            choice["message"].get("content") or "",
+            finish_reason=self._finish_reason(choice.get("finish_reason")),
+            prompt_tokens=usage.get("prompt_tokens"),
+            output_tokens=usage.get("completion_tokens"),
+            cached_tokens=self._cached_tokens(usage)
+        )
+
+    def _iter_stream(self, response):
+        """Server-Sent Events: 'data: {...}' -rivit, viimeisenä 'data: [DONE]'."""
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                break
+            event = json.loads(data)
+            if not event.get("choices"):
+                continue
+            choice = event["choices"][0]
+            usage = event.get("usage") or {}
+            yield BackendResponse(
+                (choice.get("delta") or {}).get("content") or "",
+                finish_reason=self._finish_reason(choice.get("finish_reason")),
+                prompt_tokens=usage.get("prompt_tokens"),
+                output_tokens=usage.get("completion_tokens"),
+                cached_tokens=self._cached_tokens(usage)
+            )
+
+    def _cached_tokens(self, usage):
+        # Palvelimen automaattinen alkuosan välimuisti (esim. vLLM:n prefix caching); kahvoja ei tarvita
+        return (usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+
+    def _finish_reason(self, reason):
+        # Gemini-koodit: 0 = kesken (striimin välipala), 1 = STOP, 2 = MAX_TOKENS
+        if reason is None:
+            return 0
+        return 2 if reason == "length" else 1
+
+    def list_models(self):
+        response = self.session.get(f"{self.base_url}/models", timeout=10)
+        response.raise_for_status()
+        return [m["id"] for m in response.json().get("data", [])]
+
+
+class SimulatorBackend(LLMBackend):
+    """
+    Konfiguroitava simulaattori orkestroinnin kuormitus- ja kestotesteihin ilman verkkoa.
+
+    - Viive: lognormaalijakauma (latency_median, latency_sigma) tai oma latency_fn(model, prompt) -> s.
+    - rate_limit_rate: osuus kutsuista, jotka päättyvät 429-virheeseen (Retry-After-vihjeen kanssa).
+    - truncation_rate: osuus vastauksista, jotka katkaistaan (finish_reason 2 = MAX_TOKENS).
+    - responses: vaihekohtaiset valmisvastaukset {"VAIHE 2": "{...}"} (teksti, dict tai
+      callable(prompt) -> teksti). Muuten vastaus generoidaan vaiheen skeemasta (config.PHASES).
+    - time_scale: kerroin viiveille (esim. 0.01 = 100x nopeampi ajo).
+    - tokens_per_second: jos annettu, viiveeseen lisätään tuotettujen tokenien (vastaus + ajattelu)
+      generointiaika. max_output_tokens rajaa vastauksen kuten oikea malli (finish_reason 2).
+    - thinking_tokens: ajattelutokenit, jotka malli käyttää ilman budjettia; generointiparametri
+      thinking_budget rajaa niitä. Ajattelutokenit lasketaan max_output_tokens-rajaan (kuten Gemini 2.5).
+    - Kehotteen välimuisti: create_cache palauttaa paikallisen kahvan, ja cached_content-parametrilla
+      tehty kutsu raportoi alkuosan tokenit cached_content_token_count-kentässä (kuten Gemini).
+    """
+
+    name = "simulator"
+    supports_thinking_budget = True
+
+    def __init__(self, latency_median=1.0, latency_sigma=0.5, latency_fn=None, rate_limit_rate=0.0,
+                 truncation_rate=0.0, responses=None, time_scale=1.0, seed=None, chunk_size=40,
+                 tokens_per_second=None, thinking_tokens=0):
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self.latency_fn = latency_fn
+        self.rate_limit_rate = rate_limit_rate
+        self.truncation_rate = truncation_rate
+        self.responses = dict(responses or {})
+        self.time_scale = time_scale
+        self.chunk_size = chunk_size
+        self.tokens_per_second = tokens_per_second
+        self.thinking_tokens = thinking_tokens
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._caches = {} # kahvan nimi -> SimulatedCachedContent
+        self.counters = {"calls": 0, "rate_limited": 0, "truncated": 0, "max_concurrency": 0}
+
+    def generate(self, model_name, prompt, generation_params, timeout=300, stream=False):
+        prompt, cached_tokens = self._resolve_cache(prompt, generation_params)
+        latency, outcome = self._start_call(model_name, prompt)
+        try:
+            time.sleep(latency)
+            response = self._build_response(outcome, prompt, generation_params, cached_tokens)
+            time.sleep(self._generation_time(response))
+        finally:
+            self._end_call()
+        return self._chunks(response) if stream else response
+
+    async def agenerate(self, model_name, prompt, generation_params, timeout=300, stream=False):
+        prompt, cached_tokens = self._resolve_cache(prompt, generation_params)
+        latency, outcome = self._start_call(model_name, prompt)
+        try:
+            await asyncio.sleep(latency)
+            response = self._build_response(outcome, prompt, generation_params, cached_tokens)
+            await asyncio.sleep(self._generation_time(response))
+        finally:
+            self._end_call()
+        return _AsyncChunks(self._chunks(response)) if stream else response
+
+    def list_models(self):
+        return ["gemini-2.5-flash", "gemini-2.0-flash", "gemini-2.5-flash-lite"]
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters)
+
+    def create_cache(self, model_name, prefix, ttl):
+        with self._lock:
+            handle = SimulatedCachedContent(f"cachedContents/sim-{len(self._caches) + 1}", model_name, prefix)
+            self._caches[handle.name] = handle
+        return handle
+
+    def refresh_cache(self, handle, ttl):
+        self._cached(handle)
+
+    def delete_cache(self, handle):
+        with self._lock:
+            self._caches.pop(handle.name, None)
+
+    # --- Sisäiset apumetodit ---
+
+    def _cached(self, handle):
+        with self._lock:
+            if handle.name not in self._caches:
+                raise RuntimeError(f"404 CachedContent not found: {handle.name}")
+        return handle
+
+    def _resolve_cache(self, prompt, generation_params):
+        """Välimuistikahvan kanssa malli näkee koko kehotteen (alkuosa + loppuosa)."""
+        handle = (generation_params or {}).get("cached_content")
+        if handle is None:
+            return prompt, None
+        handle = self._cached(handle)
+        return handle.prefix + prompt, len(handle.prefix) // 4
+
+    def _start_call(self, model_name, prompt):
+        with self._lock:
+            self.counters["calls"] += 1
+            self._in_flight += 1
+            self.counters["max_concurrency"] = max(self.counters["max_concurrency"], self._in_flight)
+            roll = self._random.random()
+            if self.latency_fn:
+                latency = self.latency_fn(model_name, prompt)
+            else:
+                latency = self._random.lognormvariate(0.0, self.latency_sigma) * self.latency_median
+
+        if roll < self.rate_limit_rate:
+            outcome = "rate_limited"
+        elif roll < self.rate_limit_rate + self.truncation_rate:
+            outcome = "truncated"
+        else:
+            outcome = "ok"
+        return max(0.0, latency * self.time_scale), outcome
+
+    def _end_call(self):
+        with self._lock:
+            self._in_flight -= 1
+
+    def _build_response(self, outcome, prompt, generation_params=None, cached_tokens=None):
+        if outcome == "rate_limited":
+            with self._lock:
+                self.counters["rate_limited"] += 1
+            raise RuntimeError("429 Quota exceeded (simulaattori). Please retry in 1s.")
+
+        text = self._response_text(prompt)
+        prompt_tokens = len(prompt) // 4
+        params = generation_params or {}
+        thinking = self.thinking_tokens
+        if params.get("thinking_budget") is not None:
+            thinking = min(thinking, params["thinking_budget"])
+        # Token-katto: ajattelu kuluttaa ensin, vastaukselle jää loput
+        answer_limit = None
+        if params.get("max_output_tokens"):
+            thinking = min(thinking, params["max_output_tokens"])
+            answer_limit = (params["max_output_tokens"] - thinking) * 4
+        if outcome == "truncated":
+            answer_limit = min(answer_limit or len(text), max(1, len(text) // 2))
+        if answer_limit is not None and len(text) > answer_limit:
+            with self._lock:
+                self.counters["truncated"] += 1
+            text = text[:answer_limit]
+            return BackendResponse(text, finish_reason=2, prompt_tokens=prompt_tokens,
+                                   output_tokens=len(text) // 4 + thinking, cached_tokens=cached_tokens)
+        return BackendResponse(text, finish_reason=1, prompt_tokens=prompt_tokens,
+                               output_tokens=len(text) // 4 + thinking, cached_tokens=cached_tokens)
+
+    def _generation_time(self, response):
+        if not self.tokens_per_second:
+            return 0.0
+        return response.usage_metadata.candidates_token_count / self.tokens_per_second * self.time_scale
+
+    def _chunks(self, response):
+        text = response.text
+        pieces = [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)] or [""]
+        finish_reason = response.candidates[0].finish_reason
+        usage = response.usage_metadata
+        return [
+            BackendResponse(piece, finish_reason=finish_reason if i == len(pieces) - 1 else 0,
+                            prompt_tokens=usage.prompt_token_count, output_tokens=usage.candidates_token_count,
+                            cached_tokens=usage.cached_content_token_count)
+            for i, piece in enumerate(pieces)
+        ]
+
+    def _response_text(self, prompt):
+        # Jatkopyyntö MAX_TOKENS-katkaisun jälkeen: palautetaan vastauksen puuttuva loppuosa
+        continued = partial_from_prompt(prompt)
+        if continued:
+            original_prompt, partial_text = continued
+            full_text = self._response_text(original_prompt)
+            return full_text[len(partial_text):] if full_text.startswith(partial_text) else full_text
+
+        phase_key = self._detect_phase(prompt)
+        canned = self.responses.get(phase_key, self.responses.get("*"))
+        if callable(canned):
+            canned = canned(prompt)
+        if isinstance(canned, (dict, list)):
+            canned = json.dumps(canned, ensure_ascii=False)
+        if canned is not None:
+            return canned
+
+        phase = next((p for p in PHASES if p["phase_key"] == phase_key), None)
+        if phase and "schema" in phase:
+            return json.dumps(example_from_schema(phase["schema"]), ensure_ascii=False)
+        return json.dumps({"tulos": "simuloitu vastaus"}, ensure_ascii=False)
+
+    def _detect_phase(self, prompt):
+        """Tunnistaa vaiheen AssessmentContext.build_prompt-merkinnästä '--- SUORITA VAIHE N ---'."""
+        match = re.search(r"--- SUORITA (VAIHE \d+) ---", prompt)
+        return match.group(1) if match else None
+
+
+class SimulatedCachedContent:
+    """Simulaattorin välimuistikahva (vastaa genai.caching.CachedContent-oliota)."""
+
+    def __init__(self, name, model, prefix):
+        self.name = name
+        self.model = model
+        self.prefix = prefix
+
+
+def example_from_schema(schema):
+    """Generoi esimerkkiobjektin config.PHASES-skeemasta (ks. PromptSplitter._generate_example_from_schema)."""
+    schema_type = schema.get("type")
+    if schema_type == "object":
+        return {name: example_from_schema(prop) for name, prop in schema.get("properties", {}).items()}
+    if schema_type == "array":
+        return [example_from_schema(schema.get("items", {}))]
+    if "example" in schema:
+        return schema["example"]
+    if schema_type == "enum":
+        return (schema.get("values") or [""])[0]
+    return {"string": "...", "boolean": False, "number": 0, "integer": 0}.get(schema_type)
+
+
+def create_backend(name="gemini", **kwargs):
+    """Luo taustapalvelun nimen perusteella: "gemini", "openai" tai "simulator"."""
+    backends = {
+        GeminiBackend.name: GeminiBackend,
+        OpenAICompatibleBackend.name: OpenAICompatibleBackend,
+        SimulatorBackend.name: SimulatorBackend
+    }
+    if name not in backends:
+        raise ValueError(f"Tuntematon LLM-taustapalvelu: {name} (vaihtoehdot: {', '.join(backends)})")
+    return backends[name](**kwargs)
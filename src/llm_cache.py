@@ -0,0 +1,188 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+
+class LLMCache:
+    """
+    Sisältöosoitteinen välimuisti LLM-vastauksille.
+
+    Avain on SHA-256-tiiviste (malli, kehote, generointikonfiguraatio, skeemaversio),
+    joten identtinen kehote palautetaan välimuistista ilman uutta Gemini-kutsua.
+    Muistissa on LRU-välimuisti, jonka takana on levyvarasto (.llm_cache/<avain>.json).
+    Levyltä poistetaan vanhimmat merkinnät koko- ja ikärajan mukaan.
+
+    Välimuistiin tallennetaan vain vastaukset, jotka ovat läpäisseet validoinnin.
+    """
+
+    def __init__(self, cache_dir=None, max_memory_items=128, max_disk_bytes=200 * 1024 * 1024,
+                 max_age_seconds=7 * 24 * 3600, enabled=True):
+        self.cache_dir = cache_dir or os.path.join(os.getcwd(), ".llm_cache")
+        self.max_memory_items = max_memory_items
+        self.max_disk_bytes = max_disk_bytes
+        self.max_age_seconds = max_age_seconds
+        self.enabled = enabled  # False = ohitetaan välimuisti (bypass)
+
+        self._memory = OrderedDict()  # key -> response
+        self._disk_index = None  # key -> (koko tavuina, viimeisin käyttö)
+        self._lock = threading.RLock()
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0, "bypassed": 0}
+
+    @staticmethod
+    def make_key(model_name, prompt, generation_config=None, schema_version=None):
+        """Laskee välimuistiavaimen pyynnön sisällöstä."""
+        payload = json.dumps({
+            "model": model_name,
+            "prompt": prompt,
+            "generation_config": generation_config or {},
+            "schema_version": schema_version
+        }, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key, bypass=False):
+        """Palauttaa välimuistissa olevan vastauksen tai None."""
+        if bypass or not self.enabled:
+            with self._lock:
+                self.counters["bypassed"] += 1
+            return None
+
+        with self._lock:
+            # 1. Muisti (LRU)
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                return self._memory[key]
+
+            # 2. Levy
+            response = self._read_disk(key)
+            if response is None:
+                self.counters["misses"] += 1
+                return None
+
+            self.counters["disk_hits"] += 1
+            self._remember(key, response)
+            return response
+
+    def put(self, key, response, bypass=False, metadata=None):
+        """Tallentaa (validoidun) vastauksen muistiin ja levylle."""
+        if bypass or not self.enabled or not response:
+            return
+
+        with self._lock:
+            self._remember(key, response)
+            self._write_disk(key, response, metadata or {})
+            self.counters["stores"] += 1
+            self._evict_disk()
+
+    def clear(self):
+        """Tyhjentää välimuistin (muisti ja levy)."""
+        with self._lock:
+            self._memory.clear()
+            for key in list(self._load_index()):
+                self._delete_disk(key)
+
+    def stats(self):
+        """Palauttaa osumalaskurit ja välimuistin koon."""
+        with self._lock:
+            index = self._load_index()
+            lookups = self.counters["memory_hits"] + self.counters["disk_hits"] + self.counters["misses"]
+            hits = self.counters["memory_hits"] + self.counters["disk_hits"]
+            return dict(
+                self.counters,
+                hit_rate=round(hits / lookups, 3) if lookups else 0.0,
+                memory_items=len(self._memory),
+                disk_items=len(index),
+                disk_bytes=sum(size for size, _ in index.values())
+            )
+
+    # --- Sisäiset apumetodit ---
+
+    def _remember(self, key, response):
+        self._memory[key] = response
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _load_index(self):
+        if self._disk_index is None:
+            self._disk_index = {}
+            if os.path.exists(self.cache_dir):
+                for fname in os.listdir(self.cache_dir):
+                    if fname.endswith(".json"):
+                        stat = os.stat(os.path.join(self.cache_dir, fname))
+                        self._disk_index[fname[:-5]] = (stat.st_size, stat.st_mtime)
+        return self._disk_index
+
+    def _read_disk(self, key):
+        index = self._load_index()
+        if key not in index:
+            # Indeksi luetaan kerran: toisen prosessin (eräajo, toinen käyttäjä) kirjoittama
+            # merkintä löytyy vain tarkistamalla avaimen tiedosto levyltä
+            try:
+                stat = os.stat(self._path(key))
+            except OSError:
+                return None
+            index[key] = (stat.st_size, stat.st_mtime)
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            self._delete_disk(key)
+            return None
+
+        if self.max_age_seconds and time.time() - entry.get("created_at", 0) > self.max_age_seconds:
+            self._delete_disk(key)
+            self.counters["evictions"] += 1
+            return None
+
+        # Päivitä käyttöaika (levyn LRU-järjestys)
+        now = time.time()
+        try:
+            os.utime(self._path(key), (now, now))
+        except OSError:
+            pass
+        index[key] = (index[key][0], now)
+        return entry.get("response")
+
+    def _write_disk(self, key, response, metadata):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(key)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(dict(metadata, created_at=time.time(), response=response), f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        self._load_index()[key] = (os.path.getsize(path), time.time())
+
+    def _delete_disk(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+        self._load_index().pop(key, None)
+
+    def _evict_disk(self):
+        """Poistaa vanhentuneet merkinnät ja vanhimmat merkinnät kunnes kokoraja täyttyy."""
+        index = self._load_index()
+        now = time.time()
+
+        if self.max_age_seconds:
+            for key, (_, used_at) in list(index.items()):
+                if now - used_at > self.max_age_seconds:
+                    self._delete_disk(key)
+                    self.counters["evictions"] += 1
+
+        total = sum(size for size, _ in index.values())
+        for key, (size, _) in sorted(index.items(), key=lambda item: item[1][1]):
+            if total <= self.max_disk_bytes:
+                break
+            self._delete_disk(key)
+            self._memory.pop(key, None)
+            total -= size
+            self.counters["evictions"] += 1
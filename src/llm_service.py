@@ -1,56 +1,147 @@
-import google.generativeai as genai
-import os
+import asyncio
+import contextlib
+import contextvars
+import json
+import threading
 import time
-from dotenv import load_dotenv
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from llm_backends import GeminiBackend
+from circuit_breaker import CircuitBreaker, parse_retry_after
+from stream_parser import IncrementalJSONParser
+from telemetry import Telemetry, current_scope
+from model_router import ModelRouter, RATE_LIMITED, INVALID, ERROR
+from llm_cache import LLMCache
+from single_flight import SingleFlight
+from continuation import continuation_prompt, stitch
+from config import (USE_RESPONSE_SCHEMA, REPAIR_MODEL, HEDGE_POLICY, FALLBACK_MODELS, MAX_CONTINUATIONS,
+                    THINKING_MODELS, MODEL_MAX_OUTPUT_TOKENS)
+from generation_profiles import DEFAULT_PROFILE
+
+# Kutsukohtaiset asetukset (cache_bypass, streaming), jotka ohittavat palvelun oletukset yhden
+# generate_response-kutsun ajaksi. Välimuistissa jaettua palvelua ei näin muuteta ajokohtaisesti.
+_request_options = contextvars.ContextVar("llm_request_options", default={})
+
+
+ALL_MODELS_FAILED = "KAIKKI TEKOÄLYMALLIT EPÄONNISTUIVAT"
+
+
+class HedgeCancelled(RuntimeError):
+    """Hedged-pyynnön häviäjän striimi katkaistiin, koska toinen malli vastasi ensin."""
+
+
+class ResponseValidationError(ValueError):
+    """Vastaus saatiin, mutta se ei ollut validia JSONia tai ei läpäissyt skeemavalidointia."""
+
+    def __init__(self, message, text, detail):
+        super().__init__(message)
+        self.text = text # Rikkinäinen vastaus (korjauskierrosta varten)
+        self.detail = detail # Tarkka jäsennys- tai skeemavirhe
+
 
 class LLMService:
     """
-    Infrastruktuurikerros: Hoitaa yhteyden Gemini-tekoälyyn.
+    Infrastruktuurikerros: Hoitaa yhteyden tekoälyyn (oletuksena Gemini).
+
+    Varsinainen API-kutsu tehdään taustapalvelun (backend, ks. llm_backends.py) kautta,
+    joten sama retry-, fallback-, välimuisti- ja validointilogiikka toimii myös
+    paikallisen OpenAI-yhteensopivan palvelimen ja simulaattorin kanssa.
     """
-    def __init__(self):
-        load_dotenv()
-        api_key = os.getenv("GOOGLE_API_KEY")
-        if not api_key:
-            raise ValueError("GOOGLE_API_KEY puuttuu .env-tiedostosta.")
-        genai.configure(api_key=api_key)
-        self.disabled_models = set()
+    # Jos API:n Retry-After-vihje on tätä pidempi (s), mallia ei yritetä uudelleen vaan
+    # katkaisija avataan heti ja siirrytään varamalliin.
+    MAX_RETRY_AFTER_WAIT = 30
+
+    def __init__(self, cache=None, rate_limiter=None, circuit_breaker=None, streaming=False,
+                 structured_output=USE_RESPONSE_SCHEMA, repair_model=REPAIR_MODEL, backend=None,
+                 telemetry=None, single_flight=None, hedge_policy=None, router=None, prompt_cache=None,
+                 concurrency_limiter=None):
+        # Oletuksena Gemini (heittää ValueErrorin jos GOOGLE_API_KEY puuttuu)
+        self.backend = backend or GeminiBackend()
+        self.cache = cache # LLMCache tai None (ei välimuistia)
+        self.cache_bypass = False # True = ohita välimuisti (esim. tarkoituksellinen uudelleenajo)
+        self.rate_limiter = rate_limiter # RateLimiter tai None (ei ennakoivaa rajoitusta)
+        # Mallikohtainen samanaikaisuusraja (esim. batch_runner.ModelConcurrencyLimiter) tai None.
+        # Raja koskee todellista kutsuttua mallia ("auto", fallback, hedge ja korjausmalli mukaan lukien).
+        self.concurrency_limiter = concurrency_limiter
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        self.streaming = streaming # True = vastaus luetaan striimattuna ja virheellinen vastaus keskeytetään heti
+        self.structured_output = structured_output # True = vaiheen skeema lähetetään response_schemana
+        self.repair_model = repair_model # Nopea malli JSON-korjauskierrokselle (None = ei korjausta)
+        self.max_repairs = 2 # Korjauskierroksia enintään per generate_response-kutsu
+        self.max_continuations = MAX_CONTINUATIONS # MAX_TOKENS-jatkopyyntöjä enintään per vastaus (0 = ei jatkoa)
+        self.telemetry = telemetry or Telemetry() # Kutsukohtaiset mittarit (tokenit, ajat, yritykset)
+        # Samanaikaiset identtiset pyynnöt yhdistetään (self.single_flight = None poistaa käytöstä)
+        self.single_flight = single_flight or SingleFlight()
+        # Vaihekohtaiset hedged-pyynnöt: {"phase_4": {"percentile": 90, ...}} (ks. config.HEDGE_POLICY)
+        self.hedge_policy = HEDGE_POLICY if hedge_policy is None else hedge_policy
+        # Mallien valinta ja fallback-järjestys vaihekohtaisten kesto- ja onnistumistilastojen mukaan
+        self.router = router or ModelRouter()
+        self.latency = self.router.latency
+        self.hedge_stats = {"hedged": 0, "primary_wins": 0, "hedge_wins": 0, "both_failed": 0}
+        self._hedge_lock = threading.Lock()
+        # Kehotteen alkuosan välimuisti (PromptCache tai None); alkuosan pituus luetaan validointifunktion
+        # cache_prefix_chars-attribuutista (ks. AssessmentContext.cache_layout, Orchestrator)
+        self.prompt_cache = prompt_cache
+
+    @property
+    def disabled_models(self):
+        """Mallit, joiden katkaisija on auki (yhteensopivuus vanhan estolistan kanssa)."""
+        return self.circuit_breaker.open_models()
 
     def get_available_models(self):
         """Hakee saatavilla olevat mallit."""
         try:
-            models = []
-            for m in genai.list_models():
-                if 'generateContent' in m.supported_generation_methods:
-                    models.append(m.name.replace("models/", ""))
-            return models
+            return self.backend.list_models()
         except Exception as e:
             print(f"Virhe mallien hakemisessa: {e}")
-            return ["gemini-2.5-flash", "gemini-2.0-flash", "gemini-2.5-flash-lite"] # Fallback
+            return list(FALLBACK_MODELS) # Fallback
 
-    def generate_response(self, prompt, model_name="gemini-2.5-flash", validation_fn=None):
+    def generate_response(self, prompt, model_name="gemini-2.5-flash", validation_fn=None, on_partial=None,
+                          cache_bypass=None, streaming=None):
         """
         Suorittaa LLM-kutsun retry-logiikalla ja automaattisella fallbackilla.
+
+        Jos striimaus on päällä, on_partial(dict) saa osittaisen tuloksen generoinnin aikana.
+        cache_bypass ja streaming koskevat vain tätä kutsua (None = self.cache_bypass / self.streaming).
         """
-        # Määritä kokeiltavat mallit
-        models_to_try = [model_name]
-        
-        # Fallback-logiikka: Jos pyydetään 2.5-flash, varaudu käyttämään 2.0-flashia ja 2.5-flash-litea
-        if model_name == "gemini-2.5-flash":
-            # Käyttäjän toive: 2) gemini-2.0-flash
-            models_to_try.append("gemini-2.0-flash")
-            # Käyttäjän toive: 3) gemini-2.5-flash-lite
-            models_to_try.append("gemini-2.5-flash-lite")
+        token = _request_options.set(self._options(cache_bypass, streaming))
+        try:
+            return self._generate_response(prompt, model_name, validation_fn, on_partial)
+        finally:
+            _request_options.reset(token)
 
+    def _generate_response(self, prompt, model_name, validation_fn, on_partial):
+        call = self.telemetry.start_call(model_name, prompt)
+        request_key = self._request_key(prompt, model_name, validation_fn)
+        cache_key = request_key if self.cache is not None else None
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            call.finish("ok", cache_hit=True)
+            return cached
+
+        if self.single_flight is None:
+            return self._generate(prompt, model_name, validation_fn, on_partial, call, cache_key)
+
+        # Identtinen pyyntö on jo käynnissä (toinen säie, käyttäjä tai eräajon prosessi): odotetaan sen tulosta
+        result, shared = self.single_flight.do(
+            request_key,
+            lambda: self._generate(prompt, model_name, validation_fn, on_partial, call, cache_key),
+            recheck=lambda: self._cache_get(cache_key)
+        )
+        if shared:
+            self._finish_shared(call, result)
+        return result
+
+    def _generate(self, prompt, model_name, validation_fn, on_partial, call, cache_key):
+        """Varsinainen kutsu retry- ja fallback-logiikalla (välimuisti on jo tarkistettu)."""
         max_retries = 5
-        retry_delay = 2 # sekuntia
-        
-        import json
         last_error = None
+        repairs_left = self.max_repairs
 
-        for current_model in models_to_try:
-            # TARKISTA ONKO MALLI ESTOLISTALLA (QUOTA TÄYNNÄ AIEMMIN)
-            if current_model in self.disabled_models:
-                print(f"--- OHITETAAN MALLI {current_model} (QUOTA TÄYNNÄ AIEMMIN) ---")
+        models_to_try = self._models_to_try(model_name)
+        for index, current_model in enumerate(models_to_try):
+            # TARKISTA ONKO MALLIN KATKAISIJA AUKI (QUOTA TÄYNNÄ, COOLDOWN KESKEN)
+            if not self.circuit_breaker.allow(current_model):
+                print(f"--- OHITETAAN MALLI {current_model} (CIRCUIT BREAKER AUKI) ---")
                 continue
 
             print(f"--- KÄYTETÄÄN MALLIA: {current_model} ---")
@@ -58,89 +149,812 @@ class LLMService:
             for attempt in range(max_retries):
                 try:
                     print(f"--- LLM REQUEST START ({current_model}, attempt {attempt+1}/{max_retries}) ---")
-                    model = genai.GenerativeModel(current_model)
-                    
-                    # Konfiguraatio: JSON-pakotus ja suurempi token-raja
-                    generation_config = genai.types.GenerationConfig(
-                        max_output_tokens=8192,
-                        response_mime_type="application/json"
-                    )
-                    
-                    # Asetetaan timeout 5 minuutiksi (300s)
-                    response = model.generate_content(
-                        prompt, 
-                        generation_config=generation_config,
-                        request_options={"timeout": 300}
-                    )
-                    print(f"--- LLM REQUEST END ---")
-                    
-                    # Tarkista onko vastaus validi
-                    text_response = ""
-                    if response.candidates and response.candidates[0].content.parts:
-                        text_response = response.text
+                    hedge_model, hedge_delay = self._hedge_plan(current_model, models_to_try[index + 1:])
+                    if hedge_model:
+                        result, used_model = self._hedged_attempt(current_model, hedge_model, hedge_delay, prompt,
+                                                                  validation_fn, on_partial, call)
                     else:
-                        # ... (Virheenkäsittely kuten ennen) ...
-                        finish_reason = "Tuntematon"
-                        if response.candidates:
-                            finish_reason = str(response.candidates[0].finish_reason)
-                        
-                        error_msg = f"VIRHE: Malli ei palauttanut tekstiä. (Finish Reason: {finish_reason})"
-                        # Jos token-raja, yritä palauttaa osittainen
-                        if response.candidates and response.candidates[0].finish_reason == 2:
-                             try: text_response = response.text
-                             except: pass
-                        
-                        if not text_response:
-                            raise ValueError(error_msg)
-
-                    # --- VALIDOINTI ---
-                    cleaned_json_str = self._clean_json_response(text_response)
-                    
-                    try:
-                        parsed_json = json.loads(cleaned_json_str)
-                    except json.JSONDecodeError as e:
-                        raise ValueError(f"Virheellinen JSON-rakenne: {e}")
+                        result, used_model = self._attempt(current_model, prompt, validation_fn, on_partial, call), current_model
+                    print(f"--- LLM REQUEST END ---")
 
-                    if validation_fn:
-                        if not validation_fn(parsed_json):
-                            raise ValueError("Vastaus ei läpäissyt skeemavalidointia.")
-                    
-                    # Jos päästiin tänne, onnistui!
-                    return cleaned_json_str
+                    # Jos päästiin tänne ilman poikkeusta, onnistui!
+                    self._cache_put(cache_key, result, used_model)
+                    call.finish("ok", model_used=used_model)
+                    return result
 
                 except Exception as e:
                     last_error = e
-                    print(f"VIRHE LLM-kutsussa ({current_model}): {str(e)}")
-                    
-                    # Tarkista onko kyseessä 429 (Rate Limit)
-                    is_rate_limit = "429" in str(e) or "Quota exceeded" in str(e)
-                    
-                    if attempt < max_retries - 1:
-                        wait_time = retry_delay * (2 ** attempt)
-                        if is_rate_limit:
-                            print(f"Rate limit iski. Odotetaan {wait_time} sekuntia...")
-                        else:
-                            print(f"Yritetään uudelleen {wait_time}s kuluttua...")
+                    call.error(e)
+                    # Kohdennettu korjaus: vain rikkinäinen vastaus + virhe + skeema nopealle mallille
+                    if isinstance(e, ResponseValidationError) and repairs_left > 0:
+                        repairs_left -= 1
+                        repaired = self._repair_response(e, validation_fn, call)
+                        if repaired is not None:
+                            self._cache_put(cache_key, repaired, self.repair_model)
+                            call.finish("ok", model_used=self.repair_model, repaired=True)
+                            return repaired
+                    if self._should_abandon_model(current_model, e):
+                        break
+                    wait_time = self._retry_wait(current_model, e, attempt, max_retries)
+                    if wait_time:
                         time.sleep(wait_time)
-                    else:
-                        print(f"Kaikki yritykset epäonnistuivat mallilla {current_model}.")
             
-            # Jos tultiin tänne, mallin kaikki yritykset epäonnistuivat.
-            # Jos kyseessä oli Rate Limit, LISÄÄ MALLI ESTOLISTALLE ja kokeile seuraavaa.
-            if "429" in str(last_error) or "Quota exceeded" in str(last_error):
-                print(f"LISÄTÄÄN {current_model} ESTOLISTALLE (QUOTA TÄYNNÄ).")
-                self.disabled_models.add(current_model)
-                print(f"Vaihdetaan varamalliin (Fallback)...")
+            self._handle_model_exhausted(current_model, last_error)
+
+        call.finish("failed", failure_reason=self._failure_reason(last_error))
+        return self._all_models_failed_message(last_error)
+
+    async def agenerate_response(self, prompt, model_name="gemini-2.5-flash", validation_fn=None, on_partial=None,
+                                 cache_bypass=None, streaming=None):
+        """
+        Asynkroninen versio generate_response-metodista.
+        Käyttää Geminin async-asiakasta ja asyncio.sleep-odotusta, joten yksi tapahtumasilmukka
+        voi pitää satoja kutsuja käynnissä ilman säiettä per pyyntö.
+        """
+        token = _request_options.set(self._options(cache_bypass, streaming))
+        try:
+            return await self._agenerate_response(prompt, model_name, validation_fn, on_partial)
+        finally:
+            _request_options.reset(token)
+
+    async def _agenerate_response(self, prompt, model_name, validation_fn, on_partial):
+        call = self.telemetry.start_call(model_name, prompt)
+        request_key = self._request_key(prompt, model_name, validation_fn)
+        cache_key = request_key if self.cache is not None else None
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            call.finish("ok", cache_hit=True)
+            return cached
+
+        if self.single_flight is None:
+            return await self._agenerate(prompt, model_name, validation_fn, on_partial, call, cache_key)
+
+        result, shared = await self.single_flight.ado(
+            request_key,
+            lambda: self._agenerate(prompt, model_name, validation_fn, on_partial, call, cache_key),
+            recheck=lambda: self._cache_get(cache_key)
+        )
+        if shared:
+            self._finish_shared(call, result)
+        return result
+
+    async def _agenerate(self, prompt, model_name, validation_fn, on_partial, call, cache_key):
+        max_retries = 5
+        last_error = None
+        repairs_left = self.max_repairs
+
+        models_to_try = self._models_to_try(model_name)
+        for index, current_model in enumerate(models_to_try):
+            if not self.circuit_breaker.allow(current_model):
+                print(f"--- OHITETAAN MALLI {current_model} (CIRCUIT BREAKER AUKI) ---")
                 continue
+
+            print(f"--- KÄYTETÄÄN MALLIA (async): {current_model} ---")
+
+            for attempt in range(max_retries):
+                try:
+                    print(f"--- LLM REQUEST START (async, {current_model}, attempt {attempt+1}/{max_retries}) ---")
+                    hedge_model, hedge_delay = self._hedge_plan(current_model, models_to_try[index + 1:])
+                    if hedge_model:
+                        result, used_model = await self._ahedged_attempt(current_model, hedge_model, hedge_delay,
+                                                                         prompt, validation_fn, on_partial, call)
+                    else:
+                        result = await self._aattempt(current_model, prompt, validation_fn, on_partial, call)
+                        used_model = current_model
+                    print(f"--- LLM REQUEST END (async) ---")
+
+                    self._cache_put(cache_key, result, used_model)
+                    call.finish("ok", model_used=used_model)
+                    return result
+
+                except Exception as e:
+                    last_error = e
+                    call.error(e)
+                    if isinstance(e, ResponseValidationError) and repairs_left > 0:
+                        repairs_left -= 1
+                        repaired = await self._arepair_response(e, validation_fn, call)
+                        if repaired is not None:
+                            self._cache_put(cache_key, repaired, self.repair_model)
+                            call.finish("ok", model_used=self.repair_model, repaired=True)
+                            return repaired
+                    if self._should_abandon_model(current_model, e):
+                        break
+                    wait_time = self._retry_wait(current_model, e, attempt, max_retries)
+                    if wait_time:
+                        await asyncio.sleep(wait_time)
+
+            self._handle_model_exhausted(current_model, last_error)
+
+        call.finish("failed", failure_reason=self._failure_reason(last_error))
+        return self._all_models_failed_message(last_error)
+
+    def _attempt(self, model_name, prompt, validation_fn, on_partial, call, cancel_event=None):
+        """
+        Yksi API-kutsu mallille. Palauttaa validoidun JSON-tekstin tai heittää poikkeuksen.
+        Lopputulos ja kesto kirjataan reitittimelle (vaihe luetaan telemetrian scopesta).
+        """
+        phase_id = current_scope().get("phase_id")
+        try:
+            with self._model_slot(model_name):
+                result, elapsed = self._call_model(model_name, prompt, validation_fn, on_partial, call, cancel_event)
+        except HedgeCancelled:
+            raise
+        except Exception as e:
+            self.router.record_failure(phase_id, model_name, self._outcome(e))
+            raise
+        self.router.record_success(phase_id, model_name, elapsed)
+        return result
+
+    async def _aattempt(self, model_name, prompt, validation_fn, on_partial, call):
+        """Asynkroninen versio _attempt-metodista (peruminen tapahtuu tehtävän cancel()-kutsulla)."""
+        phase_id = current_scope().get("phase_id")
+        try:
+            async with self._amodel_slot(model_name):
+                result, elapsed = await self._acall_model(model_name, prompt, validation_fn, on_partial, call)
+        except Exception as e:
+            self.router.record_failure(phase_id, model_name, self._outcome(e))
+            raise
+        self.router.record_success(phase_id, model_name, elapsed)
+        return result
+
+    def _model_slot(self, model_name):
+        """Samanaikaisuusrajan paikka mallille (with-lohko) tai tyhjä konteksti ilman rajoitinta."""
+        if self.concurrency_limiter is None:
+            return contextlib.nullcontext()
+        return self.concurrency_limiter.slot(model_name)
+
+    def _amodel_slot(self, model_name):
+        """Asynkroninen versio _model_slot-metodista (async with -lohko)."""
+        if self.concurrency_limiter is None:
+            return contextlib.nullcontext()
+        return self.concurrency_limiter.aslot(model_name)
+
+    def _call_model(self, model_name, prompt, validation_fn, on_partial, call, cancel_event=None):
+        """
+        Nopeusrajoitus, kutsu (striimattuna tai ei), kulutuksen kirjaus ja validointi.
+        Palauttaa (validoitu JSON-teksti, kutsun kesto s).
+        """
+        estimated_tokens = self._estimate_tokens(prompt)
+        if self.rate_limiter:
+            self.rate_limiter.acquire(model_name, estimated_tokens)
+        if cancel_event is not None and cancel_event.is_set():
+            # Hedged-pyynnön toinen malli vastasi odotuksen aikana: varattu TPM palautetaan
+            if self.rate_limiter:
+                self.rate_limiter.adjust_tokens(model_name, -estimated_tokens)
+            raise HedgeCancelled("Pyyntö peruttiin ennen lähetystä (toinen pyyntö vastasi ensin)")
+
+        call.attempt(model_name)
+        started = time.perf_counter()
+        handle = self._prompt_cache_handle(model_name, prompt, validation_fn)
+        request_prompt, params = self._cached_request(model_name, prompt, validation_fn, handle)
+        # Asetetaan timeout 5 minuutiksi (300s)
+        response = self.backend.generate(
+            model_name,
+            request_prompt,
+            params,
+            timeout=300,
+            stream=self._streaming()
+        )
+        if self._streaming():
+            text_response, response = self._consume_stream(response, validation_fn, on_partial, cancel_event)
+        self._record_usage(model_name, response, estimated_tokens, call)
+        self.circuit_breaker.record_success(model_name)
+        if cancel_event is not None and cancel_event.is_set():
+            raise HedgeCancelled("Vastaus hylättiin (toinen pyyntö vastasi ensin)")
+        if not self._streaming():
+            text_response = self._extract_text(response)
+        if self._needs_continuation(response, text_response):
+            text_response = self._continue_truncated(model_name, prompt, text_response, validation_fn, call, handle)
+
+        result = self._parse_and_validate(text_response, validation_fn)
+        return result, time.perf_counter() - started
+
+    async def _acall_model(self, model_name, prompt, validation_fn, on_partial, call):
+        """Asynkroninen versio _call_model-metodista."""
+        estimated_tokens = self._estimate_tokens(prompt)
+        if self.rate_limiter:
+            await self.rate_limiter.aacquire(model_name, estimated_tokens)
+
+        call.attempt(model_name)
+        started = time.perf_counter()
+        # Kahvan luonti on harvinainen verkkokutsu: ajetaan säikeessä, ettei tapahtumasilmukka pysähdy
+        handle = await asyncio.to_thread(self._prompt_cache_handle, model_name, prompt, validation_fn)
+        request_prompt, params = self._cached_request(model_name, prompt, validation_fn, handle)
+        response = await self.backend.agenerate(
+            model_name,
+            request_prompt,
+            params,
+            timeout=300,
+            stream=self._streaming()
+        )
+        if self._streaming():
+            text_response, response = await self._aconsume_stream(response, validation_fn, on_partial)
+        self._record_usage(model_name, response, estimated_tokens, call)
+        self.circuit_breaker.record_success(model_name)
+        if not self._streaming():
+            text_response = self._extract_text(response)
+        if self._needs_continuation(response, text_response):
+            text_response = await self._acontinue_truncated(model_name, prompt, text_response, validation_fn, call,
+                                                            handle)
+
+        result = self._parse_and_validate(text_response, validation_fn)
+        return result, time.perf_counter() - started
+
+    def _needs_continuation(self, response, text):
+        """MAX_TOKENS (finish_reason 2) ja JSON-objekti on kesken."""
+        if not self.max_continuations:
+            return False
+        try:
+            truncated = response.candidates[0].finish_reason == 2
+        except (AttributeError, IndexError, TypeError):
+            return False
+        if not truncated:
+            return False
+        parser = IncrementalJSONParser()
+        parser.feed(text)
+        return not parser.complete
+
+    def _continuation_request(self, model_name, follow_up, validation_fn, handle):
+        """
+        (lähetettävä kehote, generointiparametrit) jatkopyynnölle. Jatkokehote alkaa alkuperäisellä
+        kehotteella, joten saman kahvan kanssa lähetetään vain loppuosa (ks. _cached_request).
+        """
+        request_prompt, params = self._cached_request(model_name, follow_up, validation_fn, handle)
+        # Jatko-osa on JSONin loppu, ei kokonainen objekti: JSON-pakotus ja response_schema pois
+        params.pop("response_schema", None)
+        params["response_mime_type"] = "text/plain"
+        return request_prompt, params
+
+    def _continue_truncated(self, model_name, prompt, text, validation_fn, call, handle=None):
+        """
+        Jatkaa token-rajaan (MAX_TOKENS) katkennutta vastausta katkaisukohdasta sen sijaan, että koko
+        kehote ajettaisiin uudelleen: jatkopyyntö sisältää kesken jääneen vastauksen ja malli tuottaa
+        vain puuttuvan loppuosan. handle on alkuperäisen kutsun kehotevälimuistin kahva (tai None).
+        Enintään max_continuations jatkopyyntöä; lopputulos validoidaan normaalisti (_parse_and_validate).
+        """
+        for number in range(1, self.max_continuations + 1):
+            print(f"--- MAX_TOKENS: jatketaan vastausta ({model_name}, {number}/{self.max_continuations}, "
+                  f"{len(text)} merkkiä) ---")
+            follow_up = continuation_prompt(prompt, text)
+            estimated_tokens = self._estimate_tokens(follow_up)
+            if self.rate_limiter:
+                self.rate_limiter.acquire(model_name, estimated_tokens)
+            call.continuation()
+            request_prompt, params = self._continuation_request(model_name, follow_up, validation_fn, handle)
+            response = self.backend.generate(model_name, request_prompt, params, timeout=300)
+            self._record_usage(model_name, response, estimated_tokens, call)
+            text = stitch(text, self._extract_text(response))
+            if not self._needs_continuation(response, text):
+                break
+        return text
+
+    async def _acontinue_truncated(self, model_name, prompt, text, validation_fn, call, handle=None):
+        """Asynkroninen versio _continue_truncated-metodista."""
+        for number in range(1, self.max_continuations + 1):
+            print(f"--- MAX_TOKENS: jatketaan vastausta (async, {model_name}, {number}/{self.max_continuations}, "
+                  f"{len(text)} merkkiä) ---")
+            follow_up = continuation_prompt(prompt, text)
+            estimated_tokens = self._estimate_tokens(follow_up)
+            if self.rate_limiter:
+                await self.rate_limiter.aacquire(model_name, estimated_tokens)
+            call.continuation()
+            request_prompt, params = self._continuation_request(model_name, follow_up, validation_fn, handle)
+            response = await self.backend.agenerate(model_name, request_prompt, params, timeout=300)
+            self._record_usage(model_name, response, estimated_tokens, call)
+            text = stitch(text, self._extract_text(response))
+            if not self._needs_continuation(response, text):
+                break
+        return text
+
+    def _hedge_plan(self, model_name, fallback_models):
+        """
+        Hedged-pyyntö (config.HEDGE_POLICY, vaihekohtainen opt-in): palauttaa (varamalli, viive s)
+        tai (None, None). Viive on päämallin havaitun kestojakauman persentiili tässä vaiheessa;
+        ennen riittävää havaintomäärää käytetään default_delay-arvoa.
+        """
+        phase_id = current_scope().get("phase_id")
+        policy = self.hedge_policy.get(phase_id)
+        if not policy:
+            return None, None
+        # Vain suljetun katkaisijan mallit: half-open-koekutsua ei käytetä rinnakkaispyyntöön
+        open_models = self.circuit_breaker.open_models()
+        hedge_model = next((m for m in fallback_models if m != model_name and m not in open_models), None)
+        if hedge_model is None:
+            return None, None
+        delay = self.router.latency.percentile((phase_id, model_name), policy.get("percentile", 90),
+                                        policy.get("min_samples", 5))
+        if delay is None:
+            delay = policy.get("default_delay", 60)
+        return hedge_model, max(policy.get("min_delay", 1), delay)
+
+    def _hedged_attempt(self, primary_model, hedge_model, delay, prompt, validation_fn, on_partial, call):
+        """
+        Lähettää pyynnön päämallille ja, jos vastausta ei ole tullut delay sekunnissa, saman pyynnön
+        varamallille. Ensimmäinen validoinnin läpäissyt vastaus voittaa; häviäjän striimi katkaistaan.
+        Ei-striimattua HTTP-kutsua ei voi perua: häviäjä hylätään heti vastauksen saavuttua (ei jatko-
+        eikä korjauspyyntöjä), jolloin sen samanaikaisuuspaikka vapautuu. Palauttaa (tulos, malli).
+        Jos molemmat epäonnistuvat, heitetään päämallin virhe (normaali retry-logiikka jatkaa).
+
+        Kummallakin yrityksellä on oma telemetriatietueensa (call.child): voittaja ja epäonnistuneet
+        yhdistetään kutsuun, kesken oleva häviäjä kirjataan valmistuttuaan omana tietueenaan.
+        """
+        cancel_events = {primary_model: threading.Event(), hedge_model: threading.Event()}
+        attempts = {primary_model: call.child(), hedge_model: call.child()}
+        executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="hedge")
+        futures = {}
+        errors = {}
+        try:
+            futures[executor.submit(contextvars.copy_context().run, self._attempt, primary_model, prompt,
+                                    validation_fn, on_partial, attempts[primary_model],
+                                    cancel_events[primary_model])] = primary_model
+            done, _ = wait(futures, timeout=delay)
+            if not done:
+                self._start_hedge(primary_model, hedge_model, delay, call)
+                # Osittaiset tulokset näytetään vain päämallilta
+                futures[executor.submit(contextvars.copy_context().run, self._attempt, hedge_model, prompt,
+                                        validation_fn, None, attempts[hedge_model],
+                                        cancel_events[hedge_model])] = hedge_model
+
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    model = futures[future]
+                    call.merge(attempts[model])
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        errors[model] = e
+                        continue
+                    for other, other_model in futures.items():
+                        if other_model != model and other_model not in errors:
+                            cancel_events[other_model].set()
+                            other.add_done_callback(lambda _, lost=attempts[other_model]: lost.lost())
+                    self._finish_hedge(primary_model, model, len(futures) > 1, errors, call)
+                    return result, model
+            self._finish_hedge(primary_model, None, len(futures) > 1, errors, call)
+            raise errors.get(primary_model) or errors[hedge_model]
+        finally:
+            executor.shutdown(wait=False)
+
+    async def _ahedged_attempt(self, primary_model, hedge_model, delay, prompt, validation_fn, on_partial, call):
+        """Asynkroninen versio _hedged_attempt-metodista: häviäjän tehtävä perutaan (cancel)."""
+        attempts = {primary_model: call.child(), hedge_model: call.child()}
+        tasks = {asyncio.ensure_future(self._aattempt(primary_model, prompt, validation_fn, on_partial,
+                                                      attempts[primary_model])): primary_model}
+        errors = {}
+        try:
+            done, _ = await asyncio.wait(set(tasks), timeout=delay)
+            if not done:
+                self._start_hedge(primary_model, hedge_model, delay, call)
+                tasks[asyncio.ensure_future(self._aattempt(hedge_model, prompt, validation_fn, None,
+                                                           attempts[hedge_model]))] = hedge_model
+
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    model = tasks[task]
+                    call.merge(attempts[model])
+                    if task.exception() is not None:
+                        errors[model] = task.exception()
+                        continue
+                    for other, other_model in tasks.items():
+                        if other_model != model and other_model not in errors:
+                            other.add_done_callback(lambda _, lost=attempts[other_model]: lost.lost())
+                    self._finish_hedge(primary_model, model, len(tasks) > 1, errors, call)
+                    return task.result(), model
+            self._finish_hedge(primary_model, None, len(tasks) > 1, errors, call)
+            raise errors.get(primary_model) or errors[hedge_model]
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def _start_hedge(self, primary_model, hedge_model, delay, call):
+        print(f"--- HEDGE: {primary_model} ei vastannut {delay:.1f} s:ssa, rinnakkainen pyyntö mallille {hedge_model} ---")
+        call.hedge(hedge_model)
+        with self._hedge_lock:
+            self.hedge_stats["hedged"] += 1
+
+    def _finish_hedge(self, primary_model, winner, hedged, errors, call):
+        """Kirjaa hedged-pyynnön lopputuloksen (voittaja) ja hylätyn pyynnön virheen."""
+        for model, error in errors.items():
+            if model != primary_model:
+                call.error(error)
+                print(f"VIRHE hedge-pyynnössä ({model}): {error}")
+        if not hedged:
+            return
+        with self._hedge_lock:
+            if winner is None:
+                self.hedge_stats["both_failed"] += 1
+            elif winner == primary_model:
+                self.hedge_stats["primary_wins"] += 1
             else:
-                # Jos muu virhe, kannattaako vaihtaa? Usein kyllä.
-                print(f"Vakava virhe. Kokeillaan varamallia varmuuden vuoksi...")
-                continue
+                self.hedge_stats["hedge_wins"] += 1
+        if winner and winner != primary_model:
+            call.hedge_won()
+            print(f"--- HEDGE: {winner} vastasi ensin (päämalli {primary_model} hylättiin) ---")
+
+    def _models_to_try(self, model_name):
+        """
+        Palauttaa kokeiltavat mallit järjestyksessä: pyydetty malli ja sen jälkeen muut sallitut
+        mallit (config.FALLBACK_MODELS) reitittimen tilastojen mukaan. "auto" = reititin valitsee.
+        """
+        return self.router.fallback_chain(model_name, current_scope().get("phase_id"))
+
+    def _outcome(self, error):
+        """Luokittelee epäonnistuneen kutsun reitittimen tilastoja varten."""
+        if self._is_rate_limit(error):
+            return RATE_LIMITED
+        if isinstance(error, ResponseValidationError) or "Striimi keskeytettiin" in str(error):
+            return INVALID
+        return ERROR
+
+    def _generation_params(self, validation_fn=None, model_name=None):
+        """
+        Konfiguraatio: JSON-pakotus ja vaiheen generointiprofiili (token-katto, ajattelubudjetti,
+        lämpötila; validointifunktion generation_profile-attribuutti, ks. Orchestrator). Ilman
+        profiilia käytetään kiinteää 8192 tokenin rajaa. Ajattelevilla malleilla (config.THINKING_MODELS)
+        ajattelubudjetti lisätään token-kattoon, koska ajattelutokenit lasketaan samaan rajaan. Jos
+        taustapalvelu ei rajaa ajattelua budjetilla (esim. google-generativeai 0.8.x), katto ei laske
+        kiinteän 8192 tokenin rajan alle, jottei rajaton ajattelu kuluta koko kattoa.
+        Jos validointifunktiolla on response_schema-attribuutti, malli pakotetaan vaiheen skeemaan.
+        """
+        profile = getattr(validation_fn, "generation_profile", None) or DEFAULT_PROFILE
+        max_output_tokens = profile["max_output_tokens"]
+        params = {"response_mime_type": "application/json"}
+        if profile.get("temperature") is not None:
+            params["temperature"] = profile["temperature"]
+        if model_name in THINKING_MODELS and profile.get("thinking_budget") is not None:
+            params["thinking_budget"] = profile["thinking_budget"]
+            max_output_tokens += profile["thinking_budget"]
+            if not getattr(self.backend, "supports_thinking_budget", False):
+                max_output_tokens = max(max_output_tokens, DEFAULT_PROFILE["max_output_tokens"])
+        params["max_output_tokens"] = min(max_output_tokens, MODEL_MAX_OUTPUT_TOKENS.get(model_name, max_output_tokens))
+        response_schema = getattr(validation_fn, "response_schema", None)
+        if self.structured_output and response_schema:
+            params["response_schema"] = response_schema
+        return params
+
+    def _prompt_cache_handle(self, model_name, prompt, validation_fn):
+        """Kehotteen alkuosan välimuistikahva (ks. prompt_cache.py) tai None."""
+        prefix_chars = getattr(validation_fn, "cache_prefix_chars", None)
+        if self.prompt_cache is None or not prefix_chars:
+            return None
+        return self.prompt_cache.handle(model_name, prompt[:prefix_chars])
+
+    def _cached_request(self, model_name, prompt, validation_fn, handle):
+        """(lähetettävä kehote, generointiparametrit): kahvan kanssa lähetetään vain kehotteen loppuosa."""
+        params = self._generation_params(validation_fn, model_name)
+        if handle is None:
+            return prompt, params
+        params["cached_content"] = handle
+        return prompt[validation_fn.cache_prefix_chars:], params
+
+    def _request_key(self, prompt, model_name, validation_fn):
+        """
+        Pyynnön tiiviste (välimuisti- ja single-flight-avain): (malli, kehote, generointikonfiguraatio,
+        skeemaversio). Skeemaversio luetaan validointifunktion schema_version-attribuutista (ks. Orchestrator).
+        """
+        schema_version = getattr(validation_fn, "schema_version", None)
+        return LLMCache.make_key(model_name, prompt, self._generation_params(validation_fn, model_name), schema_version)
+
+    def _finish_shared(self, call, result):
+        """Telemetria kutsulle, joka sai tuloksen samanaikaiselta identtiseltä pyynnöltä."""
+        if ALL_MODELS_FAILED in result:
+            call.finish("failed", failure_reason="shared", deduplicated=True)
+        else:
+            call.finish("ok", deduplicated=True)
+
+    @staticmethod
+    def _options(cache_bypass, streaming):
+        return {name: value for name, value in (("cache_bypass", cache_bypass), ("streaming", streaming))
+                if value is not None}
+
+    def _streaming(self):
+        """Striimataanko käynnissä oleva kutsu (kutsun streaming-argumentti tai self.streaming)."""
+        return _request_options.get().get("streaming", self.streaming)
+
+    def _cache_bypassed(self):
+        return _request_options.get().get("cache_bypass", self.cache_bypass)
+
+    def _cache_get(self, cache_key):
+        if cache_key is None:
+            return None
+        cached = self.cache.get(cache_key, bypass=self._cache_bypassed())
+        if cached is not None:
+            print(f"--- LLM CACHE HIT ({cache_key[:12]}) ---")
+        return cached
+
+    def _cache_put(self, cache_key, result, used_model):
+        # Tallennetaan vain validoinnin läpäisseet vastaukset (kutsutaan _parse_and_validate:n jälkeen)
+        if cache_key is not None:
+            self.cache.put(cache_key, result, bypass=self._cache_bypassed(), metadata={"model": used_model})
+
+    def _extract_text(self, response):
+        """Poimii vastauksen tekstin. Heittää ValueErrorin jos tekstiä ei ole."""
+        text_response = ""
+        if response.candidates and response.candidates[0].content.parts:
+            text_response = response.text
+        else:
+            finish_reason = "Tuntematon"
+            if response.candidates:
+                finish_reason = str(response.candidates[0].finish_reason)
+            
+            error_msg = f"VIRHE: Malli ei palauttanut tekstiä. (Finish Reason: {finish_reason})"
+            # Jos token-raja, yritä palauttaa osittainen
+            if response.candidates and response.candidates[0].finish_reason == 2:
+                 try: text_response = response.text
+                 except: pass
+            
+            if not text_response:
+                raise ValueError(error_msg)
+        return text_response
+
+    def _consume_stream(self, stream, validation_fn=None, on_partial=None, cancel_event=None):
+        """
+        Lukee striimatun vastauksen palat inkrementaaliseen JSON-jäsentimeen.
+        Keskeyttää heti (ValueError), jos vastaus on selvästi virheellinen, ja lopettaa
+        lukemisen kun JSON-objekti on valmis. Palauttaa (teksti, viimeisin pala).
+        cancel_event: asetettu tapahtuma katkaisee lukemisen (hedged-pyynnön häviäjä).
+        """
+        parser = IncrementalJSONParser(allowed_keys=self._allowed_keys(validation_fn))
+        last_chunk = None
+        for chunk in stream:
+            if cancel_event is not None and cancel_event.is_set():
+                raise HedgeCancelled("Striimi peruttiin (toinen pyyntö vastasi ensin)")
+            last_chunk = chunk
+            if self._feed_stream_chunk(parser, chunk, on_partial):
+                break
+        return self._finish_stream(parser, last_chunk)
+
+    async def _aconsume_stream(self, stream, validation_fn=None, on_partial=None):
+        """Asynkroninen versio _consume_stream-metodista."""
+        parser = IncrementalJSONParser(allowed_keys=self._allowed_keys(validation_fn))
+        last_chunk = None
+        async for chunk in stream:
+            last_chunk = chunk
+            if self._feed_stream_chunk(parser, chunk, on_partial):
+                break
+        return self._finish_stream(parser, last_chunk)
+
+    def _feed_stream_chunk(self, parser, chunk, on_partial):
+        """Syöttää palan jäsentimeen. Palauttaa True, kun JSON-objekti on valmis."""
+        try:
+            text = chunk.text
+        except (ValueError, AttributeError, IndexError):
+            text = "" # Palassa ei ole tekstiä (esim. pelkkä finish_reason)
+
+        previous = parser.partial()
+        if parser.feed(text):
+            print(f"--- STRIIMI KESKEYTETTY: {parser.error} ---")
+            raise ValueError(f"Striimi keskeytettiin: {parser.error}")
+
+        if on_partial:
+            current = parser.partial()
+            if current is not None and current != previous:
+                on_partial(current)
+        return parser.complete
+
+    def _finish_stream(self, parser, last_chunk):
+        if not parser.text:
+            if last_chunk is None:
+                raise ValueError("VIRHE: Malli ei palauttanut tekstiä. (Tyhjä striimi)")
+            self._extract_text(last_chunk) # Heittää ValueErrorin finish_reasonin kanssa
+        return parser.json_text(), last_chunk
+
+    def _parse_and_validate(self, text_response, validation_fn=None):
+        """
+        VALIDOINTI: Puhdistaa, parsii ja validoi JSON-vastauksen.
+        Palauttaa puhdistetun JSON-merkkijonon tai heittää ResponseValidationErrorin.
+        """
+        cleaned_json_str = self._clean_json_response(text_response)
+        
+        try:
+            parsed_json = json.loads(cleaned_json_str)
+        except json.JSONDecodeError as e:
+            raise ResponseValidationError(f"Virheellinen JSON-rakenne: {e}", text_response, f"JSON-jäsennysvirhe: {e}")
+
+        if validation_fn:
+            if not validation_fn(parsed_json):
+                raise ResponseValidationError("Vastaus ei läpäissyt skeemavalidointia.", cleaned_json_str,
+                                              self._describe_schema_error(parsed_json, validation_fn))
+        
+        return cleaned_json_str
+
+    @staticmethod
+    def _allowed_keys(validation_fn):
+        """Striimin sallitut ylätason avaimet: allowed_keys (skeema + BaseJSON, ks. Orchestrator) tai schema_keys."""
+        return getattr(validation_fn, "allowed_keys", None) or getattr(validation_fn, "schema_keys", None)
+
+    def _describe_schema_error(self, parsed_json, validation_fn):
+        """Tarkka kuvaus skeemavirheestä korjauskehotetta varten."""
+        schema_keys = getattr(validation_fn, "schema_keys", None)
+        if not isinstance(parsed_json, dict):
+            return f"Juuritason tulee olla JSON-objekti, saatiin {type(parsed_json).__name__}."
+        if schema_keys:
+            missing = [key for key in schema_keys if key not in parsed_json]
+            allowed = self._allowed_keys(validation_fn)
+            extra = [key for key in parsed_json if key not in allowed]
+            parts = []
+            if missing:
+                parts.append(f"Puuttuvat ylätason avaimet: {missing}.")
+            if extra:
+                parts.append(f"Ylimääräiset ylätason avaimet: {extra}.")
+            if parts:
+                return " ".join(parts)
+        return "Vastaus ei läpäissyt skeemavalidointia."
+
+    def _repair_prompt(self, error, validation_fn):
+        """Lyhyt korjauskehote: rikkinäinen vastaus, tarkka virhe ja vaiheen skeema (ei alkuperäistä kehotetta)."""
+        schema = getattr(validation_fn, "response_schema", None) or getattr(validation_fn, "schema_keys", None)
+        schema_text = json.dumps(schema, ensure_ascii=False, separators=(",", ":")) if schema else "(ei skeemaa)"
+        return (
+            "Korjaa alla oleva JSON-vastaus. Älä muuta sisältöä tarpeettomasti: korjaa vain rakenne niin, "
+            "että vastaus on validi JSON-objekti ja noudattaa skeemaa.\n"
+            f"VIRHE: {error.detail}\n"
+            f"SKEEMA: {schema_text}\n"
+            f"RIKKINÄINEN VASTAUS:\n{error.text}\n"
+            "Palauta VAIN korjattu JSON-objekti."
+        )
+
+    def _repair_response(self, error, validation_fn, call=None):
+        """
+        Kohdennettu korjauskierros nopealla mallilla. Palauttaa validin JSON-merkkijonon
+        tai None, jolloin jatketaan tavallisella uudelleenyrityksellä.
+        """
+        if not self._can_repair():
+            return None
+        repair_prompt = self._repair_prompt(error, validation_fn)
+        print(f"--- JSON-KORJAUS ({self.repair_model}): {error.detail} ---")
+        try:
+            estimated_tokens = self._estimate_tokens(repair_prompt)
+            if self.rate_limiter:
+                self.rate_limiter.acquire(self.repair_model, estimated_tokens)
+            with self._model_slot(self.repair_model):
+                response = self.backend.generate(self.repair_model, repair_prompt,
+                                                 self._generation_params(validation_fn, self.repair_model), timeout=60)
+            self._record_usage(self.repair_model, response, estimated_tokens, call)
+            return self._finish_repair(response, validation_fn)
+        except Exception as e:
+            return self._repair_failed(e)
+
+    async def _arepair_response(self, error, validation_fn, call=None):
+        """Asynkroninen versio _repair_response-metodista."""
+        if not self._can_repair():
+            return None
+        repair_prompt = self._repair_prompt(error, validation_fn)
+        print(f"--- JSON-KORJAUS (async, {self.repair_model}): {error.detail} ---")
+        try:
+            estimated_tokens = self._estimate_tokens(repair_prompt)
+            if self.rate_limiter:
+                await self.rate_limiter.aacquire(self.repair_model, estimated_tokens)
+            async with self._amodel_slot(self.repair_model):
+                response = await self.backend.agenerate(self.repair_model, repair_prompt,
+                                                        self._generation_params(validation_fn, self.repair_model),
+                                                        timeout=60)
+            self._record_usage(self.repair_model, response, estimated_tokens, call)
+            return self._finish_repair(response, validation_fn)
+        except Exception as e:
+            return self._repair_failed(e)
+
+    def _can_repair(self):
+        return bool(self.repair_model) and self.circuit_breaker.allow(self.repair_model)
+
+    def _finish_repair(self, response, validation_fn):
+        self.circuit_breaker.record_success(self.repair_model)
+        result = self._parse_and_validate(self._extract_text(response), validation_fn)
+        print("--- JSON-KORJAUS ONNISTUI ---")
+        return result
+
+    def _repair_failed(self, error):
+        print(f"JSON-korjaus epäonnistui ({self.repair_model}): {error}. Jatketaan uudelleenyrityksellä.")
+        if self._is_rate_limit(error):
+            self.circuit_breaker.record_failure(self.repair_model, retry_after=parse_retry_after(error))
+        else:
+            self.circuit_breaker.record_success(self.repair_model)
+        return None
+
+    def _estimate_tokens(self, prompt):
+        """Karkea token-arvio (~4 merkkiä / token) TPM-rajoitusta varten."""
+        return len(prompt) // 4
+
+    def _record_usage(self, model_name, response, estimated_tokens, call=None):
+        """Kirjaa tokenit telemetriaan ja korjaa rajoittimen TPM-arvion usage_metadata-tiedoilla."""
+        if call is not None:
+            call.add_usage(response, model_name)
+        if not self.rate_limiter:
+            return
+        try:
+            actual = int(response.usage_metadata.prompt_token_count)
+        except (AttributeError, TypeError, ValueError):
+            return
+        self.rate_limiter.adjust_tokens(model_name, actual - estimated_tokens)
+
+    def _failure_reason(self, error):
+        """Luokittelee viimeisimmän virheen telemetriaa varten."""
+        if error is None:
+            return "no_model_available"
+        if self._is_rate_limit(error):
+            return "rate_limit"
+        if isinstance(error, ResponseValidationError):
+            return "validation"
+        if "Finish Reason: 2" in str(error) or "MAX_TOKENS" in str(error):
+            return "max_tokens"
+        if isinstance(error, TimeoutError) or "timeout" in str(error).lower() or "deadline" in str(error).lower():
+            return "timeout"
+        return "error"
+
+    def _is_rate_limit(self, error):
+        """Tarkista onko kyseessä 429 (Rate Limit)."""
+        return "429" in str(error) or "Quota exceeded" in str(error)
+
+    def _retry_wait(self, current_model, error, attempt, max_retries, retry_delay=2):
+        """
+        Kirjaa virheen ja palauttaa odotusajan sekunteina ennen uutta yritystä
+        (eksponentiaalinen backoff). Palauttaa None, jos yrityksiä ei ole enää jäljellä.
+        """
+        print(f"VIRHE LLM-kutsussa ({current_model}): {str(error)}")
+
+        if self.rate_limiter and self._is_rate_limit(error):
+            # Kiintiö täynnä: muutkin kutsujat odottavat rajoittimessa
+            self.rate_limiter.on_rate_limited(current_model)
+
+        if attempt < max_retries - 1:
+            wait_time = retry_delay * (2 ** attempt)
+            if self._is_rate_limit(error):
+                # Noudatetaan API:n Retry-After-vihjettä, jos se on backoffia pidempi
+                wait_time = max(wait_time, parse_retry_after(error) or 0)
+                print(f"Rate limit iski. Odotetaan {wait_time} sekuntia...")
+            else:
+                print(f"Yritetään uudelleen {wait_time}s kuluttua...")
+            return wait_time
+
+        print(f"Kaikki yritykset epäonnistuivat mallilla {current_model}.")
+        return None
+
+    def _should_abandon_model(self, current_model, error):
+        """
+        Lopetetaanko mallin yrittäminen heti 429:n jälkeen? Näin käy, jos kyseessä oli
+        half-open-tilan koekutsu tai jos API pyytää odottamaan pidempään kuin MAX_RETRY_AFTER_WAIT.
+        """
+        if not self._is_rate_limit(error):
+            return False
+        if self.circuit_breaker.is_probing(current_model):
+            print(f"VIRHE LLM-kutsussa ({current_model}): {str(error)}")
+            print(f"Koekutsu epäonnistui mallilla {current_model}.")
+            return True
+        retry_after = parse_retry_after(error)
+        if retry_after and retry_after > self.MAX_RETRY_AFTER_WAIT:
+            print(f"VIRHE LLM-kutsussa ({current_model}): {str(error)}")
+            print(f"API pyytää odottamaan {retry_after:.0f} s. Ei yritetä uudelleen.")
+            if self.rate_limiter:
+                self.rate_limiter.on_rate_limited(current_model)
+            return True
+        return False
+
+    def _handle_model_exhausted(self, current_model, last_error):
+        """
+        Kutsutaan kun mallin kaikki yritykset epäonnistuivat.
+        Jos kyseessä oli Rate Limit, AVATAAN MALLIN KATKAISIJA (cooldown Retry-After-vihjeen
+        mukaan) ja kokeillaan seuraavaa. Katkaisija palauttaa mallin käyttöön koekutsulla.
+        """
+        if self._is_rate_limit(last_error):
+            print(f"AVATAAN {current_model} KATKAISIJA (QUOTA TÄYNNÄ).")
+            self.circuit_breaker.record_failure(current_model, retry_after=parse_retry_after(last_error))
+            print(f"Vaihdetaan varamalliin (Fallback)...")
+        else:
+            # Muu virhe ei kerro kiintiöstä: vapautetaan mahdollinen koekutsu
+            self.circuit_breaker.record_success(current_model)
+            # Jos muu virhe, kannattaako vaihtaa? Usein kyllä.
+            print(f"Vakava virhe. Kokeillaan varamallia varmuuden vuoksi...")
 
-        # Jos kaikki mallit epäonnistuivat
+    def _all_models_failed_message(self, last_error):
+        """Jos kaikki mallit epäonnistuivat, palautetaan virheteksti UI:lle."""
         final_error_msg = f"""
         ============================================================
-        VIRHE: KAIKKI TEKOÄLYMALLIT EPÄONNISTUIVAT (QUOTA TÄYNNÄ?)
+        VIRHE: {ALL_MODELS_FAILED} (QUOTA TÄYNNÄ?)
         ============================================================
         Viimeisin virhe: {last_error}
         
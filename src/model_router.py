@@ -0,0 +1,114 @@
+import threading
+from collections import deque
+
+from config import FALLBACK_MODELS, CRITIC_PHASES, AUTO_MODEL, ROUTER_WINDOW, ROUTER_MIN_SAMPLES, ROUTER_MIN_SUCCESS_RATE
+from latency_stats import LatencyStats
+
+# Kutsun lopputulokset, joista onnistumisasteet lasketaan
+OK = "ok"
+INVALID = "invalid"  # Vastaus saatiin, mutta se ei läpäissyt JSON-/skeemavalidointia
+RATE_LIMITED = "rate_limited"  # 429
+ERROR = "error"  # Muu virhe (aikakatkaisu, tyhjä vastaus, MAX_TOKENS...)
+
+
+class ModelRouter:
+    """
+    Latenssi- ja onnistumistietoinen mallivalinta.
+
+    Pitää liukuvaa tilastoa (vaihe, malli) -pareittain: onnistuneiden kutsujen kesto,
+    validoinnin läpäisyaste ja 429-osuus. Mallit järjestetään odotetun ajan mukaan
+    validiin vastaukseen (mediaanikesto / onnistumisaste):
+
+    1. mallit, joilla on riittävästi havaintoja ja onnistumisaste >= min_success_rate,
+    2. mallit, joista ei vielä ole riittävästi havaintoja (config-järjestyksessä),
+    3. mallit, joiden onnistumisaste on heikko.
+
+    Valinta tehdään aina sallittujen mallien (config.FALLBACK_MODELS) joukosta.
+    """
+
+    def __init__(self, allowed_models=None, window=ROUTER_WINDOW, min_samples=ROUTER_MIN_SAMPLES,
+                 min_success_rate=ROUTER_MIN_SUCCESS_RATE):
+        self.allowed_models = list(FALLBACK_MODELS if allowed_models is None else allowed_models)
+        self.window = window
+        self.min_samples = min_samples
+        self.min_success_rate = min_success_rate
+        self.latency = LatencyStats(window)  # Onnistuneiden kutsujen kestot (myös hedged-pyyntöjen viive)
+        self._outcomes = {}  # (vaihe, malli) -> deque(lopputulokset)
+        self._lock = threading.Lock()
+
+    def record_success(self, phase_id, model_name, seconds):
+        self.latency.record((phase_id, model_name), seconds)
+        self._record(phase_id, model_name, OK)
+
+    def record_failure(self, phase_id, model_name, outcome):
+        self._record(phase_id, model_name, outcome)
+
+    def select(self, phase_id, model_name, critic_model_name=None):
+        """
+        Vaiheen malli: kriitikkoryhmän vaiheet (config.CRITIC_PHASES) käyttävät kriitikkomallia,
+        jos sellainen on annettu. AUTO_MODEL ("auto") ratkaistaan tilastojen perusteella.
+        """
+        if critic_model_name and phase_id in CRITIC_PHASES:
+            model_name = critic_model_name
+        if model_name == AUTO_MODEL:
+            return self.default_model(phase_id)
+        return model_name
+
+    def default_model(self, phase_id):
+        """Vaiheen paras sallittu malli tämänhetkisten tilastojen mukaan."""
+        return self.order(self.allowed_models, phase_id)[0]
+
+    def fallback_chain(self, model_name, phase_id):
+        """Pyydetty malli ensin, sitten muut sallitut mallit paremmuusjärjestyksessä."""
+        if model_name == AUTO_MODEL:
+            return self.order(self.allowed_models, phase_id)
+        return [model_name] + self.order([m for m in self.allowed_models if m != model_name], phase_id)
+
+    def order(self, models, phase_id):
+        ranked = []
+        for position, model in enumerate(models):
+            score = self._score(phase_id, model)
+            ranked.append(((1, position) if score is None else score, position, model))
+        return [model for _, _, model in sorted(ranked)]
+
+    def stats(self, phase_id, model_name):
+        """Liukuvan ikkunan tilastot: havainnot, onnistumis-, validointi- ja 429-asteet sekä p50-kesto."""
+        with self._lock:
+            outcomes = list(self._outcomes.get((phase_id, model_name), ()))
+        samples = len(outcomes)
+        ok = outcomes.count(OK)
+        invalid = outcomes.count(INVALID)
+        return {
+            "samples": samples,
+            "success_rate": round(ok / samples, 3) if samples else None,
+            "validation_pass_rate": round(ok / (ok + invalid), 3) if ok + invalid else None,
+            "rate_limit_rate": round(outcomes.count(RATE_LIMITED) / samples, 3) if samples else None,
+            "p50": self.latency.percentile((phase_id, model_name), 50, 1)
+        }
+
+    def snapshot(self):
+        """Tilastot ja nykyinen järjestys vaiheittain (UI / yhteenvedot)."""
+        with self._lock:
+            keys = sorted(self._outcomes, key=lambda key: (str(key[0]), key[1]))
+        phases = {}
+        for phase_id, model_name in keys:
+            phases.setdefault(phase_id or "muu", {})[model_name] = self.stats(phase_id, model_name)
+        for phase_id in phases:
+            phases[phase_id]["järjestys"] = self.order(self.allowed_models, None if phase_id == "muu" else phase_id)
+        return phases
+
+    # --- Sisäiset apumetodit ---
+
+    def _record(self, phase_id, model_name, outcome):
+        with self._lock:
+            self._outcomes.setdefault((phase_id, model_name), deque(maxlen=self.window)).append(outcome)
+
+    def _score(self, phase_id, model_name):
+        """(taso, odotettu aika validiin vastaukseen) tai None, jos havaintoja on liian vähän."""
+        stats = self.stats(phase_id, model_name)
+        if stats["samples"] < self.min_samples:
+            return None
+        if not stats["success_rate"]:
+            return (2, float("inf"))
+        expected = stats["p50"] / stats["success_rate"]
+        return (0 if stats["success_rate"] >= self.min_success_rate else 2, expected)
@@ -1,40 +1,165 @@
-from config import PHASES
+from config import PHASES, BASE_JSON_KEYS
 import time
 from report_generator import ReportGenerator
 from search_service import SearchService
 from security_validator import SecurityValidator
+from scheduler import PhaseScheduler
+from run_store import RunStore
+from schema_converter import cached_response_schema
+from generation_profiles import generation_profile
+from model_router import ModelRouter
+from telemetry import Telemetry, telemetry_scope
+from spans import span_map
+import asyncio
+import hashlib
+import inspect
 import json
+import re
+import threading
+import uuid
+
+_FILE_PLACEHOLDER = re.compile(r'\{\{FILE:\s*(.*?)\}\}')
 
 class Orchestrator:
     """
     Prosessinohjauskerros: Määrittelee työnkulun ja ketjuttaa datan.
     """
-    def __init__(self, llm_service, data_handler):
+    def __init__(self, llm_service, data_handler, max_workers=4, run_store=None):
         self.llm_service = llm_service
         self.data_handler = data_handler
         self.report_generator = ReportGenerator()
         self.search_service = SearchService()
         self.security_validator = SecurityValidator()
         self.results = {}
+        self.max_workers = max_workers # Rinnakkain ajettavien vaiheiden enimmäismäärä
+        self.phase_timings = {} # phase_id -> {"start", "end", "duration", "worker"}
+        self.last_run_summary = {}
+        self.run_store = run_store or RunStore() # Checkpointit (ks. run_pipeline(run_id=...))
+        self.partial_results = {} # phase_id -> (versio, osittainen tulos) striimauksen aikana
+        self._partial_lock = threading.Lock()
+        self._fallback_router = ModelRouter() # Jos LLM-palvelulla ei ole omaa reititintä (esim. testit)
+        self.last_assessment_id = None # Telemetrian tunniste viimeisimmälle run_pipeline-ajolle
 
     def get_phases(self):
         return PHASES
 
-    def run_phase(self, phase_id, context, model_name, save_dataset=False):
+    def run_phase(self, phase_id, context, model_name, save_dataset=False, llm_options=None):
         """
         Suorittaa yhden vaiheen käyttäen AssessmentContextia.
+        llm_options (dict): ajokohtaiset generate_response-asetukset (cache_bypass, streaming).
         """
+        with telemetry_scope(phase_id=phase_id):
+            return self._run_phase(phase_id, context, model_name, save_dataset, llm_options)
+
+    def _run_phase(self, phase_id, context, model_name, save_dataset=False, llm_options=None):
         # ERIKOISKÄSITTELY: Vaihe 9 (Raportointi) hoidetaan Pythonilla
         if phase_id == "phase_9":
-            result = self.report_generator.generate_report(context)
-            context.add_result("VAIHE 9", result)
-            self.results[phase_id] = result
-            return result
+            return self._run_report_phase(context)
+
+        phase_key, final_prompt, validation_fn, early_result = self._prepare_phase(phase_id, context)
+        if early_result is not None:
+            return early_result
+
+        # Suorita LLM-kutsu
+        try:
+            result = self.llm_service.generate_response(final_prompt, model_name, validation_fn=validation_fn,
+                                                        **self._llm_kwargs(phase_id, llm_options))
+        finally:
+            self._clear_partial(phase_id)
+        return self._finalize_phase(phase_id, phase_key, result, context, save_dataset)
+
+    async def arun_phase(self, phase_id, context, model_name, save_dataset=False, llm_options=None):
+        """
+        Asynkroninen versio run_phase-metodista (käyttää llm_service.agenerate_response).
+        """
+        with telemetry_scope(phase_id=phase_id):
+            return await self._arun_phase(phase_id, context, model_name, save_dataset, llm_options)
+
+    async def _arun_phase(self, phase_id, context, model_name, save_dataset=False, llm_options=None):
+        if phase_id == "phase_9":
+            return self._run_report_phase(context)
+
+        if phase_id == "phase_7" and self.search_service.api_key and self.search_service.cx:
+            # Faktantarkistus tekee estäviä HTTP-kutsuja, joten se ajetaan säikeessä
+            prepared = await asyncio.to_thread(self._prepare_phase, phase_id, context)
+        else:
+            prepared = self._prepare_phase(phase_id, context)
+
+        phase_key, final_prompt, validation_fn, early_result = prepared
+        if early_result is not None:
+            return early_result
+
+        try:
+            result = await self._acall_llm(final_prompt, model_name, validation_fn,
+                                           **self._llm_kwargs(phase_id, llm_options))
+        finally:
+            self._clear_partial(phase_id)
+        return self._finalize_phase(phase_id, phase_key, result, context, save_dataset)
+
+    async def _acall_llm(self, prompt, model_name, validation_fn, **kwargs):
+        """
+        Kutsuu LLM-palvelun async-rajapintaa. Jos palvelulla ei ole sitä (esim. testien
+        mockit tai DummyLLM), sync-kutsu ajetaan säikeessä.
+        """
+        agenerate = getattr(self.llm_service, "agenerate_response", None)
+        if agenerate is not None and inspect.iscoroutinefunction(agenerate):
+            return await agenerate(prompt, model_name, validation_fn=validation_fn, **kwargs)
+        return await asyncio.to_thread(self.llm_service.generate_response, prompt, model_name,
+                                       validation_fn=validation_fn, **kwargs)
+
+    def _llm_kwargs(self, phase_id, llm_options=None):
+        """
+        generate_response-kutsun lisäargumentit: ajokohtaiset asetukset (llm_options) sellaisenaan ja
+        striimattaessa on_partial-callback, joka tallentaa osittaisen tuloksen self.partial_results-
+        taulukkoon. Ilman asetuksia muille palveluille (mockit, DummyLLM) ei välitetä mitään.
+        """
+        kwargs = dict(llm_options or {})
+        if kwargs.get("streaming", getattr(self.llm_service, "streaming", False)) is not True:
+            return kwargs
+
+        def on_partial(partial):
+            with self._partial_lock:
+                version = self.partial_results.get(phase_id, (0, None))[0] + 1
+                self.partial_results[phase_id] = (version, partial)
+        kwargs["on_partial"] = on_partial
+        return kwargs
 
+    def _clear_partial(self, phase_id):
+        with self._partial_lock:
+            self.partial_results.pop(phase_id, None)
+
+    def _progress_tick(self, on_phase_progress):
+        """Rakentaa schedulerin on_tick-callbackin, joka välittää vain muuttuneet osittaiset tulokset."""
+        shown = {}
+
+        def tick():
+            with self._partial_lock:
+                snapshot = dict(self.partial_results)
+            for phase_id, (version, partial) in snapshot.items():
+                if shown.get(phase_id) != version:
+                    shown[phase_id] = version
+                    on_phase_progress(phase_id, partial)
+        return tick
+
+    def _run_report_phase(self, context):
+        """Vaihe 9 (Raportointi) luodaan Pythonilla ilman LLM-kutsua."""
+        result = self.report_generator.generate_report(context)
+        context.add_result("VAIHE 9", result)
+        self.results["phase_9"] = result
+        return result
+
+    def _prepare_phase(self, phase_id, context):
+        """
+        Rakentaa vaiheen kehotteen ja validointifunktion.
+
+        Returns:
+            tuple: (phase_key, final_prompt, validation_fn, early_result). Jos early_result
+            ei ole None, LLM-kutsua ei tehdä ja se palautetaan vaiheen tuloksena.
+        """
         # Etsi vaiheen tiedot
         phase = next((p for p in PHASES if p["id"] == phase_id), None)
         if not phase:
-            return f"VIRHE: Vaihetta {phase_id} ei löydy."
+            return None, None, None, f"VIRHE: Vaihetta {phase_id} ei löydy."
 
         phase_key = phase["phase_key"]
         
@@ -43,7 +168,15 @@ class Orchestrator:
         
         # Tarkista onko vaihe olemassa (build_prompt ei heitä virhettä, mutta tarkistus on hyvä)
         if phase_key not in context.prompt_modules:
-             return f"VAROITUS: Vaihetta '{phase_key}' ei löytynyt kehotteesta."
+             return phase_key, None, None, f"VAROITUS: Vaihetta '{phase_key}' ei löytynyt kehotteesta."
+
+        # Token-budjetti: jos kehote ylittää rajan karsinnankin jälkeen, pitkää epäonnistuvaa kutsua ei tehdä
+        budget = getattr(context, "budgets", {}).get(phase_key)
+        if isinstance(budget, dict) and budget.get("over_limit"):
+            return phase_key, None, None, (
+                f"VIRHE: Vaiheen {phase_key} kehote (~{budget['total']:,} tokenia) ylittää token-rajan "
+                f"({budget['limit']:,}) karsinnan jälkeenkin."
+            )
 
         # --- PYTHON-TURVALLISUUSTARKISTUS (Pre-Phase 1) ---
         if phase_id == "phase_1":
@@ -53,7 +186,7 @@ class Orchestrator:
             # 1. Kriittiset uhkat -> Pysäytä heti
             if security_report["security_threats"]:
                 threats_str = "\n".join(security_report["security_threats"])
-                return json.dumps({
+                return phase_key, None, None, json.dumps({
                     "security_check": {
                         "uhka_havaittu": True,
                         "adversariaalinen_simulaatio_tulos": f"PYTHON-VARTIJA HAVAITSI UHAN:\n{threats_str}",
@@ -141,19 +274,43 @@ class Orchestrator:
                     print(f"SCHEMA VALIDATION FAILED for {phase_id}: Missing keys {missing_keys}")
                     return False
                 return True
+            # Skeeman versio LLM-välimuistin avaimeen: skeeman muutos mitätöi vanhat vastaukset
+            validate_schema.schema_version = hashlib.sha256(
+                json.dumps(phase["schema"], sort_keys=True).encode("utf-8")
+            ).hexdigest()[:16]
+            validate_schema.schema_keys = tuple(required_keys)
+            # Sallitut ylätason avaimet: striimaus keskeytetään heti vieraan avaimen kohdalla. Kehotteiden
+            # BaseJSON-kentät sallitaan aina, koska ilman rakenteista tulostetta malli lisää ne
+            validate_schema.allowed_keys = tuple(dict.fromkeys(required_keys + BASE_JSON_KEYS))
+            # Natiivi rakenteinen tuloste (LLMService lähettää tämän response_schemana)
+            validate_schema.response_schema = cached_response_schema(phase["schema"], validate_schema.schema_version)
+            # Vaiheen token-katto, ajattelubudjetti ja lämpötila (ks. generation_profiles.py)
+            validate_schema.generation_profile = generation_profile(phase)
+            # Kehotteen yhteisen alkuosan pituus (AssessmentContext.cache_layout, LLMService.prompt_cache)
+            validate_schema.cache_prefix_chars = getattr(context, "cache_prefixes", {}).get(phase_key)
             validation_fn = validate_schema
 
-        # Suorita LLM-kutsu
-        result = self.llm_service.generate_response(final_prompt, model_name, validation_fn=validation_fn)
-        
+        return phase_key, final_prompt, validation_fn, None
+
+    def _finalize_phase(self, phase_id, phase_key, result, context, save_dataset=False):
+        """
+        Jälkikäsittelee LLM-vastauksen (puhdistus, placeholderit, aikaleima) ja tallentaa tuloksen.
+        """
         # Puhdista JSON-vastaus (poista "Here is the JSON" -tyyppiset höpinät)
         cleaned_result = self._clean_json_response(result)
         
         # KÄSITTELE PLACEHOLDERIT (VAIHE 1 OPTIMOINTI)
-        # Jos vastaus sisältää {{FILE: ...}}, korvaa se tiedoston sisällöllä
+        # Jos vastaus sisältää {{FILE: ...}}, korvaa se viittauksella tiedoston sisältöön
         if "{{FILE:" in cleaned_result:
             cleaned_result = self._inject_file_content(cleaned_result, context)
 
+        # LÄHDEVIITTAUKSET: {{SPAN: K12}} -> lähdetekstin segmentti sanatarkasti (ks. spans.py)
+        span_report = None
+        if "{{SPAN:" in cleaned_result:
+            cleaned_result, span_report = span_map(context.files).resolve(cleaned_result)
+            if span_report["unknown"]:
+                print(f"VAROITUS: {phase_id}: tuntemattomat lähdeviittaukset {', '.join(span_report['unknown'])}")
+
         # PÄIVITÄ AIKALEIMA (KORJATTU)
         try:
             data = json.loads(cleaned_result)
@@ -161,6 +318,8 @@ class Orchestrator:
                 # Varmista että metadata-objekti on olemassa
                 if "metadata" not in data:
                     data["metadata"] = {}
+                if span_report is not None:
+                    data["metadata"]["lahdeviitteet"] = span_report
                 
                 # Aseta nykyinen aika
                 from datetime import datetime
@@ -179,7 +338,7 @@ class Orchestrator:
         self.results[phase_id] = cleaned_result
         
         if save_dataset:
-            self._save_to_dataset(phase_id, cleaned_result)
+            self._save_to_dataset(phase_id, context.expand_result(cleaned_result))
 
         return cleaned_result
 
@@ -223,126 +382,321 @@ class Orchestrator:
 
     def _inject_file_content(self, text, context):
         """
-        Korvaa {{FILE: tiedostonimi}} -placeholderit tiedoston sisällöllä.
+        Korvaa {{FILE: tiedostonimi}} -placeholderit viittauksella kontekstin tiedostovarastoon
+        ({{BLOB: tiiviste}}, ks. blob_store.py). Tiedoston sisältö liitetään vasta, kun tulos
+        näytetään tai viedään (AssessmentContext.expand_result), joten tulos pysyy kevyenä.
         """
-        import re
-        
-        # Etsi kaikki placeholderit
-        # Oletetaan muoto: "{{FILE: tiedostonimi}}" tai '{{FILE: tiedostonimi}}'
-        pattern = re.compile(r'\{\{FILE:\s*(.*?)\}\}')
-        
         def replace_match(match):
             filename = match.group(1).strip()
-            # Etsi tiedosto kontekstista
-            # context.files on lista (filename, content)
-            for fname, content in context.files:
-                # Yksinkertainen vertailu (voi vaatia tarkempaa logiikkaa jos polkuja)
-                if fname == filename or fname.endswith(filename) or filename in fname:
-                    # JSON-escapeeraus on tärkeää!
-                    # Mutta jos korvaamme suoraan tekstissä, meidän pitää olla varovaisia JSON-rakenteen kanssa.
-                    # Jos placeholder on JSON-stringin sisällä, meidän pitää escapeerata sisältö.
-                    # Tässä oletetaan että placeholder on "value": "{{FILE: ...}}"
-                    # Joten palautamme sisällön JSON-escapeerattuna (mutta ilman lainausmerkkejä, koska ne ovat jo siellä?)
-                    # EI, regex korvaa vain {{FILE: ...}} osan.
-                    # Joten meidän pitää palauttaa sisältö escapeerattuna.
-                    import json
-                    # json.dumps lisää lainausmerkit alkuun ja loppuun, poistetaan ne
-                    escaped_content = json.dumps(content)
-                    if escaped_content.startswith('"') and escaped_content.endswith('"'):
-                        escaped_content = escaped_content[1:-1]
-                    return escaped_content
-            
-            return f"[TIEDOSTOA {filename} EI LÖYTYNYT]"
+            return context.blobs.reference(filename) or f"[TIEDOSTOA {filename} EI LÖYTYNYT]"
+
+        return _FILE_PLACEHOLDER.sub(replace_match, text)
 
-        return pattern.sub(replace_match, text)
+    # Kriitikkoryhmän vaiheet (Red Teaming), joille voidaan valita eri malli
+    def select_model(self, phase_id, model_name, critic_model_name=None):
+        """
+        Valitsee vaiheelle mallin reitittimellä (ks. ModelRouter.select): kriitikkoryhmä
+        (config.CRITIC_PHASES) voi käyttää eri mallia ja "auto" valitsee tilastojen perusteella.
+        """
+        router = getattr(self.llm_service, "router", None)
+        if not isinstance(router, ModelRouter):
+            router = self._fallback_router
+        return router.select(phase_id, model_name, critic_model_name)
 
-    def run_mode(self, mode_name, context, model_name, critic_model_name=None, save_dataset=False):
+    def run_mode(self, mode_name, context, model_name, critic_model_name=None, save_dataset=False, run_id=None,
+                 cache_bypass=None, streaming=None):
         """
         Suorittaa tietyn moodin (A, B tai C).
-        - Moodit A ja B ajetaan yhtenä isona promptina.
-        - Moodi C ajetaan sekventiaalisesti (koska Vaihe 9 on Python-koodia).
+        Vaiheet ajetaan riippuvuusgraafin mukaan (ks. run_pipeline): Moodin B
+        kriitikkovaiheet (4-7) ajetaan rinnakkain, muut moodit etenevät ketjuna.
         """
-        from config import EXECUTION_MODES, PHASES
+        from config import EXECUTION_MODES
         
         if mode_name not in EXECUTION_MODES:
             return f"VIRHE: Tuntematon moodi {mode_name}"
             
         phase_ids = EXECUTION_MODES[mode_name]
-        
-        # KAIKKI MOODIT: Ajetaan vaiheet sekventiaalisesti
-        # Tämä on varmempi tapa välttää token-rajat ja varmistaa että jokainen vaihe saa huomiota.
-        results = {}
-        import json
-        
-        # Jos critic_model_name ei ole annettu, käytä päämallia
-        if not critic_model_name:
-            critic_model_name = model_name
-        
-        for phase_id in phase_ids:
-            # Valitse malli
-            current_model = model_name
-            if phase_id in ["phase_4", "phase_5", "phase_6", "phase_7"]:
-                current_model = critic_model_name
-                
-            result = self.run_phase(phase_id, context, current_model, save_dataset=save_dataset)
-            results[phase_id] = result
-            
-            # EHDOLINEN LOGIIKKA: Jos Vaihe 1 löytää uhan, pysäytä prosessi.
+        return self.run_pipeline(
+            context,
+            model_name,
+            critic_model_name=critic_model_name,
+            phase_ids=phase_ids,
+            save_dataset=save_dataset,
+            run_id=run_id,
+            cache_bypass=cache_bypass,
+            streaming=streaming
+        )
+
+    async def arun_mode(self, mode_name, context, model_name, critic_model_name=None, save_dataset=False, run_id=None,
+                        cache_bypass=None, streaming=None):
+        """
+        Asynkroninen versio run_mode-metodista.
+        """
+        from config import EXECUTION_MODES
+
+        if mode_name not in EXECUTION_MODES:
+            return f"VIRHE: Tuntematon moodi {mode_name}"
+
+        return await self.arun_pipeline(
+            context,
+            model_name,
+            critic_model_name=critic_model_name,
+            phase_ids=EXECUTION_MODES[mode_name],
+            save_dataset=save_dataset,
+            run_id=run_id,
+            cache_bypass=cache_bypass,
+            streaming=streaming
+        )
+
+    def run_pipeline(self, context, model_name, critic_model_name=None, phase_ids=None,
+                     save_dataset=False, max_workers=None, on_phase_complete=None, run_id=None,
+                     on_phase_progress=None, cache_bypass=None, streaming=None):
+        """
+        Suorittaa vaiheet riippuvuusgraafin (PHASE_DEPENDENCIES) mukaisesti.
+        Valmiit vaiheet käynnistetään rinnakkain rajatulla säiepoolilla ja ennen
+        Vaihetta 8 odotetaan kaikkia kriitikkovaiheita.
+
+        Args:
+            phase_ids (list): Ajettavat vaiheet. Oletus: kaikki vaiheet 1-9.
+            max_workers (int): Samanaikaisten vaiheiden enimmäismäärä (oletus self.max_workers).
+            on_phase_complete (callable): (phase_id, result), kutsutaan pääsäikeessä.
+            run_id (str): Jos annettu, valmiit vaiheet tallennetaan checkpointeiksi (RunStore)
+                ja aiemmin tallennetut vaiheet ladataan eikä niitä ajeta uudelleen.
+            on_phase_progress (callable): (phase_id, partial_dict), kutsutaan pääsäikeessä kun
+                striimattu vastaus etenee (vaatii streaming=True tai llm_service.streaming = True).
+            cache_bypass (bool), streaming (bool): tämän ajon LLM-asetukset, välitetään jokaiselle
+                generate_response-kutsulle (None = LLM-palvelun oletus). Jaettua palvelua ei muuteta.
+
+        Returns:
+            dict: phase_id -> tulos. Ajoajat löytyvät self.phase_timings / self.last_run_summary.
+        """
+        if phase_ids is None:
+            phase_ids = [p["id"] for p in PHASES]
+
+        restored, pending_ids, stopped = self._begin_run(phase_ids, context, run_id)
+        if stopped:
+            return restored
+
+        assessment_id = self._start_assessment(run_id)
+        llm_options = self._llm_options(cache_bypass, streaming)
+
+        def run_one(phase_id):
+            current_model = self.select_model(phase_id, model_name, critic_model_name)
+            with telemetry_scope(assessment_id=assessment_id):
+                result = self.run_phase(phase_id, context, current_model, save_dataset=save_dataset,
+                                        llm_options=llm_options)
+            return self._complete_phase(phase_id, result, context, run_id)
+
+        scheduler = PhaseScheduler(max_workers=max_workers or self.max_workers)
+        results = scheduler.run(
+            pending_ids,
+            run_one,
+            on_phase_complete=on_phase_complete,
+            should_stop=self._is_security_stop,
+            on_tick=self._progress_tick(on_phase_progress) if on_phase_progress else None
+        )
+        return self._end_run(phase_ids, restored, results, scheduler)
+
+    async def arun_pipeline(self, context, model_name, critic_model_name=None, phase_ids=None,
+                            save_dataset=False, max_workers=None, on_phase_complete=None, run_id=None,
+                            on_phase_progress=None, cache_bypass=None, streaming=None):
+        """
+        Asynkroninen versio run_pipeline-metodista. Usean arvioinnin vaiheet voidaan pitää
+        käynnissä samassa tapahtumasilmukassa, esim.
+        asyncio.gather(*(Orchestrator(...).arun_pipeline(ctx, model) for ctx in contexts)).
+        """
+        if phase_ids is None:
+            phase_ids = [p["id"] for p in PHASES]
+
+        restored, pending_ids, stopped = self._begin_run(phase_ids, context, run_id)
+        if stopped:
+            return restored
+
+        assessment_id = self._start_assessment(run_id)
+        llm_options = self._llm_options(cache_bypass, streaming)
+
+        async def arun_one(phase_id):
+            current_model = self.select_model(phase_id, model_name, critic_model_name)
+            with telemetry_scope(assessment_id=assessment_id):
+                result = await self.arun_phase(phase_id, context, current_model, save_dataset=save_dataset,
+                                               llm_options=llm_options)
+            return self._complete_phase(phase_id, result, context, run_id)
+
+        scheduler = PhaseScheduler(max_workers=max_workers or self.max_workers)
+        results = await scheduler.arun(
+            pending_ids,
+            arun_one,
+            on_phase_complete=on_phase_complete,
+            should_stop=self._is_security_stop,
+            on_tick=self._progress_tick(on_phase_progress) if on_phase_progress else None
+        )
+        return self._end_run(phase_ids, restored, results, scheduler)
+
+    @staticmethod
+    def _llm_options(cache_bypass, streaming):
+        """Ajokohtaiset LLM-asetukset; vain annetut välitetään (mockit ja DummyLLM eivät tunne niitä)."""
+        return {name: value for name, value in (("cache_bypass", cache_bypass), ("streaming", streaming))
+                if value is not None}
+
+    def _start_assessment(self, run_id):
+        """Telemetrian arviointitunniste: run_id, tai uusi tunniste jos ajoa ei checkpointata."""
+        self.last_assessment_id = run_id or f"arviointi_{uuid.uuid4().hex[:8]}"
+        return self.last_assessment_id
+
+    def get_telemetry(self, assessment_id=None):
+        """
+        Palauttaa arvioinnin LLM-telemetrian (tokenit, ajat, yritykset, fallbackit, hinta) koosteena
+        ja vaiheittain. Oletuksena viimeisin run_pipeline-ajo.
+        """
+        telemetry = getattr(self.llm_service, "telemetry", None)
+        if not isinstance(telemetry, Telemetry):
+            return {}
+        return telemetry.assessment_summary(assessment_id or self.last_assessment_id)
+
+    def _begin_run(self, phase_ids, context, run_id):
+        """
+        Lataa ajon checkpointit (jos run_id annettu) ja palauttaa
+        (palautetut tulokset, ajettavat vaiheet, pysäytetäänkö ajo).
+        """
+        if not run_id:
+            return {}, list(phase_ids), False
+
+        if self.run_store.exists(run_id):
+            restored = {pid: res for pid, res in self.restore_run(run_id, context).items() if pid in phase_ids}
+            print(f"--- CHECKPOINT: Jatketaan ajoa {run_id}, valmiina {list(restored)} ---")
+        else:
+            # Uusi ajo: tallennetaan lähtötiedostot heti
+            restored = {}
+            self.run_store.save_files(run_id, context.files)
+
+        if "phase_1" in restored and self._is_security_stop("phase_1", restored["phase_1"]):
+            restored["STOPPED_EARLY"] = "Turvallisuusuhka havaittu. Prosessi keskeytetty."
+            return restored, [], True
+
+        return restored, [pid for pid in phase_ids if pid not in restored], False
+
+    def _complete_phase(self, phase_id, result, context, run_id):
+        """Vaiheen jälkikäsittely scheduleria varten: pisteytys ja checkpoint."""
+        # LASKENTALOGIIKKA: Vaihe 8 (Pisteytys)
+        if phase_id == "phase_8":
+            result = self._calculate_scores(result, context)
+
+        if run_id and self._is_checkpointable(phase_id, result):
+            phase_key = next((p["phase_key"] for p in PHASES if p["id"] == phase_id), phase_id)
+            entries = {k: context.results[k] for k in (phase_key, phase_id) if k in context.results}
+            self.run_store.save_phase(run_id, phase_id, result, entries)
             if phase_id == "phase_1":
-                try:
-                    data = json.loads(result)
-                    # Tarkista onko uhka havaittu (huomioi boolean tai string "true"/"false")
-                    security = data.get("security_check", {})
-                    uhka = security.get("uhka_havaittu", False)
-                    
-                    if uhka is True or str(uhka).lower() == "true":
-                        print(f"!!! TURVALLISUUSUHKA HAVAITTU VAIHEESSA 1. PYSÄYTETÄÄN PROSESSI. !!!")
-                        # Lisää tieto tuloksiin jotta UI voi näyttää sen
-                        results["STOPPED_EARLY"] = "Turvallisuusuhka havaittu. Prosessi keskeytetty."
-                        break
-                except Exception as e:
-                    print(f"Varoitus: Ei voitu tarkistaa turvallisuusuhkaa JSONista: {e}")
-
-            # LASKENTALOGIIKKA: Vaihe 8 (Pisteytys)
-            if phase_id == "phase_8":
-                try:
-                    data = json.loads(result)
-                    pisteet = data.get("pisteet", {})
-                    
-                    # Hae arvosanat (default 0 jos puuttuu)
-                    s1 = pisteet.get("analyysi_ja_prosessi", {}).get("arvosana", 0)
-                    s2 = pisteet.get("arviointi_ja_argumentaatio", {}).get("arvosana", 0)
-                    s3 = pisteet.get("synteesi_ja_luovuus", {}).get("arvosana", 0)
-                    
-                    # Varmista että ovat numeroita
-                    try:
-                        s1 = int(s1)
-                        s2 = int(s2)
-                        s3 = int(s3)
-                    except:
-                        s1 = s2 = s3 = 0
-                        
-                    total_score = s1 + s2 + s3
-                    average_score = round(total_score / 3, 2)
-                    
-                    # Lisää laskettu data JSONiin
-                    data["python_calculated_scores"] = {
-                        "total": total_score,
-                        "average": average_score,
-                        "breakdown": [s1, s2, s3]
-                    }
-                    
-                    # Päivitä tulos
-                    updated_result = json.dumps(data, indent=2, ensure_ascii=False)
-                    results[phase_id] = updated_result
-                    context.add_result(phase_id, updated_result) # Päivitä myös kontekstiin
-                    
-                    print(f"PYTHON LASKI PISTEET: Yhteensä {total_score}, Keskiarvo {average_score}")
-                    
-                except Exception as e:
-                    print(f"Varoitus: Ei voitu laskea pisteitä JSONista: {e}")
+                # Tallennetaan sanitoidut tiedostot, jotta jatkettu ajo ei käytä raakadataa
+                self.run_store.save_files(run_id, context.files)
+        return result
 
-        return results
+    def _end_run(self, phase_ids, restored, results, scheduler):
+        self.phase_timings = scheduler.timings
+        self.last_run_summary = scheduler.get_timing_summary()
+        print(f"--- AJOAJAT: {self.last_run_summary} ---")
+
+        if not restored:
+            return results
+        merged = {pid: restored.get(pid, results.get(pid)) for pid in phase_ids
+                  if pid in restored or pid in results}
+        if "STOPPED_EARLY" in results:
+            merged["STOPPED_EARLY"] = results["STOPPED_EARLY"]
+        return merged
+
+    def restore_run(self, run_id, context):
+        """
+        Lataa tallennetun ajon kontekstiin: sanitoidut tiedostot ja kaikki valmiit vaiheet.
+        Palauttaa phase_id -> tulos.
+        """
+        if not run_id or not self.run_store.exists(run_id):
+            return {}
+
+        files = self.run_store.load_files(run_id)
+        if files is not None:
+            context.files = files
+
+        restored = {}
+        for phase_id, data in self.run_store.load_phases(run_id).items():
+            for key, value in data.get("context_results", {}).items():
+                context.add_result(key, value)
+            self.results[phase_id] = data["result"]
+            restored[phase_id] = data["result"]
+        return restored
+
+    def _is_checkpointable(self, phase_id, result):
+        """
+        Tallennetaan vain onnistuneet vaiheet: LLM-vaiheiden tuloksen on oltava JSONia,
+        Vaiheen 9 raportti ei saa olla virheilmoitus.
+        """
+        if not result or not isinstance(result, str):
+            return False
+        if phase_id == "phase_9":
+            return not result.startswith("VIRHE")
+        try:
+            return isinstance(json.loads(result), dict)
+        except ValueError:
+            return False
+
+    def _is_security_stop(self, phase_id, result):
+        """
+        EHDOLLINEN LOGIIKKA: Jos Vaihe 1 löytää uhan, prosessi pysäytetään.
+        """
+        if phase_id != "phase_1":
+            return False
+        try:
+            data = json.loads(result)
+            # Tarkista onko uhka havaittu (huomioi boolean tai string "true"/"false")
+            security = data.get("security_check", {})
+            uhka = security.get("uhka_havaittu", False)
+            
+            if uhka is True or str(uhka).lower() == "true":
+                print(f"!!! TURVALLISUUSUHKA HAVAITTU VAIHEESSA 1. PYSÄYTETÄÄN PROSESSI. !!!")
+                return True
+        except Exception as e:
+            print(f"Varoitus: Ei voitu tarkistaa turvallisuusuhkaa JSONista: {e}")
+        return False
+
+    def _calculate_scores(self, result, context):
+        """
+        Laskee Vaiheen 8 pisteiden summan ja keskiarvon Pythonilla ja lisää ne tulokseen.
+        """
+        try:
+            data = json.loads(result)
+            pisteet = data.get("pisteet", {})
+            
+            # Hae arvosanat (default 0 jos puuttuu)
+            s1 = pisteet.get("analyysi_ja_prosessi", {}).get("arvosana", 0)
+            s2 = pisteet.get("arviointi_ja_argumentaatio", {}).get("arvosana", 0)
+            s3 = pisteet.get("synteesi_ja_luovuus", {}).get("arvosana", 0)
+            
+            # Varmista että ovat numeroita
+            try:
+                s1 = int(s1)
+                s2 = int(s2)
+                s3 = int(s3)
+            except:
+                s1 = s2 = s3 = 0
+                
+            total_score = s1 + s2 + s3
+            average_score = round(total_score / 3, 2)
+            
+            # Lisää laskettu data JSONiin
+            data["python_calculated_scores"] = {
+                "total": total_score,
+                "average": average_score,
+                "breakdown": [s1, s2, s3]
+            }
+            
+            # Päivitä tulos
+            updated_result = json.dumps(data, indent=2, ensure_ascii=False)
+            context.add_result("phase_8", updated_result) # Päivitä myös kontekstiin
+            
+            print(f"PYTHON LASKI PISTEET: Yhteensä {total_score}, Keskiarvo {average_score}")
+            return updated_result
+            
+        except Exception as e:
+            print(f"Varoitus: Ei voitu laskea pisteitä JSONista: {e}")
+            return result
 
     def run_agent(self, agent_config, uploaded_files, model_name):
         """
@@ -0,0 +1,92 @@
+import hashlib
+import threading
+import time
+
+from config import PROMPT_CACHE_TTL_SECONDS, PROMPT_CACHE_REFRESH_MARGIN, PROMPT_CACHE_MIN_TOKENS
+
+
+class PromptCache:
+    """
+    Kehotteen alkuosan välimuistikahvat taustapalvelussa (Gemini cached content).
+
+    Kahva tunnistetaan mallin ja alkuosan sisällön tiivisteellä, joten sama kahva palvelee kaikkia
+    kutsuja, joiden kehote alkaa samalla tekstillä: yleiset säännöt (sääntöversio) ja vaiheiden 4-7
+    yhteinen historia (arviointi). Sääntöjen tai historian muutos tuottaa uuden kahvan.
+
+    Kahvan voimassaoloa jatketaan ttl:n verran, kun sitä käytetään alle refresh_margin sekuntia ennen
+    vanhenemista. Vanhentunut kahva luodaan uudelleen. Jos taustapalvelu ei tue välimuistia
+    (create_cache palauttaa None) tai luonti epäonnistuu, alkuosa lähetetään kehotteessa normaalisti.
+    """
+
+    def __init__(self, backend, ttl=PROMPT_CACHE_TTL_SECONDS, refresh_margin=PROMPT_CACHE_REFRESH_MARGIN,
+                 min_tokens=PROMPT_CACHE_MIN_TOKENS, clock=time.time):
+        self.backend = backend
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.min_tokens = min_tokens
+        self.clock = clock
+        self._entries = {} # (malli, tiiviste) -> {"handle": ..., "expires": aikaleima}
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "created": 0, "refreshed": 0, "too_small": 0, "failed": 0}
+
+    def handle(self, model_name, prefix):
+        """Palauttaa alkuosan välimuistikahvan (luo tai jatkaa tarvittaessa) tai None."""
+        if len(prefix) // 4 < self.min_tokens:
+            self._count("too_small")
+            return None
+
+        key = (model_name, hashlib.sha256(prefix.encode("utf-8")).hexdigest())
+        with self._lock:
+            now = self.clock()
+            entry = self._entries.get(key)
+            if entry is not None and entry["expires"] > now:
+                if entry["handle"] is None:
+                    # Luonti epäonnistui äskettäin: ei yritetä joka kutsulla uudelleen
+                    return None
+                if entry["expires"] - now < self.refresh_margin:
+                    self._refresh(entry, now)
+                self.counters["hits"] += 1
+                return entry["handle"]
+
+            # Luonti lukon alla: rinnakkaiset vaiheet (4-7) jakavat saman kahvan eivätkä luo omiaan
+            try:
+                handle = self.backend.create_cache(model_name, prefix, self.ttl)
+            except Exception as e:
+                print(f"VAROITUS: Kehotteen välimuistin luonti epäonnistui ({model_name}): {e}")
+                handle = None
+            self.counters["created" if handle is not None else "failed"] += 1
+            self._entries[key] = {"handle": handle, "expires": now + self.ttl}
+            return handle
+
+    def release(self):
+        """Poistaa kaikki voimassa olevat kahvat taustapalvelusta (esim. arvioinnin lopuksi)."""
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        for entry in entries:
+            if entry["handle"] is None:
+                continue
+            try:
+                self.backend.delete_cache(entry["handle"])
+            except Exception as e:
+                print(f"VAROITUS: Kehotteen välimuistin poisto epäonnistui: {e}")
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, handles=sum(1 for e in self._entries.values() if e["handle"] is not None))
+
+    # --- Sisäiset apumetodit ---
+
+    def _refresh(self, entry, now):
+        try:
+            self.backend.refresh_cache(entry["handle"], self.ttl)
+        except Exception as e:
+            # Kahva on yhä voimassa vanhenemiseen asti; seuraava käyttö yrittää uudelleen
+            print(f"VAROITUS: Kehotteen välimuistin jatkaminen epäonnistui: {e}")
+            return
+        entry["expires"] = now + self.ttl
+        self.counters["refreshed"] += 1
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
@@ -13,14 +13,21 @@ import os
 import json
 import json
 try:
-    from config import PHASES
+    from config import PHASES, INJECT_SCHEMA_EXAMPLES
 except ImportError:
-    from src.config import PHASES
+    from src.config import PHASES, INJECT_SCHEMA_EXAMPLES
+
+# Tunnistaa _post_process_phase-metodin injektoiman esimerkki-JSON-lohkon
+SCHEMA_EXAMPLE_PATTERN = re.compile(
+    r"\n?KÄSKE: \(Esimerkki oikeasta rakenteesta\):\n.*?Käytä vain yllä olevia\.\n?", re.DOTALL
+)
 
 class PromptSplitter:
-    def __init__(self, source_file="Pääarviointikehote.docx"):
+    def __init__(self, source_file="Pääarviointikehote.docx", inject_schema_examples=INJECT_SCHEMA_EXAMPLES):
         self.source_file = source_file
         self.modules = {} # Store modules in memory: {'COMMON_RULES': '...', 'VAIHE 1': '...'}
+        # False = skeema lähetetään response_schemana, joten esimerkki-JSONia ei lisätä kehotteisiin
+        self.inject_schema_examples = inject_schema_examples
         
     def split_document(self):
         """Jakaa dokumentin osiin ja tallentaa ne muistiin."""
@@ -70,7 +77,7 @@ class PromptSplitter:
                 text = text.replace(old, new)
 
         # 2. KAIKKI VAIHEET (paitsi 9): Skeemaesimerkin injektio
-        if phase_number < 9:
+        if phase_number < 9 and self.inject_schema_examples:
             # Etsi oikea vaihe konfiguraatiosta
             phase_config = next((p for p in PHASES if p["id"] == f"phase_{phase_number}"), None)
             
@@ -206,11 +213,24 @@ Sinun TÄYTYY noudattaa tätä rakennetta (huomaa tarkat avaimet!):
                     with open(path, "r", encoding="utf-8") as f:
                         self.modules[f'VAIHE {i}'] = f.read()
             
+            if not self.inject_schema_examples:
+                self.strip_schema_examples()
+
             return len(self.modules) > 0
         except Exception as e:
             print(f"Virhe ladattaessa levyltä: {e}")
             return False
 
+    def strip_schema_examples(self):
+        """
+        Poistaa aiemmin injektoidut esimerkki-JSON-lohkot vaiheista 1-8 (esim. levylle
+        tallennetuista kehotteista), kun rakenne pakotetaan response_schemalla.
+        """
+        for i in range(1, 9):
+            key = f'VAIHE {i}'
+            if key in self.modules:
+                self.modules[key] = SCHEMA_EXAMPLE_PATTERN.sub("\n", self.modules[key])
+
 
 def split_prompt_on_startup(source_file="Pääarviointikehote.docx"):
     """
@@ -0,0 +1,272 @@
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+
+try:
+    import fcntl  # POSIX
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+try:
+    import msvcrt  # Windows
+except ImportError:
+    msvcrt = None
+
+
+class _FileLock:
+    """Prosessien välinen lukko (flock / msvcrt.locking) jaettua tilatiedostoa varten."""
+
+    def __init__(self, path):
+        self.path = f"{path}.lock"
+        self._fh = None
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._fh = open(self.path, "a+")
+        if fcntl:
+            fcntl.flock(self._fh.fileno(), fcntl.LOCK_EX)
+        elif msvcrt:
+            self._fh.seek(0)
+            msvcrt.locking(self._fh.fileno(), msvcrt.LK_LOCK, 1)
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            if fcntl:
+                fcntl.flock(self._fh.fileno(), fcntl.LOCK_UN)
+            elif msvcrt:
+                self._fh.seek(0)
+                msvcrt.locking(self._fh.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self._fh.close()
+            self._fh = None
+
+
+class RateLimiter:
+    """
+    Ennakoiva nopeusrajoitin: token bucket -algoritmi mallikohtaisesti
+    (pyynnöt minuutissa = RPM ja tokenit minuutissa = TPM).
+
+    Kutsuja odottaa kunnes kapasiteettia on, sen sijaan että törmäisi 429-virheeseen.
+    Tila on jaettu säikeiden kesken. Jos state_file on annettu, tila tallennetaan
+    tiedostoon lukon alla, jolloin myös eri prosessit (esim. useampi eräajo) jakavat kiintiön.
+
+    Esim. RateLimiter({"gemini-2.5-flash": {"rpm": 10, "tpm": 250000}})
+    """
+
+    def __init__(self, limits=None, state_file=None, poll_interval=0.5):
+        self.limits = dict(limits or {})
+        self.state_file = state_file
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._state = {}  # Prosessin sisäinen tila (kun state_file puuttuu)
+        self._waiting = {}  # model -> odottavien kutsujen määrä tässä prosessissa
+        self.counters = {"acquired": 0, "waited": 0, "wait_seconds": 0.0, "rate_limited": 0}
+
+    def acquire(self, model_name, tokens=0, timeout=None):
+        """
+        Odottaa (estävästi) kunnes mallilla on kapasiteettia yhdelle pyynnölle ja `tokens` tokenille.
+        Palauttaa odotusajan sekunteina. Heittää TimeoutError jos timeout ylittyy.
+        """
+        started = time.time()
+        self._enter_queue(model_name)
+        try:
+            while True:
+                wait = self._try_acquire(model_name, tokens)
+                if wait <= 0:
+                    return self._finish(started)
+                if timeout is not None and time.time() - started + wait > timeout:
+                    raise TimeoutError(f"Rate limiter: ei kapasiteettia mallille {model_name} ({timeout} s)")
+                time.sleep(min(wait, self.poll_interval))
+        finally:
+            self._leave_queue(model_name)
+
+    async def aacquire(self, model_name, tokens=0, timeout=None):
+        """Asynkroninen versio acquire-metodista (asyncio.sleep)."""
+        started = time.time()
+        self._enter_queue(model_name)
+        try:
+            while True:
+                wait = self._try_acquire(model_name, tokens)
+                if wait <= 0:
+                    return self._finish(started)
+                if timeout is not None and time.time() - started + wait > timeout:
+                    raise TimeoutError(f"Rate limiter: ei kapasiteettia mallille {model_name} ({timeout} s)")
+                await asyncio.sleep(min(wait, self.poll_interval))
+        finally:
+            self._leave_queue(model_name)
+
+    def adjust_tokens(self, model_name, delta_tokens):
+        """
+        Korjaa TPM-arviota toteutuneen käytön mukaan (positiivinen = käytettiin arvioitua enemmän).
+        """
+        if model_name not in self.limits or not delta_tokens:
+            return
+        with self._locked_state() as state:
+            bucket = self._bucket(state, model_name)
+            bucket["tpm"] -= delta_tokens
+
+    def on_rate_limited(self, model_name):
+        """
+        Kutsutaan kun API palautti silti 429:n: tyhjennetään mallin RPM-ämpäri,
+        jotta muut kutsujat odottavat eivätkä törmää samaan rajaan.
+        """
+        with self._lock:
+            self.counters["rate_limited"] += 1
+        if model_name not in self.limits:
+            return
+        with self._locked_state() as state:
+            self._bucket(state, model_name)["rpm"] = 0.0
+
+    def queue_depth(self, model_name=None):
+        """Odottavien kutsujen määrä (mallikohtaisesti tai yhteensä, myös muissa prosesseissa)."""
+        if self.state_file:
+            with self._locked_state() as state:
+                waiting = {m: sum(self._live_waiters(b).values()) for m, b in state.items()}
+        else:
+            with self._lock:
+                waiting = dict(self._waiting)
+        if model_name is not None:
+            return waiting.get(model_name, 0)
+        return sum(waiting.values())
+
+    def stats(self):
+        """Palauttaa laskurit ja jonon pituudet mallikohtaisesti."""
+        return dict(self.counters, queue_depth={m: self.queue_depth(m) for m in self.limits})
+
+    # --- Sisäiset apumetodit ---
+
+    def _finish(self, started):
+        waited = time.time() - started
+        with self._lock:
+            self.counters["acquired"] += 1
+            if waited > 0.01:
+                self.counters["waited"] += 1
+                self.counters["wait_seconds"] = round(self.counters["wait_seconds"] + waited, 3)
+        return waited
+
+    def _try_acquire(self, model_name, tokens):
+        """Yrittää varata kapasiteetin. Palauttaa 0 jos onnistui, muuten arvioidun odotusajan."""
+        limit = self.limits.get(model_name)
+        if not limit:
+            return 0
+
+        with self._locked_state() as state:
+            bucket = self._bucket(state, model_name)
+            # Pyyntö, joka on suurempi kuin koko TPM-ämpäri, ei muuten koskaan mahtuisi
+            tokens = min(tokens, limit.get("tpm", tokens) or tokens)
+
+            waits = []
+            if limit.get("rpm") and bucket["rpm"] < 1:
+                waits.append((1 - bucket["rpm"]) * 60.0 / limit["rpm"])
+            if limit.get("tpm") and bucket["tpm"] < tokens:
+                waits.append((tokens - bucket["tpm"]) * 60.0 / limit["tpm"])
+
+            if waits:
+                return max(waits)
+
+            bucket["rpm"] -= 1
+            bucket["tpm"] -= tokens
+            return 0
+
+    def _bucket(self, state, model_name):
+        """Hakee ja täydentää mallin ämpärit kuluneen ajan mukaan."""
+        limit = self.limits.get(model_name, {})
+        now = time.time()
+        bucket = state.setdefault(model_name, {
+            "rpm": float(limit.get("rpm", 0)),
+            "tpm": float(limit.get("tpm", 0)),
+            "updated": now,
+            "waiting": {}
+        })
+        elapsed = max(0.0, now - bucket["updated"])
+        if limit.get("rpm"):
+            bucket["rpm"] = min(float(limit["rpm"]), bucket["rpm"] + elapsed * limit["rpm"] / 60.0)
+        if limit.get("tpm"):
+            bucket["tpm"] = min(float(limit["tpm"]), bucket["tpm"] + elapsed * limit["tpm"] / 60.0)
+        bucket["updated"] = now
+        return bucket
+
+    def _enter_queue(self, model_name):
+        self._change_waiting(model_name, 1)
+
+    def _leave_queue(self, model_name):
+        self._change_waiting(model_name, -1)
+
+    def _change_waiting(self, model_name, delta):
+        with self._lock:
+            self._waiting[model_name] = max(0, self._waiting.get(model_name, 0) + delta)
+        if self.state_file:
+            with self._locked_state() as state:
+                bucket = self._bucket(state, model_name)
+                pid = str(os.getpid())
+                count = bucket["waiting"].get(pid, 0) + delta
+                if count > 0:
+                    bucket["waiting"][pid] = count
+                else:
+                    bucket["waiting"].pop(pid, None)
+
+    def _live_waiters(self, bucket):
+        """Suodattaa pois kaatuneiden prosessien odottajat."""
+        live = {}
+        for pid, count in bucket.get("waiting", {}).items():
+            try:
+                os.kill(int(pid), 0)
+                live[pid] = count
+            except (OSError, ValueError):
+                continue
+        return live
+
+    def _locked_state(self):
+        return _StateContext(self)
+
+
+class _StateContext:
+    """Lukitsee tilan (säie + tiedosto), lataa sen ja tallentaa muutokset poistuttaessa."""
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+        self._file_lock = _FileLock(limiter.state_file) if limiter.state_file else None
+        self.state = None
+
+    def __enter__(self):
+        self.limiter._lock.acquire()
+        try:
+            if self._file_lock:
+                self._file_lock.__enter__()
+                self.state = self._load()
+            else:
+                self.state = self.limiter._state
+        except Exception:
+            self.limiter._lock.release()
+            raise
+        return self.state
+
+    def __exit__(self, *exc):
+        try:
+            if self._file_lock:
+                try:
+                    self._save()
+                finally:
+                    self._file_lock.__exit__(*exc)
+        finally:
+            self.limiter._lock.release()
+
+    def _load(self):
+        path = self.limiter.state_file
+        if not os.path.exists(path):
+            return {}
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self):
+        path = self.limiter.state_file
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, path)
@@ -0,0 +1,173 @@
+import hashlib
+import json
+import re
+import threading
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+from config import (RETRIEVAL_CHUNK_CHARS, RETRIEVAL_OVERLAP_CHARS, RETRIEVAL_STEM_CHARS, RETRIEVAL_TOP_K,
+                    RETRIEVAL_INDEX_CACHE_SIZE)
+
+_WORD = re.compile(r"\w+")
+
+
+def chunk_text(text, chunk_chars=RETRIEVAL_CHUNK_CHARS, overlap_chars=RETRIEVAL_OVERLAP_CHARS):
+    """
+    Jakaa tekstin limittäisiin segmentteihin [(alku, loppu), ...]. Segmentin raja siirretään
+    lähimpään välilyöntiin tai rivinvaihtoon, jottei sana katkea (jos sellainen löytyy).
+    """
+    spans = []
+    start, length = 0, len(text)
+    while start < length:
+        end = min(length, start + chunk_chars)
+        if end < length:
+            cut = max(text.rfind(" ", start + chunk_chars // 2, end), text.rfind("\n", start + chunk_chars // 2, end))
+            if cut > start:
+                end = cut
+        spans.append((start, end))
+        if end >= length:
+            break
+        next_start = max(end - overlap_chars, start + 1)
+        breaks = [i for i in (text.find(" ", next_start, end), text.find("\n", next_start, end)) if i != -1]
+        start = min(breaks) + 1 if breaks else next_start
+    return spans
+
+
+def terms(text, stem_chars=RETRIEVAL_STEM_CHARS):
+    """
+    Hakutermit: pienaakkoset sanat, joista otetaan stem_chars ensimmäistä merkkiä (karkea
+    suomen taivutuksen normalisointi: "keskustelussa" ja "keskustelun" -> "keskus").
+    """
+    return [word[:stem_chars] for word in _WORD.findall(text.lower()) if len(word) > 1]
+
+
+class RetrievalIndex:
+    """
+    BM25-hakuindeksi tiedostojen segmenteistä (ei ulkoista palvelua).
+
+    Segmenttien termipainot tallennetaan harvana matriisina NumPy-taulukoihin termeittäin
+    (sarakepakattu: term_ptr, segment_ids, weights), joten haku summaa vain kyselyn termien
+    nollasta poikkeavat painot. Segmentin tunniste on muotoa "Tiedosto.pdf#3".
+    """
+
+    def __init__(self, files, chunk_chars=RETRIEVAL_CHUNK_CHARS, overlap_chars=RETRIEVAL_OVERLAP_CHARS,
+                 k1=1.5, b=0.75):
+        self.segments = [] # [{"id", "file", "start", "end", "text"}]
+        for filename, content in files:
+            for n, (start, end) in enumerate(chunk_text(content, chunk_chars, overlap_chars)):
+                self.segments.append({"id": f"{filename}#{n}", "file": filename, "start": start, "end": end,
+                                      "text": content[start:end]})
+
+        self.vocabulary = {}
+        rows, cols, counts = [], [], []
+        lengths = np.zeros(len(self.segments))
+        for row, segment in enumerate(self.segments):
+            segment_terms = terms(segment["text"])
+            lengths[row] = len(segment_terms)
+            for term, count in Counter(segment_terms).items():
+                rows.append(row)
+                cols.append(self.vocabulary.setdefault(term, len(self.vocabulary)))
+                counts.append(count)
+
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        tf = np.asarray(counts, dtype=np.float64)
+        df = np.bincount(cols, minlength=len(self.vocabulary))
+        n = len(self.segments)
+        idf = np.log(1.0 + (n - df + 0.5) / (df + 0.5))
+        avg_length = lengths.mean() if n else 0.0
+        norm = k1 * (1 - b + b * lengths[rows] / avg_length) if avg_length else np.zeros(len(rows))
+        weights = idf[cols] * tf * (k1 + 1) / (tf + norm)
+
+        order = np.argsort(cols, kind="stable")
+        self.term_ptr = np.concatenate(([0], np.cumsum(df)))
+        self.segment_ids = rows[order]
+        self.weights = weights[order]
+
+    def search(self, query, k=RETRIEVAL_TOP_K, files=None):
+        """
+        k parasta segmenttiä kyselylle [(segmentti, pisteet), ...]. files rajaa haun tiedostoihin,
+        joiden nimessä on jokin annetuista osista (kuten AssessmentContext.get_file_content).
+        """
+        scores = np.zeros(len(self.segments))
+        for term, count in Counter(terms(query)).items():
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            postings = slice(self.term_ptr[term_id], self.term_ptr[term_id + 1])
+            # Termin segmentit ovat yksikäsitteisiä, joten indeksoitu lisäys riittää (ei np.add.at)
+            scores[self.segment_ids[postings]] += count * self.weights[postings]
+        if files is not None:
+            parts = [part.lower() for part in files]
+            allowed = np.array([any(p in s["file"].lower() for p in parts) for s in self.segments], dtype=bool)
+            scores[~allowed] = 0.0
+        best = np.argsort(-scores, kind="stable")[:k]
+        return [(self.segments[i], float(scores[i])) for i in best if scores[i] > 0]
+
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def retrieval_index(files):
+    """
+    Tiedostojen hakuindeksi muistitettuna sisältötiivisteiden mukaan: sama tiedostosisältö
+    indeksoidaan kerran, vaikka kehote rakennettaisiin usealle vaiheelle tai arvioinnille.
+    """
+    key = tuple((name, hashlib.sha256(content.encode("utf-8")).hexdigest()) for name, content in files)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is not None:
+            _indexes.move_to_end(key)
+            return index
+    index = RetrievalIndex(files)
+    with _indexes_lock:
+        _indexes[key] = index
+        if len(_indexes) > RETRIEVAL_INDEX_CACHE_SIZE:
+            _indexes.popitem(last=False)
+    return index
+
+
+def hypothesis_queries(phase_2_result):
+    """
+    Hakukyselyt vaiheen 2 tuloksesta {hypoteesin id: kysely}: väitteen teksti sekä sen
+    RAG-todisteiden perusteet ja lainatut segmentit. Palauttaa {} jos tulos ei ole JSONia.
+    """
+    try:
+        data = json.loads(phase_2_result)
+    except (TypeError, ValueError):
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    queries = {}
+    for hypothesis in data.get("hypoteesit") or []:
+        if isinstance(hypothesis, dict) and hypothesis.get("id"):
+            queries[str(hypothesis["id"])] = [str(hypothesis.get("vaite_teksti") or "")]
+    for evidence in data.get("rag_todisteet") or []:
+        if isinstance(evidence, dict) and str(evidence.get("viittaa_hypoteesiin_id")) in queries:
+            queries[str(evidence["viittaa_hypoteesiin_id"])] += [str(evidence.get("perusteet") or ""),
+                                                                 str(evidence.get("konteksti_segmentti") or "")]
+    return {hypothesis_id: " ".join(parts) for hypothesis_id, parts in queries.items()}
+
+
+def retrieve_evidence(index, queries, spans, k=RETRIEVAL_TOP_K, files=None, description=None):
+    """
+    Top-k segmenttiä per hypoteesi tiiviinä JSONina. Osumat esitetään lähdeviittausprotokollan
+    (spans.SpanMap) tunnisteilla: {"kuvaus": description, "otteet": ["[K3] ...[K4] ...", ...],
+    "hypoteesit": {hypoteesin id: ["K3-K5", ...]}}. Päällekkäiset ja usealle hypoteesille osuvat
+    kohdat yhdistetään, joten sama teksti on kehotteessa vain kerran. Palauttaa None, jos osumia ei ole.
+    """
+    all_ids, by_hypothesis = [], {}
+    for hypothesis_id, query in queries.items():
+        ids = []
+        for segment, _ in index.search(query, k=k, files=files):
+            ids += spans.covering(segment["file"], segment["start"], segment["end"])
+        by_hypothesis[hypothesis_id] = spans.compact(ids)
+        all_ids += ids
+    if not all_ids:
+        return None
+    evidence = {"kuvaus": description} if description else {}
+    evidence["otteet"] = [text for _, text in spans.passages(all_ids)]
+    evidence["hypoteesit"] = by_hypothesis
+    return json.dumps(evidence, ensure_ascii=False, separators=(",", ":"))
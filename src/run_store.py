@@ -0,0 +1,111 @@
+import json
+import os
+import threading
+import uuid
+from datetime import datetime
+
+
+class RunStore:
+    """
+    Tallentaa arviointiajon välitulokset levylle (checkpointit), jotta keskeytynyt ajo
+    voidaan jatkaa ensimmäisestä puuttuvasta vaiheesta ilman aiempien LLM-kutsujen uusimista.
+
+    Rakenne:
+        runs/<run_id>/meta.json          -- ajon tiedot (luontiaika, valmiit vaiheet)
+        runs/<run_id>/files.json         -- context.files (Vaiheen 1 jälkeen sanitoituna)
+        runs/<run_id>/phases/<id>.json   -- vaiheen tulos ja sen kontekstiavaimet
+    """
+
+    def __init__(self, base_dir=None):
+        self.base_dir = base_dir or os.path.join(os.getcwd(), "runs")
+        self._lock = threading.Lock()
+
+    def new_run_id(self):
+        """Luo uuden ajotunnuksen (aikaleima + lyhyt satunnaisosa)."""
+        return f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+
+    def run_dir(self, run_id):
+        # Estetään polkujen karkaaminen (run_id tulee mm. käyttöliittymästä)
+        safe_id = os.path.basename(str(run_id).strip())
+        if not safe_id or safe_id in (".", ".."):
+            raise ValueError(f"Virheellinen ajotunnus: {run_id!r}")
+        return os.path.join(self.base_dir, safe_id)
+
+    def exists(self, run_id):
+        return os.path.exists(os.path.join(self.run_dir(run_id), "meta.json"))
+
+    def list_runs(self):
+        """Palauttaa tallennetut ajot uusin ensin."""
+        if not os.path.exists(self.base_dir):
+            return []
+        runs = [r for r in os.listdir(self.base_dir) if self.exists(r)]
+        return sorted(runs, reverse=True)
+
+    def save_files(self, run_id, files):
+        """Tallentaa kontekstin tiedostot (lista (tiedostonimi, sisältö) -pareja)."""
+        self._write_json(os.path.join(self.run_dir(run_id), "files.json"), [list(f) for f in files])
+        self._update_meta(run_id)
+
+    def save_phase(self, run_id, phase_id, result, context_entries):
+        """
+        Tallentaa valmiin vaiheen tuloksen.
+
+        Args:
+            context_entries (dict): Kontekstin tulosavaimet tälle vaiheelle,
+                esim. {"VAIHE 8": "...", "phase_8": "..."}.
+        """
+        path = os.path.join(self.run_dir(run_id), "phases", f"{phase_id}.json")
+        self._write_json(path, {
+            "phase_id": phase_id,
+            "result": result,
+            "context_results": context_entries,
+            "saved_at": datetime.now().isoformat()
+        })
+        self._update_meta(run_id, completed_phase=phase_id)
+
+    def load_files(self, run_id):
+        path = os.path.join(self.run_dir(run_id), "files.json")
+        if not os.path.exists(path):
+            return None
+        return [tuple(f) for f in self._read_json(path)]
+
+    def load_phases(self, run_id):
+        """Palauttaa tallennetut vaiheet: phase_id -> {"result", "context_results", ...}."""
+        phases_dir = os.path.join(self.run_dir(run_id), "phases")
+        if not os.path.exists(phases_dir):
+            return {}
+        phases = {}
+        for fname in sorted(os.listdir(phases_dir)):
+            if fname.endswith(".json"):
+                try:
+                    data = self._read_json(os.path.join(phases_dir, fname))
+                    phases[data["phase_id"]] = data
+                except (ValueError, KeyError) as e:
+                    # Rikkinäinen checkpoint -> vaihe ajetaan uudelleen
+                    print(f"CHECKPOINT VAROITUS: Ohitetaan {fname}: {e}")
+        return phases
+
+    def _update_meta(self, run_id, completed_phase=None):
+        with self._lock:
+            path = os.path.join(self.run_dir(run_id), "meta.json")
+            meta = self._read_json(path) if os.path.exists(path) else {
+                "run_id": run_id,
+                "created_at": datetime.now().isoformat(),
+                "completed_phases": []
+            }
+            if completed_phase and completed_phase not in meta["completed_phases"]:
+                meta["completed_phases"].append(completed_phase)
+            meta["updated_at"] = datetime.now().isoformat()
+            self._write_json(path, meta)
+
+    def _write_json(self, path, data):
+        """Atominen kirjoitus: kirjoitetaan väliaikaistiedostoon ja vaihdetaan paikalleen."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def _read_json(self, path):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
@@ -0,0 +1,234 @@
+import asyncio
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from config import PHASES
+from context import AssessmentContext
+
+
+class PhaseScheduler:
+    """
+    Riippuvuusgraafiin (DAG) perustuva vaiheiden suorittaja.
+
+    Lukee riippuvuudet AssessmentContext.PHASE_DEPENDENCIES -taulukosta ja käynnistää
+    jokaisen vaiheen heti kun sen riippuvuudet ovat valmiita. Esim. Vaiheet 4-7
+    riippuvat vain Vaiheista 1-3, joten ne ajetaan rinnakkain ennen Vaihetta 8.
+    """
+
+    def __init__(self, max_workers=4):
+        self.max_workers = max(1, int(max_workers))
+        self.timings = {}  # phase_id -> {"start", "end", "duration", "worker"}
+        self.errors = {}  # phase_id -> virheilmoitus
+        self._run_started = None
+
+    def build_graph(self, phase_ids):
+        """
+        Rakentaa riippuvuusgraafin annetuille vaiheille (phase_id -> set(phase_id)).
+        Ajojoukon ulkopuoliset riippuvuudet oletetaan jo suoritetuiksi (esim. Moodi B).
+        """
+        key_to_id = {p["phase_key"]: p["id"] for p in PHASES}
+        id_to_key = {p["id"]: p["phase_key"] for p in PHASES}
+
+        graph = {}
+        for phase_id in phase_ids:
+            phase_key = id_to_key.get(phase_id)
+            deps = AssessmentContext.PHASE_DEPENDENCIES.get(phase_key, [])
+            graph[phase_id] = {key_to_id[d] for d in deps if key_to_id.get(d) in phase_ids}
+        return graph
+
+    def run(self, phase_ids, run_fn, on_phase_complete=None, should_stop=None, on_tick=None, tick_interval=0.5):
+        """
+        Suorittaa vaiheet riippuvuusjärjestyksessä rajatulla säiepoolilla.
+
+        Args:
+            phase_ids (list): Suoritettavat vaiheet (esim. ["phase_1", ..., "phase_9"]).
+            run_fn (callable): run_fn(phase_id) -> tulos (str).
+            on_phase_complete (callable): Kutsutaan pääsäikeessä jokaisen vaiheen jälkeen
+                (phase_id, result). Streamlit-päivitykset on tehtävä pääsäikeessä.
+            should_stop (callable): should_stop(phase_id, result) -> bool. Jos True,
+                uusia vaiheita ei enää käynnistetä (esim. Vaiheen 1 turvallisuusuhka).
+            on_tick (callable): Kutsutaan pääsäikeessä tick_interval sekunnin välein vaiheiden
+                ollessa käynnissä (esim. osittaisten tulosten näyttäminen).
+
+        Returns:
+            dict: phase_id -> tulos. Sisältää "STOPPED_EARLY"-avaimen jos ajo keskeytettiin.
+        """
+        graph = self.build_graph(phase_ids)
+        order = {pid: i for i, pid in enumerate(phase_ids)}
+        pending = set(phase_ids)
+        done = set()
+        results = {}
+        stopped = False
+
+        self.timings = {}
+        self.errors = {}
+        self._run_started = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="phase") as pool:
+            running = {}
+
+            while pending or running:
+                # Käynnistä kaikki vaiheet, joiden riippuvuudet ovat valmiit
+                if not stopped:
+                    ready = sorted((pid for pid in pending if graph[pid] <= done), key=order.get)
+                    for phase_id in ready:
+                        pending.discard(phase_id)
+                        running[pool.submit(self._timed_run, phase_id, run_fn)] = phase_id
+
+                if not running:
+                    # Jäljellä olevat vaiheet eivät voi käynnistyä (keskeytys tai epäonnistunut riippuvuus)
+                    break
+
+                finished, _ = wait(running, timeout=tick_interval if on_tick else None,
+                                   return_when=FIRST_COMPLETED)
+                if on_tick:
+                    on_tick()
+                for future in sorted(finished, key=lambda f: order[running[f]]):
+                    phase_id = running.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        self.errors[phase_id] = str(e)
+                        results[phase_id] = f"VIRHE: Vaihe {phase_id} epäonnistui: {e}"
+                        print(f"--- SCHEDULER: {phase_id} epäonnistui: {e} ---")
+                        continue
+
+                    results[phase_id] = result
+                    done.add(phase_id)
+
+                    if on_phase_complete:
+                        on_phase_complete(phase_id, result)
+
+                    if should_stop and should_stop(phase_id, result):
+                        stopped = True
+                        results["STOPPED_EARLY"] = "Turvallisuusuhka havaittu. Prosessi keskeytetty."
+
+        return self._ordered_results(phase_ids, pending, results)
+
+    async def arun(self, phase_ids, arun_fn, on_phase_complete=None, should_stop=None, on_tick=None,
+                   tick_interval=0.5):
+        """
+        Asynkroninen versio run-metodista: vaiheet ovat korutiineja samassa tapahtumasilmukassa.
+        Enintään max_workers vaihetta on käynnissä kerrallaan.
+
+        Args:
+            arun_fn (callable): async arun_fn(phase_id) -> tulos (str).
+            Muut parametrit kuten run-metodissa.
+        """
+        graph = self.build_graph(phase_ids)
+        order = {pid: i for i, pid in enumerate(phase_ids)}
+        pending = set(phase_ids)
+        done = set()
+        results = {}
+        stopped = False
+
+        self.timings = {}
+        self.errors = {}
+        self._run_started = time.perf_counter()
+        running = {}
+
+        while pending or running:
+            if not stopped:
+                ready = sorted((pid for pid in pending if graph[pid] <= done), key=order.get)
+                for phase_id in ready[:self.max_workers - len(running)]:
+                    pending.discard(phase_id)
+                    task = asyncio.ensure_future(self._atimed_run(phase_id, arun_fn))
+                    running[task] = phase_id
+
+            if not running:
+                break
+
+            finished, _ = await asyncio.wait(running, timeout=tick_interval if on_tick else None,
+                                             return_when=asyncio.FIRST_COMPLETED)
+            if on_tick:
+                on_tick()
+            for task in sorted(finished, key=lambda t: order[running[t]]):
+                phase_id = running.pop(task)
+                try:
+                    result = task.result()
+                except Exception as e:
+                    self.errors[phase_id] = str(e)
+                    results[phase_id] = f"VIRHE: Vaihe {phase_id} epäonnistui: {e}"
+                    print(f"--- SCHEDULER: {phase_id} epäonnistui: {e} ---")
+                    continue
+
+                results[phase_id] = result
+                done.add(phase_id)
+
+                if on_phase_complete:
+                    on_phase_complete(phase_id, result)
+
+                if should_stop and should_stop(phase_id, result):
+                    stopped = True
+                    results["STOPPED_EARLY"] = "Turvallisuusuhka havaittu. Prosessi keskeytetty."
+
+        return self._ordered_results(phase_ids, pending, results)
+
+    def _ordered_results(self, phase_ids, pending, results):
+        skipped = [pid for pid in phase_ids if pid in pending]
+        if skipped:
+            print(f"--- SCHEDULER: Ohitettiin vaiheet {skipped} ---")
+
+        # Palautetaan tulokset vaiheiden järjestyksessä (ei valmistumisjärjestyksessä)
+        ordered = {pid: results[pid] for pid in phase_ids if pid in results}
+        if "STOPPED_EARLY" in results:
+            ordered["STOPPED_EARLY"] = results["STOPPED_EARLY"]
+        return ordered
+
+    async def _atimed_run(self, phase_id, arun_fn):
+        start = time.perf_counter()
+        try:
+            return await arun_fn(phase_id)
+        finally:
+            self._record_timing(phase_id, start, time.perf_counter(), "asyncio")
+
+    def _timed_run(self, phase_id, run_fn):
+        """Suorittaa vaiheen ja kirjaa sen alku- ja loppuajan (sekunteina ajon alusta)."""
+        start = time.perf_counter()
+        try:
+            return run_fn(phase_id)
+        finally:
+            self._record_timing(phase_id, start, time.perf_counter(), threading.current_thread().name)
+
+    def _record_timing(self, phase_id, start, end, worker):
+        self.timings[phase_id] = {
+            "start": round(start - self._run_started, 3),
+            "end": round(end - self._run_started, 3),
+            "duration": round(end - start, 3),
+            "worker": worker,
+        }
+
+    def get_timing_summary(self):
+        """
+        Palauttaa yhteenvedon ajoajoista: seinäkelloaika, vaiheiden summa (= sekventiaalinen aika)
+        ja kriittinen polku (pisin riippuvuusketju kestoineen).
+        """
+        if not self.timings:
+            return {"wall_time": 0.0, "sequential_time": 0.0, "critical_path": [], "critical_path_time": 0.0}
+
+        graph = self.build_graph(list(self.timings.keys()))
+        finish = {}
+        prev = {}
+
+        def longest(pid):
+            if pid not in finish:
+                best_dep = max(graph[pid], key=longest, default=None)
+                prev[pid] = best_dep
+                finish[pid] = self.timings[pid]["duration"] + (finish[best_dep] if best_dep else 0.0)
+            return finish[pid]
+
+        # Tasatilanteessa (esim. Vaihe 9 ~0 s) valitaan viimeksi valmistunut vaihe
+        last = max(reversed(list(self.timings)), key=longest)
+        path = []
+        node = last
+        while node:
+            path.append(node)
+            node = prev[node]
+
+        return {
+            "wall_time": round(max(t["end"] for t in self.timings.values()), 3),
+            "sequential_time": round(sum(t["duration"] for t in self.timings.values()), 3),
+            "critical_path": list(reversed(path)),
+            "critical_path_time": round(finish[last], 3),
+        }
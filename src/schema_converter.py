@@ -0,0 +1,53 @@
+import json
+
+
+def to_response_schema(schema):
+    """
+    Muuntaa config.PHASES-skeeman Gemini-rajapinnan response_schema-muotoon (OpenAPI-alijoukko).
+
+    - object: kaikki ominaisuudet merkitään pakollisiksi (required), jotta malli ei jätä avaimia pois.
+    - enum (oma tyyppi, arvot "values"-listassa): string + format "enum".
+    - example: siirretään kuvaukseen (description), jolloin esimerkkiarvo ohjaa mallia
+      vaikka esimerkki-JSONia ei injektoitaisi kehotteeseen.
+    """
+    schema_type = schema.get("type", "string")
+    converted = {}
+
+    if schema_type == "object":
+        properties = schema.get("properties", {})
+        converted["type"] = "object"
+        converted["properties"] = {name: to_response_schema(prop) for name, prop in properties.items()}
+        converted["required"] = list(properties)
+    elif schema_type == "array":
+        converted["type"] = "array"
+        converted["items"] = to_response_schema(schema.get("items", {"type": "string"}))
+    elif schema_type == "enum":
+        converted["type"] = "string"
+        converted["format"] = "enum"
+        converted["enum"] = [str(value) for value in schema.get("values", [])]
+    else:
+        converted["type"] = schema_type
+
+    description = schema.get("description")
+    if schema.get("example") not in (None, "", "...") and schema_type not in ("object", "array", "enum"):
+        example = f"Esimerkki: {json.dumps(schema['example'], ensure_ascii=False)}"
+        description = f"{description} {example}" if description else example
+    if description:
+        converted["description"] = description
+
+    return converted
+
+
+_converted_by_version = {}
+
+
+def cached_response_schema(schema, schema_version):
+    """
+    to_response_schema muistitettuna skeemaversion mukaan. Sama vaihe saa joka ajossa saman
+    dict-olion, jolloin taustapalvelun mallikahva (ks. GeminiBackend.model_handle) löytyy
+    välimuistista eikä skeemaa muunneta uudelleen.
+    """
+    converted = _converted_by_version.get(schema_version)
+    if converted is None:
+        converted = _converted_by_version.setdefault(schema_version, to_response_schema(schema))
+    return converted
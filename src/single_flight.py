@@ -0,0 +1,215 @@
+import asyncio
+import os
+import socket
+import threading
+import time
+
+# Johtajan kutsu keskeytyi (esim. peruttu asyncio-tehtävä): odottajat tekevät työn itse
+_RETRY = object()
+
+
+class _Flight:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = _RETRY
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Samanaikaisten identtisten LLM-pyyntöjen yhdistäminen (single-flight).
+
+    Avain on sama tiiviste kuin LLM-välimuistissa (malli, kehote, generointikonfiguraatio,
+    skeemaversio). Ensimmäinen kutsuja tekee työn ja samaan aikaan saapuvat kaksoiskappaleet
+    odottavat sen tulosta:
+
+    - säikeiden välillä (generate_response) threading.Eventillä,
+    - saman tapahtumasilmukan tehtävien välillä (agenerate_response) asyncio.Futurella,
+    - prosessien välillä, jos lock_dir on annettu: johtaja pitää lukkotiedostoa
+      (<lock_dir>/<avain>.lock, luodaan O_EXCL:llä) ja muut prosessit odottavat sen poistumista.
+      Tulos välittyy prosessilta toiselle jaetun levyvälimuistin kautta (recheck), joten
+      prosessien välinen yhdistäminen on hyödyllinen vain yhteisen LLMCache-kansion kanssa.
+
+    Kaatuneen prosessin lukko tulkitaan vanhentuneeksi, jos prosessia ei enää ole (sama kone)
+    tai lukko on vanhempi kuin stale_after sekuntia.
+    """
+
+    def __init__(self, lock_dir=None, stale_after=900, poll_interval=0.2):
+        self.lock_dir = lock_dir
+        self.stale_after = stale_after
+        self.poll_interval = poll_interval
+        self._flights = {}  # avain -> _Flight
+        self._async_flights = {}  # (silmukka, avain) -> asyncio.Future
+        self._lock = threading.Lock()
+        self.counters = {"leaders": 0, "shared": 0, "shared_across_processes": 0, "stale_locks": 0}
+
+    def do(self, key, fn, recheck=None):
+        """
+        Suorittaa fn():n, ellei sama avain ole jo käynnissä. Palauttaa (tulos, jaettu), jossa
+        jaettu=True tarkoittaa, että tulos saatiin toiselta kutsujalta.
+        recheck() palauttaa toisen prosessin tuottaman tuloksen (esim. välimuistista) tai None.
+        """
+        while True:
+            with self._lock:
+                flight = self._flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._flights[key] = _Flight()
+
+            if not leader:
+                flight.event.wait()
+                if flight.error is not None:
+                    raise flight.error
+                if flight.result is _RETRY:
+                    continue
+                self._count("shared")
+                return flight.result, True
+
+            try:
+                flight.result, shared = self._run_leader(key, fn, recheck)
+                return flight.result, shared
+            except Exception as e:
+                flight.error = e
+                raise
+            finally:
+                with self._lock:
+                    self._flights.pop(key, None)
+                flight.event.set()
+
+    async def ado(self, key, coro_fn, recheck=None):
+        """Asynkroninen versio do-metodista: coro_fn() palauttaa korutiinin."""
+        loop = asyncio.get_running_loop()
+        flight_key = (id(loop), key)
+        while True:
+            with self._lock:
+                future = self._async_flights.get(flight_key)
+                leader = future is None
+                if leader:
+                    future = self._async_flights[flight_key] = loop.create_future()
+
+            if not leader:
+                # shield: odottajan peruminen ei peru johtajan tulosta muilta
+                result = await asyncio.shield(future)
+                if result is _RETRY:
+                    continue
+                self._count("shared")
+                return result, True
+
+            try:
+                result, shared = await self._arun_leader(key, coro_fn, recheck)
+                future.set_result(result)
+                return result, shared
+            except Exception as e:
+                future.set_exception(e)
+                future.exception()  # Merkitään käsitellyksi, vaikka odottajia ei olisi
+                raise
+            except BaseException:
+                future.set_result(_RETRY)
+                raise
+            finally:
+                with self._lock:
+                    self._async_flights.pop(flight_key, None)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, in_flight=len(self._flights) + len(self._async_flights))
+
+    # --- Sisäiset apumetodit ---
+
+    def _run_leader(self, key, fn, recheck):
+        if not self.lock_dir:
+            self._count("leaders")
+            return fn(), False
+        while True:
+            lock_path = self._try_lock(key)
+            if lock_path:
+                try:
+                    # Toinen prosessi on voinut valmistua juuri ennen lukon saamista
+                    result = recheck() if recheck else None
+                    if result is not None:
+                        self._count("shared_across_processes")
+                        return result, True
+                    self._count("leaders")
+                    return fn(), False
+                finally:
+                    self._unlock(lock_path)
+            print(f"--- SINGLE-FLIGHT: odotetaan toisen prosessin pyyntöä ({key[:12]}) ---")
+            while self._is_locked(key):
+                time.sleep(self.poll_interval)
+
+    async def _arun_leader(self, key, coro_fn, recheck):
+        if not self.lock_dir:
+            self._count("leaders")
+            return await coro_fn(), False
+        while True:
+            lock_path = self._try_lock(key)
+            if lock_path:
+                try:
+                    result = recheck() if recheck else None
+                    if result is not None:
+                        self._count("shared_across_processes")
+                        return result, True
+                    self._count("leaders")
+                    return await coro_fn(), False
+                finally:
+                    self._unlock(lock_path)
+            print(f"--- SINGLE-FLIGHT: odotetaan toisen prosessin pyyntöä ({key[:12]}, async) ---")
+            while self._is_locked(key):
+                await asyncio.sleep(self.poll_interval)
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _lock_path(self, key):
+        return os.path.join(self.lock_dir, f"{key}.lock")
+
+    def _try_lock(self, key):
+        """Luo lukkotiedoston atomisesti. Palauttaa polun tai None, jos lukko on jo toisella."""
+        os.makedirs(self.lock_dir, exist_ok=True)
+        path = self._lock_path(key)
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return None
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(f"{socket.gethostname()} {os.getpid()} {time.time()}")
+        return path
+
+    def _unlock(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _is_locked(self, key):
+        """True jos lukko on olemassa eikä vanhentunut (vanhentunut lukko poistetaan)."""
+        path = self._lock_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                host, pid, created = f.read().split()
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError):
+            # Lukkoa kirjoitetaan parhaillaan; katsotaan uudelleen seuraavalla kierroksella
+            return True
+
+        stale = time.time() - float(created) > self.stale_after
+        if not stale and host == socket.gethostname():
+            stale = not _process_alive(int(pid))
+        if stale:
+            print(f"--- SINGLE-FLIGHT: poistetaan vanhentunut lukko ({key[:12]}) ---")
+            self._count("stale_locks")
+            self._unlock(path)
+            return False
+        return True
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
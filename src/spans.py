@@ -0,0 +1,142 @@
+import hashlib
+import json
+import re
+import threading
+from collections import OrderedDict
+
+from config import SPAN_CHARS, RETRIEVAL_INDEX_CACHE_SIZE
+from retrieval import chunk_text
+
+_PLACEHOLDER = re.compile(r"\{\{SPAN:\s*(.*?)\s*\}\}")
+_REFERENCE = re.compile(r"([A-ZÅÄÖ]+)(\d+)(?:\s*-\s*([A-ZÅÄÖ]+)?(\d+))?$")
+
+
+class SpanMap:
+    """
+    Lähdeviittausprotokolla: tiedostot jaetaan peräkkäisiin, limittymättömiin segmentteihin, joilla on
+    lyhyt tunniste (esim. "K12" = Keskusteluhistorian 13. segmentti). Kehotteessa teksti näytetään
+    tunnisteineen ("[K12] ..."), ja malli viittaa lainaukseen placeholderilla {{SPAN: K12}} tai
+    välillä {{SPAN: K12-K14}} kopioimatta tekstiä. resolve korvaa viittaukset alkuperäisellä tekstillä.
+    """
+
+    def __init__(self, files, span_chars=SPAN_CHARS):
+        self.texts = {} # tiedostonimi -> sisältö
+        self.spans = {} # tunniste -> (tiedostonimi, alku, loppu)
+        self.by_file = {} # tiedostonimi -> [(tunniste, alku, loppu)]
+        for (filename, content), prefix in zip(files, _prefixes([name for name, _ in files])):
+            self.texts[filename] = content
+            self.by_file[filename] = []
+            for n, (start, end) in enumerate(chunk_text(content, span_chars, 0)):
+                span_id = f"{prefix}{n}"
+                self.spans[span_id] = (filename, start, end)
+                self.by_file[filename].append((span_id, start, end))
+
+    def labelled(self, filename, start=0, end=None):
+        """Tiedoston teksti (tai sen väli) segmenttitunnisteineen: "[K0] ...[K1] ..."."""
+        end = len(self.texts[filename]) if end is None else end
+        content = self.texts[filename]
+        # Segmentit alkavat välilyönnillä tai rivinvaihdolla (paitsi ensimmäinen), ks. chunk_text
+        return "".join(f"[{span_id}]{'' if content[s:s + 1].isspace() else ' '}{content[s:e]}"
+                       for span_id, s, e in self.by_file[filename] if s < end and e > start)
+
+    def covering(self, filename, start, end):
+        """Segmentit, jotka osuvat tiedoston väliin [alku, loppu)."""
+        return [span_id for span_id, s, e in self.by_file.get(filename, []) if s < end and e > start]
+
+    def compact(self, span_ids):
+        """Peräkkäiset tunnisteet väleiksi (ks. compact_ids)."""
+        return compact_ids(span_ids)
+
+    def passages(self, span_ids):
+        """Tunnisteet yhtenäisinä otteina: (väli "K3-K5", teksti tunnisteineen) tekstijärjestyksessä."""
+        passages = []
+        for reference in compact_ids(span_ids):
+            first, _, last = reference.partition("-")
+            filename, start, _ = self.spans[first]
+            end = self.spans[last or first][2]
+            passages.append((reference, self.labelled(filename, start, end)))
+        return passages
+
+    def resolve(self, text):
+        """
+        Korvaa {{SPAN: ...}}-viittaukset alkuperäisellä tekstillä JSON-escapeerattuna (kuten
+        Orchestrator._inject_file_content). Tuntematon tai virheellinen viittaus korvataan
+        virhemerkinnällä. Palauttaa (teksti, {"resolved": määrä, "unknown": [viittaukset]}).
+        """
+        report = {"resolved": 0, "unknown": []}
+
+        def replace(match):
+            pieces = []
+            for reference in match.group(1).split(","):
+                quoted = self.quote(reference.strip())
+                if quoted is None:
+                    report["unknown"].append(reference.strip())
+                    quoted = f"[LÄHDESEGMENTTIÄ {reference.strip()} EI LÖYTYNYT]"
+                else:
+                    report["resolved"] += 1
+                pieces.append(quoted)
+            return json.dumps(" […] ".join(pieces), ensure_ascii=False)[1:-1]
+
+        return _PLACEHOLDER.sub(replace, text), report
+
+    def quote(self, reference):
+        """Viittauksen ("K12" tai "K12-K14") teksti sanatarkasti lähteestä, tai None."""
+        match = _REFERENCE.match(reference.upper())
+        if not match:
+            return None
+        first = self.spans.get(f"{match.group(1)}{match.group(2)}")
+        if first is None:
+            return None
+        if match.group(4) is None:
+            last = first
+        else:
+            last = self.spans.get(f"{match.group(3) or match.group(1)}{match.group(4)}")
+            if last is None or last[0] != first[0] or last[1] < first[1]:
+                return None
+        return self.texts[first[0]][first[1]:last[2]].strip()
+
+
+def compact_ids(span_ids):
+    """Peräkkäiset tunnisteet väleiksi: ["K3", "K4", "K5", "K9"] -> ["K3-K5", "K9"]."""
+    parsed = [_REFERENCE.match(span_id).groups()[:2] for span_id in span_ids]
+    ranges = []
+    for prefix, number in sorted(set(parsed), key=lambda p: (p[0], int(p[1]))):
+        number = int(number)
+        if ranges and ranges[-1][0] == prefix and ranges[-1][2] == number - 1:
+            ranges[-1][2] = number
+        else:
+            ranges.append([prefix, number, number])
+    return [f"{p}{a}" if a == b else f"{p}{a}-{p}{b}" for p, a, b in ranges]
+
+
+_maps = OrderedDict()
+_maps_lock = threading.Lock()
+
+
+def span_map(files):
+    """SpanMap muistitettuna tiedostojen sisältötiivisteiden mukaan (kuten retrieval.retrieval_index)."""
+    key = tuple((name, hashlib.sha256(content.encode("utf-8")).hexdigest()) for name, content in files)
+    with _maps_lock:
+        spans = _maps.get(key)
+        if spans is not None:
+            _maps.move_to_end(key)
+            return spans
+    spans = SpanMap(files)
+    with _maps_lock:
+        _maps[key] = spans
+        if len(_maps) > RETRIEVAL_INDEX_CACHE_SIZE:
+            _maps.popitem(last=False)
+    return spans
+
+
+def _prefixes(filenames):
+    """Tiedostokohtaiset tunnisteiden alkukirjaimet: Keskusteluhistoria -> K, Lopputuote -> L, ..."""
+    prefixes = []
+    for filename in filenames:
+        letters = "".join(c for c in filename.rsplit(".", 1)[0].upper() if c in "ABCDEFGHIJKLMNOPQRSTUVWXYZÅÄÖ")
+        letters = letters or "T"
+        prefix = next((letters[:n] for n in range(1, len(letters) + 1) if letters[:n] not in prefixes), None)
+        while prefix is None or prefix in prefixes:
+            prefix = (prefix or letters) + "X"
+        prefixes.append(prefix)
+    return prefixes
@@ -0,0 +1,151 @@
+import json
+
+
+class IncrementalJSONParser:
+    """
+    Inkrementaalinen JSON-jäsennin striimattua LLM-vastausta varten.
+
+    Lukee vastauksen paloina (feed) ja seuraa merkkijonotasolla JSON-rakenteen syvyyttä.
+    Näin vastaus voidaan hylätä heti kun se on selvästi virheellinen (esim. ylätason avain,
+    jota vaiheen skeemassa ei ole) ja osittainen tulos voidaan näyttää käyttäjälle jo
+    generoinnin aikana.
+
+    Esim.
+        parser = IncrementalJSONParser(allowed_keys=["hypoteesit"])
+        for chunk in stream:
+            parser.feed(chunk)
+            if parser.error: ...
+            if parser.complete: break
+    """
+
+    # Jos vastauksessa on näin paljon tekstiä ennen ensimmäistä '{'-merkkiä, se hylätään
+    MAX_PREAMBLE_CHARS = 2000
+
+    def __init__(self, allowed_keys=None):
+        self.allowed_keys = set(allowed_keys) if allowed_keys else None
+        self.text = ""
+        self.error = None
+        self.complete = False
+        self.top_level_keys = []
+
+        self._pos = 0
+        self._root_start = None
+        self._root_end = None
+        self._stack = []  # Avoimet säiliöt: '{' tai '['
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._string_is_key = False
+        self._expect_key = False
+        self._safe_end = None  # Kohta, johon asti teksti on suljettavissa validiksi JSONiksi
+        self._safe_stack = None
+        self._partial_cache = (None, None)
+
+    def feed(self, chunk):
+        """Lisää uuden palan ja jäsentää sen. Palauttaa self.error (None jos kaikki kunnossa)."""
+        if not chunk or self.error or self.complete:
+            return self.error
+        self.text += chunk
+        self._scan()
+        return self.error
+
+    def json_text(self):
+        """Palauttaa valmiin JSON-objektin tekstin (tai koko tähänastisen tekstin)."""
+        if self.complete:
+            return self.text[self._root_start:self._root_end]
+        return self.text
+
+    def partial(self):
+        """
+        Palauttaa tähän mennessä vastaanotetun osan sanakirjana (avoimet säiliöt suljettuina)
+        tai None, jos mitään ei voida vielä jäsentää.
+        """
+        if self.complete:
+            end, stack = self._root_end, []
+        elif self._safe_end is None:
+            return None
+        else:
+            end, stack = self._safe_end, self._safe_stack
+
+        cached_end, cached_value = self._partial_cache
+        if cached_end == end:
+            return cached_value
+
+        closing = "".join("}" if c == "{" else "]" for c in reversed(stack))
+        try:
+            value = json.loads(self.text[self._root_start:end] + closing)
+        except ValueError:
+            return cached_value
+        self._partial_cache = (end, value)
+        return value
+
+    # --- Sisäiset apumetodit ---
+
+    def _scan(self):
+        text = self.text
+        while self._pos < len(text) and not self.error and not self.complete:
+            pos = self._pos
+            char = text[pos]
+            self._pos += 1
+
+            if self._root_start is None:
+                if char == "{":
+                    self._root_start = pos
+                    self._open(char, pos)
+                elif pos >= self.MAX_PREAMBLE_CHARS:
+                    self.error = "Vastauksesta ei löytynyt JSON-objektia."
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    self._end_string(pos)
+                continue
+
+            if char == '"':
+                self._in_string = True
+                self._string_start = pos
+                self._string_is_key = bool(self._stack) and self._stack[-1] == "{" and self._expect_key
+            elif char in "{[":
+                self._open(char, pos)
+            elif char in "}]":
+                if self._stack.pop() != ("{" if char == "}" else "["):
+                    self.error = f"Virheellinen JSON-rakenne: odottamaton '{char}'."
+                    break
+                self._expect_key = False
+                if not self._stack:
+                    self.complete = True
+                    self._root_end = pos + 1
+                else:
+                    self._mark_safe(pos + 1)
+            elif char == ",":
+                self._mark_safe(pos)
+                self._expect_key = self._stack[-1] == "{"
+
+    def _open(self, char, pos):
+        self._stack.append(char)
+        self._expect_key = char == "{"
+        self._mark_safe(pos + 1)
+
+    def _end_string(self, pos):
+        if not self._string_is_key:
+            return
+        self._expect_key = False
+        if len(self._stack) != 1:
+            return
+        try:
+            key = json.loads(self.text[self._string_start:pos + 1])
+        except ValueError:
+            self.error = "Virheellinen avain JSON-vastauksessa."
+            return
+        self.top_level_keys.append(key)
+        if self.allowed_keys is not None and key not in self.allowed_keys:
+            self.error = f"Odottamaton ylätason avain '{key}' (sallitut: {sorted(self.allowed_keys)})."
+
+    def _mark_safe(self, end):
+        self._safe_end = end
+        self._safe_stack = list(self._stack)
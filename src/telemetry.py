@@ -0,0 +1,260 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from config import MODEL_PRICING
+
+_scope = contextvars.ContextVar("telemetry_scope", default={})
+
+
+@contextmanager
+def telemetry_scope(**tags):
+    """
+    Liittää tunnisteet (esim. assessment_id, phase_id) kaikkiin tämän lohkon sisällä tehtyihin
+    LLM-kutsuihin. Sisäkkäiset lohkot yhdistetään. Toimii säikeissä ja asyncio-tehtävissä,
+    kunhan lohko avataan samassa säikeessä/tehtävässä kuin kutsu tehdään.
+    """
+    token = _scope.set(dict(_scope.get(), **tags))
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+
+def current_scope():
+    """Palauttaa tämänhetkiset tunnisteet (esim. {"assessment_id": ..., "phase_id": ...})."""
+    return _scope.get()
+
+
+class CallTelemetry:
+    """
+    Yhden generate_response-kutsun mittarit (kaikki yritykset, fallbackit ja korjaukset).
+
+    Päivitykset tehdään lukon alla, ja finish() tallentaa tietueesta kopion. Hedged-pyynnön
+    yrityksillä on omat tietueensa (child): voittaja ja epäonnistuneet yhdistetään kutsuun (merge),
+    ja vasta kutsun jälkeen valmistuva häviäjä kirjataan omana tietueenaan (lost), jotta hedgauksen
+    kustannus näkyy koosteissa.
+    """
+
+    def __init__(self, telemetry, requested_model, prompt_chars):
+        self.telemetry = telemetry
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self.record = dict(
+            _scope.get(),
+            timestamp=time.time(),
+            requested_model=requested_model,
+            model_used=None,
+            prompt_chars=prompt_chars,
+            attempts=0,
+            models_tried=[],
+            prompt_tokens=0,
+            cached_tokens=0,
+            output_tokens=0,
+            cost_usd=0.0,
+            cache_hit=False,
+            repaired=False,
+            deduplicated=False,
+            continuations=0,
+            hedged_to=None,
+            hedge_won=False,
+            status=None,
+            failure_reason=None,
+            errors=[]
+        )
+
+    def attempt(self, model_name):
+        with self._lock:
+            self.record["attempts"] += 1
+            if model_name not in self.record["models_tried"]:
+                self.record["models_tried"].append(model_name)
+
+    def add_usage(self, response, model_name=None):
+        """
+        Lukee token-määrät vastauksen usage_metadata-kentästä ja kasvattaa hinta-arviota.
+        cached_tokens = kehotteen tokenit, jotka luettiin välimuistista (sisältyvät prompt_tokens-määrään).
+        """
+        usage = getattr(response, "usage_metadata", None)
+        tokens = {}
+        for field, key in (("prompt_token_count", "prompt_tokens"), ("cached_content_token_count", "cached_tokens"),
+                           ("candidates_token_count", "output_tokens")):
+            try:
+                tokens[key] = int(getattr(usage, field) or 0)
+            except (AttributeError, TypeError, ValueError):
+                tokens[key] = 0
+        cost = self.telemetry.cost(model_name or self.record["requested_model"], tokens["prompt_tokens"],
+                                   tokens["output_tokens"], tokens["cached_tokens"])
+        with self._lock:
+            for key, count in tokens.items():
+                self.record[key] += count
+            self.record["cost_usd"] = round(self.record["cost_usd"] + cost, 6)
+
+    def continuation(self):
+        """MAX_TOKENS-katkaisun jälkeen lähti jatkopyyntö."""
+        with self._lock:
+            self.record["continuations"] += 1
+
+    def hedge(self, model_name):
+        """Kutsusta lähti rinnakkainen (hedged) pyyntö varamallille."""
+        with self._lock:
+            self.record["hedged_to"] = model_name
+
+    def hedge_won(self):
+        with self._lock:
+            self.record["hedge_won"] = True
+
+    def child(self):
+        """Hedged-pyynnön yhden yrityksen oma tietue (samat tunnisteet kuin kutsulla)."""
+        return CallTelemetry(self.telemetry, self.record["requested_model"], self.record["prompt_chars"])
+
+    def merge(self, other):
+        """Lisää yrityksen (child) yritykset, mallit, tokenit ja hinnan tähän kutsuun."""
+        with other._lock:
+            counts = {key: other.record[key] for key in ("attempts", "prompt_tokens", "cached_tokens",
+                                                         "output_tokens", "cost_usd", "continuations")}
+            models = list(other.record["models_tried"])
+        with self._lock:
+            for key, value in counts.items():
+                self.record[key] += value
+            self.record["cost_usd"] = round(self.record["cost_usd"], 6)
+            for model_name in models:
+                if model_name not in self.record["models_tried"]:
+                    self.record["models_tried"].append(model_name)
+
+    def lost(self):
+        """Hedged-pyynnön häviäjä valmistui: kulutus kirjataan omana tietueenaan (status hedge_lost)."""
+        self.finish("hedge_lost")
+
+    def error(self, error):
+        with self._lock:
+            self.record["errors"].append(str(error)[:300])
+
+    def finish(self, status, model_used=None, cache_hit=False, repaired=False, failure_reason=None,
+               deduplicated=False):
+        with self._lock:
+            self.record.update(
+                status=status,
+                model_used=model_used,
+                cache_hit=cache_hit,
+                repaired=repaired,
+                deduplicated=deduplicated,
+                failure_reason=failure_reason,
+                wall_time=round(time.perf_counter() - self.started, 3),
+                fallbacks=max(0, len(self.record["models_tried"]) - 1),
+                retries=max(0, self.record["attempts"] - 1)
+            )
+            record = dict(self.record, models_tried=list(self.record["models_tried"]),
+                          errors=list(self.record["errors"]))
+        self.telemetry.add(record)
+
+
+class Telemetry:
+    """
+    LLM-kutsujen telemetria: tokenit (usage_metadata), seinäkelloaika, yritykset, todellinen
+    malli fallbackin jälkeen ja epäonnistumisen syy. Koosteet vaiheittain ja arvioinneittain
+    (summary / assessment_summary) sekä vienti JSON lines -muotoon.
+
+    Muistissa pidetään enintään max_records viimeisintä kutsua. Jos jsonl_path on annettu,
+    jokainen kutsu kirjoitetaan myös tiedostoon heti.
+    """
+
+    def __init__(self, jsonl_path=None, max_records=10000, pricing=None):
+        self.jsonl_path = jsonl_path
+        self.pricing = MODEL_PRICING if pricing is None else pricing
+        self._records = deque(maxlen=max_records)
+        self._lock = threading.Lock()
+
+    def start_call(self, requested_model, prompt):
+        return CallTelemetry(self, requested_model, len(prompt or ""))
+
+    def add(self, record):
+        with self._lock:
+            self._records.append(record)
+            if self.jsonl_path:
+                self._append_jsonl(self.jsonl_path, [record])
+
+    def cost(self, model_name, prompt_tokens, output_tokens, cached_tokens=0):
+        """
+        Arvioitu hinta (USD) config.MODEL_PRICING-taulukon mukaan (hinnat / 1M tokenia).
+        Välimuistista luetut kehotetokenit hinnoitellaan cached_input-hinnalla, jos se on annettu.
+        """
+        price = self.pricing.get(model_name)
+        if not price:
+            return 0.0
+        cached_tokens = min(cached_tokens, prompt_tokens)
+        cached_price = price.get("cached_input", price.get("input", 0))
+        return ((prompt_tokens - cached_tokens) / 1e6 * price.get("input", 0) + cached_tokens / 1e6 * cached_price
+                + output_tokens / 1e6 * price.get("output", 0))
+
+    def records(self, **filters):
+        """Palauttaa kutsut, joiden kentät vastaavat suodattimia (esim. assessment_id="ajo_1")."""
+        with self._lock:
+            records = list(self._records)
+        return [r for r in records if all(r.get(k) == v for k, v in filters.items())]
+
+    def summary(self, group_by="phase_id", **filters):
+        """Kooste ryhmittäin (oletus vaiheittain): kutsut, yritykset, tokenit, aika ja hinta."""
+        groups = {}
+        for record in self.records(**filters):
+            key = record.get(group_by) or "muu"
+            groups.setdefault(key, []).append(record)
+        return {key: self._aggregate(records) for key, records in groups.items()}
+
+    def assessment_summary(self, assessment_id):
+        """Yhden arvioinnin kokonaiskulutus ja vaihekohtainen erittely."""
+        records = self.records(assessment_id=assessment_id)
+        return dict(self._aggregate(records), assessment_id=assessment_id,
+                    phases=self.summary("phase_id", assessment_id=assessment_id))
+
+    def export_jsonl(self, path, **filters):
+        """Kirjoittaa kutsut JSON lines -tiedostoon (yksi kutsu per rivi). Palauttaa rivien määrän."""
+        records = self.records(**filters)
+        with self._lock:
+            self._append_jsonl(path, records, mode="w")
+        return len(records)
+
+    # --- Sisäiset apumetodit ---
+
+    def _aggregate(self, records):
+        models = {}
+        failures = {}
+        # Hedged-pyyntöjen häviäjät eivät ole omia kutsujaan, mutta niiden tokenit ja hinta lasketaan mukaan
+        lost = [r for r in records if r.get("status") == "hedge_lost"]
+        calls = [r for r in records if r.get("status") != "hedge_lost"]
+        for r in records:
+            if r.get("model_used"):
+                models[r["model_used"]] = models.get(r["model_used"], 0) + 1
+            if r.get("failure_reason"):
+                failures[r["failure_reason"]] = failures.get(r["failure_reason"], 0) + 1
+        return {
+            "calls": len(calls),
+            "attempts": sum(r["attempts"] for r in records),
+            "retries": sum(r.get("retries", 0) for r in records),
+            "fallbacks": sum(r.get("fallbacks", 0) for r in records),
+            "cache_hits": sum(1 for r in records if r.get("cache_hit")),
+            "repairs": sum(1 for r in records if r.get("repaired")),
+            "deduplicated": sum(1 for r in records if r.get("deduplicated")),
+            "continuations": sum(r.get("continuations", 0) for r in records),
+            "hedges": sum(1 for r in records if r.get("hedged_to")),
+            "hedge_wins": sum(1 for r in records if r.get("hedge_won")),
+            "hedge_losses": len(lost),
+            "hedge_cost_usd": round(sum(r.get("cost_usd", 0) for r in lost), 6),
+            "failed": sum(1 for r in records if r.get("status") == "failed"),
+            "wall_time": round(sum(r.get("wall_time", 0) for r in calls), 3),
+            "prompt_tokens": sum(r["prompt_tokens"] for r in records),
+            "cached_tokens": sum(r.get("cached_tokens", 0) for r in records),
+            "output_tokens": sum(r["output_tokens"] for r in records),
+            "cost_usd": round(sum(r.get("cost_usd", 0) for r in records), 6),
+            "models_used": models,
+            "failure_reasons": failures
+        }
+
+    def _append_jsonl(self, path, records, mode="a"):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, mode, encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
@@ -0,0 +1,90 @@
+import math
+import threading
+
+from config import PROMPT_TOKEN_LIMIT, TOKEN_CALIBRATION_SAMPLE_CHARS
+
+# Kehotteen osiot build_prompt-budjetissa (järjestys = kehotteen järjestys)
+SECTIONS = ("rules", "phase_module", "files", "history", "other")
+
+TRIM_MARKER = "\n[... {removed:,} merkkiä poistettu token-budjetin vuoksi ...]\n"
+
+
+class TokenEstimator:
+    """
+    Token-arvio ennen kutsua (~4 merkkiä / token oletuksena). calibrate() sovittaa merkkiä/token-
+    suhteen rajapinnan count_tokens-tulokseen näytetekstillä: suomenkielinen teksti pilkkoutuu
+    tyypillisesti useammaksi tokeniksi kuin englanti, joten kiinteä 4 aliarvioi.
+    """
+
+    def __init__(self, chars_per_token=4.0):
+        self.chars_per_token = chars_per_token
+        self.calibrated = False
+        self._lock = threading.Lock()
+
+    def estimate(self, text):
+        return self.estimate_chars(len(text) if text else 0)
+
+    def estimate_chars(self, chars):
+        return math.ceil(chars / self.chars_per_token)
+
+    def calibrate(self, count_fn, samples, max_chars=TOKEN_CALIBRATION_SAMPLE_CHARS):
+        """
+        count_fn(teksti) -> tokenit (esim. LLMBackend.count_tokens). Näytteistä käytetään enintään
+        max_chars merkkiä. Palauttaa uuden suhteen tai None, jos laskenta ei onnistunut
+        (arvio jää ennalleen).
+        """
+        sample = "".join(samples)[:max_chars]
+        if not sample:
+            return None
+        try:
+            tokens = count_fn(sample)
+        except Exception as e:
+            print(f"Token-arvion kalibrointi epäonnistui: {e}")
+            return None
+        if not tokens:
+            return None
+        with self._lock:
+            self.chars_per_token = len(sample) / tokens
+            self.calibrated = True
+        print(f"--- Token-arvio kalibroitu: {self.chars_per_token:.2f} merkkiä/token ({len(sample):,} merkin näyte) ---")
+        return self.chars_per_token
+
+
+def new_budget(estimator, section_chars, limit=PROMPT_TOKEN_LIMIT):
+    """
+    Budjetti osioittain osioiden merkkimääristä: {"sections": {osio: tokenit}, "total", "limit",
+    "trimmed", "over_limit"}.
+    """
+    counts = {name: estimator.estimate_chars(section_chars.get(name, 0)) for name in SECTIONS}
+    total = sum(counts.values())
+    return {
+        "sections": counts,
+        "total": total,
+        "limit": limit,
+        "chars_per_token": round(estimator.chars_per_token, 2),
+        "calibrated": estimator.calibrated,
+        "trimmed": [],
+        "over_limit": bool(limit) and total > limit
+    }
+
+
+def head_tail(text, keep_chars):
+    """Lyhentää tekstin säilyttäen alun ja lopun (suurin osa alusta) ja merkitsee poiston."""
+    if len(text) <= keep_chars:
+        return text
+    removed = len(text) - keep_chars
+    head = int(keep_chars * 0.8)
+    return text[:head] + TRIM_MARKER.format(removed=removed) + text[len(text) - (keep_chars - head):]
+
+
+def shrink_items(items, excess_chars):
+    """
+    Lyhentää (nimi, sisältö)-parien sisältöjä suhteessa niiden pituuteen, kunnes yhteensä on
+    poistettu vähintään excess_chars merkkiä. Palauttaa uuden listan.
+    """
+    total = sum(len(content) for _, content in items)
+    if not total or excess_chars <= 0:
+        return list(items)
+    excess_chars += (len(TRIM_MARKER) + 10) * len(items)  # Poistomerkinnät vievät itsekin tilaa
+    keep_ratio = max(0.0, 1 - excess_chars / total)
+    return [(name, head_tail(content, int(len(content) * keep_ratio))) for name, content in items]
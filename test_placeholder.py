@@ -2,14 +2,21 @@ import sys
 import os
 sys.path.append(os.path.join(os.getcwd(), "src"))
 from orchestrator import Orchestrator
+from blob_store import BlobStore
 
-# Mock Context
+# Mock Context (tiedostot tiedostovarastossa, ks. AssessmentContext.blobs / expand_result)
 class MockContext:
     def __init__(self):
         self.files = [
             ("test.pdf", "This is the content of test.pdf with \"quotes\" and \n newlines."),
             ("other.txt", "Simple content")
         ]
+        self.blobs = BlobStore()
+        for filename, content in self.files:
+            self.blobs.put(filename, content)
+
+    def expand_result(self, content):
+        return self.blobs.expand(content)
 
 # Mock Orchestrator (partial)
 class MockOrchestrator(Orchestrator):
@@ -26,14 +33,15 @@ print(f"Input: {json_input}")
 result = orch._inject_file_content(json_input, context)
 print(f"Result: {result}")
 
-if expected_content in result:
+# Tulokseen jää viittaus; sisältö liitetään vasta viennissä
+if "{{BLOB:" in result and expected_content in context.expand_result(result):
     print("SUCCESS: Content injected and escaped.")
 else:
     print("FAILURE: Content mismatch.")
 
 # Test case 2: Multiple files
 json_input_2 = '{"f1": "{{FILE: test.pdf}}", "f2": "{{FILE: other.txt}}"}'
-result_2 = orch._inject_file_content(json_input_2, context)
+result_2 = context.expand_result(orch._inject_file_content(json_input_2, context))
 print(f"Result 2: {result_2}")
 
 if "Simple content" in result_2 and "quotes" in result_2:
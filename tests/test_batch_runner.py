@@ -0,0 +1,125 @@
+import sys
+import os
+import json
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock
+
+# Add src to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from batch_runner import BatchRunner, ModelConcurrencyLimiter, discover_submissions
+from llm_backends import LLMBackend, BackendResponse
+from llm_service import LLMService
+
+
+class TestBatchRunner(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.input_dir = os.path.join(self.tmp_dir, "palautukset")
+        self.output_dir = os.path.join(self.tmp_dir, "tulokset")
+
+        for student, product in [("opiskelija_a", "Hyvä lopputuote."), ("opiskelija_b", "RIKKINAINEN lopputuote.")]:
+            student_dir = os.path.join(self.input_dir, student)
+            os.makedirs(student_dir)
+            for fname, text in [("Keskusteluhistoria.txt", "Opiskelija: Kysymys. Tekoäly: Vastaus. " * 3),
+                                ("Lopputuote.txt", product * 5),
+                                ("Reflektio.txt", "Opin paljon prosessin aikana ja pohdin sitä. " * 3)]:
+                with open(os.path.join(student_dir, fname), "w", encoding="utf-8") as f:
+                    f.write(text)
+
+        response = json.dumps({
+            "data": {},
+            "pisteet": {
+                "analyysi_ja_prosessi": {"arvosana": 3, "perustelu": "..."},
+                "arviointi_ja_argumentaatio": {"arvosana": 3, "perustelu": "..."},
+                "synteesi_ja_luovuus": {"arvosana": 3, "perustelu": "..."}
+            },
+            "security_check": {"uhka_havaittu": False}
+        })
+
+        def fake_response(prompt, model_name, validation_fn=None):
+            if "RIKKINAINEN" in prompt:
+                raise RuntimeError("Simuloitu virhe")
+            return response
+
+        self.mock_llm = MagicMock()
+        self.mock_llm.generate_response.side_effect = fake_response
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_discover_directory(self):
+        submissions = discover_submissions(self.input_dir)
+        self.assertEqual([s["id"] for s in submissions], ["opiskelija_a", "opiskelija_b"])
+        self.assertEqual(set(submissions[0]["files"]), {"keskusteluhistoria", "lopputuote", "reflektiodokumentti"})
+
+    def test_manifest_ids_cannot_escape_output_dir(self):
+        manifest = os.path.join(self.tmp_dir, "manifesti.json")
+        with open(manifest, "w", encoding="utf-8") as f:
+            json.dump([{"id": "../../ulkona", "lopputuote": "a.txt"}, {"lopputuote": "b.txt"}], f)
+        self.assertEqual([s["id"] for s in discover_submissions(manifest)], ["ulkona", "opiskelija_2"])
+
+        with open(manifest, "w", encoding="utf-8") as f:
+            json.dump([{"id": "..", "lopputuote": "a.txt"}], f)
+        with self.assertRaises(ValueError):
+            discover_submissions(manifest)
+
+    def test_batch_survives_single_failure(self):
+        llm = ModelConcurrencyLimiter(self.mock_llm, default_limit=2)
+        runner = BatchRunner(llm, "Säännöt...", {f"VAIHE {i}": f"Ohje {i}" for i in range(1, 10)},
+                             self.output_dir, workers=2)
+        summary = runner.run(discover_submissions(self.input_dir))
+
+        statuses = {s["id"]: s["status"] for s in summary["students"]}
+        self.assertEqual(statuses, {"opiskelija_a": "ok", "opiskelija_b": "failed"})
+        self.assertEqual(summary["completed"], 1)
+        self.assertGreater(summary["assessments_per_hour"], 0)
+
+        student_dir = os.path.join(self.output_dir, "opiskelija_a")
+        self.assertTrue(os.path.exists(os.path.join(student_dir, "raportti.md")))
+        self.assertTrue(os.path.exists(os.path.join(student_dir, "phase_8.json")))
+        self.assertTrue(os.path.exists(os.path.join(self.output_dir, "yhteenveto.json")))
+
+
+class ConcurrencyBackend(LLMBackend):
+    """Kirjaa samanaikaisten kutsujen enimmäismäärän malleittain."""
+
+    name = "concurrency"
+
+    def __init__(self):
+        self.in_flight = {}
+        self.max_in_flight = {}
+        self._lock = threading.Lock()
+
+    def generate(self, model_name, prompt, generation_params, timeout=300, stream=False):
+        with self._lock:
+            self.in_flight[model_name] = self.in_flight.get(model_name, 0) + 1
+            self.max_in_flight[model_name] = max(self.max_in_flight.get(model_name, 0), self.in_flight[model_name])
+        time.sleep(0.05)
+        with self._lock:
+            self.in_flight[model_name] -= 1
+        return BackendResponse('{"tulos": "ok"}')
+
+
+class TestModelConcurrencyLimiter(unittest.TestCase):
+    def test_limit_applies_to_model_actually_called(self):
+        backend = ConcurrencyBackend()
+        llm = ModelConcurrencyLimiter(LLMService(backend=backend), limits={"gemini-2.5-flash": 1}, default_limit=4)
+
+        # "auto" ratkeaa samaksi malliksi kuin suora pyyntö, joten niiden on jaettava sama raja
+        threads = [threading.Thread(target=llm.generate_response, args=(f"kehote {i}", model))
+                   for i, model in enumerate(["auto", "gemini-2.5-flash"] * 2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(backend.max_in_flight, {"gemini-2.5-flash": 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import sys
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+# Add src to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from blob_store import BlobStore, blob_references
+from context import AssessmentContext
+from orchestrator import Orchestrator
+
+CHAT = 'Opiskelija: "Miten rajaan aiheen?"\nTekoäly: Rajaa aineisto vuosiin 2017–2023. ' * 50
+PHASE_1 = ('{"data": {"keskusteluhistoria": "{{FILE: Keskusteluhistoria.pdf}}", '
+           '"lopputuote": "{{FILE: Lopputuote}}", "reflektiodokumentti": "{{FILE: Puuttuva.pdf}}"}}')
+
+
+class TestBlobStore(unittest.TestCase):
+    def test_same_content_is_stored_once(self):
+        store = BlobStore()
+        digest = store.put("Keskusteluhistoria.pdf", CHAT)
+        self.assertEqual(store.put("Kopio.pdf", (CHAT + " ")[:-1]), digest)
+        self.assertEqual(store.stats(), {"blobs": 1, "chars": len(CHAT)})
+        self.assertEqual(store.find("Kopio.pdf"), digest)
+        self.assertEqual(store.find("Keskusteluhistoria"), digest)  # Osa nimestä
+        self.assertIsNone(store.find("Lopputuote.pdf"))
+
+    def test_expand_escapes_content_and_keeps_plain_text(self):
+        store = BlobStore()
+        store.put("Keskusteluhistoria.pdf", CHAT)
+        text = '{"a": "' + store.reference("Keskusteluhistoria.pdf") + '", "b": "{{BLOB: ' + "0" * 64 + '}}"}'
+
+        expanded = store.expand(text)
+        self.assertEqual(json.loads(expanded)["a"], CHAT)
+        self.assertIn("EI LÖYTYNYT", json.loads(expanded)["b"])
+        self.assertEqual(store.expanded_length(text), len(expanded))
+        plain = '{"a": "b"}'
+        self.assertIs(store.expand(plain), plain)
+
+    def test_retain_drops_unreferenced_content(self):
+        store = BlobStore()
+        old = store.put("Lopputuote.pdf", "Raakateksti")
+        new = store.put("Lopputuote.pdf", "Sanitoitu teksti")
+        store.retain({new})
+        self.assertIsNone(store.get(old))
+        self.assertEqual(store.get(store.find("Lopputuote.pdf")), "Sanitoitu teksti")
+
+
+class TestBlobReferences(unittest.TestCase):
+    def setUp(self):
+        self.context = AssessmentContext("Säännöt", {f"VAIHE {i}": f"Ohje {i}" for i in range(1, 10)})
+        self.context.add_file("Keskusteluhistoria.pdf", CHAT)
+        self.context.add_file("Lopputuote.pdf", "Essee.")
+        self.orchestrator = Orchestrator(None, None)
+
+    def test_phase_1_result_keeps_references(self):
+        result = self.orchestrator._finalize_phase("phase_1", "VAIHE 1", PHASE_1, self.context)
+
+        self.assertNotIn(CHAT[:40], result)
+        self.assertEqual(len(blob_references(result)), 2)
+        data = json.loads(self.context.expand_result(result))["data"]
+        self.assertEqual(data["keskusteluhistoria"], CHAT)
+        self.assertEqual(data["lopputuote"], "Essee.")
+        self.assertEqual(data["reflektiodokumentti"], "[TIEDOSTOA Puuttuva.pdf EI LÖYTYNYT]")
+
+    def test_prompt_and_dataset_export_get_file_text(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir, True)
+        with patch("os.getcwd", return_value=tmp_dir):
+            self.orchestrator._finalize_phase("phase_1", "VAIHE 1", PHASE_1, self.context, save_dataset=True)
+        with open(os.path.join(tmp_dir, "dataset", os.listdir(os.path.join(tmp_dir, "dataset"))[0]),
+                  encoding="utf-8") as f:
+            self.assertEqual(json.load(f)["data"]["keskusteluhistoria"], CHAT)
+
+        prompt = self.context.build_prompt("VAIHE 5")
+        self.assertNotIn("{{BLOB:", prompt)
+        self.assertIn(json.dumps(CHAT, ensure_ascii=False)[1:-1], prompt)
+        self.assertGreater(self.context.budgets["VAIHE 5"]["history_unprojected"], len(CHAT) // 4)
+
+    def test_replacing_files_keeps_referenced_content(self):
+        result = self.orchestrator._finalize_phase("phase_1", "VAIHE 1", PHASE_1, self.context)
+        self.context.files = [("Keskusteluhistoria.pdf", "Uusi"), ("Lopputuote.pdf", "Essee.")]
+
+        self.assertEqual(json.loads(self.context.expand_result(result))["data"]["keskusteluhistoria"], CHAT)
+        self.context.results.clear()
+        self.context.files = list(self.context.files)
+        self.assertEqual(self.context.blobs.stats(), {"blobs": 2, "chars": len("Uusi") + len("Essee.")})
+
+
+if __name__ == '__main__':
+    unittest.main()
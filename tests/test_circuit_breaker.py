@@ -0,0 +1,135 @@
+import sys
+import os
+import json
+import unittest
+from unittest.mock import MagicMock, patch
+
+# Add src to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+import circuit_breaker as breaker_module
+import llm_backends
+import llm_service as llm_module
+from circuit_breaker import CircuitBreaker, parse_retry_after, CLOSED, OPEN, HALF_OPEN
+from llm_service import LLMService
+
+
+def fake_response(text):
+    response = MagicMock()
+    response.candidates[0].content.parts = [text]
+    response.text = text
+    return response
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = patch.object(breaker_module.time, "time", self.clock.time)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker(cooldown=60)
+
+    def state(self, model):
+        return self.breaker.snapshot()[model]["state"]
+
+    def test_open_half_open_closed(self):
+        self.breaker.record_failure("m")
+        self.assertEqual(self.state("m"), OPEN)
+        self.assertFalse(self.breaker.allow("m"))
+
+        self.clock.now += 61
+        self.assertTrue(self.breaker.allow("m"))  # koekutsu
+        self.assertEqual(self.state("m"), HALF_OPEN)
+        self.assertFalse(self.breaker.allow("m"))  # vain yksi koekutsu kerrallaan
+
+        self.breaker.record_success("m")
+        self.assertEqual(self.state("m"), CLOSED)
+        self.assertTrue(self.breaker.allow("m"))
+
+    def test_failed_probe_doubles_cooldown(self):
+        self.breaker.record_failure("m")
+        self.clock.now += 61
+        self.assertTrue(self.breaker.allow("m"))
+        self.breaker.record_failure("m")
+
+        snapshot = self.breaker.snapshot()["m"]
+        self.assertEqual(snapshot["state"], OPEN)
+        self.assertEqual(snapshot["cooldown"], 120)
+        self.assertEqual(snapshot["trips"], 2)
+
+    def test_retry_after_sets_cooldown(self):
+        self.breaker.record_failure("m", retry_after=15)
+        self.clock.now += 16
+        self.assertTrue(self.breaker.allow("m"))
+
+    def test_parse_retry_after(self):
+        self.assertEqual(parse_retry_after("429 Quota exceeded. Please retry in 23.5s."), 23.5)
+        self.assertEqual(parse_retry_after("429 ... retry_delay {\n  seconds: 41\n}"), 41)
+        self.assertIsNone(parse_retry_after("500 Internal"))
+
+
+class TestLLMServiceBreaker(unittest.TestCase):
+    def setUp(self):
+        patcher = patch.dict(os.environ, {"GOOGLE_API_KEY": "test-key"})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        genai_patcher = patch.object(llm_backends, "genai")
+        self.genai = genai_patcher.start()
+        self.addCleanup(genai_patcher.stop)
+
+        sleep_patcher = patch.object(llm_module.time, "sleep")
+        sleep_patcher.start()
+        self.addCleanup(sleep_patcher.stop)
+
+        self.clock = FakeClock()
+        clock_patcher = patch.object(breaker_module.time, "time", self.clock.time)
+        clock_patcher.start()
+        self.addCleanup(clock_patcher.stop)
+
+        self.service = LLMService()
+        self.valid = json.dumps({"tulos": "ok"})
+
+    def test_primary_model_restored_after_cooldown(self):
+        quota_error = Exception("429 Quota exceeded. Please retry in 45s.")
+
+        def make_model(name, **kwargs):
+            # Mallikahvat ovat välimuistissa, joten kutsuttu malli kirjataan generate-kutsussa
+            def generate(prompt, **kwargs):
+                self.current_model = name
+                if name == "gemini-2.5-flash" and self.primary_down:
+                    raise quota_error
+                return fake_response(self.valid)
+            model = MagicMock()
+            model.generate_content.side_effect = generate
+            return model
+
+        self.genai.GenerativeModel.side_effect = make_model
+        self.primary_down = True
+
+        self.service.generate_response("kehote", "gemini-2.5-flash")
+        # Pitkä Retry-After: malli hylätään ensimmäisen 429:n jälkeen
+        self.assertEqual(self.current_model, "gemini-2.0-flash")
+        self.assertEqual(self.service.disabled_models, {"gemini-2.5-flash"})
+
+        self.service.generate_response("kehote 2", "gemini-2.5-flash")
+        self.assertEqual(self.current_model, "gemini-2.0-flash")
+
+        # Cooldown kuluu ja kiintiö on palautunut: koekutsu palauttaa päämallin
+        self.clock.now += 46
+        self.primary_down = False
+        self.service.generate_response("kehote 3", "gemini-2.5-flash")
+        self.assertEqual(self.current_model, "gemini-2.5-flash")
+        self.assertEqual(self.service.disabled_models, set())
+
+
+if __name__ == '__main__':
+    unittest.main()
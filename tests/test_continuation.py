@@ -0,0 +1,116 @@
+import sys
+import os
+import json
+import unittest
+from unittest.mock import MagicMock, patch
+
+# Add src to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+import llm_service as llm_module
+from continuation import PARTIAL_MARKER, continuation_prompt, partial_from_prompt, stitch
+from llm_backends import LLMBackend, BackendResponse, SimulatorBackend
+from llm_service import LLMService
+
+
+class ScriptedBackend(LLMBackend):
+    """Palauttaa vastaukset annetussa järjestyksessä ja tallentaa kehotteet ja parametrit."""
+
+    name = "scripted"
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    def generate(self, model_name, prompt, generation_params, timeout=300, stream=False):
+        self.calls.append((prompt, generation_params))
+        text, finish_reason = self.responses.pop(0) if len(self.responses) > 1 else self.responses[0]
+        return BackendResponse(text, finish_reason=finish_reason)
+
+
+class TestStitch(unittest.TestCase):
+    def test_repeated_tail_and_fences_are_removed(self):
+        partial = '{"rag_todisteet": ["Ensimmäinen pitkä todiste", "Toinen todi'
+        continuation = '```json\n"Ensimmäinen pitkä todiste", "Toinen todiste"]}\n```'
+        self.assertEqual(json.loads(stitch(partial, continuation)),
+                         {"rag_todisteet": ["Ensimmäinen pitkä todiste", "Toinen todiste"]})
+
+    def test_short_common_prefix_is_kept(self):
+        self.assertEqual(stitch('{"a": "x', 'x"}'), '{"a": "xx"}')
+
+    def test_prompt_round_trip(self):
+        prompt = continuation_prompt("Alkuperäinen kehote", '{"a": ')
+        self.assertEqual(partial_from_prompt(prompt), ("Alkuperäinen kehote", '{"a": '))
+        self.assertIsNone(partial_from_prompt("Tavallinen kehote"))
+
+
+class TestContinuation(unittest.TestCase):
+    def setUp(self):
+        sleep_patcher = patch.object(llm_module.time, "sleep")
+        sleep_patcher.start()
+        self.addCleanup(sleep_patcher.stop)
+
+        def validate(data):
+            return "tulos" in data
+        validate.response_schema = {"type": "object"}
+        self.validate = validate
+
+    def test_truncated_answer_is_continued(self):
+        backend = ScriptedBackend([('{"tulos": "alku ja ', 2), ('loppu"}', 1)])
+        service = LLMService(backend=backend, repair_model=None)
+
+        result = service.generate_response("kehote", "gemini-2.5-flash", validation_fn=self.validate)
+
+        self.assertEqual(json.loads(result), {"tulos": "alku ja loppu"})
+        self.assertEqual(len(backend.calls), 2)
+        follow_up, params = backend.calls[1]
+        self.assertTrue(follow_up.startswith("kehote"))
+        self.assertIn(PARTIAL_MARKER, follow_up)
+        self.assertEqual(params["response_mime_type"], "text/plain")
+        self.assertNotIn("response_schema", params)
+        self.assertEqual(service.telemetry.records()[-1]["continuations"], 1)
+
+    def test_continuation_reuses_prompt_cache_handle(self):
+        backend = ScriptedBackend([('{"tulos": "alku ja ', 2), ('loppu"}', 1)])
+        service = LLMService(backend=backend, repair_model=None, prompt_cache=MagicMock())
+        service.prompt_cache.handle.return_value = "kahva"
+        self.validate.cache_prefix_chars = len("Yhteiset säännöt. ")
+
+        result = service.generate_response("Yhteiset säännöt. Vaiheen ohje", "gemini-2.5-flash",
+                                           validation_fn=self.validate)
+
+        self.assertEqual(json.loads(result), {"tulos": "alku ja loppu"})
+        follow_up, params = backend.calls[1]
+        self.assertTrue(follow_up.startswith("Vaiheen ohje"))
+        self.assertIn(PARTIAL_MARKER, follow_up)
+        self.assertEqual(params["cached_content"], "kahva")
+        self.assertEqual(params["response_mime_type"], "text/plain")
+        service.prompt_cache.handle.assert_called_once_with("gemini-2.5-flash", "Yhteiset säännöt. ")
+
+    def test_continuations_are_capped(self):
+        backend = ScriptedBackend([('{"tulos": "loputon', 2)])
+        service = LLMService(backend=backend, repair_model=None)
+        service.max_continuations = 2
+
+        result = service.generate_response("kehote", "gemini-2.5-flash", validation_fn=self.validate)
+
+        self.assertIn("EPÄONNISTUIVAT", result)
+        first_prompts = [prompt for prompt, _ in backend.calls if PARTIAL_MARKER not in prompt]
+        self.assertEqual(len(backend.calls), len(first_prompts) * 3)
+
+    def test_simulator_truncation_is_recovered_without_full_retry(self):
+        answer = {"tulos": " ".join(f"sana{i}" for i in range(60))}
+        simulator = SimulatorBackend(time_scale=0, seed=0, truncation_rate=1.0, responses={"*": answer})
+        service = LLMService(backend=simulator, repair_model=None)
+        service.max_continuations = 12  # Simulaattori katkaisee myös jokaisen jatko-osan puoliksi
+
+        result = service.generate_response("kehote", "gemini-2.5-flash", validation_fn=self.validate)
+
+        self.assertEqual(json.loads(result), answer)
+        record = service.telemetry.records()[-1]
+        self.assertEqual(record["attempts"], 1)
+        self.assertGreater(record["continuations"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
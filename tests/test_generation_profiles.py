@@ -0,0 +1,118 @@
+import sys
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+# Add src to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+import llm_backends
+from config import PHASES
+from generation_profiles import derive_profile, generation_profile, observed_output_tokens
+from llm_backends import GeminiBackend, SimulatorBackend
+from llm_service import LLMService
+
+PHASE_1 = next(p for p in PHASES if p["id"] == "phase_1")
+PHASE_2 = next(p for p in PHASES if p["id"] == "phase_2")
+PHASE_5 = next(p for p in PHASES if p["id"] == "phase_5")
+
+
+class TestDerivedProfiles(unittest.TestCase):
+    def setUp(self):
+        self.dataset_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dataset_dir)
+
+    def write(self, name, record):
+        with open(os.path.join(self.dataset_dir, name), "w", encoding="utf-8") as f:
+            json.dump(record, f, ensure_ascii=False)
+
+    def test_observed_lengths_skip_placeholders_and_restore_file_fields(self):
+        self.write("20250101_120000_phase_2.json", {"metadata": {}, "data": {"analysis": "Test analysis"}})
+        self.write("20250101_120001_phase_2.json", {"hypoteesit": ["x" * 4000], "rag_todisteet": []})
+        self.write("20250101_120002_phase_1.json", {
+            "data": {"keskusteluhistoria": "y" * 40000}, "security_check": {"uhka_havaittu": False}
+        })
+
+        observed = observed_output_tokens(self.dataset_dir)
+        self.assertEqual(len(observed["phase_2"]), 1)
+        self.assertGreater(observed["phase_2"][0], 1000)
+        # Tiedoston sisältö on liitetty vastaukseen vasta jälkikäteen: mallin tuotos on lyhyt
+        self.assertLess(observed["phase_1"][0], 100)
+
+    def test_ceiling_follows_observed_length(self):
+        small = derive_profile(PHASE_5)
+        large = derive_profile(PHASE_5, observed_tokens=[1500, 1500, 2000, 3000, 5000])
+        self.assertEqual(large["max_output_tokens"], 10240)
+        self.assertLess(small["max_output_tokens"], large["max_output_tokens"])
+        self.assertEqual(small["thinking_budget"], large["thinking_budget"])
+        self.assertEqual(derive_profile(PHASE_5)["temperature"], 0.5)  # Kriitikkovaihe
+
+    def test_few_observations_and_floors_keep_schema_estimate(self):
+        # Yksittäinen havainto ei muuta kattoa
+        self.assertEqual(derive_profile(PHASE_5, observed_tokens=[5000]), derive_profile(PHASE_5))
+        # Vaiheiden 2 ja 8 katto ei laske aiemman kiinteän rajan alle
+        self.assertEqual(derive_profile(PHASE_2)["max_output_tokens"], 8192)
+
+    def test_config_profiles_cover_schema_phases(self):
+        for phase in PHASES:
+            profile = generation_profile(phase)
+            if phase["id"] in ("phase_2", "phase_8"):
+                self.assertEqual(profile["max_output_tokens"], 8192)
+            elif "schema" in phase:
+                self.assertLess(profile["max_output_tokens"], 8192)
+            else:
+                self.assertEqual(profile["max_output_tokens"], 8192)
+
+
+class TestProfilesInLLMService(unittest.TestCase):
+    def validation_fn(self, profile):
+        def validate(data):
+            return True
+        validate.generation_profile = profile
+        return validate
+
+    def test_thinking_budget_is_added_to_ceiling_for_thinking_models(self):
+        service = LLMService(backend=SimulatorBackend(time_scale=0), repair_model=None)
+        validate = self.validation_fn({"max_output_tokens": 2048, "thinking_budget": 3072, "temperature": 0.2})
+
+        params = service._generation_params(validate, "gemini-2.5-flash")
+        self.assertEqual(params["max_output_tokens"], 5120)
+        self.assertEqual(params["thinking_budget"], 3072)
+        self.assertEqual(params["temperature"], 0.2)
+
+        params = service._generation_params(validate, "gemini-2.0-flash")
+        self.assertEqual(params["max_output_tokens"], 2048)
+        self.assertNotIn("thinking_budget", params)
+        self.assertEqual(service._generation_params(None, "gemini-2.5-flash")["max_output_tokens"], 8192)
+
+        # Taustapalvelu ei rajaa ajattelua (google-generativeai 0.8.x): katto ei laske kiinteän rajan alle
+        with patch.object(service.backend, "supports_thinking_budget", False):
+            self.assertEqual(service._generation_params(validate, "gemini-2.5-flash")["max_output_tokens"], 8192)
+            self.assertEqual(service._generation_params(validate, "gemini-2.0-flash")["max_output_tokens"], 2048)
+
+    def test_simulator_truncates_at_ceiling_and_response_is_continued(self):
+        backend = SimulatorBackend(time_scale=0, thinking_tokens=10000,
+                                   responses={"*": {"teksti": " ".join(f"sana{i}" for i in range(400))}})
+        service = LLMService(backend=backend, repair_model=None, single_flight=None)
+        validate = self.validation_fn({"max_output_tokens": 512, "thinking_budget": 256, "temperature": None})
+
+        result = service.generate_response("kehote", "gemini-2.5-flash", validate)
+        self.assertEqual(len(json.loads(result)["teksti"].split()), 400)
+        self.assertGreaterEqual(backend.stats()["truncated"], 1)
+        self.assertGreaterEqual(service.telemetry.records()[-1]["continuations"], 1)
+
+    def test_gemini_drops_unsupported_thinking_budget(self):
+        with patch.object(llm_backends, "genai"):
+            backend = GeminiBackend(api_key="test")
+        params = {"max_output_tokens": 5120, "thinking_budget": 3072}
+        with patch.object(llm_backends, "GEMINI_SUPPORTS_THINKING", False):
+            self.assertEqual(backend._config_params(params), {"max_output_tokens": 5120})
+        with patch.object(llm_backends, "GEMINI_SUPPORTS_THINKING", True):
+            self.assertEqual(backend._config_params(params)["thinking_config"], {"thinking_budget": 3072})
+
+
+if __name__ == '__main__':
+    unittest.main()
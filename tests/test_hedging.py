@@ -0,0 +1,98 @@
+import sys
+import os
+import asyncio
+import json
+import time
+import unittest
+
+# Add src to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from latency_stats import LatencyStats
+from llm_backends import SimulatorBackend
+from llm_service import LLMService
+from telemetry import telemetry_scope
+
+POLICY = {"phase_2": {"percentile": 90, "min_samples": 3, "default_delay": 0.05, "min_delay": 0.01}}
+
+
+def slow_primary(model_name, prompt):
+    return 2.0 if model_name == "gemini-2.5-flash" else 0.01
+
+
+class TestHedgedRequests(unittest.TestCase):
+    def make_service(self, latency_fn):
+        backend = SimulatorBackend(latency_fn=latency_fn, responses={"*": {"tulos": "ok"}})
+        return LLMService(backend=backend, hedge_policy=POLICY, single_flight=None)
+
+    def test_hedge_wins_when_primary_is_slow(self):
+        service = self.make_service(slow_primary)
+        started = time.perf_counter()
+        with telemetry_scope(phase_id="phase_2"):
+            result = service.generate_response("kehote", "gemini-2.5-flash")
+
+        self.assertEqual(json.loads(result), {"tulos": "ok"})
+        self.assertLess(time.perf_counter() - started, 1.0)
+        self.assertEqual(service.hedge_stats["hedged"], 1)
+        self.assertEqual(service.hedge_stats["hedge_wins"], 1)
+        record = service.telemetry.records(phase_id="phase_2")[-1]
+        self.assertEqual(record["model_used"], "gemini-2.0-flash")
+        self.assertEqual(record["hedged_to"], "gemini-2.0-flash")
+        self.assertTrue(record["hedge_won"])
+
+    def test_loser_usage_is_recorded_separately(self):
+        service = self.make_service(lambda model, prompt: 0.3 if model == "gemini-2.5-flash" else 0.01)
+        with telemetry_scope(phase_id="phase_2"):
+            service.generate_response("kehote", "gemini-2.5-flash")
+
+        deadline = time.time() + 2
+        while not service.telemetry.records(status="hedge_lost") and time.time() < deadline:
+            time.sleep(0.02)
+        lost = service.telemetry.records(status="hedge_lost")
+        self.assertEqual(len(lost), 1)
+        self.assertEqual(lost[0]["models_tried"], ["gemini-2.5-flash"])
+        self.assertGreater(lost[0]["output_tokens"], 0)
+        self.assertEqual(lost[0]["phase_id"], "phase_2")
+
+        summary = service.telemetry.summary()["phase_2"]
+        self.assertEqual((summary["calls"], summary["hedge_losses"]), (1, 1))
+        self.assertEqual(summary["output_tokens"], lost[0]["output_tokens"] + service.telemetry.records(
+            status="ok")[-1]["output_tokens"])
+
+    def test_async_hedge_cancels_loser(self):
+        service = self.make_service(slow_primary)
+
+        async def run():
+            with telemetry_scope(phase_id="phase_2"):
+                return await service.agenerate_response("kehote", "gemini-2.5-flash")
+
+        started = time.perf_counter()
+        self.assertEqual(json.loads(asyncio.run(run())), {"tulos": "ok"})
+        self.assertLess(time.perf_counter() - started, 1.0)
+        self.assertEqual(service.hedge_stats["hedge_wins"], 1)
+
+    def test_no_hedge_for_fast_primary_or_other_phases(self):
+        service = self.make_service(lambda model, prompt: 0.0)
+        with telemetry_scope(phase_id="phase_2"):
+            service.generate_response("kehote", "gemini-2.5-flash")
+        with telemetry_scope(phase_id="phase_3"):
+            service.generate_response("kehote 2", "gemini-2.5-flash")
+
+        self.assertEqual(service.hedge_stats["hedged"], 0)
+        self.assertEqual(len(service.latency.snapshot()), 2)
+
+
+class TestLatencyStats(unittest.TestCase):
+    def test_percentile(self):
+        stats = LatencyStats(window=10)
+        for seconds in range(1, 21):
+            stats.record("malli", float(seconds))
+
+        self.assertIsNone(stats.percentile("muu", 90))
+        self.assertEqual(stats.percentile("malli", 50), 15.0)  # Ikkunassa 11..20
+        self.assertEqual(stats.percentile("malli", 100), 20.0)
+        self.assertIsNone(stats.percentile("malli", 90, min_samples=11))
+
+
+if __name__ == '__main__':
+    unittest.main()
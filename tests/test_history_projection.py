@@ -0,0 +1,64 @@
+import sys
+import os
+import json
+import unittest
+
+# Add src to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from context import AssessmentContext
+from history_projection import project_history, project_result
+
+PHASE_1 = json.dumps({
+    "metadata": {"luontiaika": "2025-11-25T23:23:07"},
+    "metodologinen_loki": "Sanitointi suoritettu.",
+    "data": {"keskusteluhistoria": "Pitkä keskustelu", "lopputuote": "Essee", "reflektiodokumentti": "Pohdinta"},
+    "security_check": {"uhka_havaittu": False, "riski_taso": "MATALA"}
+}, indent=2, ensure_ascii=False)
+
+PHASE_2 = json.dumps({
+    "hypoteesit": [{"id": "Väite-1", "vaite_teksti": "Väite"}],
+    "rag_todisteet": [
+        {"viittaa_hypoteesiin_id": "Väite-1", "perusteet": "Peruste", "konteksti_segmentti": "Lainaus"},
+        {"viittaa_hypoteesiin_id": "Väite-2", "konteksti_segmentti": "Lainaus 2"}
+    ]
+}, indent=2, ensure_ascii=False)
+
+
+class TestHistoryProjection(unittest.TestCase):
+    def test_fields_and_array_items_are_projected(self):
+        projected = json.loads(project_result(PHASE_2, ["hypoteesit", "rag_todisteet.viittaa_hypoteesiin_id",
+                                                        "rag_todisteet.perusteet"]))
+        self.assertEqual(projected["hypoteesit"], [{"id": "Väite-1", "vaite_teksti": "Väite"}])
+        self.assertEqual(projected["rag_todisteet"], [
+            {"viittaa_hypoteesiin_id": "Väite-1", "perusteet": "Peruste"},
+            {"viittaa_hypoteesiin_id": "Väite-2"}
+        ])
+
+    def test_default_drops_bookkeeping_and_minifies(self):
+        projected = project_result(PHASE_1)
+        self.assertNotIn("\n", projected)
+        self.assertNotIn("metadata", json.loads(projected))
+        self.assertNotIn("metodologinen_loki", json.loads(projected))
+        self.assertEqual(project_result("VIRHE: ei JSONia"), "VIRHE: ei JSONia")
+
+    def test_judge_gets_projected_history(self):
+        entries = project_history("VAIHE 8", [("VAIHE 2", PHASE_2), ("VAIHE 1", PHASE_1)])
+        phase_1 = json.loads(entries[1][1])
+        self.assertEqual(set(phase_1["data"]), {"lopputuote", "reflektiodokumentti"})
+        self.assertNotIn("Lainaus", entries[0][1])
+
+    def test_budget_reports_tokens_before_and_after(self):
+        context = AssessmentContext("Säännöt", {"VAIHE 8": "Ohje 8"})
+        context.add_result("VAIHE 1", PHASE_1)
+        context.add_result("VAIHE 2", PHASE_2)
+
+        prompt = context.build_prompt("VAIHE 8")
+        budget = context.budgets["VAIHE 8"]
+        self.assertLess(budget["sections"]["history"], budget["history_unprojected"])
+        self.assertNotIn("Pitkä keskustelu", prompt)
+        self.assertIn('"lopputuote":"Essee"', context.get_history_text("VAIHE 8"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+import sys
+import os
+import asyncio
+import json
+import shutil
+import tempfile
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+# Add src to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+import llm_backends
+import llm_service as llm_module
+from context import AssessmentContext
+from data_handler import DataHandler
+from llm_backends import SimulatorBackend, OpenAICompatibleBackend, create_backend
+from llm_service import LLMService
+from orchestrator import Orchestrator
+from run_store import RunStore
+
+
+class TestSimulatorBackend(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir, True)
+        sleep_patcher = patch.object(llm_module.time, "sleep")
+        sleep_patcher.start()
+        self.addCleanup(sleep_patcher.stop)
+
+    def make_context(self):
+        context = AssessmentContext("Säännöt...", {f"VAIHE {i}": f"Ohje {i}" for i in range(1, 10)})
+        context.add_file("Keskusteluhistoria.pdf", "Opiskelija: Kysymys. Tekoäly: Vastaus. " * 3)
+        context.add_file("Lopputuote.pdf", "Tässä on lopputuote. Se on hyvä ja perusteltu. " * 3)
+        context.add_file("Reflektiodokumentti.pdf", "Opin paljon prosessin aikana ja pohdin sitä. " * 3)
+        return context
+
+    def test_full_pipeline_offline(self):
+        simulator = SimulatorBackend(time_scale=0, seed=1)
+        service = LLMService(backend=simulator)
+        orchestrator = Orchestrator(service, DataHandler(), run_store=RunStore(self.tmp_dir))
+
+        context = self.make_context()
+        results = orchestrator.run_pipeline(context, "gemini-2.5-flash")
+
+        self.assertEqual(list(results), ["phase_%d" % i for i in range(1, 10)])
+        self.assertIn("python_calculated_scores", context.results["phase_8"])
+        self.assertEqual(simulator.stats()["calls"], 8)
+        self.assertGreaterEqual(simulator.stats()["max_concurrency"], 1)
+
+    def test_injected_failures_are_retried(self):
+        simulator = SimulatorBackend(time_scale=0, seed=3, rate_limit_rate=0.3, truncation_rate=0.3,
+                                     responses={"*": {"tulos": "ok"}})
+        service = LLMService(backend=simulator, repair_model=None)
+
+        for i in range(10):
+            result = service.generate_response(f"kehote {i}", "gemini-2.0-flash",
+                                               validation_fn=lambda d: "tulos" in d)
+            self.assertEqual(json.loads(result), {"tulos": "ok"})
+
+        stats = simulator.stats()
+        self.assertGreater(stats["rate_limited"], 0)
+        self.assertGreater(stats["truncated"], 0)
+        self.assertEqual(stats["calls"], 10 + stats["rate_limited"] + stats["truncated"])
+
+    def test_streaming_from_simulator(self):
+        service = LLMService(backend=SimulatorBackend(time_scale=0, chunk_size=5,
+                                                      responses={"*": {"tulos": [1, 2, 3]}}),
+                             streaming=True)
+        partials = []
+        result = service.generate_response("kehote", "gemini-2.0-flash", on_partial=partials.append)
+
+        self.assertEqual(json.loads(result), {"tulos": [1, 2, 3]})
+        self.assertGreater(len(partials), 1)
+
+
+class TestGeminiBackend(unittest.TestCase):
+    def setUp(self):
+        genai_patcher = patch.object(llm_backends, "genai")
+        self.genai = genai_patcher.start()
+        self.addCleanup(genai_patcher.stop)
+
+    def test_model_handles_are_reused(self):
+        backend = llm_backends.GeminiBackend(api_key="test-key", transport="rest")
+        schema = {"type": "object", "properties": {}}
+        params = {"response_mime_type": "application/json", "response_schema": schema}
+
+        for _ in range(3):
+            backend.generate("gemini-2.5-flash", "kehote", dict(params))
+        backend.generate("gemini-2.0-flash", "kehote", dict(params))
+
+        self.genai.configure.assert_called_once_with(api_key="test-key", transport="rest")
+        self.assertEqual(self.genai.GenerativeModel.call_count, 2)
+        self.assertEqual(self.genai.GenerativeModel.return_value.generate_content.call_count, 4)
+
+    def test_grpc_async_client_is_awaited(self):
+        backend = llm_backends.GeminiBackend(api_key="test-key", transport="grpc")
+        model = self.genai.GenerativeModel.return_value
+        model.generate_content_async = AsyncMock(return_value="vastaus")
+
+        result = asyncio.run(backend.agenerate("gemini-2.5-flash", "kehote", {"response_mime_type": "application/json"}))
+
+        # Oletus-gRPC: kirjasto valitsee async-asiakkaalle grpc_asyncio-kanavan itse
+        self.genai.configure.assert_called_once_with(api_key="test-key")
+        self.assertEqual(result, "vastaus")
+        model.generate_content_async.assert_awaited_once_with("kehote", request_options={"timeout": 300},
+                                                              stream=False)
+
+    def test_unknown_transport(self):
+        with self.assertRaises(ValueError):
+            llm_backends.GeminiBackend(api_key="test-key", transport="http3")
+
+
+class TestOpenAICompatibleBackend(unittest.TestCase):
+    def test_chat_completion_is_mapped(self):
+        http_response = MagicMock(status_code=200)
+        http_response.json.return_value = {
+            "choices": [{"message": {"content": '{"tulos": "ok"}'}, "finish_reason": "length"}],
+            "usage": {"prompt_tokens": 12, "completion_tokens": 5}
+        }
+        backend = create_backend("openai", base_url="http://localhost:9999/v1/", model_map={"gemini-2.5-flash": "qwen"})
+
+        with patch.object(llm_backends.requests.Session, "post", return_value=http_response) as post:
+            response = backend.generate("gemini-2.5-flash", "kehote",
+                                        {"max_output_tokens": 100, "response_mime_type": "application/json"})
+
+        self.assertEqual(post.call_args.args[0], "http://localhost:9999/v1/chat/completions")
+        payload = post.call_args.kwargs["json"]
+        self.assertEqual(payload["model"], "qwen")
+        self.assertEqual(payload["max_tokens"], 100)
+        self.assertEqual(response.text, '{"tulos": "ok"}')
+        self.assertEqual(response.candidates[0].finish_reason, 2)
+        self.assertEqual(response.usage_metadata.prompt_token_count, 12)
+
+    def test_rate_limit_is_reported_as_429(self):
+        http_response = MagicMock(status_code=429, headers={"Retry-After": "7"})
+        backend = OpenAICompatibleBackend("http://localhost:9999/v1")
+
+        with patch.object(llm_backends.requests.Session, "post", return_value=http_response):
+            with self.assertRaisesRegex(RuntimeError, "429.*Retry-After: 7"):
+                backend.generate("malli", "kehote", {})
+
+
+if __name__ == '__main__':
+    unittest.main()
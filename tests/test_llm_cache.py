@@ -0,0 +1,79 @@
+import sys
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+# Add src to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from llm_cache import LLMCache
+
+
+class TestLLMCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def test_key_depends_on_all_parts(self):
+        base = LLMCache.make_key("gemini-2.5-flash", "kehote", {"max_output_tokens": 8192}, "v1")
+        self.assertEqual(base, LLMCache.make_key("gemini-2.5-flash", "kehote", {"max_output_tokens": 8192}, "v1"))
+        self.assertNotEqual(base, LLMCache.make_key("gemini-2.0-flash", "kehote", {"max_output_tokens": 8192}, "v1"))
+        self.assertNotEqual(base, LLMCache.make_key("gemini-2.5-flash", "kehote!", {"max_output_tokens": 8192}, "v1"))
+        self.assertNotEqual(base, LLMCache.make_key("gemini-2.5-flash", "kehote", {"max_output_tokens": 1024}, "v1"))
+        self.assertNotEqual(base, LLMCache.make_key("gemini-2.5-flash", "kehote", {"max_output_tokens": 8192}, "v2"))
+
+    def test_memory_and_disk_hits(self):
+        cache = LLMCache(self.cache_dir)
+        cache.put("a" * 64, '{"x": 1}')
+        self.assertEqual(cache.get("a" * 64), '{"x": 1}')
+
+        # Uusi instanssi (esim. Streamlit-uudelleenajo) löytää vastauksen levyltä
+        fresh = LLMCache(self.cache_dir)
+        self.assertEqual(fresh.get("a" * 64), '{"x": 1}')
+        self.assertIsNone(fresh.get("b" * 64))
+        stats = fresh.stats()
+        self.assertEqual((stats["disk_hits"], stats["misses"]), (1, 1))
+
+    def test_bypass(self):
+        cache = LLMCache(self.cache_dir)
+        cache.put("a" * 64, "vastaus")
+        self.assertIsNone(cache.get("a" * 64, bypass=True))
+        cache.put("c" * 64, "vastaus", bypass=True)
+        self.assertIsNone(cache.get("c" * 64))
+        self.assertEqual(cache.stats()["bypassed"], 1)
+
+    def test_size_eviction_removes_least_recently_used(self):
+        cache = LLMCache(self.cache_dir, max_memory_items=1, max_disk_bytes=600)
+        cache.put("a" * 64, "x" * 200)
+        time.sleep(0.01)
+        cache.put("b" * 64, "y" * 200)
+        time.sleep(0.01)
+        self.assertIsNotNone(cache.get("a" * 64))  # 'a' on nyt tuoreempi kuin 'b'
+        time.sleep(0.01)
+        cache.put("c" * 64, "z" * 200)
+
+        fresh = LLMCache(self.cache_dir)
+        self.assertIsNotNone(fresh.get("a" * 64))
+        self.assertIsNone(fresh.get("b" * 64))
+        self.assertIsNotNone(fresh.get("c" * 64))
+
+    def test_age_eviction(self):
+        cache = LLMCache(self.cache_dir, max_age_seconds=60)
+        cache.put("a" * 64, "vanha")
+
+        aged = LLMCache(self.cache_dir, max_age_seconds=60)
+        real_time = time.time
+        try:
+            time.time = lambda: real_time() + 120
+            self.assertIsNone(aged.get("a" * 64))
+        finally:
+            time.time = real_time
+        self.assertFalse(os.listdir(self.cache_dir))
+
+
+if __name__ == '__main__':
+    unittest.main()
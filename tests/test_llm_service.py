@@ -0,0 +1,137 @@
+import sys
+import os
+import json
+import shutil
+import asyncio
+import tempfile
+import unittest
+from unittest.mock import MagicMock, AsyncMock, patch
+
+# Add src to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+import llm_backends
+import llm_service as llm_module
+from llm_service import LLMService
+from llm_cache import LLMCache
+
+
+def fake_response(text, finish_reason=1):
+    """Rakentaa Gemini-vastausta muistuttavan olion."""
+    response = MagicMock()
+    candidate = MagicMock()
+    candidate.content.parts = [text] if text else []
+    candidate.finish_reason = finish_reason
+    response.candidates = [candidate]
+    response.text = text
+    return response
+
+
+class TestLLMService(unittest.TestCase):
+    def setUp(self):
+        patcher = patch.dict(os.environ, {"GOOGLE_API_KEY": "test-key"})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        genai_patcher = patch.object(llm_backends, "genai")
+        self.genai = genai_patcher.start()
+        self.addCleanup(genai_patcher.stop)
+
+        sleep_patcher = patch.object(llm_module.time, "sleep")
+        self.sleep = sleep_patcher.start()
+        self.addCleanup(sleep_patcher.stop)
+
+        self.service = LLMService()
+        self.valid = json.dumps({"tulos": "ok"})
+
+    def test_retry_then_success(self):
+        model = self.genai.GenerativeModel.return_value
+        model.generate_content.side_effect = [Exception("500 Internal"), fake_response("Tässä: " + self.valid)]
+
+        result = self.service.generate_response("kehote", "gemini-2.5-flash")
+
+        self.assertEqual(json.loads(result), {"tulos": "ok"})
+        self.assertEqual(model.generate_content.call_count, 2)
+        self.sleep.assert_called_once_with(2)
+
+    def test_validation_failure_falls_back(self):
+        model = self.genai.GenerativeModel.return_value
+        model.generate_content.return_value = fake_response(json.dumps({"vaara": 1}))
+
+        result = self.service.generate_response("kehote", "gemini-2.5-flash",
+                                                validation_fn=lambda d: "tulos" in d)
+
+        self.assertIn("KAIKKI TEKOÄLYMALLIT EPÄONNISTUIVAT", result)
+        called_models = [c.args[0] for c in self.genai.GenerativeModel.call_args_list]
+        self.assertEqual(called_models[0], "gemini-2.5-flash")
+        self.assertIn("gemini-2.0-flash", called_models)
+        self.assertIn("gemini-2.5-flash-lite", called_models)
+
+    def test_validation_failure_is_repaired_with_fast_model(self):
+        prompts = {}
+
+        def make_model(name, **kwargs):
+            model = MagicMock()
+
+            def generate(prompt, **kwargs):
+                prompts.setdefault(name, []).append(prompt)
+                if name == "gemini-2.5-flash-lite":
+                    return fake_response(self.valid)
+                return fake_response('{"tulos": "ok", "vaara": 1')  # Katkennut JSON
+            model.generate_content.side_effect = generate
+            return model
+
+        self.genai.GenerativeModel.side_effect = make_model
+        long_prompt = "kehote " * 5000
+
+        result = self.service.generate_response(long_prompt, "gemini-2.5-flash", validation_fn=lambda d: "tulos" in d)
+
+        self.assertEqual(json.loads(result), {"tulos": "ok"})
+        self.assertEqual(len(prompts["gemini-2.5-flash"]), 1)  # Ei täyttä uudelleenyritystä
+        repair_prompt = prompts["gemini-2.5-flash-lite"][0]
+        self.assertIn("JSON-jäsennysvirhe", repair_prompt)
+        self.assertIn('"vaara": 1', repair_prompt)
+        self.assertLess(len(repair_prompt), 1000)
+
+    def test_async_generate_response(self):
+        model = self.genai.GenerativeModel.return_value
+        model.generate_content_async = AsyncMock(side_effect=[Exception("429 Quota exceeded"),
+                                                              fake_response(self.valid)])
+
+        with patch.object(llm_module.asyncio, "sleep", AsyncMock()) as async_sleep:
+            result = asyncio.run(self.service.agenerate_response("kehote", "gemini-2.5-flash"))
+
+        self.assertEqual(json.loads(result), {"tulos": "ok"})
+        async_sleep.assert_awaited_once_with(2)
+        self.sleep.assert_not_called()
+
+    def test_cache_stores_only_validated_responses(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir, True)
+        self.service.cache = LLMCache(cache_dir)
+
+        def validate(data):
+            return "tulos" in data
+        validate.schema_version = "v1"
+
+        model = self.genai.GenerativeModel.return_value
+        model.generate_content.return_value = fake_response(json.dumps({"vaara": 1}))
+        self.service.generate_response("kehote", "gemini-2.0-flash", validation_fn=validate)
+        self.assertEqual(self.service.cache.stats()["stores"], 0)
+
+        model.generate_content.reset_mock()
+        model.generate_content.return_value = fake_response(self.valid)
+        first = self.service.generate_response("kehote", "gemini-2.0-flash", validation_fn=validate)
+        second = self.service.generate_response("kehote", "gemini-2.0-flash", validation_fn=validate)
+
+        self.assertEqual(first, second)
+        self.assertEqual(model.generate_content.call_count, 1)
+
+        # Skeemaversion muutos ohittaa vanhan merkinnän
+        validate.schema_version = "v2"
+        self.service.generate_response("kehote", "gemini-2.0-flash", validation_fn=validate)
+        self.assertEqual(model.generate_content.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
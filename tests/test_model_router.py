@@ -0,0 +1,97 @@
+import sys
+import os
+import json
+import unittest
+from unittest.mock import MagicMock, patch
+
+# Add src to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+import llm_service as llm_module
+from data_handler import DataHandler
+from llm_backends import SimulatorBackend
+from llm_service import LLMService
+from model_router import ModelRouter, RATE_LIMITED, INVALID
+from orchestrator import Orchestrator
+from telemetry import telemetry_scope
+
+MODELS = ["gemini-2.5-flash", "gemini-2.0-flash", "gemini-2.5-flash-lite"]
+
+
+class TestModelRouter(unittest.TestCase):
+    def setUp(self):
+        self.router = ModelRouter(allowed_models=MODELS, min_samples=3)
+
+    def test_config_order_without_statistics(self):
+        self.assertEqual(self.router.fallback_chain("auto", "phase_2"), MODELS)
+        self.assertEqual(self.router.fallback_chain("gemini-2.0-flash", "phase_2"),
+                         ["gemini-2.0-flash", "gemini-2.5-flash", "gemini-2.5-flash-lite"])
+        self.assertEqual(self.router.default_model("phase_2"), "gemini-2.5-flash")
+
+    def test_faster_model_is_preferred_per_phase(self):
+        for _ in range(3):
+            self.router.record_success("phase_2", "gemini-2.5-flash", 40.0)
+            self.router.record_success("phase_2", "gemini-2.0-flash", 8.0)
+
+        self.assertEqual(self.router.default_model("phase_2"), "gemini-2.0-flash")
+        self.assertEqual(self.router.default_model("phase_3"), "gemini-2.5-flash")
+        self.assertEqual(self.router.fallback_chain("gemini-2.5-flash", "phase_2"),
+                         ["gemini-2.5-flash", "gemini-2.0-flash", "gemini-2.5-flash-lite"])
+
+    def test_rate_limited_model_is_demoted_behind_unknown(self):
+        self.router.record_success("phase_2", "gemini-2.5-flash", 5.0)
+        for _ in range(3):
+            self.router.record_failure("phase_2", "gemini-2.5-flash", RATE_LIMITED)
+        self.router.record_failure("phase_2", "gemini-2.5-flash", INVALID)
+
+        stats = self.router.stats("phase_2", "gemini-2.5-flash")
+        self.assertEqual(stats["rate_limit_rate"], 0.6)
+        self.assertEqual(stats["validation_pass_rate"], 0.5)
+        self.assertEqual(self.router.fallback_chain("auto", "phase_2"),
+                         ["gemini-2.0-flash", "gemini-2.5-flash-lite", "gemini-2.5-flash"])
+
+    def test_select_maps_critic_phases_and_auto(self):
+        self.assertEqual(self.router.select("phase_4", "gemini-2.5-flash", "gemini-2.0-flash"), "gemini-2.0-flash")
+        self.assertEqual(self.router.select("phase_2", "gemini-2.5-flash", "gemini-2.0-flash"), "gemini-2.5-flash")
+        self.assertEqual(self.router.select("phase_2", "auto"), "gemini-2.5-flash")
+
+    def test_orchestrator_without_router_uses_defaults(self):
+        orchestrator = Orchestrator(MagicMock(), DataHandler())
+        self.assertEqual(orchestrator.select_model("phase_5", "auto", "gemini-2.0-flash"), "gemini-2.0-flash")
+        self.assertIn(orchestrator.select_model("phase_1", "auto"), MODELS)
+
+
+class TestRoutingInLLMService(unittest.TestCase):
+    def setUp(self):
+        sleep_patcher = patch.object(llm_module.time, "sleep")
+        sleep_patcher.start()
+        self.addCleanup(sleep_patcher.stop)
+
+    def test_failures_reorder_the_fallback_chain(self):
+        # 2.5-flash vastaa aina rikkinäisellä JSONilla, muut mallit oikein
+        def respond(prompt):
+            return '{"tulos": "ok"}'
+        simulator = SimulatorBackend(time_scale=0, responses={"*": respond})
+        original_generate = simulator.generate
+
+        def generate(model_name, prompt, generation_params, timeout=300, stream=False):
+            if model_name == "gemini-2.5-flash":
+                raise ValueError("Striimi keskeytettiin: tuntematon avain")
+            return original_generate(model_name, prompt, generation_params, timeout, stream)
+        simulator.generate = generate
+
+        service = LLMService(backend=simulator, repair_model=None,
+                             router=ModelRouter(allowed_models=MODELS, min_samples=3))
+        with telemetry_scope(phase_id="phase_2"):
+            for i in range(3):
+                result = service.generate_response(f"kehote {i}", "auto", validation_fn=lambda d: "tulos" in d)
+                self.assertEqual(json.loads(result), {"tulos": "ok"})
+            self.assertEqual(service._models_to_try("auto")[0], "gemini-2.0-flash")
+
+        record = service.telemetry.records(phase_id="phase_2")[-1]
+        self.assertEqual(record["models_tried"], ["gemini-2.0-flash"])
+        self.assertEqual(service.router.stats("phase_2", "gemini-2.5-flash")["validation_pass_rate"], 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import sys
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+# Add src to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+import llm_service as llm_module
+from context import AssessmentContext
+from data_handler import DataHandler
+from llm_backends import SimulatorBackend
+from llm_service import LLMService
+from orchestrator import Orchestrator
+from prompt_cache import PromptCache
+from run_store import RunStore
+
+RULES = "Yleinen sääntö: arvioi perustellusti. " * 50
+PHASES = {f"VAIHE {i}": f"Ohje {i}" for i in range(1, 10)}
+
+
+class TestPromptCache(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.backend = MagicMock()
+        self.backend.create_cache.side_effect = lambda model, prefix, ttl: object()
+        self.cache = PromptCache(self.backend, ttl=100, refresh_margin=20, min_tokens=10, clock=lambda: self.now)
+
+    def test_handle_is_reused_refreshed_and_recreated(self):
+        handle = self.cache.handle("gemini-2.5-flash", RULES)
+        self.assertIs(self.cache.handle("gemini-2.5-flash", RULES), handle)
+        self.backend.refresh_cache.assert_not_called()
+
+        self.now += 90  # Alle refresh_margin ennen vanhenemista: voimassaoloa jatketaan
+        self.assertIs(self.cache.handle("gemini-2.5-flash", RULES), handle)
+        self.backend.refresh_cache.assert_called_once_with(handle, 100)
+
+        self.now += 101  # Vanhentunut: luodaan uusi
+        self.assertIsNot(self.cache.handle("gemini-2.5-flash", RULES), handle)
+        self.assertEqual(self.cache.stats()["created"], 2)
+        self.assertEqual(self.cache.stats()["refreshed"], 1)
+
+    def test_small_prefix_and_failed_create_fall_back_to_plain_prompt(self):
+        self.assertIsNone(self.cache.handle("gemini-2.5-flash", "lyhyt"))
+
+        self.backend.create_cache.side_effect = RuntimeError("400 too few tokens")
+        self.assertIsNone(self.cache.handle("gemini-2.0-flash", RULES))
+        self.assertIsNone(self.cache.handle("gemini-2.0-flash", RULES))
+        self.assertEqual(self.backend.create_cache.call_count, 1)  # Ei uutta yritystä ennen ttl:ää
+        self.assertEqual(self.cache.stats()["too_small"], 1)
+
+
+class TestStableLayout(unittest.TestCase):
+    def test_shared_prefix_is_byte_stable(self):
+        context = AssessmentContext(RULES, PHASES, cache_layout=True)
+        for i in range(1, 4):
+            context.add_result(f"VAIHE {i}", f'{{"tulos": {i}}}')
+
+        prompts = {key: context.build_prompt(key) for key in ("VAIHE 2", "VAIHE 4", "VAIHE 7", "VAIHE 8")}
+        self.assertEqual(context.cache_prefixes["VAIHE 2"], len(RULES))
+        self.assertEqual(context.cache_prefixes["VAIHE 8"], len(RULES))
+        shared = prompts["VAIHE 4"][:context.cache_prefixes["VAIHE 4"]]
+        self.assertIn("=== TULOS: VAIHE 3 ===", shared)
+        self.assertTrue(prompts["VAIHE 7"].startswith(shared))
+        self.assertEqual(context.cache_prefixes["VAIHE 7"], len(shared))
+        self.assertTrue(prompts["VAIHE 4"].endswith("--- SUORITA VAIHE 4 ---"))
+        self.assertGreater(context.budgets["VAIHE 4"]["cacheable"], context.budgets["VAIHE 2"]["cacheable"])
+
+    def test_default_layout_is_unchanged(self):
+        context = AssessmentContext(RULES, PHASES)
+        self.assertTrue(context.build_prompt("VAIHE 4").startswith(RULES + "\\n\\n--- VAIHE 4 ---"))
+        self.assertIsNone(context.cache_prefixes["VAIHE 4"])
+
+
+class TestCachedPipeline(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir, True)
+        sleep_patcher = patch.object(llm_module.time, "sleep")
+        sleep_patcher.start()
+        self.addCleanup(sleep_patcher.stop)
+
+    def test_pipeline_reports_cached_tokens(self):
+        simulator = SimulatorBackend(time_scale=0, seed=1)
+        cache = PromptCache(simulator, min_tokens=10)
+        service = LLMService(backend=simulator, prompt_cache=cache)
+        orchestrator = Orchestrator(service, DataHandler(), run_store=RunStore(self.tmp_dir))
+        context = AssessmentContext(RULES, PHASES, cache_layout=True)
+        context.add_file("Lopputuote.pdf", "Tässä on lopputuote. " * 5)
+
+        results = orchestrator.run_pipeline(context, "gemini-2.5-flash")
+
+        self.assertIn("python_calculated_scores", results["phase_8"])
+        # Kolme kahvaa: säännöt (vaiheet 1-3 ja 8), säännöt + vaiheiden 4-6 yhteinen historia sekä
+        # vaihe 7, jonka historiassa on lähdesegmentit (simulaattorin vaiheessa 2 ei ole väitteitä hakuun)
+        self.assertEqual(cache.stats()["created"], 3)
+        self.assertEqual(cache.stats()["hits"], 5)
+        telemetry = service.telemetry.summary()
+        self.assertGreaterEqual(telemetry["phase_5"]["cached_tokens"], len(RULES) // 4)
+        self.assertGreater(telemetry["phase_5"]["prompt_tokens"], telemetry["phase_5"]["cached_tokens"])
+
+        cache.release()
+        self.assertEqual(cache.stats()["handles"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import sys
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+# Add src to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from rate_limiter import RateLimiter
+
+
+class TestRateLimiter(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_rpm_bucket_waits_for_refill(self):
+        limiter = RateLimiter({"malli": {"rpm": 120}}, poll_interval=0.05)
+        for _ in range(120):
+            self.assertLess(limiter.acquire("malli"), 0.05)
+
+        waited = limiter.acquire("malli")
+        self.assertGreater(waited, 0.3)  # 1 pyyntö / 0.5 s
+        self.assertEqual(limiter.counters["waited"], 1)
+
+    def test_tpm_bucket_and_unknown_model(self):
+        limiter = RateLimiter({"malli": {"rpm": 1000, "tpm": 6000}}, poll_interval=0.05)
+        limiter.acquire("malli", tokens=6000)
+        with self.assertRaises(TimeoutError):
+            limiter.acquire("malli", tokens=3000, timeout=0.2)  # 3000 tokenia vaatii ~30 s
+        # Rajattomat mallit eivät odota
+        self.assertLess(limiter.acquire("tuntematon", tokens=10 ** 9), 0.05)
+
+    def test_queue_depth(self):
+        limiter = RateLimiter({"malli": {"rpm": 60}}, poll_interval=0.05)
+        for _ in range(60):
+            limiter.acquire("malli")
+
+        waiter = threading.Thread(target=limiter.acquire, args=("malli",))
+        waiter.start()
+        time.sleep(0.2)
+        self.assertEqual(limiter.queue_depth("malli"), 1)
+        waiter.join()
+        self.assertEqual(limiter.queue_depth("malli"), 0)
+
+    def test_state_shared_through_file(self):
+        state_file = os.path.join(self.tmp_dir, "rate_limits.json")
+        first = RateLimiter({"malli": {"rpm": 60}}, state_file=state_file)
+        second = RateLimiter({"malli": {"rpm": 60}}, state_file=state_file)
+
+        for _ in range(60):
+            first.acquire("malli")
+        # Toinen "prosessi" näkee saman tyhjentyneen ämpärin
+        with self.assertRaises(TimeoutError):
+            second.acquire("malli", timeout=0.1)
+
+    def test_rate_limited_drains_bucket(self):
+        limiter = RateLimiter({"malli": {"rpm": 60}}, poll_interval=0.05)
+        limiter.on_rate_limited("malli")
+        with self.assertRaises(TimeoutError):
+            limiter.acquire("malli", timeout=0.1)
+
+    def test_concurrent_rate_limits_are_all_counted(self):
+        limiter = RateLimiter({"malli": {"rpm": 60}})
+
+        def report():
+            for _ in range(500):
+                limiter.on_rate_limited("malli")
+                limiter.on_rate_limited("muu")
+
+        threads = [threading.Thread(target=report) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(limiter.stats()["rate_limited"], 4000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import sys
+import os
+import json
+import unittest
+
+# Add src to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from context import AssessmentContext
+from retrieval import RetrievalIndex, chunk_text, retrieval_index
+
+FILLER = "Opiskelija kysyi tekoälyltä säästä ja ruokareseptistä, ja tekoäly vastasi kohteliaasti. "
+CHAT = (FILLER * 60 + "Opiskelija hylkäsi tekoälyn ehdottaman tutkimuskysymyksen ja perusteli valintansa "
+        "aineiston rajauksella. " + FILLER * 60)
+PHASE_1 = json.dumps({"data": {"keskusteluhistoria": CHAT, "lopputuote": "Essee", "reflektiodokumentti": "Pohdinta"}},
+                     indent=2, ensure_ascii=False)
+PHASE_2 = json.dumps({
+    "hypoteesit": [{"id": "Väite-1", "vaite_teksti": "Opiskelija hylkäsi tutkimuskysymyksen perustellusti."}],
+    "rag_todisteet": [{"viittaa_hypoteesiin_id": "Väite-1", "perusteet": "Aineiston rajaus",
+                       "konteksti_segmentti": "hylkäsi ehdotuksen"}]
+}, ensure_ascii=False)
+
+
+class TestRetrievalIndex(unittest.TestCase):
+    def test_chunks_overlap_and_cover_text(self):
+        spans = chunk_text(CHAT, chunk_chars=500, overlap_chars=100)
+        self.assertEqual(spans[0][0], 0)
+        self.assertEqual(spans[-1][1], len(CHAT))
+        for (_, end), (start, _) in zip(spans, spans[1:]):
+            self.assertLess(start, end)  # Limittäiset
+            self.assertIn(CHAT[end], " \n")  # Sana ei katkea
+
+    def test_inflected_query_finds_relevant_segment(self):
+        index = RetrievalIndex([("Keskusteluhistoria.pdf", CHAT), ("Lopputuote.pdf", "Tutkimuskysymys on rajattu.")],
+                               chunk_chars=500, overlap_chars=100)
+        query = "hylkäämä tutkimuskysymys rajauksen vuoksi"
+        self.assertIn("Lopputuote.pdf", [segment["file"] for segment, _ in index.search(query, k=3)])
+
+        hits = index.search(query, k=3, files=["keskusteluhistoria"])
+        self.assertIn("hylkäsi tekoälyn ehdottaman", hits[0][0]["text"])
+        self.assertTrue(all(segment["file"] == "Keskusteluhistoria.pdf" for segment, _ in hits))
+        self.assertEqual(index.search("täysin tuntematon sanasto"), [])
+
+    def test_index_is_cached_per_content_hash(self):
+        files = [("Keskusteluhistoria.pdf", CHAT)]
+        index = retrieval_index(files)
+        self.assertIs(retrieval_index([("Keskusteluhistoria.pdf", (CHAT + " ")[:-1])]), index)
+        self.assertIsNot(retrieval_index([("Keskusteluhistoria.pdf", CHAT + " Lisäys.")]), index)
+
+
+class TestRetrievalPrompt(unittest.TestCase):
+    def make_context(self):
+        context = AssessmentContext("Säännöt", {f"VAIHE {i}": f"Ohje {i}" for i in range(1, 10)})
+        context.add_file("Keskusteluhistoria.pdf", CHAT)
+        context.add_result("VAIHE 1", PHASE_1)
+        context.add_result("VAIHE 2", PHASE_2)
+        return context
+
+    def test_retrieval_phase_gets_segments_instead_of_full_text(self):
+        context = self.make_context()
+        prompt = context.build_prompt("VAIHE 4")
+
+        self.assertIn("=== TULOS: HAKUTULOKSET ===", prompt)
+        self.assertIn("hylkäsi tekoälyn ehdottaman", prompt)
+        self.assertNotIn('"keskusteluhistoria"', prompt)
+        self.assertIn('"lopputuote":"Essee"', prompt)
+        self.assertLess(len(prompt), len(CHAT) / 2)
+
+    def test_whole_process_phases_and_missing_hypotheses_keep_full_text(self):
+        context = self.make_context()
+        self.assertIn(CHAT, json.loads(context.build_prompt("VAIHE 5").split("=== TULOS: VAIHE 1 ===\\n")[1]
+                                       .split("\\n")[0])["data"]["keskusteluhistoria"])
+
+        context.add_result("VAIHE 2", "VIRHE: ei tulosta")
+        self.assertNotIn("HAKUTULOKSET", context.build_prompt("VAIHE 4"))
+        self.assertIn('"keskusteluhistoria"', context.build_prompt("VAIHE 4"))
+
+
+if __name__ == '__main__':
+    unittest.main()
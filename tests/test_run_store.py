@@ -0,0 +1,88 @@
+import sys
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+# Add src to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from orchestrator import Orchestrator
+from context import AssessmentContext
+from data_handler import DataHandler
+from run_store import RunStore
+
+
+class TestCheckpointResume(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.store = RunStore(self.tmp_dir)
+        self.response = json.dumps({
+            "data": {},
+            "pisteet": {
+                "analyysi_ja_prosessi": {"arvosana": 2},
+                "arviointi_ja_argumentaatio": {"arvosana": 3},
+                "synteesi_ja_luovuus": {"arvosana": 4}
+            },
+            "security_check": {"uhka_havaittu": False}
+        })
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def make_context(self):
+        context = AssessmentContext("Säännöt...", {f"VAIHE {i}": f"Ohje {i}" for i in range(1, 10)})
+        context.add_file("Keskusteluhistoria.pdf", "Opiskelija: Soita 040 1234567. Tekoäly: Selvä. " * 3)
+        context.add_file("Lopputuote.pdf", "Tässä on lopputuote. Se on hyvä ja perusteltu. " * 3)
+        context.add_file("Reflektiodokumentti.pdf", "Opin paljon prosessin aikana ja pohdin sitä. " * 3)
+        return context
+
+    def test_resume_from_first_missing_phase(self):
+        def failing_phase_7(prompt, model_name, validation_fn=None):
+            if "--- VAIHE 7 ---" in prompt:
+                raise RuntimeError("Quota exceeded")
+            return self.response
+
+        first_llm = MagicMock()
+        first_llm.generate_response.side_effect = failing_phase_7
+        first = Orchestrator(first_llm, DataHandler(), run_store=self.store)
+        results = first.run_pipeline(self.make_context(), "gemini-2.5-flash", run_id="ajo_1")
+
+        self.assertNotIn("phase_8", results)
+        self.assertTrue(self.store.exists("ajo_1"))
+        self.assertEqual(set(self.store.load_phases("ajo_1")),
+                         {"phase_1", "phase_2", "phase_3", "phase_4", "phase_5", "phase_6"})
+        # Checkpointiin tallennetaan sanitoidut tiedostot
+        stored_files = dict(self.store.load_files("ajo_1"))
+        self.assertNotIn("040 1234567", stored_files["Keskusteluhistoria.pdf"])
+
+        second_llm = MagicMock()
+        second_llm.generate_response.return_value = self.response
+        second = Orchestrator(second_llm, DataHandler(), run_store=self.store)
+        context = self.make_context()
+        results = second.run_pipeline(context, "gemini-2.5-flash", run_id="ajo_1")
+
+        # Vain Vaiheet 7 ja 8 ajetaan uudelleen LLM:llä
+        self.assertEqual(second_llm.generate_response.call_count, 2)
+        self.assertEqual(list(results), ["phase_%d" % i for i in range(1, 10)])
+        self.assertIn("VAIHE 3", context.results)
+        self.assertIn("python_calculated_scores", context.results["phase_8"])
+        self.assertNotIn("040 1234567", context.get_file_content("Keskusteluhistoria"))
+
+    def test_failed_results_are_not_checkpointed(self):
+        llm = MagicMock()
+        llm.generate_response.return_value = "VIRHE: KAIKKI TEKOÄLYMALLIT EPÄONNISTUIVAT"
+        orchestrator = Orchestrator(llm, DataHandler(), run_store=self.store)
+        orchestrator.run_mode("MOODI_A", self.make_context(), "gemini-2.5-flash", run_id="ajo_2")
+
+        self.assertEqual(self.store.load_phases("ajo_2"), {})
+
+    def test_rejects_path_traversal(self):
+        with self.assertRaises(ValueError):
+            self.store.run_dir("..")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import sys
+import os
+import json
+import unittest
+from unittest.mock import MagicMock, patch
+
+# Add src to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+import llm_backends
+import llm_service as llm_module
+from config import PHASES
+from context import AssessmentContext
+from llm_service import LLMService
+from orchestrator import Orchestrator
+from prompt_splitter import PromptSplitter
+from schema_converter import to_response_schema
+
+
+class TestSchemaConverter(unittest.TestCase):
+    def test_enum_and_required(self):
+        schema = {
+            "type": "object",
+            "properties": {
+                "riski_taso": {"type": "enum", "values": ["MATALA", "KORKEA"], "example": "MATALA"},
+                "lista": {"type": "array", "items": {"type": "number", "example": 3}}
+            }
+        }
+        converted = to_response_schema(schema)
+
+        self.assertEqual(converted["required"], ["riski_taso", "lista"])
+        self.assertEqual(converted["properties"]["riski_taso"],
+                         {"type": "string", "format": "enum", "enum": ["MATALA", "KORKEA"]})
+        self.assertEqual(converted["properties"]["lista"]["items"], {"type": "number", "description": "Esimerkki: 3"})
+
+    def test_all_phase_schemas_convert(self):
+        for phase in PHASES:
+            if "schema" not in phase:
+                continue
+            converted = to_response_schema(phase["schema"])
+            self.assertEqual(converted["type"], "object")
+            self.assertEqual(converted["required"], list(phase["schema"]["properties"]))
+            self.assertNotIn('"type": "enum"', json.dumps(converted))
+            self.assertNotIn('"values"', json.dumps(converted))
+
+
+class TestResponseSchemaInGenerationConfig(unittest.TestCase):
+    def setUp(self):
+        patcher = patch.dict(os.environ, {"GOOGLE_API_KEY": "test-key"})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        genai_patcher = patch.object(llm_backends, "genai")
+        self.genai = genai_patcher.start()
+        self.addCleanup(genai_patcher.stop)
+
+    def test_phase_schema_is_sent_as_response_schema(self):
+        context = AssessmentContext("Säännöt", {"VAIHE 2": "Ohje 2"})
+        _, _, validation_fn, _ = Orchestrator(MagicMock(), MagicMock())._prepare_phase("phase_2", context)
+
+        response = MagicMock()
+        response.text = json.dumps({key: [] for key in PHASES[1]["schema"]["properties"]})
+        self.genai.GenerativeModel.return_value.generate_content.return_value = response
+
+        LLMService().generate_response("kehote", "gemini-2.0-flash", validation_fn=validation_fn)
+        config_kwargs = self.genai.types.GenerationConfig.call_args.kwargs
+        self.assertEqual(config_kwargs["response_schema"], to_response_schema(PHASES[1]["schema"]))
+
+        LLMService(structured_output=False).generate_response("kehote", "gemini-2.0-flash",
+                                                              validation_fn=validation_fn)
+        self.assertNotIn("response_schema", self.genai.types.GenerationConfig.call_args.kwargs)
+
+
+class TestSchemaExampleInjection(unittest.TestCase):
+    def test_examples_are_optional(self):
+        with_examples = PromptSplitter(inject_schema_examples=True)._post_process_phase(2, "Ohje.")
+        without_examples = PromptSplitter(inject_schema_examples=False)._post_process_phase(2, "Ohje.")
+
+        self.assertIn("Esimerkki oikeasta rakenteesta", with_examples)
+        self.assertEqual(without_examples, "Ohje.")
+
+        splitter = PromptSplitter(inject_schema_examples=False)
+        splitter.modules = {"VAIHE 2": with_examples}
+        splitter.strip_schema_examples()
+        self.assertEqual(splitter.modules["VAIHE 2"].strip(), "Ohje.")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+import sys
+import os
+import asyncio
+import json
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+# Add src to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from llm_backends import LLMBackend, BackendResponse
+from llm_cache import LLMCache
+from llm_service import LLMService
+from single_flight import SingleFlight
+
+
+class SlowBackend(LLMBackend):
+    """Taustapalvelu, joka laskee kutsut ja vastaa vasta kun release-tapahtuma asetetaan."""
+
+    name = "slow"
+
+    def __init__(self, text='{"tulos": "ok"}'):
+        self.text = text
+        self.calls = 0
+        self.release = threading.Event()
+
+    def generate(self, model_name, prompt, generation_params, timeout=300, stream=False):
+        self.calls += 1
+        self.release.wait(5)
+        return BackendResponse(self.text)
+
+
+class TestSingleFlightService(unittest.TestCase):
+    def test_concurrent_identical_requests_share_one_call(self):
+        backend = SlowBackend()
+        service = LLMService(backend=backend)
+        results = []
+
+        def worker():
+            results.append(service.generate_response("sama kehote", "gemini-2.0-flash"))
+
+        threads = [threading.Thread(target=worker) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.2)
+        backend.release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(backend.calls, 1)
+        self.assertEqual([json.loads(r) for r in results], [{"tulos": "ok"}] * 5)
+        self.assertEqual(service.single_flight.stats()["shared"], 4)
+        self.assertEqual(service.telemetry.summary()["muu"]["deduplicated"], 4)
+
+    def test_async_identical_requests_share_one_call(self):
+        backend = SlowBackend()
+        backend.release.set()
+        service = LLMService(backend=backend)
+
+        async def run():
+            return await asyncio.gather(*[service.agenerate_response("kehote", "gemini-2.0-flash") for _ in range(3)])
+
+        results = asyncio.run(run())
+        self.assertEqual(backend.calls, 1)
+        self.assertEqual(len(set(results)), 1)
+
+    def test_different_prompts_are_not_merged(self):
+        backend = SlowBackend()
+        backend.release.set()
+        service = LLMService(backend=backend)
+        service.generate_response("kehote 1", "gemini-2.0-flash")
+        service.generate_response("kehote 2", "gemini-2.0-flash")
+        self.assertEqual(backend.calls, 2)
+
+
+class TestSingleFlightLocks(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir, True)
+        self.flight = SingleFlight(lock_dir=os.path.join(self.tmp_dir, "locks"), poll_interval=0.01)
+        self.cache = LLMCache(cache_dir=self.tmp_dir)
+
+    def write_lock(self, key, pid):
+        os.makedirs(self.flight.lock_dir, exist_ok=True)
+        with open(self.flight._lock_path(key), "w", encoding="utf-8") as f:
+            f.write(f"{socket.gethostname()} {pid} {time.time()}")
+
+    def test_waits_for_other_process_and_reads_cache(self):
+        key = "a" * 64
+        self.write_lock(key, os.getpid())  # "Toinen prosessi" (elossa) pitää lukkoa
+        other_cache = LLMCache(cache_dir=self.tmp_dir)  # Toisen prosessin oma välimuisti-instanssi
+        self.assertIsNone(self.cache.get(key))  # Tämän prosessin levyindeksi on jo luettu
+
+        def other_process_finishes():
+            time.sleep(0.1)
+            other_cache.put(key, '{"tulos": "toinen prosessi"}')
+            os.remove(self.flight._lock_path(key))
+        threading.Thread(target=other_process_finishes).start()
+
+        result, shared = self.flight.do(key, lambda: self.fail("Ei saa kutsua"), recheck=lambda: self.cache.get(key))
+        self.assertTrue(shared)
+        self.assertEqual(result, '{"tulos": "toinen prosessi"}')
+        self.assertEqual(self.flight.stats()["shared_across_processes"], 1)
+
+    def test_stale_lock_of_dead_process_is_removed(self):
+        key = "b" * 64
+        self.write_lock(key, 2 ** 22 + 12345)  # Prosessia ei ole olemassa
+
+        result, shared = self.flight.do(key, lambda: "oma tulos", recheck=lambda: None)
+        self.assertEqual((result, shared), ("oma tulos", False))
+        self.assertEqual(self.flight.stats()["stale_locks"], 1)
+        self.assertFalse(os.path.exists(self.flight._lock_path(key)))
+
+    def test_leader_error_is_shared(self):
+        flight = SingleFlight()
+        started = threading.Event()
+        errors = []
+
+        def failing():
+            started.set()
+            time.sleep(0.1)
+            raise RuntimeError("rikki")
+
+        def follower():
+            started.wait()
+            try:
+                flight.do("k", lambda: "ei kutsuta")
+            except RuntimeError as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=follower)
+        thread.start()
+        with self.assertRaises(RuntimeError):
+            flight.do("k", failing)
+        thread.join()
+        self.assertEqual(len(errors), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import sys
+import os
+import json
+import unittest
+
+# Add src to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from context import AssessmentContext
+from orchestrator import Orchestrator
+from spans import SpanMap, compact_ids
+
+CHAT = " ".join(f"Viesti {n}: opiskelija kysyi \"lähteistä\" ja tekoäly vastasi." for n in range(40))
+FILES = [("Keskusteluhistoria.pdf", CHAT), ("Lopputuote.pdf", "Essee tekoälystä.\nToinen rivi.")]
+
+
+class TestSpanMap(unittest.TestCase):
+    def setUp(self):
+        self.spans = SpanMap(FILES, span_chars=200)
+
+    def test_spans_cover_file_without_overlap(self):
+        ids = self.spans.by_file["Keskusteluhistoria.pdf"]
+        self.assertEqual(ids[0][0], "K0")
+        self.assertEqual(ids[-1][2], len(CHAT))
+        for (_, _, end), (_, start, _) in zip(ids, ids[1:]):
+            self.assertEqual(start, end)
+        self.assertEqual(self.spans.by_file["Lopputuote.pdf"][0][0], "L0")
+        self.assertTrue(self.spans.labelled("Keskusteluhistoria.pdf").startswith("[K0] Viesti 0"))
+
+    def test_resolve_single_range_and_unknown(self):
+        k1 = self.spans.quote("K1")
+        self.assertIn(k1, CHAT)
+        self.assertEqual(self.spans.quote("K1-K2"), CHAT[self.spans.spans["K1"][1]:self.spans.spans["K2"][2]].strip())
+        self.assertIsNone(self.spans.quote("K2-K1"))
+        self.assertIsNone(self.spans.quote("K1-L0"))
+
+        text, report = self.spans.resolve('{"a": "{{SPAN: K1}}", "b": "{{SPAN: K1-K2}}", "c": "{{SPAN: K999}}"}')
+        data = json.loads(text)
+        self.assertEqual(data["a"], k1)  # Lainausmerkit escapeerattu, teksti sanatarkasti
+        self.assertEqual(data["b"], self.spans.quote("K1-K2"))
+        self.assertEqual(data["c"], "[LÄHDESEGMENTTIÄ K999 EI LÖYTYNYT]")
+        self.assertEqual(report, {"resolved": 2, "unknown": ["K999"]})
+
+    def test_compact_ids(self):
+        self.assertEqual(compact_ids(["K5", "K3", "K4", "K9", "L0", "K4"]), ["K3-K5", "K9", "L0"])
+
+
+class TestSpanPrompt(unittest.TestCase):
+    def test_span_phase_gets_labelled_sources_and_instruction(self):
+        context = AssessmentContext("Säännöt", {f"VAIHE {i}": f"Ohje {i}" for i in range(1, 10)})
+        for name, content in FILES:
+            context.add_file(name, content)
+        context.add_result("VAIHE 1", json.dumps({"data": {"keskusteluhistoria": CHAT, "lopputuote": "Essee"}}))
+
+        prompt = context.build_prompt("VAIHE 2")
+        self.assertIn("=== TULOS: LÄHDESEGMENTIT ===", prompt)
+        self.assertIn("[K0] Viesti 0", prompt)
+        self.assertIn("{{SPAN: K12}}", prompt)
+        self.assertNotIn('"keskusteluhistoria"', prompt)
+        self.assertNotIn("LÄHDESEGMENTIT", context.build_prompt("VAIHE 5"))
+        self.assertNotIn("{{SPAN:", context.build_prompt("VAIHE 5"))
+
+    def test_retrieval_phase_labels_remaining_sources(self):
+        context = AssessmentContext("Säännöt", {f"VAIHE {i}": f"Ohje {i}" for i in range(1, 10)})
+        for name, content in FILES + [("Reflektiodokumentti.pdf", "Pohdinta lähteistä.")]:
+            context.add_file(name, content)
+        context.add_result("VAIHE 1", json.dumps({"data": {"keskusteluhistoria": CHAT, "lopputuote": "Essee",
+                                                           "reflektiodokumentti": "Pohdinta"}}))
+        context.add_result("VAIHE 2", json.dumps({"hypoteesit": [{"id": "H1", "vaite_teksti": "Viesti lähteistä"}]}))
+
+        prompt = context.build_prompt("VAIHE 7")
+        self.assertIn("=== TULOS: HAKUTULOKSET ===", prompt)
+        self.assertIn("[K", prompt)
+        self.assertIn("[L0] Essee tekoälystä.", prompt)
+        self.assertIn("[R0] Pohdinta lähteistä.", prompt)
+        self.assertNotIn('"lopputuote"', prompt)
+        self.assertNotIn('"reflektiodokumentti"', prompt)
+
+    def test_finalize_resolves_references(self):
+        context = AssessmentContext("Säännöt", {})
+        for name, content in FILES:
+            context.add_file(name, content)
+        orchestrator = Orchestrator(None, None)
+        result = orchestrator._finalize_phase(
+            "phase_2", "VAIHE 2", '{"rag_todisteet": [{"konteksti_segmentti": "{{SPAN: L0}}"}], "x": "{{SPAN: Q1}}"}',
+            context
+        )
+
+        data = json.loads(result)
+        self.assertEqual(data["rag_todisteet"][0]["konteksti_segmentti"], "Essee tekoälystä.\nToinen rivi.")
+        self.assertEqual(data["metadata"]["lahdeviitteet"], {"resolved": 1, "unknown": ["Q1"]})
+        self.assertEqual(context.results["VAIHE 2"], result)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+import sys
+import os
+import json
+import unittest
+from unittest.mock import MagicMock, patch
+
+# Add src to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+import llm_backends
+from context import AssessmentContext
+from orchestrator import Orchestrator
+import llm_service as llm_module
+from llm_service import LLMService
+from stream_parser import IncrementalJSONParser
+
+
+def chunks(text, size=7):
+    """Pilkkoo vastauksen Gemini-striimin paloja muistuttaviksi olioiksi."""
+    result = []
+    for i in range(0, len(text), size):
+        chunk = MagicMock()
+        chunk.text = text[i:i + size]
+        result.append(chunk)
+    return result
+
+
+class TestIncrementalJSONParser(unittest.TestCase):
+    def test_partial_and_complete(self):
+        document = {"hypoteesit": [{"id": "Väite-1", "teksti": "a } \" ["}], "yhteenveto": "ok"}
+        text = "Tässä: " + json.dumps(document, ensure_ascii=False) + "\nKiitos!"
+        parser = IncrementalJSONParser(allowed_keys=["hypoteesit", "yhteenveto"])
+
+        partials = []
+        for chunk in chunks(text, 5):
+            parser.feed(chunk.text)
+            partials.append(parser.partial())
+
+        self.assertTrue(parser.complete)
+        self.assertIsNone(parser.error)
+        self.assertEqual(json.loads(parser.json_text()), document)
+        self.assertEqual(parser.top_level_keys, ["hypoteesit", "yhteenveto"])
+        self.assertIn({"hypoteesit": [{"id": "Väite-1"}]}, partials)
+
+    def test_unknown_top_level_key_is_an_error(self):
+        parser = IncrementalJSONParser(allowed_keys=["data"])
+        parser.feed('{"data": {"x": 1}, "selitys": ')
+        self.assertIn("selitys", parser.error)
+
+    def test_nested_keys_are_not_checked(self):
+        parser = IncrementalJSONParser(allowed_keys=["data"])
+        parser.feed('{"data": {"mikä_tahansa": 1}}')
+        self.assertIsNone(parser.error)
+        self.assertTrue(parser.complete)
+
+
+class TestStreamingLLMService(unittest.TestCase):
+    def setUp(self):
+        patcher = patch.dict(os.environ, {"GOOGLE_API_KEY": "test-key"})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        genai_patcher = patch.object(llm_backends, "genai")
+        self.genai = genai_patcher.start()
+        self.addCleanup(genai_patcher.stop)
+
+        sleep_patcher = patch.object(llm_module.time, "sleep")
+        sleep_patcher.start()
+        self.addCleanup(sleep_patcher.stop)
+
+        self.service = LLMService(streaming=True)
+        self.model = self.genai.GenerativeModel.return_value
+
+        def validate(data):
+            return "tulos" in data
+        validate.schema_keys = ("tulos",)
+        self.validate = validate
+
+    def test_streaming_reports_partials(self):
+        text = json.dumps({"tulos": {"a": 1, "b": [1, 2, 3]}})
+        self.model.generate_content.return_value = iter(chunks(text))
+        partials = []
+
+        result = self.service.generate_response("kehote", "gemini-2.0-flash", validation_fn=self.validate,
+                                                on_partial=partials.append)
+
+        self.assertEqual(json.loads(result), {"tulos": {"a": 1, "b": [1, 2, 3]}})
+        self.assertTrue(self.model.generate_content.call_args.kwargs["stream"])
+        self.assertGreater(len(partials), 1)
+        self.assertEqual(partials[-1], json.loads(text))
+
+    def test_wrong_top_level_key_aborts_stream(self):
+        consumed = []
+
+        def stream(text):
+            for chunk in chunks(text):
+                consumed.append(chunk)
+                yield chunk
+
+        bad = json.dumps({"vaara": "x" * 500})
+        good = json.dumps({"tulos": "ok"})
+        self.model.generate_content.side_effect = [stream(bad), stream(good)]
+
+        result = self.service.generate_response("kehote", "gemini-2.0-flash", validation_fn=self.validate)
+
+        self.assertEqual(json.loads(result), {"tulos": "ok"})
+        # Virheellinen vastaus keskeytettiin heti avaimen jälkeen eikä 500 merkin arvoa luettu
+        self.assertLess(len(consumed), len(chunks(bad)))
+
+    def test_base_json_keys_do_not_abort_phase_stream(self):
+        context = AssessmentContext("Säännöt", {f"VAIHE {i}": f"Ohje {i}" for i in range(1, 10)})
+        _, _, validation_fn, _ = Orchestrator(MagicMock(), MagicMock())._prepare_phase("phase_2", context)
+        document = {"metodologinen_loki": "Rajoitukset kirjattu.", "edellisen_vaiheen_validointi": "OK."}
+        document.update({key: "..." for key in validation_fn.schema_keys})
+        self.model.generate_content.return_value = iter(chunks(json.dumps(document)))
+
+        result = self.service.generate_response("kehote", "gemini-2.0-flash", validation_fn=validation_fn)
+
+        self.assertEqual(json.loads(result), document)
+        self.assertEqual(self.model.generate_content.call_count, 1)
+
+    def test_per_call_options_do_not_change_shared_service(self):
+        response = MagicMock()
+        response.text = json.dumps({"tulos": "ok"})
+        self.model.generate_content.return_value = response
+        self.service.cache = MagicMock()
+        self.service.cache.get.return_value = None
+
+        result = self.service.generate_response("kehote", "gemini-2.0-flash", validation_fn=self.validate,
+                                                cache_bypass=True, streaming=False)
+
+        self.assertEqual(json.loads(result), {"tulos": "ok"})
+        self.assertFalse(self.model.generate_content.call_args.kwargs["stream"])
+        self.assertTrue(self.service.cache.get.call_args.kwargs["bypass"])
+        self.assertTrue(self.service.cache.put.call_args.kwargs["bypass"])
+        self.assertTrue(self.service.streaming)
+        self.assertFalse(self.service.cache_bypass)
+
+    def test_run_pipeline_passes_options_to_each_call(self):
+        llm = MagicMock(spec=["generate_response"])
+        llm.generate_response.return_value = json.dumps({"tulos": "ok"})
+        orchestrator = Orchestrator(llm, MagicMock())
+        context = AssessmentContext("Säännöt", {"VAIHE 4": "Ohje 4", "VAIHE 5": "Ohje 5"})
+
+        orchestrator.run_pipeline(context, "gemini-2.0-flash", phase_ids=["phase_4", "phase_5"],
+                                  cache_bypass=True, streaming=True)
+
+        self.assertEqual(llm.generate_response.call_count, 2)
+        for call in llm.generate_response.call_args_list:
+            self.assertTrue(call.kwargs["cache_bypass"])
+            self.assertTrue(call.kwargs["streaming"])
+            self.assertTrue(callable(call.kwargs["on_partial"]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import sys
+import os
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+# Add src to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+import llm_service as llm_module
+from context import AssessmentContext
+from data_handler import DataHandler
+from llm_backends import SimulatorBackend
+from llm_service import LLMService
+from orchestrator import Orchestrator
+from run_store import RunStore
+from telemetry import Telemetry, telemetry_scope
+
+
+class TestTelemetry(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir, True)
+        sleep_patcher = patch.object(llm_module.time, "sleep")
+        sleep_patcher.start()
+        self.addCleanup(sleep_patcher.stop)
+
+    def make_context(self):
+        context = AssessmentContext("Säännöt...", {f"VAIHE {i}": f"Ohje {i}" for i in range(1, 10)})
+        context.add_file("Keskusteluhistoria.pdf", "Opiskelija: Kysymys. Tekoäly: Vastaus. " * 3)
+        context.add_file("Lopputuote.pdf", "Tässä on lopputuote. Se on hyvä ja perusteltu. " * 3)
+        context.add_file("Reflektiodokumentti.pdf", "Opin paljon prosessin aikana ja pohdin sitä. " * 3)
+        return context
+
+    def test_pipeline_records_calls_per_phase(self):
+        telemetry = Telemetry(pricing={"gemini-2.5-flash": {"input": 1.0, "output": 2.0}})
+        service = LLMService(backend=SimulatorBackend(time_scale=0, seed=1), telemetry=telemetry)
+        orchestrator = Orchestrator(service, DataHandler(), run_store=RunStore(self.tmp_dir))
+
+        orchestrator.run_pipeline(self.make_context(), "gemini-2.5-flash", run_id="opiskelija_1")
+
+        summary = orchestrator.get_telemetry()
+        self.assertEqual(summary["assessment_id"], "opiskelija_1")
+        self.assertEqual(summary["calls"], 8)
+        self.assertEqual(set(summary["phases"]), {f"phase_{i}" for i in range(1, 9)})
+        self.assertGreater(summary["prompt_tokens"], 0)
+        self.assertGreater(summary["cost_usd"], 0)
+        self.assertEqual(summary["models_used"], {"gemini-2.5-flash": 8})
+
+        path = os.path.join(self.tmp_dir, "telemetry.jsonl")
+        self.assertEqual(telemetry.export_jsonl(path, assessment_id="opiskelija_1"), 8)
+        with open(path, encoding="utf-8") as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual(records[0]["assessment_id"], "opiskelija_1")
+        self.assertIn("wall_time", records[0])
+
+    def test_failure_reason_and_fallbacks(self):
+        simulator = SimulatorBackend(time_scale=0, rate_limit_rate=1.0)
+        service = LLMService(backend=simulator, repair_model=None)
+
+        with telemetry_scope(phase_id="phase_2"):
+            result = service.generate_response("kehote", "gemini-2.5-flash")
+
+        self.assertIn("EPÄONNISTUIVAT", result)
+        record = service.telemetry.records(phase_id="phase_2")[-1]
+        self.assertEqual(record["status"], "failed")
+        self.assertEqual(record["failure_reason"], "rate_limit")
+        self.assertGreater(record["fallbacks"], 0)
+        self.assertEqual(service.telemetry.summary()["phase_2"]["failed"], 1)
+
+    def test_concurrent_attempts_share_call_safely(self):
+        telemetry = Telemetry(pricing={})
+        call = telemetry.start_call("gemini-2.5-flash", "kehote")
+        usage = SimpleNamespace(usage_metadata=SimpleNamespace(prompt_token_count=10, candidates_token_count=1,
+                                                               cached_content_token_count=0))
+
+        def attempt(model_name):
+            for _ in range(2000):
+                call.attempt(model_name)
+                call.add_usage(usage, model_name)
+
+        threads = [threading.Thread(target=attempt, args=(model,)) for model in ("gemini-2.5-flash", "gemini-2.0-flash")]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        call.finish("ok", model_used="gemini-2.0-flash")
+        call.add_usage(usage, "gemini-2.5-flash")  # Perumaton häviäjä valmistuu tallennuksen jälkeen
+
+        record = telemetry.records()[-1]
+        self.assertEqual(record["attempts"], 4000)
+        self.assertEqual(record["prompt_tokens"], 40000)
+        self.assertEqual(record["output_tokens"], 4000)
+        self.assertEqual(sorted(record["models_tried"]), ["gemini-2.0-flash", "gemini-2.5-flash"])
+
+
+if __name__ == '__main__':
+    unittest.main()
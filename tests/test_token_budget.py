@@ -0,0 +1,115 @@
+import sys
+import os
+import unittest
+from unittest.mock import MagicMock
+
+# Add src to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from context import AssessmentContext
+from data_handler import DataHandler
+from orchestrator import Orchestrator
+from token_budget import TokenEstimator
+
+PHASES = {f"VAIHE {i}": f"Ohje {i}" for i in range(1, 10)}
+
+
+class TestTokenEstimator(unittest.TestCase):
+    def test_calibration_uses_count_tokens_ratio(self):
+        estimator = TokenEstimator()
+        self.assertEqual(estimator.estimate("a" * 400), 100)
+
+        ratio = estimator.calibrate(lambda text: len(text) // 3, ["a" * 300, "b" * 300])
+        self.assertEqual(ratio, 3.0)
+        self.assertTrue(estimator.calibrated)
+        self.assertEqual(estimator.estimate("a" * 300), 100)
+
+    def test_failed_or_missing_count_keeps_default(self):
+        estimator = TokenEstimator()
+        self.assertIsNone(estimator.calibrate(lambda text: None, ["teksti"]))
+
+        def failing(text):
+            raise RuntimeError("ei verkkoa")
+        self.assertIsNone(estimator.calibrate(failing, ["teksti"]))
+        self.assertEqual(estimator.chars_per_token, 4.0)
+        self.assertFalse(estimator.calibrated)
+
+
+class TestPromptBudget(unittest.TestCase):
+    def test_budget_is_reported_per_section(self):
+        context = AssessmentContext("s" * 4000, PHASES)
+        context.add_file("Lopputuote.pdf", "t" * 8000)
+        context.add_result("VAIHE 1", "h" * 2000)
+
+        budget = context.prompt_budget("VAIHE 1")
+        self.assertEqual(budget["sections"]["rules"], 1000)
+        self.assertGreater(budget["sections"]["files"], 2000)
+        self.assertLess(budget["sections"]["history"], 20)  # Pelkkä otsikko: VAIHE 1 ei tarvitse historiaa
+        self.assertEqual(budget["total"], sum(budget["sections"].values()))
+        self.assertFalse(budget["over_limit"])
+        self.assertGreater(context.prompt_budget("VAIHE 2")["sections"]["history"], 500)
+
+    def test_files_are_trimmed_to_fit(self):
+        context = AssessmentContext("Säännöt", PHASES, token_limit=3000)
+        context.add_file("Keskusteluhistoria.pdf", "alku " + "x" * 20000 + " loppu")
+
+        prompt = context.build_prompt("VAIHE 1")
+        budget = context.budgets["VAIHE 1"]
+        self.assertLessEqual(budget["total"], 3000)
+        self.assertEqual(budget["trimmed"][0]["policy"], "trim_files")
+        self.assertIn("alku", prompt)
+        self.assertIn("loppu", prompt)
+        self.assertIn("poistettu token-budjetin vuoksi", prompt)
+        self.assertIn("--- SUORITA VAIHE 1 ---", prompt)
+
+    def test_distant_history_is_dropped_first(self):
+        context = AssessmentContext("Säännöt", PHASES, token_limit=2000)
+        for i in range(1, 8):
+            context.add_result(f"VAIHE {i}", f"tulos {i} " + "y" * 1500)
+
+        prompt = context.build_prompt("VAIHE 8")
+        self.assertIn("=== TULOS: VAIHE 7 ===", prompt)
+        self.assertNotIn("=== TULOS: VAIHE 1 ===", prompt)
+        self.assertEqual(context.budgets["VAIHE 8"]["trimmed"][0]["policy"], "drop_distant_history")
+        self.assertFalse(context.budgets["VAIHE 8"]["over_limit"])
+
+    def test_orchestrator_skips_call_when_still_over_limit(self):
+        llm = MagicMock()
+        context = AssessmentContext("s" * 8000, PHASES, token_limit=1000, trim_policies=["trim_files"])
+        result = Orchestrator(llm, DataHandler()).run_phase("phase_2", context, "gemini-2.5-flash")
+
+        self.assertIn("ylittää token-rajan", result)
+        llm.generate_response.assert_not_called()
+
+
+class TestCompiledPrompts(unittest.TestCase):
+    def test_prompt_is_memoized_per_input_version(self):
+        context = AssessmentContext("Säännöt", PHASES)
+        context.add_result("VAIHE 1", "tulos 1")
+
+        first = context.build_prompt("VAIHE 2")
+        self.assertIs(context.build_prompt("VAIHE 2"), first)
+        template = context._templates["VAIHE 2"]
+
+        # Riippuvuuden uusi tulos = uusi syöteversio; muuttumaton alkuosa käytetään uudelleen
+        context.add_result("VAIHE 1", "tulos 1 (korjattu)")
+        second = context.build_prompt("VAIHE 2")
+        self.assertIn("tulos 1 (korjattu)", second)
+        self.assertIs(context._templates["VAIHE 2"], template)
+        self.assertTrue(second.startswith(template.prefix))
+
+        # Vaihetta 2 koskematon tulos ei mitätöi kehotetta
+        context.add_result("VAIHE 5", "tulos 5")
+        self.assertIs(context.build_prompt("VAIHE 2"), second)
+
+    def test_replaced_files_invalidate_prompt(self):
+        context = AssessmentContext("Säännöt", PHASES)
+        context.add_file("Lopputuote.pdf", "Alkuperäinen")
+        self.assertIn("Alkuperäinen", context.build_prompt("VAIHE 1"))
+
+        context.files = [("Lopputuote.pdf", "Anonymisoitu")]  # Kuten SecurityValidator.sanitize_all
+        self.assertIn("Anonymisoitu", context.build_prompt("VAIHE 1"))
+
+
+if __name__ == '__main__':
+    unittest.main()